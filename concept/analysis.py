@@ -28,7 +28,8 @@ from commons import *
 cimport('from mesh import diff_domain')
 cimport('from communication import communicate_domain, get_buffer')
 cimport('from graphics import plot_powerspec')
-cimport('from mesh import CIC_components2φ_general, fft, slab_decompose')
+cimport('from mesh import CIC_components2φ_general, fft, fourier_view, slab_decompose')
+cimport('from mesh import get_deconvolution_table, interlace_particles')
 
 
 
@@ -51,7 +52,10 @@ cimport('from mesh import CIC_components2φ_general, fft, slab_decompose')
                 component_index='Py_ssize_t',
                 component_indices_str=str,
                 component_mapping=object,  # OrderedDict
+                deconv='double[::1]',
+                deconv_ij='double',
                 deconv_ijk='double',
+                deconv_j='double',
                 delimiter=str,
                 fill_n_modes='bint',
                 fmt=list,
@@ -76,9 +80,6 @@ cimport('from mesh import CIC_components2φ_general, fft, slab_decompose')
                 power='double[::1]',
                 power_dict=object,  # OrderedDict
                 power_jik='double',
-                reciprocal_sqrt_deconv_ij='double',
-                reciprocal_sqrt_deconv_ijk='double',
-                reciprocal_sqrt_deconv_j='double',
                 representation=str,
                 row_components=list,
                 row_headings=list,
@@ -93,6 +94,8 @@ cimport('from mesh import CIC_components2φ_general, fft, slab_decompose')
                 slab_fluid_jik='double*',
                 slab_particles='double[:, :, ::1]',
                 slab_particles_jik='double*',
+                slab_start_j='Py_ssize_t',
+                slab_start_k='Py_ssize_t',
                 spectrum_plural=str,
                 symmetry_multiplicity='int',
                 topline=list,
@@ -166,21 +169,36 @@ def powerspec(components, filename):
         any_fluid     = ('fluid'     in φ_dict)
         # Slab decompose the grids
         slab_dict = {
-            representation: slab_decompose(φ, f'φ_{representation}_slab', prepare_fft=True)
+            representation: slab_decompose(
+                φ, φ_gridsize, f'φ_{representation}_slab', prepare_fft=True,
+            )
             for representation, φ in φ_dict.items()
             }
-        if any_fluid:
-            slab_fluid = slab_dict['fluid']
-        if any_particles:
-            slab_particles = slab_dict['particles']
         # Do a forward in-place Fourier transform of the slabs
         for slab in slab_dict.values():
             fft(slab, 'forward')
-            size_j, size_i, size_k = slab.shape[0], slab.shape[1], slab.shape[2]
+        # Interlace the particle contributions
+        if φ_interlace and any_particles:
+            interlace_particles(
+                list(component_combination), interpolation_quantities, slab_dict['particles'],
+            )
+        # Switch to the Fourier-space layout of the slabs (which differs
+        # from the real-space layout for pencil decomposed grids),
+        # also obtaining the global starting indices of the local part.
+        if any_fluid:
+            slab_fluid, slab_start_j, slab_start_k = fourier_view(slab_dict['fluid'])
+            size_j, size_i, size_k = slab_fluid.shape[0], slab_fluid.shape[1], slab_fluid.shape[2]
+        if any_particles:
+            slab_particles, slab_start_j, slab_start_k = fourier_view(slab_dict['particles'])
+            size_j, size_i, size_k = (
+                slab_particles.shape[0], slab_particles.shape[1], slab_particles.shape[2]
+            )
         # Flag specifying whether or not n_modes has been computed
         fill_n_modes = (n_modes[0] == -1)
         if fill_n_modes:
             n_modes[0] = 0
+        # The tabulated deconvolution factors along one dimension
+        deconv = get_deconvolution_table(φ_gridsize, φ_assignment_order)
         # Begin loop over slabs. As the first and second dimensions
         # are transposed due to the FFT, start with the j-dimension.
         nyquist = φ_gridsize//2
@@ -188,17 +206,16 @@ def powerspec(components, filename):
             # The j-component of the wave vector (grid units).
             # Since the slabs are distributed along the j-dimension,
             # an offset must be used.
-            j_global = ℤ[size_j*rank] + j
+            j_global = slab_start_j + j
             if j_global > ℤ[φ_gridsize//2]:
                 kj = j_global - φ_gridsize
             else:
                 kj = j_global
             kj2 = kj**2
-            # Reciprocal square root of the
-            # j-component of the deconvolution.
+            # The j-component of the deconvolution
             with unswitch(1):
                 if any_particles:
-                    reciprocal_sqrt_deconv_j = sinc(kj*ℝ[π/φ_gridsize])
+                    deconv_j = deconv[j_global]
             # Loop over the entire first dimension
             for i in range(φ_gridsize):
                 # The i-component of the wave vector
@@ -206,19 +223,17 @@ def powerspec(components, filename):
                     ki = i - φ_gridsize
                 else:
                     ki = i
-                # Reciprocal square root of the product of the i-
-                # and the j-component of the deconvolution.
+                # The product of the i- and the j-component
+                # of the deconvolution.
                 with unswitch(2):
                     if any_particles:
-                        reciprocal_sqrt_deconv_ij = (
-                            sinc(ki*ℝ[π/φ_gridsize])*reciprocal_sqrt_deconv_j
-                        )
+                        deconv_ij = deconv[i]*deconv_j
                 # Loop over the entire last dimension in steps of two,
                 # as contiguous pairs of elements are the real and
                 # imaginary part of the same complex number.
                 for k in range(0, size_k, 2):
                     # The k-component of the wave vector
-                    kk = k//2
+                    kk = (slab_start_k + k)//2
                     # The squared magnitude of the wave vector
                     k2 = ℤ[ki**2 + kj2] + kk**2
                     # Skip the DC component.
@@ -228,7 +243,7 @@ def powerspec(components, filename):
                         continue
                     # Get the bin index of this k²
                     k_bin_index = k_bin_indices[k2]
-                    # Do the CIC deconvolution of the particles slab
+                    # Do the deconvolution of the particles slab
                     with unswitch(3):
                         if any_particles:
                             # Pointer to the [j, i, k]'th element of the
@@ -237,14 +252,10 @@ def powerspec(components, filename):
                             # Re = slab_particles_jik[0],
                             # Im = slab_particles_jik[1].
                             slab_particles_jik = cython.address(slab_particles[j, i, k:])
-                            # Reciprocal square root of the product of
-                            # all components of the deconvolution.
-                            reciprocal_sqrt_deconv_ijk = (
-                                reciprocal_sqrt_deconv_ij*sinc(kk*ℝ[π/φ_gridsize])
-                            )
-                            # The total factor
-                            # for a complete deconvolution.
-                            deconv_ijk = 1/reciprocal_sqrt_deconv_ijk**2
+                            # The total factor for a complete
+                            # deconvolution, given the order of the
+                            # mass assignment scheme.
+                            deconv_ijk = deconv_ij*deconv[kk]
                             # Carry out the deconvolution
                             slab_particles_jik[0] *= deconv_ijk  # Real part
                             slab_particles_jik[1] *= deconv_ijk  # Imag part
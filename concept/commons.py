@@ -177,6 +177,10 @@ Gather = lambda sendbuf, recvbuf, root=master_rank: comm.Gather(
 Gatherv = lambda sendbuf, recvbuf, root=master_rank: comm.Gatherv(
     buf_and_dtype(sendbuf), recvbuf, root)
 Isend = lambda buf, dest, tag=0: comm.Isend(buf_and_dtype(buf), dest, tag)
+Irecv = lambda buf, source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG: comm.Irecv(
+    buf_and_dtype(buf), source, tag)
+Probe = lambda source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG, status=None: comm.Probe(
+    source, tag, status)
 Reduce = lambda sendbuf, recvbuf, op=MPI.SUM, root=master_rank: comm.Reduce(
     buf_and_dtype(sendbuf), recvbuf, op, root)
 Recv = lambda buf, source=MPI.ANY_SOURCE, tag=MPI.ANY_TAG: comm.Recv(
@@ -722,6 +726,7 @@ if not cython.compiled:
                        exp, log, log2, log10,
                        sqrt,
                        floor, ceil, round,
+                       fmod,
                        )
     cbrt = lambda x: x**(1/3)
     from math import erf, erfc
@@ -759,6 +764,13 @@ if not cython.compiled:
         def __exit__(self, *exc_info):
             ...
     unswitch = DummyContextManager()
+    # Dummy GIL context managers, with cython.nogil also
+    # usable as a function decorator.
+    class DummyGIL(DummyContextManager):
+        def __call__(self, func):
+            return func
+    setattr(cython, 'gil', DummyGIL())
+    setattr(cython, 'nogil', DummyGIL())
     # The pxd function, which in pure Python defines the variables
     # passed in as a string in the global name space.
     class DummyPxd:
@@ -1742,8 +1754,14 @@ cython.declare(# Input/output
                boxsize='double',
                ewald_gridsize='Py_ssize_t',
                φ_gridsize='ptrdiff_t',
+               φ_assignment=str,
+               φ_interlace='bint',
+               φ_fused_gradient='bint',
                p3m_scale='double',
                p3m_cutoff='double',
+               p3m_shortrange_kernel=str,
+               p3m_shortrange_table_size='Py_ssize_t',
+               tree_opening_angle='double',
                R_tophat='double',
                modes_per_decade='double',
                # Cosmology
@@ -1765,6 +1783,18 @@ cython.declare(# Input/output
                fftw_wisdom_rigor=str,
                fftw_wisdom_reuse='bint',
                random_seed='unsigned long int',
+               num_threads='int',
+               particle_ordering=str,
+               particle_ordering_interval='Py_ssize_t',
+               domain_balancing=str,
+               domain_balancing_interval='Py_ssize_t',
+               mpi_instrumentation='bint',
+               mpi_instrumentation_filename=str,
+               profiling='bint',
+               profiling_filename=str,
+               memory_accounting='bint',
+               linear_rescaling_rtol='double',
+               N_rungs='int',
                fluid_scheme_select=dict,
                fluid_options=dict,
                class_k_max=dict,
@@ -1883,10 +1913,22 @@ ewald_gridsize = to_int(user_params.get('ewald_gridsize', 64))
 user_params['ewald_gridsize'] = ewald_gridsize
 φ_gridsize = to_int(user_params.get('φ_gridsize', 64))
 user_params['φ_gridsize'] = φ_gridsize
+φ_assignment = str(user_params.get('φ_assignment', 'CIC')).upper()
+user_params['φ_assignment'] = φ_assignment
+φ_interlace = bool(user_params.get('φ_interlace', False))
+user_params['φ_interlace'] = φ_interlace
+φ_fused_gradient = bool(user_params.get('φ_fused_gradient', True))
+user_params['φ_fused_gradient'] = φ_fused_gradient
 p3m_scale = float(user_params.get('p3m_scale', 1.25))
 user_params['p3m_scale'] = p3m_scale
 p3m_cutoff = float(user_params.get('p3m_cutoff', 4.8))
 user_params['p3m_cutoff'] = p3m_cutoff
+p3m_shortrange_kernel = str(user_params.get('p3m_shortrange_kernel', 'exact')).lower()
+user_params['p3m_shortrange_kernel'] = p3m_shortrange_kernel
+p3m_shortrange_table_size = to_int(user_params.get('p3m_shortrange_table_size', 2**12))
+user_params['p3m_shortrange_table_size'] = p3m_shortrange_table_size
+tree_opening_angle = float(user_params.get('tree_opening_angle', 0.5))
+user_params['tree_opening_angle'] = tree_opening_angle
 R_tophat = float(user_params.get('R_tophat', -1))  # Defautl value will be set later
 user_params['R_tophat'] = R_tophat
 modes_per_decade = float(user_params.get('modes_per_decade', 100))
@@ -2017,6 +2059,30 @@ fftw_wisdom_reuse = bool(user_params.get('fftw_wisdom_reuse', True))
 user_params['fftw_wisdom_reuse'] = fftw_wisdom_reuse
 random_seed = to_int(user_params.get('random_seed', 1))
 user_params['random_seed'] = random_seed
+num_threads = to_int(user_params.get('num_threads', os.environ.get('OMP_NUM_THREADS', 1)))
+user_params['num_threads'] = num_threads
+particle_ordering = str(user_params.get('particle_ordering', 'none')).lower()
+user_params['particle_ordering'] = particle_ordering
+particle_ordering_interval = to_int(user_params.get('particle_ordering_interval', 1))
+user_params['particle_ordering_interval'] = particle_ordering_interval
+domain_balancing = str(user_params.get('domain_balancing', 'none')).lower()
+user_params['domain_balancing'] = domain_balancing
+domain_balancing_interval = to_int(user_params.get('domain_balancing_interval', 10))
+user_params['domain_balancing_interval'] = domain_balancing_interval
+mpi_instrumentation = bool(user_params.get('mpi_instrumentation', False))
+user_params['mpi_instrumentation'] = mpi_instrumentation
+mpi_instrumentation_filename = str(user_params.get('mpi_instrumentation_filename', ''))
+user_params['mpi_instrumentation_filename'] = mpi_instrumentation_filename
+profiling = bool(user_params.get('profiling', False))
+user_params['profiling'] = profiling
+profiling_filename = str(user_params.get('profiling_filename', ''))
+user_params['profiling_filename'] = profiling_filename
+memory_accounting = bool(user_params.get('memory_accounting', False))
+user_params['memory_accounting'] = memory_accounting
+linear_rescaling_rtol = float(user_params.get('linear_rescaling_rtol', 1e-6))
+user_params['linear_rescaling_rtol'] = linear_rescaling_rtol
+N_rungs = to_int(user_params.get('N_rungs', 1))
+user_params['N_rungs'] = N_rungs
 fluid_scheme_select = {'all': 'Kurganov-Tadmor'}
 if user_params.get('fluid_scheme_select'):
     if isinstance(user_params['fluid_scheme_select'], dict):
@@ -2269,6 +2335,7 @@ cython.declare(snapshot_dir=str,
                Ωm='double',
                ρ_mbar='double',
                slab_size_padding='ptrdiff_t',
+               φ_assignment_order='int',
                pm_fac_const='double',
                longrange_exponent_fac='double',
                p3m_cutoff_phys='double',
@@ -2331,6 +2398,10 @@ autosave_dir = output_dirs['autosave']
 ρ_mbar = Ωm*ρ_crit
 # The real size of the padded (last) dimension of global slab grid
 slab_size_padding = 2*(φ_gridsize//2 + 1)
+# The order of the mass assignment scheme, i.e. the number of grid
+# points in each dimension over which a particle is spread. The Fourier
+# transform of the assignment window is sinc**φ_assignment_order.
+φ_assignment_order = {'CIC': 2, 'TSC': 3, 'PCS': 4}.get(φ_assignment, 2)
 # All constant factors across the PM scheme is gathered in the
 # pm_fac_const variable. Its contributions are:
 # Normalization due to forwards and backwards Fourier transforms:
@@ -2392,6 +2463,7 @@ units_dict.setdefault(unicode('ρ_mbar')       , ρ_mbar                )
 # Add dimensionless sizes
 units_dict.setdefault('p3m_scale'          , p3m_scale          )
 units_dict.setdefault('p3m_cutoff'         , p3m_cutoff         )
+units_dict.setdefault('tree_opening_angle' , tree_opening_angle )
 units_dict.setdefault('ewald_gridsize'     , ewald_gridsize     )
 units_dict.setdefault('render3D_resolution', render3D_resolution)
 units_dict.setdefault('slab_size_padding'  , slab_size_padding  )
@@ -3182,6 +3254,48 @@ if snapshot_type not in ('standard', 'gadget2'):
 # Abort on illegal FFTW rigor
 if fftw_wisdom_rigor not in ('estimate', 'measure', 'patient', 'exhaustive'):
     abort('Does not recognize FFTW rigor "{}"'.format(user_params['fftw_wisdom_rigor']))
+# Abort on illegal short-range P³M kernel
+if p3m_shortrange_kernel not in ('exact', 'linear'):
+    abort(
+        f'Does not recognize short-range P³M kernel "{user_params["p3m_shortrange_kernel"]}". '
+        f'Valid kernels are "exact" and "linear", the latter being tabulated.'
+    )
+if p3m_shortrange_table_size < 2:
+    abort(f'A p3m_shortrange_table_size of {p3m_shortrange_table_size} was specified, '
+          f'but at least 2 points are needed')
+# Abort on illegal mass assignment scheme
+if φ_assignment not in ('CIC', 'TSC', 'PCS'):
+    abort(
+        f'Does not recognize mass assignment scheme "{user_params["φ_assignment"]}". '
+        f'Valid schemes are "CIC", "TSC" and "PCS".'
+    )
+# Abort on non-positive tree opening angle
+if tree_opening_angle <= 0:
+    abort(f'A tree_opening_angle of {tree_opening_angle} was specified, but it must be positive')
+if num_threads < 1:
+    abort(f'A num_threads of {num_threads} was specified, but at least 1 thread is needed')
+# Abort on illegal particle ordering
+if particle_ordering not in ('none', 'morton', 'hilbert'):
+    abort(
+        f'Does not recognize particle ordering "{user_params["particle_ordering"]}". '
+        f'Valid orderings are "none", "morton" and "hilbert".'
+    )
+if particle_ordering_interval < 1:
+    abort(f'A particle_ordering_interval of {particle_ordering_interval} was specified, '
+          f'but it must be at least 1')
+# Abort on illegal domain balancing
+if domain_balancing not in ('none', 'counts', 'work'):
+    abort(
+        f'Does not recognize domain balancing "{user_params["domain_balancing"]}". '
+        f'Valid balancings are "none", "counts" and "work".'
+    )
+if domain_balancing_interval < 1:
+    abort(f'A domain_balancing_interval of {domain_balancing_interval} was specified, '
+          f'but it must be at least 1')
+# Abort on illegal number of rungs. The rungs are stored as unsigned
+# chars, with values up to N_rungs**2 - 1 (see assign_rungs).
+if not 1 <= N_rungs <= 16:
+    abort(f'N_rungs = {N_rungs} was specified, but it must be between 1 and 16')
 # Warn if random_seed is chosen to be 0, as this may lead to clashes
 # with the default seed used by GSL.
 if random_seed < 1:
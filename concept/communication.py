@@ -24,6 +24,10 @@
 # In the .pyx file, Cython declared variables will also get cimported.
 from commons import *
 
+# Cython imports
+cimport('from instrumentation import memory_register, mpi_count_bytes, mpi_tic, mpi_toc, '
+        '                            profile_tic, profile_toc')
+
 
 
 # Function for fairly partitioning data among the processes
@@ -111,218 +115,200 @@ def find_N_recv(N_send):
                component='Component',
                reset_buffers='bint',
                # Locals
-               ID_recv='int',
-               ID_send='int',
+               N_keep='Py_ssize_t',
                N_local='Py_ssize_t',
                N_needed='Py_ssize_t',
-               N_recv='Py_ssize_t[::1]',
-               N_recv_j='Py_ssize_t',
-               N_recv_max='Py_ssize_t',
                N_recv_tot='Py_ssize_t',
-               N_send_j='Py_ssize_t',
-               N_send_max='Py_ssize_t',
                N_send_tot='Py_ssize_t',
                N_send_tot_global='Py_ssize_t',
-               buffer_name=object,  # int or str
-               holes_filled='Py_ssize_t',
                i='Py_ssize_t',
-               index_recv_j='Py_ssize_t',
-               indices_send_j='Py_ssize_t*',
-               j='int',
-               k='Py_ssize_t',
-               k_start='Py_ssize_t',
+               index='Py_ssize_t',
+               j='Py_ssize_t',
                momx='double*',
-               momx_mv='double[::1]',
                momy='double*',
-               momy_mv='double[::1]',
                momz='double*',
-               momz_mv='double[::1]',
+               n_vars='int',
+               other_rank='int',
                owner='int',
+               owners='int[::1]',
                posx='double*',
-               posx_mv='double[::1]',
                posy='double*',
-               posy_mv='double[::1]',
                posz='double*',
-               posz_mv='double[::1]',
+               recvbuf_mv='double[::1]',
+               rung='unsigned char*',
                sendbuf_mv='double[::1]',
-               Δmemory='Py_ssize_t',
                )
 def exchange(component, reset_buffers=False):
     """This function will do an exchange of particles between processes,
     so that every particle resides on the process in charge of the
-    domain where the particle is located. The variable indices_send
-    holds arrays of indices of particles to send to the different
-    processes, while particle data is copied to sendbuf before it is
-    send. These two variables will grow in size if needed. Call with
-    reset_buffers=True to reset these variables to their most basic
-    forms, freeing up memory.
+    domain where the particle is located. All variables of the
+    particles to be send are packed together into a single buffer,
+    ordered by destination, which is then communicated in one go using
+    a single Alltoallv. The holes left behind by the particles send
+    away are filled with particles from the end of the local data, after
+    which the received particles are appended. The buffers used grow in
+    size if needed. Call with reset_buffers=True to reset these to
+    their most basic forms, freeing up memory.
     """
+    global exchange_owners
     # No need to consider exchange of particles if running serially
     if nprocs == 1:
         return
     # Only particles are exchangeable
     if component.representation != 'particles':
         return
+    if profiling:
+        profile_tic('exchange')
+    if mpi_instrumentation:
+        mpi_tic()
     # Extract some variables from component
     N_local = component.N_local
     posx = component.posx
     posy = component.posy
     posz = component.posz
-    # The index buffers indices_send[:] increase in size by this amount
-    Δmemory = 2 + cast(0.01*N_local/nprocs, 'Py_ssize_t')
-    # Reset the number of particles to be sent
-    for j in range(nprocs):
-        N_send[j] = 0
+    momx = component.momx
+    momy = component.momy
+    momz = component.momz
+    rung = component.rung
+    # Enlarge the array of owners if needed
+    if exchange_owners.shape[0] < N_local:
+        exchange_owners = empty(N_local, dtype=C2np['int'])
+    owners = exchange_owners
     # Find out where to send which particle
+    for other_rank in range(nprocs):
+        N_send[other_rank] = 0
     for i in range(N_local):
         # Rank of the process that local particle i belongs to
         owner = which_domain(posx[i], posy[i], posz[i])
-        if owner != rank:
-            # Particle owned by nonlocal process owner.
-            # Append the owner's index buffer with the particle index.
-            indices_send[owner][N_send[owner]] = i
-            # Increase the number of particle to send to this process.
-            N_send[owner] += 1
-            # Enlarge the index buffer indices_send[owner] if needed
-            if N_send[owner] == indices_send_sizes[owner]:
-                indices_send_sizes[owner] += Δmemory
-                indices_send[owner] = realloc(indices_send[owner],
-                                              indices_send_sizes[owner]*sizeof('Py_ssize_t'))
+        owners[i] = owner
+        N_send[owner] += 1
+    N_send_tot = N_local - N_send[rank]
+    N_send[rank] = 0
     # No need to continue if no particles should be exchanged
-    N_send_tot = sum(N_send)
     N_send_tot_global = allreduce(N_send_tot, op=MPI.SUM)
     if N_send_tot_global == 0:
+        if mpi_instrumentation:
+            mpi_toc('exchange')
+        if profiling:
+            profile_toc()
         return
     # Print out exchange message
     masterprint('Exchanging {} of the {} particles ...'.format(N_send_tot_global, component.name))
-    # Grab a buffer for holding the data to be send.
-    # The 'send' buffer is also used internally by smart_mpi.
-    buffer_name = 'send'
-    N_send_max = max(N_send)
-    sendbuf_mv = get_buffer(N_send_max, buffer_name)
-    # Find out how many particles to receive
-    N_recv = find_N_recv(N_send)
-    # The maximum number of particles to
-    # receive is stored in entrance rank.
-    N_recv_max = N_recv[rank]
-    N_recv_tot = sum(N_recv) - N_recv_max
-    # Enlarge the component data attributes, if needed. This may not be
-    # strcitly necessary as more particles may be send than received.
-    N_needed = N_local + N_recv_tot
+    # Communicate the number of doubles to send to each process,
+    # so that everyone knows how much to receive from every process.
+    # With block time steps, the rung of each particle is sent along
+    # (as a double) with its positions and momenta.
+    n_vars = 6 + (N_rungs > 1)
+    for other_rank in range(nprocs):
+        exchange_counts_send[other_rank] = n_vars*N_send[other_rank]
+    comm.Alltoall(asarray(exchange_counts_send), asarray(exchange_counts_recv))
+    exchange_displacements_send[0] = 0
+    exchange_displacements_recv[0] = 0
+    for other_rank in range(1, nprocs):
+        exchange_displacements_send[other_rank] = (
+            exchange_displacements_send[other_rank - 1] + exchange_counts_send[other_rank - 1]
+        )
+        exchange_displacements_recv[other_rank] = (
+            exchange_displacements_recv[other_rank - 1] + exchange_counts_recv[other_rank - 1]
+        )
+    N_recv_tot = (
+        exchange_displacements_recv[nprocs - 1] + exchange_counts_recv[nprocs - 1]
+    )//n_vars
+    # Pack the variables of all particles to be send into a single
+    # buffer, ordered by destination and with the variables
+    # of each particle stored contiguously. The displacements are
+    # used as running indices during the packing.
+    sendbuf_mv = get_buffer(n_vars*N_send_tot, 'exchange_send')
+    for i in range(N_local):
+        owner = owners[i]
+        if owner == rank:
+            continue
+        index = exchange_displacements_send[owner]
+        sendbuf_mv[index    ] = posx[i]
+        sendbuf_mv[index + 1] = posy[i]
+        sendbuf_mv[index + 2] = posz[i]
+        sendbuf_mv[index + 3] = momx[i]
+        sendbuf_mv[index + 4] = momy[i]
+        sendbuf_mv[index + 5] = momz[i]
+        with unswitch:
+            if N_rungs > 1:
+                sendbuf_mv[index + 6] = rung[i]
+        exchange_displacements_send[owner] = index + n_vars
+    # Reset the send displacements
+    for other_rank in range(nprocs):
+        exchange_displacements_send[other_rank] -= exchange_counts_send[other_rank]
+    # Communicate everything in one go
+    recvbuf_mv = get_buffer(n_vars*N_recv_tot, 'exchange_recv')
+    comm.Alltoallv(
+        [asarray(sendbuf_mv[:n_vars*N_send_tot]),
+            (asarray(exchange_counts_send), asarray(exchange_displacements_send)), MPI.DOUBLE],
+        [asarray(recvbuf_mv[:n_vars*N_recv_tot]),
+            (asarray(exchange_counts_recv), asarray(exchange_displacements_recv)), MPI.DOUBLE],
+    )
+    if mpi_instrumentation:
+        mpi_count_bytes(8*n_vars*N_send_tot)
+    # Fill the holes left by the particles send away with particles
+    # from the end of the local data, scanning forward for holes and
+    # backward for particles to keep. Each hole is visited once,
+    # so this is O(N_local).
+    i = 0
+    j = N_local - 1
+    while True:
+        while i < N_local and owners[i] == rank:
+            i += 1
+        while j >= 0 and owners[j] != rank:
+            j -= 1
+        if i >= j:
+            break
+        # Particle j and hole i found.
+        # Fill the hole with the particle.
+        posx[i] = posx[j]
+        posy[i] = posy[j]
+        posz[i] = posz[j]
+        momx[i] = momx[j]
+        momy[i] = momy[j]
+        momz[i] = momz[j]
+        rung[i] = rung[j]
+        owners[i] = rank
+        owners[j] = -1
+    N_keep = N_local - N_send_tot
+    # Enlarge the component data attributes, if needed
+    N_needed = N_keep + N_recv_tot
     if component.N_allocated < N_needed:
         component.resize(N_needed)
-        # Reextract position pointers
+        # Reextract data pointers
         posx = component.posx
         posy = component.posy
         posz = component.posz
-    # Extract momenta pointers and all memory views
-    # of the possibly resized data.
-    momx = component.momx
-    momy = component.momy
-    momz = component.momz
-    posx_mv = component.posx_mv
-    posy_mv = component.posy_mv
-    posz_mv = component.posz_mv
-    momx_mv = component.momx_mv
-    momy_mv = component.momy_mv
-    momz_mv = component.momz_mv
-    # Exchange particles between processes
-    index_recv_j = N_local
-    for j in range(1, nprocs):
-        # Process ranks to send/receive to/from
-        ID_send = mod(rank + j, nprocs)
-        ID_recv = mod(rank - j, nprocs)
-        # Number of particles to send/receive
-        N_send_j = N_send[ID_send]
-        N_recv_j = N_recv[ID_recv]
-        # The indices of particles to send and the index from
-        # which received particles are allowed to be appended.
-        indices_send_j = indices_send[ID_send]
-        # Send/receive posx
-        for i in range(N_send_j):
-            sendbuf_mv[i] = posx[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=posx_mv[index_recv_j:],
-                 source=ID_recv)
-        # Send/receive posy
-        for i in range(N_send_j):
-            sendbuf_mv[i] = posy[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=posy_mv[index_recv_j:],
-                 source=ID_recv)
-        # Send/receive posz
-        for i in range(N_send_j):
-            sendbuf_mv[i] = posz[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=posz_mv[index_recv_j:],
-                 source=ID_recv)
-        # Send/receive momx
-        for i in range(N_send_j):
-            sendbuf_mv[i] = momx[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=momx_mv[index_recv_j:],
-                 source=ID_recv)
-        # Send/receive momy
-        for i in range(N_send_j):
-            sendbuf_mv[i] = momy[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=momy_mv[index_recv_j:],
-                 source=ID_recv)
-        # Send/receive momz
-        for i in range(N_send_j):
-            sendbuf_mv[i] = momz[indices_send_j[i]]
-        Sendrecv(sendbuf_mv[:N_send_j],
-                 dest=ID_send,
-                 recvbuf=momz_mv[index_recv_j:],
-                 source=ID_recv)
-        # Update the start index for received data
-        index_recv_j += N_recv_j
-        # Mark the holes in the data by setting posx[hole] = -1
-        for k in range(N_send_j):
-            posx[indices_send_j[k]] = -1
-    # Move particle data to fill holes
-    k_start = 0
-    holes_filled = 0
-    if N_send_tot > 0:
-        # Loop backward over particles
-        for i in range(index_recv_j - 1, -1, -1):
-            # Index i should be a particle
-            if posx[i] == -1:
-                continue
-            # Loop forward over holes
-            for k in range(k_start, index_recv_j):
-                # Index k should be a hole
-                if posx[k] != -1:
-                    continue
-                # Particle i and hole k found.
-                # Fill the hole with the particle.
-                posx[k] = posx[i]
-                posy[k] = posy[i]
-                posz[k] = posz[i]
-                momx[k] = momx[i]
-                momy[k] = momy[i]
-                momz[k] = momz[i]
-                k_start = k + 1
-                holes_filled += 1
-                break
-            # All holes have been filled
-            if holes_filled == N_send_tot:
-                break
+        momx = component.momx
+        momy = component.momy
+        momz = component.momz
+        rung = component.rung
+    # Append the received particles
+    for i in range(N_recv_tot):
+        index = n_vars*i
+        j = N_keep + i
+        posx[j] = recvbuf_mv[index    ]
+        posy[j] = recvbuf_mv[index + 1]
+        posz[j] = recvbuf_mv[index + 2]
+        momx[j] = recvbuf_mv[index + 3]
+        momy[j] = recvbuf_mv[index + 4]
+        momz[j] = recvbuf_mv[index + 5]
+        with unswitch:
+            if N_rungs > 1:
+                rung[j] = int(recvbuf_mv[index + 6])
     # Update N_local
-    component.N_local = N_needed - N_send_tot
-    # If reset_buffers is True, reset the global indices_send and
-    # sendbuf to their basic forms. This buffer will then be rebuild in
-    # future calls.
+    component.N_local = N_needed
+    # If reset_buffers is True, reset the global buffers to their basic
+    # forms. These buffers will then be rebuild in future calls.
     if reset_buffers:
-        resize_buffer(1, buffer_name)
-        for j in range(nprocs):
-            indices_send[j] = realloc(indices_send[j], 1*sizeof('Py_ssize_t'))
-            indices_send_sizes[j] = 1
+        resize_buffer(1, 'exchange_send')
+        resize_buffer(1, 'exchange_recv')
+        exchange_owners = empty(1, dtype=C2np['int'])
+    if mpi_instrumentation:
+        mpi_toc('exchange')
+    if profiling:
+        profile_toc()
     # Finalize exchange message
     masterprint('done')
 
@@ -414,6 +400,8 @@ def communicate_domain(domain_grid, mode=''):
               'Call with mode=\'add contributions\' or mode=\'populate\'.')
     else:
         abort('Mode "{}" not implemented'.format(mode))
+    if mpi_instrumentation:
+        mpi_tic()
     for i in range(-1, 2):
         if i == -1:
             # Send left, receive right
@@ -489,6 +477,8 @@ def communicate_domain(domain_grid, mode=''):
                           reverse=reverse,
                           mpifun='Sendrecv',
                           operation=operation)
+    if mpi_instrumentation:
+        mpi_toc('communicate_domain')
 
 # Function for cutting out domains as rectangular boxes in the best
 # possible way. The return value is an array of 3 elements; the number
@@ -572,11 +562,42 @@ def cutout_domains(n, basecall=True):
                returns='int',
                )
 def which_domain(x, y, z):
-    x_index = int(x/domain_size_x)
-    y_index = int(y/domain_size_y)
-    z_index = int(z/domain_size_z)
+    # When the domains have been balanced they are no longer of equal
+    # size, and so the cuts between them have to be searched.
+    if domain_balanced:
+        x_index = find_cut_index(domain_cuts_x, x)
+        y_index = find_cut_index(domain_cuts_y, y)
+        z_index = find_cut_index(domain_cuts_z, z)
+    else:
+        x_index = int(x/domain_size_x)
+        y_index = int(y/domain_size_y)
+        z_index = int(z/domain_size_z)
     return domain_layout[x_index, y_index, z_index]
 
+# Function returning the index of the domain slice (along a single
+# dimension) in which the coordinate x resides, given the global cuts
+# between the domain slices. Coordinates outside the box are mapped to
+# the first or last domain slice.
+@cython.header(# Arguments
+               cuts='double[::1]',
+               x='double',
+               # Locals
+               index='int',
+               index_lower='int',
+               index_upper='int',
+               returns='int',
+               )
+def find_cut_index(cuts, x):
+    index_lower = 0
+    index_upper = cuts.shape[0] - 1
+    while index_upper - index_lower > 1:
+        index = (index_lower + index_upper)//2
+        if x < cuts[index]:
+            index_upper = index
+        else:
+            index_lower = index
+    return index_lower
+
 # This function computes the ranks of the processes governing the
 # domain which is located i domains to the right, j domains forward and
 # k domains up, relative to the local domain.
@@ -593,6 +614,233 @@ def rank_neighboring_domain(i, j, k):
                          mod(domain_layout_local_indices[2] + k, domain_subdivisions[2]),
                          ]
 
+# Function returning the boundaries
+# ((x_start, x_end), (y_start, y_end), (z_start, z_end))
+# of the domain governed by the process of the given rank.
+@cython.header(# Arguments
+               other_rank='int',
+               # Locals
+               indices=tuple,
+               returns=tuple,
+               )
+def domain_bounds(other_rank):
+    indices = np.unravel_index(other_rank, asarray(domain_subdivisions))
+    return (
+        (domain_cuts_x[indices[0]], domain_cuts_x[indices[0] + 1]),
+        (domain_cuts_y[indices[1]], domain_cuts_y[indices[1] + 1]),
+        (domain_cuts_z[indices[2]], domain_cuts_z[indices[2] + 1]),
+    )
+
+# Function returning the width of the narrowest domain
+# along the given dimension.
+@cython.header(# Arguments
+               dim='int',
+               # Locals
+               cuts='double[::1]',
+               returns='double',
+               )
+def domain_width_min(dim):
+    cuts = (domain_cuts_x, domain_cuts_y, domain_cuts_z)[dim]
+    return np.min(np.diff(cuts))
+
+# Function for recording the (wall) time spent by the local process
+# on computations which scale with the number of local particles.
+# The accumulated work is used to balance the domains
+# when domain_balancing == 'work'.
+@cython.header(# Arguments
+               seconds='double',
+               returns='void',
+               )
+def add_domain_work(seconds):
+    global domain_work
+    domain_work += seconds
+
+# Function which moves the cuts between the domains so as to balance
+# the load among the processes, after which the particles of all
+# components are exchanged according to the new domains.
+# The returned value signals whether the domains were changed.
+@cython.pheader(# Arguments
+                components=list,
+                # Locals
+                N_local_tot='Py_ssize_t',
+                changed='bint',
+                component='Component',
+                cuts='double[::1]',
+                cuts_cells=object,  # np.ndarray
+                dim='int',
+                histogram=object,  # np.ndarray
+                imbalance='double',
+                load='double',
+                pos=object,  # np.ndarray
+                weight='double',
+                width_min='Py_ssize_t',
+                returns='bint',
+                )
+def rebalance_domains(components):
+    """The domains are kept as a rectilinear (tensor product) grid,
+    with the cuts along each dimension shared by all domains. This
+    preserves the neighbour structure of the domains, so that the
+    exchange of boundaries and ghost layers works unchanged. The cuts
+    are placed on the global φ grid, so that the domain grids remain
+    aligned with the domains. Along each dimension, the cuts are chosen
+    such that the global (marginal) distribution of the weights of all
+    particles is split evenly. With domain_balancing == 'counts', all
+    particles have the same weight. With domain_balancing == 'work',
+    the weight of a particle is the work measured on its process
+    (see add_domain_work) since the last rebalancing, divided by the
+    number of local particles.
+    """
+    global domain_balanced, domain_balancing_disabled, domain_work
+    global domain_cuts_x, domain_cuts_y, domain_cuts_z
+    if domain_balancing == 'none' or domain_balancing_disabled or nprocs == 1:
+        return False
+    # Check whether balancing is possible at all
+    for component in components:
+        if component.representation != 'particles':
+            domain_balancing_disabled = True
+            masterwarn(
+                f'Domain balancing is disabled as the fluid component {component.name} '
+                f'requires equally sized domains'
+            )
+            return False
+    # The weight of each local particle
+    N_local_tot = 0
+    for component in components:
+        N_local_tot += component.N_local
+    weight = 1
+    if domain_balancing == 'work' and allreduce(domain_work, op=MPI.SUM) > 0:
+        weight = domain_work/pairmax(N_local_tot, 1)
+    domain_work = 0
+    # The load imbalance of the current domains,
+    # measured as the maximum load over the mean load.
+    load = weight*N_local_tot
+    imbalance = allreduce(load, op=MPI.MAX)/pairmax(
+        allreduce(load, op=MPI.SUM)/nprocs, machine_ϵ)
+    # Find new cuts along each dimension
+    changed = False
+    for dim in range(3):
+        histogram = zeros(φ_gridsize, dtype=C2np['double'])
+        for component in components:
+            pos = asarray(component.pos_mv[dim])[:component.N_local]
+            histogram += np.bincount(
+                np.clip((pos*ℝ[φ_gridsize/boxsize]).astype(C2np['Py_ssize_t']), 0, φ_gridsize - 1),
+                minlength=φ_gridsize,
+            )
+        histogram = allreduce(weight*histogram, op=MPI.SUM)
+        # The domains must be at least 3 grid cells wide, so that the
+        # ghost layers are fully covered by the neighbouring domains.
+        # They must also be wide enough for the short-range cutoff.
+        width_min = pairmax(3, int(ceil(
+            (1 + (domain_subdivisions[dim] == 2))*p3m_cutoff_phys*ℝ[φ_gridsize/boxsize]
+        )))
+        width_min = pairmin(width_min, φ_gridsize//domain_subdivisions[dim])
+        cuts_cells = balance_cuts(histogram, domain_subdivisions[dim], width_min)
+        cuts = asarray(cuts_cells, dtype=C2np['double'])*ℝ[boxsize/φ_gridsize]
+        cuts[domain_subdivisions[dim]] = boxsize
+        if not np.array_equal(asarray(cuts), asarray((domain_cuts_x, domain_cuts_y, domain_cuts_z)[dim])):
+            changed = True
+            if dim == 0:
+                domain_cuts_x = cuts
+            elif dim == 1:
+                domain_cuts_y = cuts
+            else:
+                domain_cuts_z = cuts
+    if not changed:
+        return False
+    masterprint(f'Rebalancing domains (load imbalance {imbalance:.3f}) ...')
+    domain_balanced = True
+    update_domain_geometry()
+    for component in components:
+        exchange(component)
+    masterprint('done')
+    return True
+# Flag signalling that domain balancing has been disabled
+# due to an incompatible setup.
+cython.declare(domain_balancing_disabled='bint')
+domain_balancing_disabled = False
+
+# Helper function for rebalance_domains, returning the cuts (in units
+# of grid cells) which divides the given histogram into n_parts parts
+# of as equal total weight as possible, with each part being at least
+# width_min cells wide.
+@cython.header(# Arguments
+               histogram=object,  # np.ndarray
+               n_parts='int',
+               width_min='Py_ssize_t',
+               # Locals
+               N_cells='Py_ssize_t',
+               cumulative='double[::1]',
+               cut='Py_ssize_t',
+               cuts='Py_ssize_t[::1]',
+               part='int',
+               target='double',
+               total='double',
+               returns='Py_ssize_t[::1]',
+               )
+def balance_cuts(histogram, n_parts, width_min):
+    N_cells = histogram.shape[0]
+    cumulative = np.cumsum(histogram)
+    total = cumulative[N_cells - 1]
+    cuts = zeros(n_parts + 1, dtype=C2np['Py_ssize_t'])
+    cuts[n_parts] = N_cells
+    for part in range(1, n_parts):
+        if total > 0:
+            # Place the cut at the cell boundary closest to
+            # the target cumulative weight.
+            target = part*total/n_parts
+            cut = pairmin(int(np.searchsorted(cumulative, target)), N_cells - 1)
+            if cut > 0 and target - cumulative[cut - 1] < cumulative[cut] - target:
+                cut -= 1
+            cut += 1
+        else:
+            cut = part*N_cells//n_parts
+        cuts[part] = pairmin(pairmax(cut, cuts[part - 1] + width_min),
+                             N_cells - (n_parts - part)*width_min)
+    return cuts
+
+# Function which updates the geometry of the local domain
+# according to the current cuts between the domains.
+@cython.header(# Locals
+               module=object,
+               module_dict=dict,
+               module_name=str,
+               name=str,
+               returns='void',
+               )
+def update_domain_geometry():
+    global domain_size_x, domain_size_y, domain_size_z, domain_volume
+    global domain_start_x, domain_start_y, domain_start_z
+    global domain_end_x, domain_end_y, domain_end_z
+    domain_start_x = domain_cuts_x[domain_layout_local_indices[0]]
+    domain_start_y = domain_cuts_y[domain_layout_local_indices[1]]
+    domain_start_z = domain_cuts_z[domain_layout_local_indices[2]]
+    domain_end_x = domain_cuts_x[domain_layout_local_indices[0] + 1]
+    domain_end_y = domain_cuts_y[domain_layout_local_indices[1] + 1]
+    domain_end_z = domain_cuts_z[domain_layout_local_indices[2] + 1]
+    domain_size_x = domain_end_x - domain_start_x
+    domain_size_y = domain_end_y - domain_start_y
+    domain_size_z = domain_end_z - domain_start_z
+    domain_volume = domain_size_x*domain_size_y*domain_size_z
+    # In compiled mode, the domain geometry is shared between the
+    # modules through C variables. In pure Python, the other modules
+    # hold their own copies of the variables they have cimported,
+    # which then need to be updated. Only the CO𝘕CEPT modules which
+    # cimport (some of) these variables are touched.
+    if not cython.compiled:
+        for module_name in ('graphics', 'gravity', 'gravity_old', 'interactions', 'mesh', 'species'):
+            module = sys.modules.get(module_name)
+            if module is None:
+                continue
+            module_dict = vars(module)
+            for name in ('domain_balanced',
+                         'domain_start_x', 'domain_start_y', 'domain_start_z',
+                         'domain_end_x', 'domain_end_y', 'domain_end_z',
+                         'domain_size_x', 'domain_size_y', 'domain_size_z',
+                         'domain_volume',
+                         ):
+                if name in module_dict:
+                    module_dict[name] = globals()[name]
+
 # Function which communicates local component data
 @cython.header(# Arguments
                component_send='Component',
@@ -600,7 +848,9 @@ def rank_neighboring_domain(i, j, k):
                dest='int',
                source='int',
                component_recv='Component',
+               indices='Py_ssize_t[::1]',
                # Locals
+               N_indices='Py_ssize_t',
                dim='int',
                operation=str,
                mom_dim_recv='double[::1]',
@@ -609,7 +859,8 @@ def rank_neighboring_domain(i, j, k):
                pos_dim_send='double[::1]',
                returns='Component',
                )
-def sendrecv_component(component_send, variables, dest, source, component_recv=None):
+def sendrecv_component(component_send, variables, dest, source, component_recv=None,
+                       indices=None):
     """This function operate in two modes:
     - Communicate data (no component_recv supplied):
       The data of component_send will be send and received
@@ -628,6 +879,12 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
     The implemented variables are:
     - 'pos' (posx, posy and posz for particles)
     - 'mom' (momx, momy and momz for particles)
+    If indices are passed, only a subset of the local particles
+    participate in the communication. In communicate mode, only the
+    particles of component_send with these indices are sent, while in
+    apply mode the received buffer data is added to the particles of
+    component_recv with these indices. Thus, the same indices should
+    be passed to both calls.
     """
     global component_buffer
     if component_send.representation != 'particles':  # !!! Generalize to fluids also
@@ -643,25 +900,10 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
         # really the local process.
         if dest == rank == source:
             return component_send
-        # We cannot simply import Component from the species module,
-        # as this would create an import loop. Instead, the first time
-        # the component_buffer is needed, we grab the type of the passed
-        # component_send (Component) and instantiate such an instance.
-        if component_buffer is None:
-            component_buffer = type(component_send)('', 'dark matter particles', 1)
-            component_buffer.name = 'buffer'
-        # Adjust important meta data on the buffer component
-        component_buffer.name           = component_send.name
-        component_buffer.species        = component_send.species
-        component_buffer.representation = component_send.representation
-        if component_send.representation == 'particles':
-            component_buffer.N                = component_send.N
-            component_buffer.mass             = component_send.mass
-            component_buffer.softening_length = component_send.softening_length
-        elif component_send.representation == 'fluid':
-            ...
+        component_buffer = prepare_component_buffer(component_send, component_buffer)
         # Enlarge the data arrays of the component_buffer if necessary
-        component_buffer.N_local = sendrecv(component_send.N_local, dest=dest, source=source)
+        N_indices = (component_send.N_local if indices is None else indices.shape[0])
+        component_buffer.N_local = sendrecv(N_indices, dest=dest, source=source)
         if component_buffer.N_allocated < component_buffer.N_local:
             component_buffer.resize(component_buffer.N_local)
         # Use component_buffer as component_recv
@@ -674,12 +916,9 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
                     pos_dim_send = component_send.pos_mv[dim][:component_send.N_local]
                 else:
                     pos_dim_send = component_send.Δpos_mv[dim][:component_send.N_local]
-            pos_dim_recv = component_recv.pos_mv[dim][:component_recv.N_local]
-            smart_mpi(pos_dim_send, pos_dim_recv, dest=dest,
-                                                  source=source,
-                                                  mpifun='Sendrecv',
-                                                  operation=operation,
-                      )
+            pos_dim_recv = component_recv.pos_mv[dim]
+            sendrecv_component_data(pos_dim_send, pos_dim_recv, component_recv.N_local,
+                                    dest, source, operation, indices)
     if 'mom' in variables:
         for dim in range(3):
             with unswitch:
@@ -687,17 +926,294 @@ def sendrecv_component(component_send, variables, dest, source, component_recv=N
                     mom_dim_send = component_send.mom_mv[dim][:component_send.N_local]
                 else:
                     mom_dim_send = component_send.Δmom_mv[dim][:component_send.N_local]
-            mom_dim_recv = component_recv.mom_mv[dim][:component_recv.N_local]
-            smart_mpi(mom_dim_send, mom_dim_recv, dest=dest,
-                                                  source=source,
-                                                  mpifun='Sendrecv',
-                                                  operation=operation,
-                      )
+            mom_dim_recv = component_recv.mom_mv[dim]
+            sendrecv_component_data(mom_dim_send, mom_dim_recv, component_recv.N_local,
+                                    dest, source, operation, indices)
     return component_recv
 # Declare the buffer component used by sendrecv_component
 cython.declare(component_buffer='Component')
 component_buffer = None
 
+# Helper function for sendrecv_component and sendrecv_component_start,
+# returning the passed buffer component with its meta data adjusted to
+# match that of component_send. If no buffer component is passed
+# (None), a new one is instantiated.
+@cython.header(# Arguments
+               component_send='Component',
+               buffer_component='Component',
+               returns='Component',
+               )
+def prepare_component_buffer(component_send, buffer_component):
+    # We cannot simply import Component from the species module,
+    # as this would create an import loop. Instead, the first time
+    # a buffer component is needed, we grab the type of the passed
+    # component_send (Component) and instantiate such an instance.
+    if buffer_component is None:
+        buffer_component = type(component_send)('', 'dark matter particles', 1)
+    # Adjust important meta data on the buffer component
+    buffer_component.name           = component_send.name
+    buffer_component.species        = component_send.species
+    buffer_component.representation = component_send.representation
+    if component_send.representation == 'particles':
+        buffer_component.N                = component_send.N
+        buffer_component.mass             = component_send.mass
+        buffer_component.softening_length = component_send.softening_length
+    elif component_send.representation == 'fluid':
+        ...
+    return buffer_component
+
+# Non-blocking version of sendrecv_component. The communication is
+# started by this function, which returns a handle to be passed to
+# sendrecv_component_wait, which completes the communication.
+# No blocking calls are made here. In communicate mode, the number of
+# particles to receive is not known up front, and so the receive is
+# only posted by sendrecv_component_wait, sized using MPI Probe.
+# All variables are packed into a single message. Two sets of buffers
+# exist, selected by buffer_index (0 or 1), allowing the communication
+# for the next pair of processes to be carried out while the data
+# received from the current pair is still in use (double buffering).
+# Communications started in the two modes (communicate and apply)
+# use separate buffers, and so one of each may be in flight for each
+# buffer_index at the same time. Besides 'pos' and 'mom', the particle
+# rungs may be communicated as 'rung' (in communicate mode only).
+@cython.pheader(# Arguments
+                component_send='Component',
+                variables=list,  # list of str's
+                dest='int',
+                source='int',
+                component_recv='Component',
+                indices='Py_ssize_t[::1]',
+                buffer_index='int',
+                # Locals
+                N_recv='Py_ssize_t',
+                N_send='Py_ssize_t',
+                buffer_recv=object,  # np.ndarray
+                buffer_send_mv='double[::1]',
+                data_send='double[::1]',
+                dim='int',
+                i='Py_ssize_t',
+                index='Py_ssize_t',
+                n_vars='int',
+                operation=str,
+                requests=list,
+                rung='unsigned char*',
+                tag='int',
+                variable=str,
+                returns=tuple,
+                )
+def sendrecv_component_start(component_send, variables, dest, source, component_recv=None,
+                             indices=None, buffer_index=0):
+    if component_send.representation != 'particles':  # !!! Generalize to fluids also
+        abort('The sendrecv_component_start function is only implemented for particle components')
+    # Determine the mode of operation
+    operation = '+='
+    if component_recv is None:
+        operation = '='
+    if operation == '=':
+        # No communication is needed if the destination and source is
+        # really the local process.
+        if dest == rank == source:
+            return (operation, component_send, variables, indices, [], None, -1, -1, -1)
+    if mpi_instrumentation:
+        mpi_tic()
+    if operation == '=':
+        # Use one of the double buffer components as component_recv
+        component_recv = prepare_component_buffer(component_send,
+                                                  component_buffers[buffer_index])
+        component_buffers[buffer_index] = component_recv
+        N_send = (component_send.N_local if indices is None else indices.shape[0])
+        tag = 1
+    else:
+        N_send = component_send.N_local
+        N_recv = (component_recv.N_local if indices is None else indices.shape[0])
+        tag = 2
+    # Pack the variables into a single contiguous send buffer.
+    # In communicate mode, only the indexed particles are packed.
+    n_vars = count_component_variables(variables)
+    buffer_send_mv = get_buffer(n_vars*N_send, ('sendrecv_component_send', tag, buffer_index))
+    index = 0
+    for variable in variables:
+        if variable == 'rung':
+            # The rungs are packed as doubles
+            rung = component_send.rung
+            if indices is not None:
+                for i in range(N_send):
+                    buffer_send_mv[index + i] = rung[indices[i]]
+            else:
+                for i in range(N_send):
+                    buffer_send_mv[index + i] = rung[i]
+            index += N_send
+            continue
+        for dim in range(3):
+            if variable == 'pos':
+                data_send = (component_send.pos_mv  if operation == '=' else component_send.Δpos_mv)[dim]
+            elif variable == 'mom':
+                data_send = (component_send.mom_mv  if operation == '=' else component_send.Δmom_mv)[dim]
+            else:
+                abort(f'The sendrecv_component_start function cannot communicate "{variable}"')
+            if operation == '=' and indices is not None:
+                for i in range(N_send):
+                    buffer_send_mv[index + i] = data_send[indices[i]]
+            else:
+                buffer_send_mv[index:index + N_send] = data_send[:N_send]
+            index += N_send
+    # Post the non-blocking communication. In communicate mode,
+    # the receive is posted by sendrecv_component_wait.
+    requests = [Isend(buffer_send_mv[:n_vars*N_send], dest=dest, tag=tag)]
+    buffer_recv = None
+    if operation == '+=':
+        buffer_recv = get_buffer(n_vars*N_recv, ('sendrecv_component_recv', tag, buffer_index))
+        buffer_recv = buffer_recv[:n_vars*N_recv]
+        requests.append(Irecv(buffer_recv, source=source, tag=tag))
+    if mpi_instrumentation:
+        mpi_count_bytes(8*n_vars*N_send)
+        mpi_toc('sendrecv_component_start')
+    return (operation, component_recv, variables, indices, requests, buffer_recv,
+        source, tag, buffer_index)
+# The two buffer components used by sendrecv_component_start
+cython.declare(component_buffers=list)
+component_buffers = [None, None]
+
+# Function completing a communication
+# started by sendrecv_component_start. In communicate mode, the buffer
+# component holding the received data is returned. In apply mode,
+# the received buffer data is added to the component passed as
+# component_recv to sendrecv_component_start, which is returned.
+@cython.pheader(# Arguments
+                handle=tuple,
+                # Locals
+                N_recv='Py_ssize_t',
+                buffer_index='int',
+                buffer_recv=object,  # np.ndarray
+                buffer_recv_mv='double[::1]',
+                component_recv='Component',
+                data_recv='double[::1]',
+                dim='int',
+                i='Py_ssize_t',
+                index='Py_ssize_t',
+                indices='Py_ssize_t[::1]',
+                n_vars='int',
+                operation=str,
+                requests=list,
+                rung='unsigned char*',
+                source='int',
+                status=object,  # mpi4py.MPI.Status
+                tag='int',
+                variable=str,
+                variables=list,
+                returns='Component',
+                )
+def sendrecv_component_wait(handle):
+    (operation, component_recv, variables, indices, requests, buffer_recv,
+        source, tag, buffer_index) = handle
+    if not requests:
+        return component_recv
+    if mpi_instrumentation:
+        mpi_tic()
+    n_vars = count_component_variables(variables)
+    if buffer_recv is None:
+        # Communicate mode. Probe the incoming message for the number
+        # of particles, enlarge the data arrays of the buffer component
+        # if necessary and receive the data.
+        status = MPI.Status()
+        Probe(source=source, tag=tag, status=status)
+        N_recv = status.Get_count(MPI.DOUBLE)//n_vars
+        component_recv.N_local = N_recv
+        if component_recv.N_allocated < N_recv:
+            component_recv.resize(N_recv)
+        buffer_recv = get_buffer(n_vars*N_recv, ('sendrecv_component_recv', tag, buffer_index))
+        buffer_recv = buffer_recv[:n_vars*N_recv]
+        Recv(buffer_recv, source=source, tag=tag)
+    MPI.Request.Waitall(requests)
+    if mpi_instrumentation:
+        mpi_toc('sendrecv_component_wait')
+    # Unpack the received data
+    buffer_recv_mv = buffer_recv
+    N_recv = buffer_recv_mv.shape[0]//n_vars
+    index = 0
+    for variable in variables:
+        if variable == 'rung':
+            rung = component_recv.rung
+            for i in range(N_recv):
+                rung[i] = int(buffer_recv_mv[index + i])
+            index += N_recv
+            continue
+        for dim in range(3):
+            data_recv = (component_recv.pos_mv if variable == 'pos' else component_recv.mom_mv)[dim]
+            if operation == '=':
+                data_recv[:N_recv] = buffer_recv_mv[index:index + N_recv]
+            elif indices is None:
+                for i in range(N_recv):
+                    data_recv[i] += buffer_recv_mv[index + i]
+            else:
+                for i in range(N_recv):
+                    data_recv[indices[i]] += buffer_recv_mv[index + i]
+            index += N_recv
+    return component_recv
+
+# Helper function for sendrecv_component_start and
+# sendrecv_component_wait, returning the number of doubles
+# per particle needed to store the given variables.
+@cython.header(# Arguments
+               variables=list,
+               # Locals
+               n_vars='int',
+               variable=str,
+               returns='int',
+               )
+def count_component_variables(variables):
+    n_vars = 0
+    for variable in variables:
+        n_vars += (1 if variable == 'rung' else 3)
+    return n_vars
+
+# Helper function for sendrecv_component, communicating a single
+# data array. If indices are given, only the indexed elements of
+# data_send are sent (communicate mode, operation == '=') or the
+# received data is added to the indexed elements of data_recv
+# (apply mode, operation == '+=').
+@cython.header(# Arguments
+               data_send='double[::1]',
+               data_recv='double[::1]',
+               N_recv='Py_ssize_t',
+               dest='int',
+               source='int',
+               operation=str,
+               indices='Py_ssize_t[::1]',
+               # Locals
+               buffer_mv='double[::1]',
+               i='Py_ssize_t',
+               returns='void',
+               )
+def sendrecv_component_data(data_send, data_recv, N_recv, dest, source, operation, indices):
+    if indices is None:
+        # Communicate the data of all local particles
+        smart_mpi(data_send, data_recv[:N_recv], dest=dest,
+                                                 source=source,
+                                                 mpifun='Sendrecv',
+                                                 operation=operation,
+                  )
+    elif operation == '=':
+        # Gather the data of the indexed particles
+        # into a contiguous buffer before sending.
+        buffer_mv = get_buffer(indices.shape[0], 'sendrecv_component')
+        for i in range(indices.shape[0]):
+            buffer_mv[i] = data_send[indices[i]]
+        smart_mpi(buffer_mv, data_recv[:N_recv], dest=dest,
+                                                 source=source,
+                                                 mpifun='Sendrecv',
+                  )
+    else:
+        # Receive the buffer data into a contiguous buffer
+        # and add it to the indexed particles.
+        buffer_mv = get_buffer(indices.shape[0], 'sendrecv_component')
+        smart_mpi(data_send, buffer_mv, dest=dest,
+                                        source=source,
+                                        mpifun='Sendrecv',
+                  )
+        for i in range(indices.shape[0]):
+            data_recv[indices[i]] += buffer_mv[i]
+
 # Very general function for different MPI communications
 @cython.pheader(# Arguments
                 block_send=object,  # Memoryview of dimension 1, 2 or 3
@@ -736,6 +1252,7 @@ component_buffer = None
                 reverse_mpifun_mapping=dict,
                 sendbuf_mv='double[::1]',
                 using_recvbuf='bint',
+                request=object,  # mpi4py.MPI.Request
                 returns=object,  # NumPy array or mpi4py.MPI.Request
                 )
 def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank,
@@ -953,6 +1470,10 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
                         sendbuf_mv[index] = mv_3D[i, j, k]
                         index += 1
     # Do the communication
+    if mpi_instrumentation:
+        mpi_tic()
+        if sending:
+            mpi_count_bytes(8*size_send)
     if mpifun == 'allgather':
         Allgather(data_send, data_recv)
     elif mpifun == 'allgatherv':
@@ -967,7 +1488,7 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
     elif mpifun == 'gatherv':
         Gatherv(data_send, (data_recv, sizes_recv) if rank == root else None, root=root)
     elif mpifun == 'isend':
-        return Isend(data_send, dest=dest)
+        request = Isend(data_send, dest=dest)
     elif mpifun == 'recv':
         Recv(data_recv, source=source)
     elif mpifun == 'send':
@@ -976,7 +1497,11 @@ def smart_mpi(block_send=(), block_recv=(), dest=-1, source=-1, root=master_rank
         Sendrecv(data_send, recvbuf=data_recv, dest=dest, source=source)
     else:
         abort('MPI function "{}" is not implemented'.format(mpifun))
+    if mpi_instrumentation:
+        mpi_toc(f'smart_mpi ({mpifun})')
     # If only sending, return now
+    if mpifun == 'isend':
+        return request
     if not recving:
         return data_send
     # If nothing was received, return an empty slice of arr_recv
@@ -1106,6 +1631,7 @@ def get_buffer(size_or_shape=-1, buffer_name=0, nullify=False):
         buffers[N_buffers - 1] = buffer
         buffer_mv = cast(buffer, 'double[:size]')
         buffers_mv[buffer_name] = buffer_mv
+        memory_register('buffer', str(buffer_name), size*np.dtype(C2np['double']).itemsize)
     # Nullify the buffer, if required
     if nullify:
         for i in range(size):
@@ -1134,6 +1660,7 @@ def resize_buffer(size, buffer_name):
     buffers[index] = buffer
     buffer_mv = cast(buffer, 'double[:size]')
     buffers_mv[buffer_name] = buffer_mv
+    memory_register('buffer', str(buffer_name), size*np.dtype(C2np['double']).itemsize)
 # Initialize buffers
 cython.declare(buffers='double**',
                buffer='double*',
@@ -1183,21 +1710,57 @@ domain_start_x = domain_layout_local_indices[0]*domain_size_x
 domain_start_y = domain_layout_local_indices[1]*domain_size_y
 domain_start_z = domain_layout_local_indices[2]*domain_size_z
 domain_end_x = domain_start_x + domain_size_x
-domain_end_y = domain_start_x + domain_size_x
-domain_end_z = domain_start_x + domain_size_x
+domain_end_y = domain_start_y + domain_size_y
+domain_end_z = domain_start_z + domain_size_z
+# The global cuts between the domains along each dimension. Initially
+# the domains are of equal size, but the cuts may later be moved
+# in order to balance the load, see rebalance_domains.
+cython.declare(domain_balanced='bint',
+               domain_cuts_x='double[::1]',
+               domain_cuts_y='double[::1]',
+               domain_cuts_z='double[::1]',
+               domain_work='double',
+               )
+domain_balanced = False
+domain_cuts_x = asarray([j*domain_size_x for j in range(domain_subdivisions[0] + 1)],
+                        dtype=C2np['double'])
+domain_cuts_y = asarray([j*domain_size_y for j in range(domain_subdivisions[1] + 1)],
+                        dtype=C2np['double'])
+domain_cuts_z = asarray([j*domain_size_z for j in range(domain_subdivisions[2] + 1)],
+                        dtype=C2np['double'])
+domain_cuts_x[domain_subdivisions[0]] = boxsize
+domain_cuts_y[domain_subdivisions[1]] = boxsize
+domain_cuts_z[domain_subdivisions[2]] = boxsize
+# The domain grids must be aligned with the domains. If φ_gridsize
+# cannot be divided according to the domain decomposition, the cuts are
+# moved to the nearest cell boundaries of the global φ grid, leaving
+# the domains slightly unequal in size, just as for balanced domains.
+if any([φ_gridsize%domain_subdivisions[dim] != 0 for dim in range(3)]):
+    for cuts in (domain_cuts_x, domain_cuts_y, domain_cuts_z):
+        for j in range(cuts.shape[0]):
+            cuts[j] = round(cuts[j]*ℝ[φ_gridsize/boxsize])*ℝ[boxsize/φ_gridsize]
+        cuts[cuts.shape[0] - 1] = boxsize
+    domain_balanced = True
+    update_domain_geometry()
+# The work done by the local process since the last rebalancing
+domain_work = 0
 
 # Initialize variables used in the exchange function
 cython.declare(N_send='Py_ssize_t[::1]',
-               indices_send='Py_ssize_t**',
-               indices_send_sizes='Py_ssize_t[::1]',
+               exchange_counts_recv='int[::1]',
+               exchange_counts_send='int[::1]',
+               exchange_displacements_recv='int[::1]',
+               exchange_displacements_send='int[::1]',
+               exchange_owners='int[::1]',
                )
 # This variable stores the number of particles to send to each prcess
 N_send = empty(nprocs, dtype=C2np['Py_ssize_t'])
-# This Py_ssize_t** variable stores the indices of particles to be send
-# to other processes. That is, indices_send[other_rank][i] is the local
-# index of some particle which should be send to other_rank.
-indices_send = malloc(nprocs*sizeof('Py_ssize_t*'))
-for j in range(nprocs):
-    indices_send[j] = malloc(1*sizeof('Py_ssize_t'))
-# The size of the allocated indices_send[:] memory
-indices_send_sizes = ones(nprocs, dtype=C2np['Py_ssize_t'])
+# The number of doubles to send to and receive from each process,
+# as well as the corresponding displacements into the packed buffers.
+exchange_counts_send        = empty(nprocs, dtype=C2np['int'])
+exchange_counts_recv        = empty(nprocs, dtype=C2np['int'])
+exchange_displacements_send = empty(nprocs, dtype=C2np['int'])
+exchange_displacements_recv = empty(nprocs, dtype=C2np['int'])
+# The rank of the owner of each local particle. This grows in size
+# if needed.
+exchange_owners = empty(1, dtype=C2np['int'])
@@ -25,6 +25,7 @@
 from commons import *
 
 # Cython imports
+cimport('from instrumentation import memory_register')
 cimport('from mesh import CIC_vectorgrid2coordinates, tabulate_vectorfield')
 
 
@@ -124,13 +125,6 @@ def summation(x, y, z):
                x='double',
                y='double',
                z='double',
-               # Locals
-               dim='int',
-               force='double*',
-               grid='double[:, :, :, ::1]',
-               isnegative_x='bint',
-               isnegative_y='bint',
-               isnegative_z='bint',
                returns='double*',
                )
 def ewald(x, y, z):
@@ -143,8 +137,32 @@ def ewald(x, y, z):
     0 <= |x|, |y|, |z| < boxsize/2. The returned value is thus the force
     arising on the first particle due to all periodic images of the
     second particle, except for the nearest one.
+    The returned force is stored in the global vector buffer.
+    For threaded loops, use ewald_lookup instead.
     """
-    grid = get_grid()
+    ewald_lookup(get_grid(), x, y, z, vector)
+    return vector
+
+# Function performing the Ewald look up of the ewald function above,
+# using the passed (already loaded) Ewald grid and writing the force
+# to the passed force buffer. As the function does not need the GIL,
+# it can be called from within threaded loops, given that each thread
+# passes its own force buffer.
+@cython.header(# Arguments
+               grid='double[:, :, :, ::1]',
+               x='double',
+               y='double',
+               z='double',
+               force='double*',
+               # Locals
+               dim='int',
+               isnegative_x='bint',
+               isnegative_y='bint',
+               isnegative_z='bint',
+               returns='void',
+               )
+@cython.nogil
+def ewald_lookup(grid, x, y, z, force):
     # Only the positive octant of the box is tabulated. Flip the sign of
     # the coordinates so that they reside inside this octant.
     if x > 0:
@@ -165,10 +183,11 @@ def ewald(x, y, z):
     # Look up Ewald force and do a CIC interpolation. Since the
     # coordinates are to the nearest image, they must be scaled by
     # 2/boxsize to reside in the range 0 <= x, y, z < 1.
-    force = CIC_vectorgrid2coordinates(grid, x*ℝ[2/boxsize],
-                                             y*ℝ[2/boxsize],
-                                             z*ℝ[2/boxsize],
-                                       )
+    CIC_vectorgrid2coordinates(grid, x*ℝ[2/boxsize],
+                                     y*ℝ[2/boxsize],
+                                     z*ℝ[2/boxsize],
+                               force,
+                               )
     # Put the sign back in for negative input
     if isnegative_x:
         force[0] *= -1
@@ -179,7 +198,6 @@ def ewald(x, y, z):
     # The tabulated force is for a unit box. Do rescaling
     for dim in range(3):
         force[dim] *= ℝ[1/boxsize**2]
-    return force
 
 # Function for loading the Ewald grid from disk.
 # The result is stored as the global variable 'grid',
@@ -214,6 +232,7 @@ def get_grid():
         # No tabulated Ewald grid found. Compute it. The factor 0.5
         # ensures that only the first octant of the box is tabulated.
         grid = tabulate()
+    memory_register('ewald', 'grid', np.prod(shape)*np.dtype(C2np['double']).itemsize)
     return grid
 cython.declare(grid='double[:, :, :, ::1]', filename=str)
 grid = np.empty((1, 1, 1, 1), dtype=C2np['double'])
@@ -30,7 +30,7 @@ https://github.com/jmd-dk/concept/
 /* This file defines the functions fftw_setup and fftw_clean, which
 together with fftw_execute (included in fftw3-mpi.h) constitutes the
 necessary functions for using FFTW to do parallel, real, 3D in-place
-transforms through Cython.
+transforms through Cython. The transforms may additionally be threaded.
 */
 
 /* Note on indexing.
@@ -76,6 +76,28 @@ struct fftw_return_struct{
     fftw_plan plan_forward;
     fftw_plan plan_backward;
 };
+
+// Flag specifying whether the threaded FFTW has been initialized
+static bool fftw_threads_initialized = false;
+
+// Function converting the FFTW rigor given as a string
+// to the corresponding FFTW flag.
+int get_rigor_flag(char* fftw_wisdom_rigor){
+    if (strcmp(fftw_wisdom_rigor, "estimate") == 0){
+        return FFTW_ESTIMATE;
+    }
+    else if (strcmp(fftw_wisdom_rigor, "measure") == 0){
+        return FFTW_MEASURE;
+    }
+    else if (strcmp(fftw_wisdom_rigor, "patient") == 0){
+        return FFTW_PATIENT;
+    }
+    else if (strcmp(fftw_wisdom_rigor, "exhaustive") == 0){
+        return FFTW_EXHAUSTIVE;
+    }
+    return FFTW_ESTIMATE;
+}
+
 // This function initializes fftw_mpi, allocates a grid,
 // desides the local lengths and starting indices and
 // creates forwards and backwards plans.
@@ -84,7 +106,8 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
                                      ptrdiff_t gridsize_k,
                                      char* fftw_wisdom_rigor,
                                      bool fftw_wisdom_reuse,
-                                     char* wisdom_filename){
+                                     char* wisdom_filename,
+                                     int nthreads){
     // Arguments to this function:
     // - Linear gridsize of dimension 1.
     // - Linear gridsize of dimension 2.
@@ -93,16 +116,28 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
     //   of the wisdom. In order of patience:
     //   "estimate", "measure", "patient", "exhaustive".
     // - Flag specifying whether or not to use pre-existing FFTW wisdom.
+    // - Filename of the wisdom file.
+    // - Number of threads with which to carry out the transforms.
 
     // Size of last dimension with padding
     ptrdiff_t gridsize_padding = 2*(gridsize_k/2 + 1);
 
+    // Initialize threaded FFTW. This must be done
+    // before fftw_mpi_init is called.
+    if (! fftw_threads_initialized){
+        fftw_init_threads();
+        fftw_threads_initialized = true;
+    }
+
     // Initialize parallel fftw (note that MPI_Init should not be
     // called, as MPI is already running via MPI4Py).
     // Note that this function may be called multiple times in one MPI
     // session without errors; only the first call will have any effect.
     fftw_mpi_init();
 
+    // All plans created from now on will use nthreads threads
+    fftw_plan_with_nthreads(nthreads);
+
     // Process identification
     int rank, nprocs;
     MPI_Comm_rank(MPI_COMM_WORLD, &rank);
@@ -135,19 +170,7 @@ struct fftw_return_struct fftw_setup(ptrdiff_t gridsize_i,
     }
 
     // Convert fftw_wisdom_rigor to integer flag
-    int rigor_flag = FFTW_ESTIMATE;
-    if (strcmp(fftw_wisdom_rigor, "estimate") == 0){
-        rigor_flag = FFTW_ESTIMATE;
-    }
-    else if (strcmp(fftw_wisdom_rigor, "measure") == 0){
-        rigor_flag = FFTW_MEASURE;
-    }
-    else if (strcmp(fftw_wisdom_rigor, "patient") == 0){
-        rigor_flag = FFTW_PATIENT;
-    }
-    else if (strcmp(fftw_wisdom_rigor, "exhaustive") == 0){
-        rigor_flag = FFTW_EXHAUSTIVE;
-    }
+    int rigor_flag = get_rigor_flag(fftw_wisdom_rigor);
 
     // Create the two plans
     fftw_plan plan_forward  = fftw_mpi_plan_dft_r2c_3d(gridsize_i,
@@ -189,3 +212,124 @@ void fftw_clean(double* grid, fftw_plan plan_forward, fftw_plan plan_backward){
     fftw_destroy_plan(plan_backward);
     fftw_mpi_cleanup();
 }
+
+/* Pencil decomposition.
+The functions below implement a distributed real 3D transform using a
+2D (pencil) decomposition over a P1×P2 process grid, lifting the
+restriction of the slab decomposition to at most gridsize processes.
+Only the local 1D transforms are carried out by FFTW here, while the
+global transpositions between the stages are done through MPI by the
+caller. The three stages (data layouts) are, with the complex numbers
+along the last dimension stored as pairs of doubles:
+- Real space:    [i_local (P1), j_local (P2), k (padded)]
+- Transposed:    [i_local (P1), j,            k_local (P2)]
+- Fourier space: [j_local (P1), i,            k_local (P2)]
+The forward transform is then an r2c transform along k in real space,
+a c2c transform along j in the transposed layout and a c2c transform
+along i in Fourier space. The backward transform is the reverse.
+Note that the Fourier space layout is identical to that of the slab
+decomposition when P2 = 1.
+*/
+
+// Struct for return type of the fftw_pencil_setup function
+struct fftw_pencil_return_struct{
+    double* grid;
+    fftw_plan plan_forward_k;
+    fftw_plan plan_forward_j;
+    fftw_plan plan_forward_i;
+    fftw_plan plan_backward_i;
+    fftw_plan plan_backward_j;
+    fftw_plan plan_backward_k;
+};
+
+// This function allocates a pencil grid and creates the
+// (1D, in-place) plans for all stages of the forward and backward
+// transformations.
+struct fftw_pencil_return_struct fftw_pencil_setup(ptrdiff_t gridsize,
+                                                   ptrdiff_t size_i_real,
+                                                   ptrdiff_t size_j_real,
+                                                   ptrdiff_t size_j_fourier,
+                                                   ptrdiff_t size_k_fourier,
+                                                   ptrdiff_t size_alloc,
+                                                   char* fftw_wisdom_rigor,
+                                                   int nthreads){
+    // Arguments to this function:
+    // - Linear gridsize of all dimensions.
+    // - Local size of the i-dimension in real space
+    //   (and in the transposed layout).
+    // - Local size of the j-dimension in real space.
+    // - Local size of the j-dimension in Fourier space.
+    // - Local number of complex numbers along the k-dimension
+    //   in the transposed layout and in Fourier space.
+    // - Number of doubles to allocate, enough to store every stage.
+    // - FFTW planning-rigor.
+    // - Number of threads with which to carry out the transforms.
+
+    // Number of complex numbers along the full k-dimension
+    ptrdiff_t gridsize_complex = gridsize/2 + 1;
+
+    // Initialize threaded FFTW
+    if (! fftw_threads_initialized){
+        fftw_init_threads();
+        fftw_threads_initialized = true;
+    }
+    fftw_plan_with_nthreads(nthreads);
+
+    // Allocate the grid
+    double* grid = fftw_alloc_real(size_alloc);
+    fftw_complex* grid_complex = (fftw_complex*) grid;
+    int rigor_flag = get_rigor_flag(fftw_wisdom_rigor);
+
+    // The r2c and c2r plans along k in real space. Here the i- and
+    // j-dimensions are collapsed into a single loop dimension.
+    fftw_iodim dims_k[1] = {{gridsize, 1, 1}};
+    fftw_iodim howmany_dims_forward_k[1] = {
+        {size_i_real*size_j_real, 2*gridsize_complex, gridsize_complex},
+    };
+    fftw_iodim howmany_dims_backward_k[1] = {
+        {size_i_real*size_j_real, gridsize_complex, 2*gridsize_complex},
+    };
+    fftw_plan plan_forward_k = fftw_plan_guru_dft_r2c(1, dims_k,
+                                                      1, howmany_dims_forward_k,
+                                                      grid, grid_complex,
+                                                      rigor_flag);
+    fftw_plan plan_backward_k = fftw_plan_guru_dft_c2r(1, dims_k,
+                                                       1, howmany_dims_backward_k,
+                                                       grid_complex, grid,
+                                                       rigor_flag);
+
+    // The c2c plans along j in the transposed layout
+    // and along i in Fourier space. As both of these are the
+    // middle dimension, the plans differ only in the outer loop.
+    fftw_iodim dims_middle[1] = {{gridsize, size_k_fourier, size_k_fourier}};
+    fftw_iodim howmany_dims_j[2] = {
+        {size_i_real,    gridsize*size_k_fourier, gridsize*size_k_fourier},
+        {size_k_fourier, 1,                       1                      },
+    };
+    fftw_iodim howmany_dims_i[2] = {
+        {size_j_fourier, gridsize*size_k_fourier, gridsize*size_k_fourier},
+        {size_k_fourier, 1,                       1                      },
+    };
+    fftw_plan plan_forward_j = fftw_plan_guru_dft(1, dims_middle, 2, howmany_dims_j,
+                                                  grid_complex, grid_complex,
+                                                  FFTW_FORWARD, rigor_flag);
+    fftw_plan plan_backward_j = fftw_plan_guru_dft(1, dims_middle, 2, howmany_dims_j,
+                                                   grid_complex, grid_complex,
+                                                   FFTW_BACKWARD, rigor_flag);
+    fftw_plan plan_forward_i = fftw_plan_guru_dft(1, dims_middle, 2, howmany_dims_i,
+                                                  grid_complex, grid_complex,
+                                                  FFTW_FORWARD, rigor_flag);
+    fftw_plan plan_backward_i = fftw_plan_guru_dft(1, dims_middle, 2, howmany_dims_i,
+                                                   grid_complex, grid_complex,
+                                                   FFTW_BACKWARD, rigor_flag);
+
+    // Return a struct with variables
+    struct fftw_pencil_return_struct fftw_pencil_struct = {grid,
+                                                           plan_forward_k,
+                                                           plan_forward_j,
+                                                           plan_forward_i,
+                                                           plan_backward_i,
+                                                           plan_backward_j,
+                                                           plan_backward_k};
+    return fftw_pencil_struct;
+}
@@ -25,11 +25,13 @@
 from commons import *
 
 # Cython imports
-cimport('from communication import communicate_domain')
+cimport('from communication import add_domain_work, communicate_domain, domain_subdivisions, get_buffer')
+cimport('from cython.parallel import prange, threadid')
 cimport('from communication import domain_size_x , domain_size_y , domain_size_z' )
 cimport('from communication import domain_start_x, domain_start_y, domain_start_z')
-cimport('from ewald import ewald')
-cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
+cimport('from ewald import ewald_lookup, get_grid')
+cimport('from mesh import CIC_grid2grid, domain_grid2particles, domain_grid2particles_gradient')
+cimport('from tree import construct_tree, tree_force')
 
 
 
@@ -45,13 +47,21 @@ cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
                # Locals
                N_1='Py_ssize_t',
                N_2='Py_ssize_t',
-               force_ij='double*',
+               cells_threads='Py_ssize_t[:, ::1]',
+               ewald_grid='double[:, :, :, ::1]',
+               force_threads='double[:, ::1]',
                forcex_ij='double',
                forcey_ij='double',
                forcez_ij='double',
                i='Py_ssize_t',
+               index='Py_ssize_t',
+               index_end='Py_ssize_t',
+               index_start='Py_ssize_t',
                j='Py_ssize_t',
-               j_start='Py_ssize_t',
+               kick='double',
+               kick_1='double',
+               kick_2='double',
+               l='Py_ssize_t',
                mass_1='double',
                mass_2='double',
                momx_1='double*',
@@ -60,6 +70,7 @@ cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
                momy_2='double*',
                momz_1='double*',
                momz_2='double*',
+               n_cells='Py_ssize_t',
                only_short_range='bint',
                periodic='bint',
                posx_1='double*',
@@ -68,12 +79,18 @@ cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
                posy_2='double*',
                posz_1='double*',
                posz_2='double*',
-               r='double',
-               r_scaled='double',
+               r2='double',
                r3='double',
+               rung_1='unsigned char*',
+               rung_2='unsigned char*',
+               rung_ᔑdt='double[::1]',
                shortrange_fac='double',
                softening_1='double',
                softening_2='double',
+               thread='int',
+               update_j='bint',
+               use_mesh='bint',
+               use_rungs='bint',
                x_ji='double',
                xi='double',
                y_ji='double',
@@ -86,6 +103,7 @@ cimport('from mesh import CIC_grid2grid, CIC_scalargrid2coordinates')
                Δmomy_ij='double',
                Δmomz_2='double*',
                Δmomz_ij='double',
+               Δmom_threads='double[:, :, ::1]',
                returns='void',
                )
 def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, extra_args):
@@ -94,6 +112,14 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
     # Extract extra arguments
     only_short_range = extra_args.get('only_short_range', False)
     periodic         = extra_args.get('periodic',         True)
+    # With block time steps, each particle is kicked by the time
+    # integral ∫a⁻¹dt belonging to its rung, with inactive rungs having
+    # a vanishing integral. Otherwise, all particles are kicked
+    # by the same integral.
+    use_rungs = ('rungs' in ᔑdt)
+    if use_rungs:
+        rung_ᔑdt = ᔑdt['rungs']
+    kick = ᔑdt['a**(-1)']
     # Extract variables from the first (the local) component
     N_1 = component_1.N_local
     mass_1 = component_1.mass
@@ -104,6 +130,7 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
     momx_1 = component_1.momx
     momy_1 = component_1.momy
     momz_1 = component_1.momz
+    rung_1 = component_1.rung
     # Extract variables from the second (the external) component
     N_2 = component_2.N_local
     mass_2 = component_2.mass
@@ -114,111 +141,536 @@ def gravity_pairwise(component_1, component_2, rank_2, ᔑdt, local, mutual, ext
     momx_2 = component_2.momx
     momy_2 = component_2.momy
     momz_2 = component_2.momz
+    rung_2 = component_2.rung
     Δmomx_2 = component_2.Δmomx
     Δmomy_2 = component_2.Δmomy
     Δmomz_2 = component_2.Δmomz
+    # The Ewald grid is needed for the periodic force. Make sure that it
+    # is loaded before entering the threaded loop below. The Ewald
+    # look-ups are written to a separate force buffer for each thread.
+    if periodic and not only_short_range:
+        ewald_grid = get_grid()
+    force_threads = empty((num_threads, 3), dtype=C2np['double'])
+    # For the short-range force, the particles j are sorted into a
+    # chaining mesh covering the local domain, so that each particle i
+    # only needs to visit the particles j in the surrounding cells.
+    # The neighbouring cells of each particle i are stored separately
+    # for each thread.
+    use_mesh = only_short_range
+    if use_mesh:
+        construct_chaining_mesh(posx_2, posy_2, posz_2, N_2)
+        cells_threads = empty((num_threads, 27), dtype=C2np['Py_ssize_t'])
+    # The loop over particles i is shared among the OpenMP threads.
+    # Each particle i is then handled by a single thread, but the same
+    # particle j receives momentum updates from all threads. The
+    # momentum updates of the particles j are therefore accumulated
+    # separately for each thread in a persistent buffer and summed up
+    # after the loop. When the interaction is completely local, each
+    # pair is visited only once, with both particles updated.
+    update_j = (local or mutual)
+    if update_j:
+        Δmom_threads = get_buffer((num_threads, N_2, 3), 'gravity_pairwise (Δmom_threads)', nullify=True)
     # Loop over all pairs of particles
-    for i in range(N_1):
+    for i in prange(N_1, nogil=True, schedule='guided', num_threads=num_threads):
+        thread = threadid()
+        kick_1 = kick
+        kick_2 = kick
+        with unswitch:
+            if use_rungs:
+                kick_1 = rung_ᔑdt[rung_1[i]]
+        # Skip inactive particles i when the particles j
+        # do not receive any momentum updates.
+        if kick_1 == 0 and not update_j:
+            continue
         xi = posx_1[i]
         yi = posy_1[i]
         zi = posz_1[i]
-        # If the interaction is completely local,
-        # make sure not to double count.
+        # The particles j to visit. With the chaining mesh, these are
+        # the particles within the (up to 27) cells surrounding
+        # particle i. Otherwise, all particles j are visited,
+        # as though they all belong to a single cell.
         with unswitch:
-            if local:
-                j_start = i + 1
+            if use_mesh:
+                n_cells = chaining_mesh_neighbour_cells(
+                    xi, yi, zi, cython.address(cells_threads[thread, :]),
+                )
             else:
-                j_start = 0
-        for j in range(j_start, N_2):
-            # "Vector" from particle j to particle i
-            x_ji = xi - posx_2[j]
-            y_ji = yi - posy_2[j]
-            z_ji = zi - posz_2[j]
-            # Evaluate the gravitational force in one of three ways:
-            # Just the short range force, the total force with Ewald
-            # corrections or the total force without Ewald corrections.
+                n_cells = 1
+        for l in range(n_cells):
             with unswitch:
-                if only_short_range:
-                    # Translate coordinates so they
-                    # correspond to the nearest image.
-                    if x_ji > ℝ[0.5*boxsize]:
-                        x_ji -= boxsize
-                    elif x_ji < ℝ[-0.5*boxsize]:
-                        x_ji += boxsize
-                    if y_ji > ℝ[0.5*boxsize]:
-                        y_ji -= boxsize
-                    elif y_ji < ℝ[-0.5*boxsize]:
-                        y_ji += boxsize
-                    if z_ji > ℝ[0.5*boxsize]:
-                        z_ji -= boxsize
-                    elif z_ji < ℝ[-0.5*boxsize]:
-                        z_ji += boxsize
-                    r = sqrt(x_ji**2 + y_ji**2 + z_ji**2 + ℝ[(0.5*(softening_1 + softening_2))**2])
-                    r_scaled = r*ℝ[1/p3m_scale_phys]
-                    shortrange_fac = (  r_scaled*ℝ[1/sqrt(π)]*exp(-0.25*r_scaled**2)
-                                      + erfc(0.5*r_scaled))
-                    forcex_ij = x_ji*ℝ[-shortrange_fac/r**3]
-                    forcey_ij = y_ji*ℝ[-shortrange_fac/r**3]
-                    forcez_ij = z_ji*ℝ[-shortrange_fac/r**3]
-                elif periodic:
-                    # Translate coordinates so they
-                    # correspond to the nearest image.
-                    if x_ji > ℝ[0.5*boxsize]:
-                        x_ji -= boxsize
-                    elif x_ji < ℝ[-0.5*boxsize]:
-                        x_ji += boxsize
-                    if y_ji > ℝ[0.5*boxsize]:
-                        y_ji -= boxsize
-                    elif y_ji < ℝ[-0.5*boxsize]:
-                        y_ji += boxsize
-                    if z_ji > ℝ[0.5*boxsize]:
-                        z_ji -= boxsize
-                    elif z_ji < ℝ[-0.5*boxsize]:
-                        z_ji += boxsize
-                    # The Ewald correction force for all
-                    # images except the nearest one,
-                    # which might not be the actual particle.
-                    force_ij = ewald(x_ji, y_ji, z_ji)
-                    # Add in the force from the particle's nearest image
-                    r3 = (  x_ji**2 + y_ji**2 + z_ji**2
-                          + ℝ[(0.5*(softening_1 + softening_2))**2])**1.5
-                    forcex_ij = force_ij[0] - x_ji*ℝ[1/r3]
-                    forcey_ij = force_ij[1] - y_ji*ℝ[1/r3]
-                    forcez_ij = force_ij[2] - z_ji*ℝ[1/r3]
+                if use_mesh:
+                    index_start = chaining_mesh_offsets[cells_threads[thread, l]]
+                    index_end   = chaining_mesh_offsets[cells_threads[thread, l] + 1]
+                elif local:
+                    # If the interaction is completely local,
+                    # make sure not to double count.
+                    index_start = i + 1
+                    index_end   = N_2
                 else:
-                    # The force from the actual particle,
-                    # without periodic images.
-                    r3 = (  x_ji**2 + y_ji**2 + z_ji**2
-                          + ℝ[(0.5*(softening_1 + softening_2))**2])**1.5
-                    forcex_ij = -x_ji*ℝ[1/r3]
-                    forcey_ij = -y_ji*ℝ[1/r3]
-                    forcez_ij = -z_ji*ℝ[1/r3]
-            # Convert force on particle i from particle j
-            # to momentum change of partcicle i due to particle j.
-            Δmomx_ij = forcex_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a**(-1)']]
-            Δmomy_ij = forcey_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a**(-1)']]
-            Δmomz_ij = forcez_ij*ℝ[G_Newton*mass_1*mass_2*ᔑdt['a**(-1)']]
-            # Apply momentum change to particle i of component_1
-            # (the local component).
-            momx_1[i] += Δmomx_ij
-            momy_1[i] += Δmomy_ij
-            momz_1[i] += Δmomz_ij
-            # Apply or save the momentum change of particle j
-            # of component_2 (the external component).
+                    index_start = 0
+                    index_end   = N_2
+            for index in range(index_start, index_end):
+                with unswitch:
+                    if use_mesh:
+                        j = chaining_mesh_order[index]
+                        if local and j <= i:
+                            continue
+                    else:
+                        j = index
+                with unswitch:
+                    if use_rungs and update_j:
+                        kick_2 = rung_ᔑdt[rung_2[j]]
+                # Skip pairs of inactive particles
+                if kick_1 == 0 and kick_2 == 0:
+                    continue
+                # "Vector" from particle j to particle i
+                x_ji = xi - posx_2[j]
+                y_ji = yi - posy_2[j]
+                z_ji = zi - posz_2[j]
+                # Evaluate the gravitational force in one of three ways:
+                # Just the short range force, the total force with Ewald
+                # corrections or the total force without Ewald corrections.
+                with unswitch:
+                    if only_short_range:
+                        # Translate coordinates so they
+                        # correspond to the nearest image.
+                        if x_ji > ℝ[0.5*boxsize]:
+                            x_ji = x_ji - boxsize
+                        elif x_ji < ℝ[-0.5*boxsize]:
+                            x_ji = x_ji + boxsize
+                        if y_ji > ℝ[0.5*boxsize]:
+                            y_ji = y_ji - boxsize
+                        elif y_ji < ℝ[-0.5*boxsize]:
+                            y_ji = y_ji + boxsize
+                        if z_ji > ℝ[0.5*boxsize]:
+                            z_ji = z_ji - boxsize
+                        elif z_ji < ℝ[-0.5*boxsize]:
+                            z_ji = z_ji + boxsize
+                        # Ignore pairs beyond the cutoff, as is also done
+                        # when only the particles near the domain boundaries
+                        # are communicated (see domain_domain).
+                        r2 = x_ji**2 + y_ji**2 + z_ji**2
+                        if r2 > ℝ[p3m_cutoff_phys**2]:
+                            continue
+                        shortrange_fac = shortrange_force_factor(
+                            r2 + ℝ[(0.5*(softening_1 + softening_2))**2]
+                        )
+                        forcex_ij = -x_ji*shortrange_fac
+                        forcey_ij = -y_ji*shortrange_fac
+                        forcez_ij = -z_ji*shortrange_fac
+                    elif periodic:
+                        # Translate coordinates so they
+                        # correspond to the nearest image.
+                        if x_ji > ℝ[0.5*boxsize]:
+                            x_ji = x_ji - boxsize
+                        elif x_ji < ℝ[-0.5*boxsize]:
+                            x_ji = x_ji + boxsize
+                        if y_ji > ℝ[0.5*boxsize]:
+                            y_ji = y_ji - boxsize
+                        elif y_ji < ℝ[-0.5*boxsize]:
+                            y_ji = y_ji + boxsize
+                        if z_ji > ℝ[0.5*boxsize]:
+                            z_ji = z_ji - boxsize
+                        elif z_ji < ℝ[-0.5*boxsize]:
+                            z_ji = z_ji + boxsize
+                        # The Ewald correction force for all
+                        # images except the nearest one,
+                        # which might not be the actual particle.
+                        ewald_lookup(ewald_grid, x_ji, y_ji, z_ji,
+                                     cython.address(force_threads[thread, :]))
+                        forcex_ij = force_threads[thread, 0]
+                        forcey_ij = force_threads[thread, 1]
+                        forcez_ij = force_threads[thread, 2]
+                        # Add in the force from the particle's nearest image
+                        r3 = (  x_ji**2 + y_ji**2 + z_ji**2
+                              + ℝ[(0.5*(softening_1 + softening_2))**2])**1.5
+                        forcex_ij = forcex_ij - x_ji*ℝ[1/r3]
+                        forcey_ij = forcey_ij - y_ji*ℝ[1/r3]
+                        forcez_ij = forcez_ij - z_ji*ℝ[1/r3]
+                    else:
+                        # The force from the actual particle,
+                        # without periodic images.
+                        r3 = (  x_ji**2 + y_ji**2 + z_ji**2
+                              + ℝ[(0.5*(softening_1 + softening_2))**2])**1.5
+                        forcex_ij = -x_ji*ℝ[1/r3]
+                        forcey_ij = -y_ji*ℝ[1/r3]
+                        forcez_ij = -z_ji*ℝ[1/r3]
+                # Convert force on particle i from particle j
+                # to momentum change of partcicle i due to particle j,
+                # up to the time integral which is applied separately
+                # for the two particles.
+                Δmomx_ij = forcex_ij*ℝ[G_Newton*mass_1*mass_2]
+                Δmomy_ij = forcey_ij*ℝ[G_Newton*mass_1*mass_2]
+                Δmomz_ij = forcez_ij*ℝ[G_Newton*mass_1*mass_2]
+                # Apply momentum change to particle i of component_1
+                # (the local component).
+                momx_1[i] = momx_1[i] + Δmomx_ij*kick_1
+                momy_1[i] = momy_1[i] + Δmomy_ij*kick_1
+                momz_1[i] = momz_1[i] + Δmomz_ij*kick_1
+                # Accumulate the momentum change of particle j
+                # of component_2 (the external component).
+                with unswitch:
+                    if update_j:
+                        Δmom_threads[thread, j, 0] = Δmom_threads[thread, j, 0] - Δmomx_ij*kick_2
+                        Δmom_threads[thread, j, 1] = Δmom_threads[thread, j, 1] - Δmomy_ij*kick_2
+                        Δmom_threads[thread, j, 2] = Δmom_threads[thread, j, 2] - Δmomz_ij*kick_2
+    # Apply or save the accumulated momentum changes
+    # of the particles of component_2.
+    if not update_j:
+        return
+    for j in prange(N_2, nogil=True, num_threads=num_threads):
+        Δmomx_ij = 0
+        Δmomy_ij = 0
+        Δmomz_ij = 0
+        for thread in range(num_threads):
+            Δmomx_ij = Δmomx_ij + Δmom_threads[thread, j, 0]
+            Δmomy_ij = Δmomy_ij + Δmom_threads[thread, j, 1]
+            Δmomz_ij = Δmomz_ij + Δmom_threads[thread, j, 2]
+        with unswitch:
+            if local:
+                # The passed component_1 and component_2 are really one
+                # and the same, and both contain data in the
+                # local domain. Apply momentum change to particle j.
+                momx_2[j] = momx_2[j] + Δmomx_ij
+                momy_2[j] = momy_2[j] + Δmomy_ij
+                momz_2[j] = momz_2[j] + Δmomz_ij
+            else:
+                # Add momentum change to the external Δmom buffers
+                # of component_2.
+                Δmomx_2[j] = Δmomx_2[j] + Δmomx_ij
+                Δmomy_2[j] = Δmomy_2[j] + Δmomy_ij
+                Δmomz_2[j] = Δmomz_2[j] + Δmomz_ij
+
+# Function which sorts particles into the chaining mesh (linked cells)
+# used for the short-range force by gravity_pairwise. The chaining mesh
+# covers the local domain using cells at least as wide as
+# p3m_cutoff_phys, plus a ghost layer of cells on each side. Along
+# dimensions where the local domain spans the entire box, the chaining
+# mesh is periodic. As the local domain changes when the domains are
+# balanced, the geometry of the chaining mesh is recomputed from the
+# current domain on each call. Afterwards, the indices of the particles
+# within a given (flat) cell are stored in chaining_mesh_order, from
+# chaining_mesh_offsets[cell] up to chaining_mesh_offsets[cell + 1].
+# Particles outside of the chaining mesh are left out.
+@cython.header(# Arguments
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               N='Py_ssize_t',
+               # Locals
+               cell='Py_ssize_t',
+               cell_x='Py_ssize_t',
+               cell_y='Py_ssize_t',
+               cell_z='Py_ssize_t',
+               dim='int',
+               domain_size='double',
+               i='Py_ssize_t',
+               n_cells='Py_ssize_t',
+               returns='void',
+               )
+def construct_chaining_mesh(posx, posy, posz, N):
+    global chaining_mesh_cells, chaining_mesh_offsets, chaining_mesh_order
+    # Compute the geometry of the chaining mesh
+    chaining_mesh_domain_start[0] = domain_start_x
+    chaining_mesh_domain_start[1] = domain_start_y
+    chaining_mesh_domain_start[2] = domain_start_z
+    for dim in range(3):
+        domain_size = (domain_size_x, domain_size_y, domain_size_z)[dim]
+        chaining_mesh_dims[dim] = pairmax(1, int(domain_size*ℝ[1/p3m_cutoff_phys]))
+        chaining_mesh_cellsizes_inv[dim] = chaining_mesh_dims[dim]/domain_size
+        # Coordinates (relative to the start of the local domain) are
+        # translated to the periodic image within [lower, lower + boxsize),
+        # the interval centered on the local domain.
+        chaining_mesh_lower[dim] = -0.5*(boxsize - domain_size)
+        chaining_mesh_periodic[dim] = (domain_subdivisions[dim] == 1)
+    n_cells = (
+          (chaining_mesh_dims[0] + 2)
+        * (chaining_mesh_dims[1] + 2)
+        * (chaining_mesh_dims[2] + 2)
+    )
+    # Enlarge the buffers if needed
+    if chaining_mesh_offsets.shape[0] < n_cells + 1:
+        chaining_mesh_offsets = empty(n_cells + 1, dtype=C2np['Py_ssize_t'])
+    if chaining_mesh_order.shape[0] < N:
+        chaining_mesh_cells = empty(N, dtype=C2np['Py_ssize_t'])
+        chaining_mesh_order = empty(N, dtype=C2np['Py_ssize_t'])
+    # Sort the particles into the cells (counting sort)
+    for cell in range(n_cells + 1):
+        chaining_mesh_offsets[cell] = 0
+    for i in range(N):
+        chaining_mesh_cells[i] = -1
+        cell_x = chaining_mesh_index(posx[i], 0, False)
+        if cell_x == -1:
+            continue
+        cell_y = chaining_mesh_index(posy[i], 1, False)
+        if cell_y == -1:
+            continue
+        cell_z = chaining_mesh_index(posz[i], 2, False)
+        if cell_z == -1:
+            continue
+        cell = (cell_x*(chaining_mesh_dims[1] + 2) + cell_y)*(chaining_mesh_dims[2] + 2) + cell_z
+        chaining_mesh_cells[i] = cell
+        chaining_mesh_offsets[cell + 1] += 1
+    for cell in range(n_cells):
+        chaining_mesh_offsets[cell + 1] += chaining_mesh_offsets[cell]
+    for i in range(N):
+        cell = chaining_mesh_cells[i]
+        if cell == -1:
+            continue
+        chaining_mesh_order[chaining_mesh_offsets[cell]] = i
+        chaining_mesh_offsets[cell] += 1
+    # The offsets are now shifted by one cell. Shift them back.
+    for cell in range(n_cells, 0, -1):
+        chaining_mesh_offsets[cell] = chaining_mesh_offsets[cell - 1]
+    chaining_mesh_offsets[0] = 0
+
+# Function returning the index of the chaining mesh cell along
+# dimension dim containing the given coordinate. Indices 0 and n + 1
+# (with n the number of cells covering the local domain along this
+# dimension) are ghost cells just outside of the local domain.
+# If the coordinate lies outside of the chaining mesh, -1 is returned.
+# With clamp, the index is instead clamped to lie within the local
+# domain, as is appropriate for coordinates known to lie within the
+# local domain up to round-off errors.
+@cython.header(# Arguments
+               pos='double',
+               dim='int',
+               clamp='bint',
+               # Locals
+               d='double',
+               index='Py_ssize_t',
+               n='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+@cython.nogil
+def chaining_mesh_index(pos, dim, clamp):
+    d = pos - chaining_mesh_domain_start[dim]
+    if d < chaining_mesh_lower[dim]:
+        d += boxsize
+    elif d >= chaining_mesh_lower[dim] + boxsize:
+        d -= boxsize
+    n = chaining_mesh_dims[dim]
+    index = 1 + int(floor(d*chaining_mesh_cellsizes_inv[dim]))
+    if clamp or chaining_mesh_periodic[dim]:
+        # Along periodic dimensions, the chaining mesh has no
+        # ghost cells.
+        if index < 1:
+            index = 1
+        elif index > n:
+            index = n
+    elif index < 0 or index > n + 1:
+        index = -1
+    return index
+
+# Function returning the index along dimension dim of the k'th
+# (k = 0, 1, 2) chaining mesh cell neighbouring the cell with the given
+# index (which must lie within the local domain), with k = 0
+# corresponding to the cell itself. Along dimensions where the chaining
+# mesh is periodic, the neighbour indices are wrapped around.
+@cython.header(# Arguments
+               index='Py_ssize_t',
+               dim='int',
+               k='int',
+               # Locals
+               n='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+@cython.nogil
+def chaining_mesh_neighbour(index, dim, k):
+    if k == 0:
+        return index
+    if not chaining_mesh_periodic[dim]:
+        return index + (1 if k == 1 else -1)
+    n = chaining_mesh_dims[dim]
+    if k == 1:
+        return index + 1 if index < n else 1
+    return index - 1 if index > 1 else n
+
+# Function which stores the (flat) indices of the chaining mesh cells
+# neighbouring the cell containing the given coordinates (including
+# this cell itself) in the passed array, returning the number of such
+# cells. The coordinates must lie within the local domain.
+# Along periodic dimensions spanned by fewer than three cells,
+# care is taken not to include the same cell twice.
+@cython.header(# Arguments
+               x='double',
+               y='double',
+               z='double',
+               cells='Py_ssize_t*',
+               # Locals
+               index_x='Py_ssize_t',
+               index_y='Py_ssize_t',
+               index_z='Py_ssize_t',
+               l='int',
+               m='int',
+               n='int',
+               n_cells='int',
+               n_x='int',
+               n_y='int',
+               n_z='int',
+               returns='int',
+               )
+@cython.nogil
+def chaining_mesh_neighbour_cells(x, y, z, cells):
+    index_x = chaining_mesh_index(x, 0, True)
+    index_y = chaining_mesh_index(y, 1, True)
+    index_z = chaining_mesh_index(z, 2, True)
+    n_x = 3
+    n_y = 3
+    n_z = 3
+    if chaining_mesh_periodic[0] and chaining_mesh_dims[0] < 3:
+        n_x = chaining_mesh_dims[0]
+    if chaining_mesh_periodic[1] and chaining_mesh_dims[1] < 3:
+        n_y = chaining_mesh_dims[1]
+    if chaining_mesh_periodic[2] and chaining_mesh_dims[2] < 3:
+        n_z = chaining_mesh_dims[2]
+    n_cells = 0
+    for l in range(n_x):
+        for m in range(n_y):
+            for n in range(n_z):
+                cells[n_cells] = (
+                    (
+                          chaining_mesh_neighbour(index_x, 0, l)*(chaining_mesh_dims[1] + 2)
+                        + chaining_mesh_neighbour(index_y, 1, m)
+                    )*(chaining_mesh_dims[2] + 2)
+                    + chaining_mesh_neighbour(index_z, 2, n)
+                )
+                n_cells += 1
+    return n_cells
+
+# Function implementing gravity via the Barnes-Hut tree method
+@cython.header(# Arguments
+               receivers=list,
+               suppliers=list,
+               ᔑdt=dict,
+               periodic='bint',
+               only_short_range='bint',
+               # Locals
+               component='Component',
+               cutoff='double',
+               force='double*',
+               i='Py_ssize_t',
+               kick='double',
+               momx='double*',
+               momy='double*',
+               momz='double*',
+               offset='Py_ssize_t',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               rung='unsigned char*',
+               rung_ᔑdt='double[::1]',
+               softening2='double',
+               time_start='double',
+               use_rungs='bint',
+               returns='void',
+               )
+def gravity_tree(receivers, suppliers, ᔑdt, periodic, only_short_range=False):
+    """The tree is constructed from all local particles of both the
+    receivers and the suppliers, together with the locally essential
+    (pseudo-)particles from all other domains. The momenta of the
+    receiver particles are then updated by walking this tree. The
+    softening length used is that of the receiving component.
+    With only_short_range, only the short-range part of the force
+    (as in P³M) is computed, with interactions beyond p3m_cutoff
+    ignored altogether. This is used by the TreePM method.
+    With block time steps, only receiver particles on active rungs
+    walk the tree.
+    """
+    # With block time steps, each particle is kicked by the time
+    # integral ∫a⁻¹dt belonging to its rung (see gravity_pairwise).
+    use_rungs = ('rungs' in ᔑdt)
+    if use_rungs:
+        rung_ᔑdt = ᔑdt['rungs']
+    kick = ᔑdt['a**(-1)']
+    # Construct the tree. As the receivers are added first, the ids
+    # of the receiver particles within the tree are simply given by
+    # their index within their component, offset by the total number
+    # of particles in the preceding receivers.
+    cutoff = (p3m_cutoff_phys if only_short_range else ထ)
+    construct_tree(receivers + suppliers, periodic, cutoff)
+    # Walk the tree for each receiver particle,
+    # recording the time spent as work of the local domain.
+    time_start = time()
+    offset = 0
+    for component in receivers:
+        softening2 = component.softening_length**2
+        posx = component.posx
+        posy = component.posy
+        posz = component.posz
+        momx = component.momx
+        momy = component.momy
+        momz = component.momz
+        rung = component.rung
+        for i in range(component.N_local):
             with unswitch:
-                if local:
-                    # The passed component_1 and component_2 are really one
-                    # and the same, and both contain data in the
-                    # local domain. Apply momentum change to particle j.
-                    momx_2[j] -= Δmomx_ij
-                    momy_2[j] -= Δmomy_ij
-                    momz_2[j] -= Δmomz_ij
-                elif mutual:
-                    # Add momentum change to the external Δmom buffers
-                    # of component_2.
-                    Δmomx_2[j] -= Δmomx_ij
-                    Δmomy_2[j] -= Δmomy_ij
-                    Δmomz_2[j] -= Δmomz_ij
+                if use_rungs:
+                    kick = rung_ᔑdt[rung[i]]
+                    if kick == 0:
+                        continue
+            force = tree_force(posx[i], posy[i], posz[i], offset + i,
+                               component.mass, softening2, periodic,
+                               only_short_range, shortrange_force_factor,
+                               cutoff)
+            # Convert the force to a momentum change
+            # and apply it to particle i.
+            momx[i] += force[0]*ℝ[G_Newton]*kick
+            momy[i] += force[1]*ℝ[G_Newton]*kick
+            momz[i] += force[2]*ℝ[G_Newton]*kick
+        offset += component.N_local
+    add_domain_work(time() - time_start)
+
+# Function returning the short-range part of the gravitational force
+# between two particles relative to the full Newtonian force, as used
+# by the P³M method. Here r2 = r² is the squared (softened) separation.
+@cython.header(
+    # Arguments
+    r2='double',
+    # Locals
+    r_scaled='double',
+    returns='double',
+)
+@cython.nogil
+def shortrange_fac_exact(r2):
+    r_scaled = sqrt(r2)*ℝ[1/p3m_scale_phys]
+    return r_scaled*ℝ[1/sqrt(π)]*exp(-0.25*r_scaled**2) + erfc(0.5*r_scaled)
+
+# Function returning the factor by which the separation vector
+# (x, y, z) from a particle to another should be multiplied in order
+# to get the short-range gravitational force (per G*m_1*m_2) on the
+# latter particle, i.e. shortrange_fac/r³. Here r2 = r² is the squared
+# (softened) separation. Depending on the p3m_shortrange_kernel
+# parameter, this is either computed exactly or interpolated from the
+# table constructed at import time. Close to r = 0, where the factor
+# diverges as 1/r³, the table is replaced by the Newtonian 1/r³ plus
+# the power series of (shortrange_fac - 1)/r³ in r², which is
+# well-behaved (see tabulate_shortrange). As the function does not
+# need the GIL, it can be called from within threaded loops.
+@cython.header(
+    # Arguments
+    r2='double',
+    # Locals
+    correction='double',
+    index='Py_ssize_t',
+    n='int',
+    x='double',
+    returns='double',
+)
+@cython.nogil
+def shortrange_force_factor(r2):
+    if shortrange_tabulated and r2 < shortrange_table_r2_max:
+        if r2 >= shortrange_table_r2_min:
+            # Linear interpolation in the table
+            x = (r2 - shortrange_table_r2_min)*shortrange_table_inv_spacing
+            index = int(x)
+            x -= index
+            return (1 - x)*shortrange_table[index] + x*shortrange_table[index + 1]
+        # Evaluate the power series using Horner's scheme
+        correction = 0
+        for n in range(shortrange_series.shape[0] - 1, -1, -1):
+            correction = correction*r2 + shortrange_series[n]
+        return 1/(r2*sqrt(r2)) + correction
+    return shortrange_fac_exact(r2)/(r2*sqrt(r2))
 
 # Function implementing the gravitational potential (in Fouier space).
 # Here k2 = k² is the squared magnitude of the wave vector,
@@ -239,41 +691,117 @@ def gravity_potential(k2):
                dim='int',
                # Locals
                J_dim='FluidScalar',
+               Wxl='double',
+               Wxu='double',
+               Wyl='double',
+               Wyu='double',
+               Wzl='double',
+               Wzu='double',
                fac='double',
                i='Py_ssize_t',
                mom_dim='double*',
                posx='double*',
                posy='double*',
                posz='double*',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
                x='double',
+               x_lower='Py_ssize_t',
+               x_upper='Py_ssize_t',
                y='double',
+               y_lower='Py_ssize_t',
+               y_upper='Py_ssize_t',
                z='double',
+               z_lower='Py_ssize_t',
+               z_upper='Py_ssize_t',
                returns='void',
                )
 def apply_gravity_potential(component, ᔑdt, gradφ_dim, dim):
     """The argument gradφ_dim is the differentiated potential [∇φ]_dim
-    in physical units.
+    in physical units. For particle components and a mass assignment
+    scheme of order higher than CIC, gradφ_dim must include populated
+    ghost layers. Otherwise, gradφ_dim should not include these.
+    For particle components, dim may also be -1, in which case the
+    passed grid should be the potential φ itself, including populated
+    ghost layers. The gradient along all three dimensions is then
+    computed and applied directly at the particle positions.
     """
     if component.representation == 'particles':
         # Extract variables from component
         posx    = component.posx
         posy    = component.posy
         posz    = component.posz
+        # The factor with which to multiply gradφ_dim by to get
+        # momentum updates is -mass*Δt, where Δt = ᔑdt['1'].
+        fac = component.mass*ᔑdt['1']
+        # Differentiate and interpolate in a single pass
+        # over the particles.
+        if dim == -1:
+            domain_grid2particles_gradient(gradφ_dim, posx, posy, posz,
+                                           component.momx, component.momy, component.momz,
+                                           component.N_local, -fac)
+            return
         mom_dim = component.mom[dim]
-        # Update the dim momentum component of particle i
-        for i in range(component.N_local):
-            # The coordinates of the i'th particle,
-            # transformed so that 0 <= x, y, z < 1.
-            x = (posx[i] - domain_start_x)/domain_size_x
-            y = (posy[i] - domain_start_y)/domain_size_y
-            z = (posz[i] - domain_start_z)/domain_size_z
-            # Look up the force via a CIC interpolation,
+        # Use the general (threaded) interpolation
+        # for mass assignment schemes other than CIC.
+        if φ_assignment_order > 2:
+            domain_grid2particles(gradφ_dim, posx, posy, posz, mom_dim,
+                                  component.N_local, -fac, φ_assignment_order)
+            return
+        # Factors transforming coordinates into grid units
+        scale_x = (gradφ_dim.shape[0] - 1)/domain_size_x
+        scale_y = (gradφ_dim.shape[1] - 1)/domain_size_y
+        scale_z = (gradφ_dim.shape[2] - 1)/domain_size_z
+        # Update the dim momentum component of particle i.
+        # The particles are independent and so the loop is shared
+        # among the OpenMP threads. As calls to
+        # CIC_scalargrid2coordinates requires the GIL,
+        # the CIC interpolation is carried out explicitly here.
+        for i in prange(component.N_local, nogil=True, num_threads=num_threads):
+            # The coordinates of the i'th particle, transformed so that
+            # 0 <= x, y, z < gridsize - 1. Coordinates exactly at an
+            # upper domain boundary are corrected so that they
+            # lie just inside.
+            x = (posx[i] - domain_start_x)*scale_x
+            y = (posy[i] - domain_start_y)*scale_y
+            z = (posz[i] - domain_start_z)*scale_z
+            if x >= gradφ_dim.shape[0] - 1:
+                x = (gradφ_dim.shape[0] - 1)*(1 - machine_ϵ)
+            if y >= gradφ_dim.shape[1] - 1:
+                y = (gradφ_dim.shape[1] - 1)*(1 - machine_ϵ)
+            if z >= gradφ_dim.shape[2] - 1:
+                z = (gradφ_dim.shape[2] - 1)*(1 - machine_ϵ)
+            # Indices of the 8 vertices (6 faces)
+            # of the grid surrounding (x, y, z).
+            x_lower = int(x)
+            y_lower = int(y)
+            z_lower = int(z)
+            x_upper = x_lower + 1
+            y_upper = y_lower + 1
+            z_upper = z_lower + 1
+            # The linear weights according to the
+            # CIC rule W = 1 - |dist| if |dist| < 1.
+            Wxl = x_upper - x
+            Wyl = y_upper - y
+            Wzl = z_upper - z
+            Wxu = x - x_lower
+            Wyu = y - y_lower
+            Wzu = z - z_lower
+            # Look up the force via the CIC interpolation,
             # convert it to momentum units and subtract it from the
             # momentum of particle i (subtraction because the force is
             # the negative gradient of the potential).
-            # The factor with which to multiply gradφ_dim by to get
-            # momentum updates is -mass*Δt, where Δt = ᔑdt['1'].
-            mom_dim[i] -= ℝ[component.mass*ᔑdt['1']]*CIC_scalargrid2coordinates(gradφ_dim, x, y, z)
+            mom_dim[i] = mom_dim[i] - fac*(
+                  gradφ_dim[x_lower, y_lower, z_lower]*Wxl*Wyl*Wzl
+                + gradφ_dim[x_lower, y_lower, z_upper]*Wxl*Wyl*Wzu
+                + gradφ_dim[x_lower, y_upper, z_lower]*Wxl*Wyu*Wzl
+                + gradφ_dim[x_lower, y_upper, z_upper]*Wxl*Wyu*Wzu
+                + gradφ_dim[x_upper, y_lower, z_lower]*Wxu*Wyl*Wzl
+                + gradφ_dim[x_upper, y_lower, z_upper]*Wxu*Wyl*Wzu
+                + gradφ_dim[x_upper, y_upper, z_lower]*Wxu*Wyu*Wzl
+                + gradφ_dim[x_upper, y_upper, z_upper]*Wxu*Wyu*Wzu
+            )
     elif component.representation == 'fluid':
         # Simply scale and extrapolate the values in gradφ_dim
         # to the grid points of the dim'th component of the
@@ -299,3 +827,106 @@ def apply_gravity_potential(component, ᔑdt, gradφ_dim, dim):
                       )
         # Communicate the pseudo and ghost points of J_dim
         communicate_domain(J_dim.grid_mv, mode='populate')
+
+
+
+# Function for tabulating the short-range P³M force factor
+@cython.header(
+    # Locals
+    error='double',
+    error_max='double',
+    i='Py_ssize_t',
+    n='int',
+    r2='double',
+    term='double',
+    returns='void',
+)
+def tabulate_shortrange():
+    global shortrange_table, shortrange_table_inv_spacing, shortrange_series
+    masterprint(
+        f'Tabulating short-range gravitational force '
+        f'({p3m_shortrange_table_size} points) ...'
+    )
+    # Tabulate shortrange_fac/r³ as a function of r² at equally spaced
+    # values of r², from shortrange_table_r2_min up to
+    # shortrange_table_r2_max. An extra point is added to the end of
+    # the table, as the interpolation needs both neighbouring points.
+    shortrange_table = empty(p3m_shortrange_table_size + 1, dtype=C2np['double'])
+    shortrange_table_inv_spacing = (
+        (p3m_shortrange_table_size - 1)/(shortrange_table_r2_max - shortrange_table_r2_min)
+    )
+    for i in range(p3m_shortrange_table_size + 1):
+        r2 = shortrange_table_r2_min + i/shortrange_table_inv_spacing
+        shortrange_table[i] = shortrange_fac_exact(r2)/(r2*sqrt(r2))
+    # Below shortrange_table_r2_min, the 1/r³ divergence makes linear
+    # interpolation inaccurate. With s = p3m_scale_phys, we have
+    #   d(shortrange_fac)/dr = -r²/(2√π s³) exp(-r²/(4s²)),
+    # and so (shortrange_fac - 1)/r³ is the power series
+    #   Σₙ -(-1/4)ⁿ/(2√π n! (2n + 3)) r²ⁿ/s²ⁿ⁺³,
+    # with shortrange_fac - 1 vanishing as r³ at r = 0. Store the
+    # coefficients of this series in r², keeping enough terms for the
+    # truncation error to be negligible at shortrange_table_r2_min.
+    shortrange_series = empty(8, dtype=C2np['double'])
+    term = ℝ[-1/(2*sqrt(π))]/p3m_scale_phys**3
+    for n in range(shortrange_series.shape[0]):
+        shortrange_series[n] = term/(2*n + 3)
+        term *= -0.25/((n + 1)*p3m_scale_phys**2)
+    # Test the accuracy of the interpolation in between tabulated
+    # points, where the error is the largest. The error is measured
+    # relative to the Newtonian force, 1/r³.
+    error_max = 0
+    for i in range(p3m_shortrange_table_size - 1):
+        r2 = shortrange_table_r2_min + (i + 0.5)/shortrange_table_inv_spacing
+        error = abs(
+            0.5*(shortrange_table[i] + shortrange_table[i + 1])*r2*sqrt(r2)
+            - shortrange_fac_exact(r2)
+        )
+        if error > error_max:
+            error_max = error
+    masterprint('done')
+    if error_max > 1e-4:
+        masterwarn(
+            f'The tabulated short-range gravitational force has a maximum interpolation '
+            f'error of {error_max:.3e} relative to the Newtonian force. You may want to '
+            f'increase p3m_shortrange_table_size.'
+        )
+
+# Set up the short-range P³M force table at import time
+cython.declare(shortrange_series='double[::1]',
+               shortrange_table='double[::1]',
+               shortrange_table_inv_spacing='double',
+               shortrange_table_r2_max='double',
+               shortrange_table_r2_min='double',
+               shortrange_tabulated='bint',
+               )
+shortrange_tabulated = (p3m_shortrange_kernel != 'exact')
+# The table extends a bit beyond the cutoff, leaving room for the
+# softening. Beyond the table, the force is computed exactly.
+# Below the table, the power series is used.
+shortrange_table_r2_max = (1.25*p3m_cutoff_phys)**2
+shortrange_table_r2_min = p3m_scale_phys**2
+shortrange_table_inv_spacing = 0
+shortrange_table = empty(1, dtype=C2np['double'])
+shortrange_series = zeros(1, dtype=C2np['double'])
+if shortrange_tabulated:
+    tabulate_shortrange()
+
+# Initialize the chaining mesh used by gravity_pairwise
+# at import time. Its geometry is set upon use.
+cython.declare(chaining_mesh_cells='Py_ssize_t[::1]',
+               chaining_mesh_cellsizes_inv='double[::1]',
+               chaining_mesh_dims='Py_ssize_t[::1]',
+               chaining_mesh_domain_start='double[::1]',
+               chaining_mesh_lower='double[::1]',
+               chaining_mesh_offsets='Py_ssize_t[::1]',
+               chaining_mesh_order='Py_ssize_t[::1]',
+               chaining_mesh_periodic='int[::1]',
+               )
+chaining_mesh_cellsizes_inv = zeros(3, dtype=C2np['double'])
+chaining_mesh_dims = zeros(3, dtype=C2np['Py_ssize_t'])
+chaining_mesh_domain_start = zeros(3, dtype=C2np['double'])
+chaining_mesh_lower = zeros(3, dtype=C2np['double'])
+chaining_mesh_periodic = zeros(3, dtype=C2np['int'])
+chaining_mesh_cells = empty(1, dtype=C2np['Py_ssize_t'])
+chaining_mesh_offsets = empty(1, dtype=C2np['Py_ssize_t'])
+chaining_mesh_order = empty(1, dtype=C2np['Py_ssize_t'])
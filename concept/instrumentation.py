@@ -0,0 +1,365 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# Import everything from the commons module.
+# In the .pyx file, Cython declared variables will also get cimported.
+from commons import *
+
+
+
+# Function starting the measurement of an instrumented call site of
+# MPI communication, to be ended by a matching call to mpi_toc.
+# Call sites may be nested, in which case the measurements of the inner
+# sites are included in those of the outer sites.
+@cython.header(returns='void')
+def mpi_tic():
+    mpi_tic_stack.append((time(), mpi_bytes))
+
+# Function ending the measurement of an instrumented call site,
+# started by mpi_tic. The number of calls, the number of bytes sent
+# and the wall time spent are accumulated for the site.
+@cython.header(# Arguments
+               site=str,
+               # Locals
+               bytes_start='double',
+               stats='double[::1]',
+               time_start='double',
+               returns='void',
+               )
+def mpi_toc(site):
+    time_start, bytes_start = mpi_tic_stack.pop()
+    stats = mpi_stats.get(site)
+    if stats is None:
+        stats = zeros(3, dtype=C2np['double'])
+        mpi_stats[site] = stats
+    stats[0] += 1
+    stats[1] += mpi_bytes - bytes_start
+    stats[2] += time() - time_start
+
+# Function for counting bytes sent by the local process,
+# attributed to the currently measured call sites.
+@cython.header(# Arguments
+               nbytes='double',
+               returns='void',
+               )
+def mpi_count_bytes(nbytes):
+    global mpi_bytes
+    mpi_bytes += nbytes
+
+# Function which reports the MPI instrumentation accumulated since the
+# last report, after which the measurements are reset. For each call
+# site, the calls and bytes are summed over all processes, while both
+# the maximum and the mean wall time over the processes are reported.
+# The report is either printed or appended to the CSV file given by
+# mpi_instrumentation_filename.
+@cython.pheader(# Arguments
+                time_step='Py_ssize_t',
+                # Locals
+                bytes_tot='double',
+                calls_tot='double',
+                exists='bint',
+                file=object,  # io.TextIOWrapper
+                lines=list,
+                site=str,
+                sites=list,
+                stats_all=list,
+                stats_process=dict,
+                times=list,
+                )
+def mpi_report(time_step):
+    if not mpi_instrumentation:
+        return
+    stats_all = gather(mpi_stats)
+    mpi_stats.clear()
+    if not master:
+        return
+    sites = sorted(set([site for stats_process in stats_all for site in stats_process]))
+    if not sites:
+        return
+    lines = []
+    for site in sites:
+        calls_tot = 0
+        bytes_tot = 0
+        times = []
+        for stats_process in stats_all:
+            if site in stats_process:
+                calls_tot += stats_process[site][0]
+                bytes_tot += stats_process[site][1]
+                times.append(stats_process[site][2])
+            else:
+                times.append(0)
+        lines.append((site, int(calls_tot), int(bytes_tot), np.max(times), np.mean(times)))
+    if mpi_instrumentation_filename:
+        exists = os.path.isfile(mpi_instrumentation_filename)
+        with open(mpi_instrumentation_filename, 'a', encoding='utf-8') as file:
+            if not exists:
+                file.write('time_step,site,calls,bytes,time_max,time_mean\n')
+            for site, calls, nbytes, time_max, time_mean in lines:
+                file.write(f'{time_step},{site},{calls},{nbytes},{time_max:.6e},{time_mean:.6e}\n')
+        return
+    masterprint(
+        '\n'.join(
+            [f'MPI communication (time step {time_step}):']
+            + [
+                f'    {site}: {calls} calls, {significant_figures(nbytes/2**20, 3)} MB, '
+                f'{significant_figures(time_max, 3)} s (max), '
+                f'{significant_figures(time_mean, 3)} s (mean)'
+                for site, calls, nbytes, time_max, time_mean in lines
+            ]
+        ),
+        wrap=False,
+    )
+
+# Function starting the wall time measurement of a phase of the
+# computation, to be ended by a matching call to profile_toc.
+# Phases may be nested, in which case the inner phases are recorded
+# beneath the outer ones, e.g. 'kick/gravity (pm)/fft'.
+@cython.header(# Arguments
+               phase=str,
+               # Locals
+               path=str,
+               returns='void',
+               )
+def profile_tic(phase):
+    if profile_stack:
+        path = profile_stack[len(profile_stack) - 1][0] + '/' + phase
+    else:
+        path = phase
+    profile_stack.append((path, time()))
+
+# Function ending the wall time measurement of the innermost phase,
+# started by profile_tic. The number of calls and the wall time spent
+# are accumulated for the phase.
+@cython.header(# Locals
+               path=str,
+               stats='double[::1]',
+               time_start='double',
+               returns='void',
+               )
+def profile_toc():
+    path, time_start = profile_stack.pop()
+    stats = profile_stats.get(path)
+    if stats is None:
+        stats = zeros(2, dtype=C2np['double'])
+        profile_stats[path] = stats
+    stats[0] += 1
+    stats[1] += time() - time_start
+
+# Function which reports the phase timings accumulated since the last
+# report, after which the measurements are reset. For each phase, the
+# minimum, mean and maximum wall time over the processes are reported,
+# exposing load imbalance. The report is either printed or appended to
+# the CSV trace file given by profiling_filename.
+@cython.pheader(# Arguments
+                time_step='Py_ssize_t',
+                # Locals
+                calls_max='double',
+                exists='bint',
+                file=object,  # io.TextIOWrapper
+                lines=list,
+                path=str,
+                paths=list,
+                stats_all=list,
+                stats_process=dict,
+                times=list,
+                )
+def profile_report(time_step):
+    if not profiling:
+        return
+    stats_all = gather(profile_stats)
+    profile_stats.clear()
+    if not master:
+        return
+    paths = sorted(set([path for stats_process in stats_all for path in stats_process]))
+    if not paths:
+        return
+    lines = []
+    for path in paths:
+        calls_max = 0
+        times = []
+        for stats_process in stats_all:
+            if path in stats_process:
+                calls_max = pairmax(calls_max, stats_process[path][0])
+                times.append(stats_process[path][1])
+            else:
+                times.append(0)
+        lines.append((path, int(calls_max), np.min(times), np.mean(times), np.max(times)))
+    if profiling_filename:
+        exists = os.path.isfile(profiling_filename)
+        with open(profiling_filename, 'a', encoding='utf-8') as file:
+            if not exists:
+                file.write('time_step,phase,calls,time_min,time_mean,time_max\n')
+            for path, calls, time_min, time_mean, time_max in lines:
+                file.write(
+                    f'{time_step},{path},{calls},'
+                    f'{time_min:.6e},{time_mean:.6e},{time_max:.6e}\n'
+                )
+        return
+    masterprint(
+        '\n'.join(
+            [f'Wall time of phases (time step {time_step}), min/mean/max over processes:']
+            + [
+                f'    {"    "*path.count("/")}{path.rpartition("/")[2]}: '
+                f'{significant_figures(time_min, 3)}/'
+                f'{significant_figures(time_mean, 3)}/'
+                f'{significant_figures(time_max, 3)} s ({calls} calls)'
+                for path, calls, time_min, time_mean, time_max in lines
+            ]
+        ),
+        wrap=False,
+    )
+
+# Function for registering the number of bytes currently allocated
+# for some named piece of memory, to be called whenever the memory is
+# (re)allocated. Register 0 bytes when the memory is freed.
+# The local high-water mark is updated accordingly. Nothing is done
+# unless memory_accounting is enabled. Note that the byte counts must
+# not be computed using sizeof, which in pure Python mode returns an
+# array rather than the number of bytes.
+@cython.header(# Arguments
+               category=str,
+               name=str,
+               nbytes='double',
+               # Locals
+               key=tuple,
+               returns='void',
+               )
+def memory_register(category, name, nbytes):
+    global memory_peak, memory_total, memory_usage_peak
+    if not memory_accounting:
+        return
+    # Byte counts are always stored as plain floats
+    nbytes = float(nbytes)
+    key = (category, name)
+    memory_total += nbytes - memory_usage.get(key, 0)
+    if nbytes > 0:
+        memory_usage[key] = nbytes
+    else:
+        memory_usage.pop(key, None)
+    if memory_total > memory_peak:
+        memory_peak = memory_total
+        memory_usage_peak = memory_usage.copy()
+
+# Function returning a summary of the registered memory as the tuple
+# (current, peak, current_total, peak_total), where the first two are
+# the maximum over the processes and the last two are summed over the
+# processes, all in bytes. Note that the summed peak is an upper bound
+# on the global high-water mark, as the processes may peak at
+# different times. This function must be called by all processes.
+@cython.header(# Locals
+               memory_current='double',
+               memory_current_total='double',
+               memory_peak_max='double',
+               memory_peak_total='double',
+               returns=tuple,
+               )
+def memory_summary():
+    memory_current       = allreduce(memory_total, op=MPI.MAX)
+    memory_peak_max      = allreduce(memory_peak,  op=MPI.MAX)
+    memory_current_total = allreduce(memory_total, op=MPI.SUM)
+    memory_peak_total    = allreduce(memory_peak,  op=MPI.SUM)
+    return memory_current, memory_peak_max, memory_current_total, memory_peak_total
+
+# Function which prints a report of the registered memory, listing the
+# allocations live at the high-water mark of the process with the
+# largest high-water mark, as well as the allocations live at present
+# summed over all processes. Large allocations which are still live
+# but no longer in use (e.g. communication buffers left enlarged after
+# an exchange) should thus be apparent.
+@cython.pheader(# Locals
+                category=str,
+                key=tuple,
+                lines=list,
+                memory_current='double',
+                memory_current_total='double',
+                memory_peak_max='double',
+                memory_peak_total='double',
+                name=str,
+                nbytes='double',
+                peaks=list,
+                rank_peak='int',
+                usage=dict,
+                usage_all=list,
+                usage_current=dict,
+                usage_peak_all=list,
+                )
+def memory_report():
+    memory_current, memory_peak_max, memory_current_total, memory_peak_total = memory_summary()
+    peaks = gather(memory_peak)
+    usage_peak_all = gather(memory_usage_peak)
+    usage_all = gather(memory_usage)
+    if not master:
+        return
+    rank_peak = int(np.argmax(peaks))
+    usage_current = {}
+    for usage in usage_all:
+        for key, nbytes in usage.items():
+            usage_current[key] = usage_current.get(key, 0) + nbytes
+    lines = [
+        f'Memory high-water mark: {significant_figures(memory_peak_max/2**20, 3)} MB '
+        f'(process {rank_peak}), {significant_figures(memory_peak_total/2**20, 3)} MB '
+        f'summed over processes',
+        f'Allocations at the high-water mark of process {rank_peak}:',
+    ]
+    for (category, name), nbytes in sorted(
+        usage_peak_all[rank_peak].items(), key=(lambda item: -item[1]),
+    ):
+        lines.append(f'    {category} "{name}": {significant_figures(nbytes/2**20, 3)} MB')
+    lines.append(
+        f'Allocations at present, summed over processes '
+        f'({significant_figures(memory_current_total/2**20, 3)} MB in total):'
+    )
+    for (category, name), nbytes in sorted(
+        usage_current.items(), key=(lambda item: -item[1]),
+    ):
+        lines.append(f'    {category} "{name}": {significant_figures(nbytes/2**20, 3)} MB')
+    masterprint('\n'.join(lines), wrap=False)
+
+# Variables used for the MPI instrumentation. The statistics of each
+# call site are stored as arrays of the form [calls, bytes, time].
+cython.declare(mpi_bytes='double',
+               mpi_stats=dict,
+               mpi_tic_stack=list,
+               )
+mpi_bytes = 0
+mpi_stats = {}
+mpi_tic_stack = []
+# Variables used for the profiling. The statistics of each phase
+# are stored as arrays of the form [calls, time].
+cython.declare(profile_stack=list,
+               profile_stats=dict,
+               )
+profile_stack = []
+profile_stats = {}
+# Variables used for the memory accounting. The live bytes of each
+# registered allocation are stored under keys of the form
+# (category, name). The allocations live at the time of the local
+# high-water mark are kept as well.
+cython.declare(memory_peak='double',
+               memory_total='double',
+               memory_usage=dict,
+               memory_usage_peak=dict,
+               )
+memory_peak = 0
+memory_total = 0
+memory_usage = {}
+memory_usage_peak = {}
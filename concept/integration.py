@@ -47,6 +47,7 @@ class Spline:
         logy='bint',
         # Locals
         i='Py_ssize_t',
+        spacing='double',
     )
     def __init__(self, x, y, name='', *, logx=False, logy=False):
         # Here x and y = y(x) are the tabulated data.
@@ -68,6 +69,9 @@ class Spline:
         double xmax
         double abs_tol_min
         double abs_tol_max
+        Py_ssize_t size
+        int spacing_type
+        double spacing_fac
         gsl_interp_accel* acc
         gsl_spline* spline
         """
@@ -126,6 +130,29 @@ class Spline:
         abs_tol = 1e-9*(self.xmax - self.xmin) + machine_ϵ
         self.abs_tol_min = abs_tol + 0.5*(x[1] - self.xmin)
         self.abs_tol_max = abs_tol + 0.5*(self.xmax - x[x.shape[0] - 2])
+        # Detect whether the (possibly logged) x values are uniformly
+        # (spacing_type = 1) or logarithmically uniformly
+        # (spacing_type = 2) spaced. For such data the interpolation
+        # interval of a given point can be computed directly,
+        # which is exploited by eval_many.
+        self.size = x.shape[0]
+        self.spacing_type = 0
+        self.spacing_fac = 0
+        spacing = (self.xmax - self.xmin)/(self.size - 1)
+        for i in range(self.size):
+            if abs(x[i] - (self.xmin + i*spacing)) > 1e-6*spacing:
+                break
+        else:
+            self.spacing_type = 1
+            self.spacing_fac = 1/spacing
+        if self.spacing_type == 0 and self.xmin > 0:
+            spacing = log(self.xmax/self.xmin)/(self.size - 1)
+            for i in range(self.size):
+                if abs(log(x[i]/self.xmin) - i*spacing) > 1e-6*spacing:
+                    break
+            else:
+                self.spacing_type = 2
+                self.spacing_fac = 1/spacing
         # Use SciPy in pure Python and GSL when compiled
         if not cython.compiled:
             # Initialize the spline.
@@ -165,6 +192,70 @@ class Spline:
             y = exp(y)
         return y
 
+    # Method for doing spline evaluation at many points at once
+    @cython.pheader(
+        # Arguments
+        x_in='double[::1]',
+        out='double[::1]',
+        # Locals
+        i='Py_ssize_t',
+        index='Py_ssize_t',
+        x='double',
+        x_arr=object,  # np.ndarray
+        y='double',
+        returns='double[::1]',
+    )
+    def eval_many(self, x_in, out=None):
+        """The spline is evaluated at all points in x_in, with the
+        results stored in out (which will be allocated if not passed)
+        and returned. The evaluation is fastest for sorted x_in, as then
+        consecutive points mostly fall within the same or a neighbouring
+        interpolation interval, as found through the accelerator.
+        For uniformly or logarithmically uniformly tabulated splines,
+        the interval is computed directly, skipping any bisection.
+        """
+        if out is None:
+            out = empty(x_in.shape[0], dtype=C2np['double'])
+        elif out.shape[0] != x_in.shape[0]:
+            abort(
+                f'Spline "{self.name}": '
+                f'eval_many() called with {x_in.shape[0]} input values '
+                f'but an output array of size {out.shape[0]}'
+            )
+        # Use SciPy in pure Python and GSL when compiled
+        if not cython.compiled:
+            x_arr = np.log(x_in) if self.logx else asarray(x_in).copy()
+            for i in range(x_arr.shape[0]):
+                x_arr[i] = self.in_interval(x_arr[i], 'interpolate to')
+            out[:] = np.exp(self.spline(x_arr)) if self.logy else self.spline(x_arr)
+            return out
+        for i in range(x_in.shape[0]):
+            with unswitch:
+                if self.logx:
+                    x = log(x_in[i])
+                else:
+                    x = x_in[i]
+            # Check that x is within the interpolation interval
+            x = self.in_interval(x, 'interpolate to')
+            # Place the accelerator at the interval containing x,
+            # if this can be computed directly. Should the computed
+            # index be off due to round-off errors, the accelerator
+            # falls back to bisection.
+            with unswitch:
+                if self.spacing_type == 1:
+                    index = int((x - ℝ[self.xmin])*ℝ[self.spacing_fac])
+                    self.acc.cache = pairmin(index, ℤ[self.size - 2])
+                elif self.spacing_type == 2:
+                    index = int(log(x*ℝ[1/self.xmin])*ℝ[self.spacing_fac])
+                    self.acc.cache = pairmin(index, ℤ[self.size - 2])
+            y = gsl_spline_eval(self.spline, x, self.acc)
+            # Undo the log
+            with unswitch:
+                if self.logy:
+                    y = exp(y)
+            out[i] = y
+        return out
+
     # Method for doing spline derivative evaluation
     @cython.header(
         # Arguments
@@ -558,7 +649,9 @@ def scale_factor(t=-1):
         if spline_t_a is None:
             abort('The function a(t) has not been tabulated. Have you called initiate_time?')
         return spline_t_a.eval(t)
-    # Not using CLASS.
+    # Not using CLASS. Look up a(t) in the cosmic clock if tabulated.
+    if in_cosmic_clock(t):
+        return spline_t_a_clock.eval(t)
     # Integrate the Friedmann equation from the beginning of time
     # to the requested time.
     return rkf45(ȧ_rkf, machine_ϵ, machine_ϵ, t, abs_tol=1e-9, rel_tol=1e-9)
@@ -654,7 +747,10 @@ t_max_ever = 20*units.Gyr
 def expand(a, t, Δt):
     """Integrates the Friedmann equation from t to t + Δt,
     where the scale factor at time t is given by a. Returns a(t + Δt).
+    Within the tabulated cosmic clock, a(t + Δt) is simply looked up.
     """
+    if in_cosmic_clock(t) and in_cosmic_clock(t + Δt):
+        return spline_t_a_clock.eval(t + Δt)
     return rkf45(ȧ_rkf, a, t, t + Δt, abs_tol=1e-9, rel_tol=1e-9, save_intermediate=True)
 
 # Function for solving ODEs of the form ḟ(t, f)
@@ -777,18 +873,11 @@ integrand_tab_mv = cast(integrand_tab, 'double[:alloc_tab]')
     t_ini='double',
     Δt='double',
     # Locals
-    a='double',
-    a_tab_spline='double[::1]',
     component='Component',
-    i='Py_ssize_t',
     integrand=str,
     integrand_tab_spline='double[::1]',
     size='Py_ssize_t',
     spline='Spline',
-    t='double',
-    t_tab_spline='double[::1]',
-    w='double',
-    w_eff='double',
     returns='double',
 )
 def scalefactor_integral(key, t_ini=-1.0, Δt=-1.0):
@@ -798,87 +887,295 @@ def scalefactor_integral(key, t_ini=-1.0, Δt=-1.0):
     (e.g. 'a**(-1)') or a tuple in the format (string, component),
     where again the string is really the integrand. This second form is
     used when the integrand is component specific, e.g. 'a**(-3*w_eff)'.
-    It is important that the expand function expand(a, t, Δt) has been
-    called prior to calling this function, as expand generates the
-    values needed in the integration. You can call this function
-    multiple times (and with different integrands) without calling
-    expand in between.
+    When using the CLASS background or when the interval lies within
+    the tabulated cosmic clock (see tabulate_cosmic_clock), the
+    integral is found by integrating the once and for all tabulated
+    spline of the integrand. Otherwise it is important that the
+    expand function expand(a, t, Δt) has been called prior to calling
+    this function, as expand generates the values needed in the
+    integration. You can call this function multiple times (and with
+    different integrands) without calling expand in between.
     """
+    # Integrate the tabulated integrand. As the interval typically
+    # spans only a few tabulated points, this is about as cheap as a
+    # lookup. Note that splining the cumulative integral itself would
+    # not do, as the natural boundary conditions of the cubic spline
+    # then introduce errors near the ends of the tabulation which are
+    # large compared to the integral over a short interval.
+    if enable_class_background or (in_cosmic_clock(t_ini) and in_cosmic_clock(t_ini + Δt)):
+        spline = get_integrand_spline(key)
+        return spline.integrate(t_ini, t_ini + Δt)
     # Extract the integrand from the passed key
     if isinstance(key, str):
         integrand, component = key, None
     else:  # tuple key
         integrand, component = key
-    # When using the CLASS background, a(t) is already tabulated
-    # throughout time. Here we simply construct Spline objects over the
-    # given integrand and ask for the integral.
-    if enable_class_background:
-        spline = spline_t_integrands.get(key)
-        if spline is not None:
-            return spline.integrate(t_ini, t_ini + Δt)
-    # At this point, either enable_class_background is False,
-    # or this is the first time this function has been called with
-    # the given key. In both cases, we now need to tabulate
-    # the integrand.
-    if enable_class_background:
-        if component is None or component.w_type == 'constant':
-            a_tab_spline = spline_a_t.x
-            t_tab_spline = spline_a_t.y
-        else:
-            a_tab_spline = component.w_eff_spline.x
-            t_tab_spline = asarray([spline_a_t.eval(a) for a in a_tab_spline])
-        integrand_tab_spline = empty(t_tab_spline.shape[0], dtype=C2np['double'])
-        size = t_tab_spline.shape[0]
-    else:
-        # We do not use the CLASS background. If expand() has been
-        # called as it should, t_tab_mv stores the tabulated values of t
-        # while f_tab_mv stores the tabulated values of a.
-        a_tab_spline = f_tab_mv
-        t_tab_spline = t_tab_mv
-        integrand_tab_spline = integrand_tab_mv
-        size = size_tab
-    # Do the tabulation
-    for i in range(size):
-        a = a_tab_spline[i]
-        t = t_tab_spline[i]
+    # Without Hubble expansion, a = 1 at all times and so the integrand
+    # is constant. The integral is then computed directly, which also
+    # works for intervals other than the one last passed to expand(),
+    # as needed for the block time steps.
+    if not enable_Hubble:
+        integrand_tab_spline = integrand_tab_mv[:1]
+        tabulate_integrand(integrand, component, ones(1, dtype=C2np['double']),
+            asarray([t_ini], dtype=C2np['double']), integrand_tab_spline)
+        return integrand_tab_spline[0]*Δt
+    # We do not use the CLASS background. If expand() has been
+    # called as it should, t_tab_mv stores the tabulated values of t
+    # while f_tab_mv stores the tabulated values of a.
+    size = size_tab
+    integrand_tab_spline = integrand_tab_mv[:size]
+    tabulate_integrand(integrand, component, f_tab_mv[:size], t_tab_mv[:size],
+        integrand_tab_spline)
+    # Do the integration
+    spline = Spline(t_tab_mv[:size], integrand_tab_spline, integrand)
+    return spline.integrate(t_ini, t_ini + Δt)
+
+# Function for tabulating the integrand of a scalefactor integral
+# at the given tabulated values of a and t. The result is stored
+# in integrand_tab.
+@cython.header(
+    # Arguments
+    integrand=str,
+    component='Component',
+    a_tab='double[::1]',
+    t_tab='double[::1]',
+    integrand_tab='double[::1]',
+    # Locals
+    a='double',
+    i='Py_ssize_t',
+    t='double',
+    w='double',
+    w_eff='double',
+    returns='void',
+)
+def tabulate_integrand(integrand, component, a_tab, t_tab, integrand_tab):
+    for i in range(t_tab.shape[0]):
+        a = a_tab[i]
+        t = t_tab[i]
         with unswitch:
             if integrand == '1' or integrand == '':
-                integrand_tab_spline[i] = 1
+                integrand_tab[i] = 1
             elif integrand == 'a**(-1)':
-                integrand_tab_spline[i] = 1/a
+                integrand_tab[i] = 1/a
             elif integrand == 'a**(-2)':
-                integrand_tab_spline[i] = 1/a**2
+                integrand_tab[i] = 1/a**2
             elif integrand == 'ȧ/a':
-                integrand_tab_spline[i] = hubble(a)
+                integrand_tab[i] = hubble(a)
             elif integrand == 'a**(-3*w)':  # !!! Only used by gravity_old.py
                 w = component.w(t=t, a=a)
-                integrand_tab_spline[i] = a**(-3*w)
+                integrand_tab[i] = a**(-3*w)
             elif integrand == 'a**(-3*w-1)':  # !!! Only used by gravity_old.py
                 w = component.w(t=t, a=a)
-                integrand_tab_spline[i] = a**(-3*w - 1)
+                integrand_tab[i] = a**(-3*w - 1)
             elif integrand == 'a**(-3*w_eff)':
                 w_eff = component.w_eff(t=t, a=a)
-                integrand_tab_spline[i] = a**(-3*w_eff)
+                integrand_tab[i] = a**(-3*w_eff)
             elif integrand == 'a**(-3*w_eff-1)':
                 w_eff = component.w_eff(t=t, a=a)
-                integrand_tab_spline[i] = a**(-3*w_eff - 1)
+                integrand_tab[i] = a**(-3*w_eff - 1)
             elif integrand == 'a**(3*w_eff-2)':
                 w_eff = component.w_eff(t=t, a=a)
-                integrand_tab_spline[i] = a**(3*w_eff - 2)
+                integrand_tab[i] = a**(3*w_eff - 2)
             elif master:
                 abort(
                     f'The scalefactor integral with "{integrand}" as the integrand '
                     f'is not implemented'
                 )
-    # Do the integration
-    spline = Spline(t_tab_spline[:size], integrand_tab_spline[:size], integrand)
+
+# Function returning a Spline of the integrand of a scalefactor
+# integral (see scalefactor_integral) as a function of t. The values of
+# a(t) are taken from the CLASS background when available and from the
+# tabulated cosmic clock otherwise. Each Spline is only constructed once.
+@cython.header(
+    # Arguments
+    key=object,  # str or tuple
+    # Locals
+    a_tab='double[::1]',
+    component='Component',
+    integrand=str,
+    integrand_tab='double[::1]',
+    spline='Spline',
+    t_tab='double[::1]',
+    returns='Spline',
+)
+def get_integrand_spline(key):
+    spline = spline_t_integrands.get(key)
+    if spline is not None:
+        return spline
+    # Extract the integrand from the passed key
+    if isinstance(key, str):
+        integrand, component = key, None
+    else:  # tuple key
+        integrand, component = key
+    # Get tabulated values of a and t
     if enable_class_background:
-        spline_t_integrands[key] = spline
-    return spline.integrate(t_ini, t_ini + Δt)
-# Global dict of Spline objects defined by scalefactor_integral
+        if component is None or component.w_type == 'constant':
+            a_tab = spline_a_t.x
+            t_tab = spline_a_t.y
+        else:
+            a_tab = component.w_eff_spline.x
+            t_tab = spline_a_t.eval_many(a_tab)
+    else:
+        if spline_t_a_clock is None:
+            abort('The cosmic clock has not been tabulated. Have you called tabulate_cosmic_clock?')
+        a_tab = spline_t_a_clock.y
+        t_tab = spline_t_a_clock.x
+    # Tabulate the integrand
+    integrand_tab = empty(t_tab.shape[0], dtype=C2np['double'])
+    tabulate_integrand(integrand, component, a_tab, t_tab, integrand_tab)
+    spline = Spline(t_tab, integrand_tab, integrand)
+    spline_t_integrands[key] = spline
+    return spline
+# Global dict of Spline objects defined by get_integrand_spline
 cython.declare(spline_t_integrands=dict)
 spline_t_integrands = {}
 
+# Function refining the tabulated cosmic clock, given by t_clock and
+# a_clock, by bisecting every interval at the midpoint of which cubic
+# interpolation of a(t) or of any of the integrands given as keys
+# (see scalefactor_integral) is off by more than the tolerance used
+# when integrating the Friedmann equation. The refined t_clock and
+# a_clock are returned.
+@cython.header(
+    # Arguments
+    t_clock='double[::1]',
+    a_clock='double[::1]',
+    keys=list,
+    # Locals
+    a_interp='double[::1]',
+    a_mid='double[::1]',
+    a_mids=dict,
+    component='Component',
+    i='Py_ssize_t',
+    integrand=str,
+    integrand_clock='double[::1]',
+    integrand_interp='double[::1]',
+    integrand_mid='double[::1]',
+    key=object,  # str or tuple
+    refine=object,  # np.ndarray of bools
+    refinement='int',
+    size='Py_ssize_t',
+    spline='Spline',
+    t_mid='double[::1]',
+    returns=tuple,
+)
+def refine_cosmic_clock(t_clock, a_clock, keys=None):
+    if keys is None:
+        keys = []
+    # Values of a at the midpoints of the intervals, stored so that
+    # untouched intervals need not be integrated again
+    # in subsequent refinements.
+    a_mids = {}
+    # Stop after at most 64 refinements, though
+    # typically only a handful is needed.
+    for refinement in range(64):
+        size = t_clock.shape[0]
+        # Find a at the midpoints of all intervals by integrating
+        # the Friedmann equation from the left end of each interval
+        t_mid = 0.5*(asarray(t_clock[:size - 1]) + asarray(t_clock[1:]))
+        a_mid = empty(size - 1, dtype=C2np['double'])
+        for i in range(size - 1):
+            a_mid[i] = a_mids.get(t_mid[i], -1)
+            if a_mid[i] == -1:
+                a_mid[i] = rkf45(ȧ_rkf, a_clock[i], t_clock[i], t_mid[i],
+                    abs_tol=1e-9, rel_tol=1e-9)
+                a_mids[t_mid[i]] = a_mid[i]
+        # Compare the interpolated a(t) and integrands
+        # with their directly computed values.
+        spline = Spline(t_clock, a_clock, 'a(t) (cosmic clock)')
+        a_interp = spline.eval_many(t_mid)
+        refine = np.abs(asarray(a_interp) - asarray(a_mid)) > 1e-9*(1 + np.abs(a_mid))
+        for key in keys:
+            if isinstance(key, str):
+                integrand, component = key, None
+            else:  # tuple key
+                integrand, component = key
+            integrand_clock = empty(size, dtype=C2np['double'])
+            tabulate_integrand(integrand, component, a_clock, t_clock, integrand_clock)
+            integrand_mid = empty(size - 1, dtype=C2np['double'])
+            tabulate_integrand(integrand, component, a_mid, t_mid, integrand_mid)
+            spline = Spline(t_clock, integrand_clock, integrand)
+            integrand_interp = spline.eval_many(t_mid)
+            refine |= (
+                np.abs(asarray(integrand_interp) - asarray(integrand_mid))
+                > 1e-9*np.abs(integrand_mid)
+            )
+        if not refine.any():
+            break
+        # Bisect the inaccurate intervals
+        t_clock = np.insert(asarray(t_clock), np.where(refine)[0] + 1, asarray(t_mid)[refine])
+        a_clock = np.insert(asarray(a_clock), np.where(refine)[0] + 1, asarray(a_mid)[refine])
+    return t_clock, a_clock
+
+# Function which tabulates the cosmic clock for the remainder of the
+# run, i.e. a(t) from the present universals.t to t_end, together
+# with the integrands of the scalefactor integrals given as keys
+# (see scalefactor_integral). Within this time span,
+# scale_factor, expand and scalefactor_integral then reduce to table
+# lookups, removing all ODE solving from the time loop. When using the
+# CLASS background, a(t) is already tabulated throughout time, and so
+# only the integrals are tabulated.
+@cython.pheader(
+    # Arguments
+    t_end='double',
+    keys=list,
+    # Locals
+    a_clock='double[::1]',
+    key=object,  # str or tuple
+    t_clock='double[::1]',
+)
+def tabulate_cosmic_clock(t_end, keys=None):
+    global spline_t_a_clock, clock_t_min, clock_t_max
+    if not enable_Hubble:
+        return
+    masterprint('Tabulating the cosmic clock ...')
+    if not enable_class_background:
+        # Integrate the Friedmann equation from the present time
+        # to t_end, keeping the intermediate values.
+        rkf45(ȧ_rkf, universals.a, universals.t, t_end,
+            abs_tol=1e-9, rel_tol=1e-9, save_intermediate=True)
+        t_clock = empty(size_tab + 1, dtype=C2np['double'])
+        a_clock = empty(size_tab + 1, dtype=C2np['double'])
+        t_clock[0] = universals.t
+        a_clock[0] = universals.a
+        t_clock[1:] = t_tab_mv[:size_tab]
+        a_clock[1:] = f_tab_mv[:size_tab]
+        # The steps taken by the integration may be as large as 1% of
+        # the tabulated time span, and so cubic interpolation between
+        # them is not generally as accurate as the integration itself.
+        # Refine the tabulation so that it is.
+        t_clock, a_clock = refine_cosmic_clock(t_clock, a_clock, keys)
+        spline_t_a_clock = Spline(t_clock, a_clock, 'a(t) (cosmic clock)')
+        clock_t_min = universals.t
+        clock_t_max = t_end
+    # Tabulate the integrands anew
+    spline_t_integrands.clear()
+    if keys is not None:
+        for key in keys:
+            get_integrand_spline(key)
+    masterprint('done')
+# Global Spline object of a(t) and the time span
+# defined by tabulate_cosmic_clock.
+cython.declare(spline_t_a_clock='Spline', clock_t_min='double', clock_t_max='double')
+spline_t_a_clock = None
+clock_t_min = 0
+clock_t_max = -1
+
+# Function checking whether the given cosmic time
+# is within the tabulated cosmic clock.
+@cython.header(
+    # Arguments
+    t='double',
+    returns='bint',
+)
+def in_cosmic_clock(t):
+    if spline_t_a_clock is None:
+        return False
+    return (
+            t >= clock_t_min - 1e-9*(clock_t_max - clock_t_min)
+        and t <= clock_t_max + 1e-9*(clock_t_max - clock_t_min)
+    )
+
 # Function which sets the value of universals.a and universals.t
 # based on the user parameters a_begin and t_begin together with the
 # cosmology if enable_Hubble is True. The functions t(a), a(t) and H(a)
@@ -25,13 +25,20 @@
 from commons import *
 
 # Cython imports
-cimport('from communication import sendrecv_component')
+cimport('from communication import add_domain_work, domain_subdivisions, domain_width_min, '
+        '                          rank_neighboring_domain, '
+        '                          sendrecv_component_start, sendrecv_component_wait')
+cimport('from communication import domain_size_x,  domain_size_y,  domain_size_z')
+cimport('from communication import domain_start_x, domain_start_y, domain_start_z')
+cimport('from communication import domain_end_x,   domain_end_y,   domain_end_z')
+cimport('from cython.parallel import prange')
 cimport('from mesh import CIC_components2φ, diff_domain, domain_decompose, fft, slab_decompose')
-cimport('from mesh import CIC_components2φ_general')
+cimport('from mesh import fourier_view, get_deconvolution_table')
+cimport('from mesh import CIC_components2φ_general, interlace_particles')
 # Import interactions defined in other modules
 cimport('from gravity import *')
 # DELETE WHEN DONE with gravity_old.py !!!
-cimport('from gravity_old import build_φ, p3m, pm, pp')
+cimport('from gravity_old import build_φ, pm, pp')
 
 # Function pointer types used in this module
 pxd("""
@@ -56,6 +63,7 @@ ctypedef void   (*func_apply_potential)(Component, dict, double[:, :, ::1], int)
               affected=list,   # list of str's
               deterministic='bint',
               extra_args=dict,
+              cutoff='double',
               # Locals
               N_domain_pairs='Py_ssize_t',
               assisted='bint',
@@ -63,18 +71,26 @@ ctypedef void   (*func_apply_potential)(Component, dict, double[:, :, ::1], int)
               component_1='Component',
               component_2_extrl='Component',
               component_2_local='Component',
+              dim='int',
+              domain_size='double',
+              handle_affected=tuple,
+              handle_dependent=tuple,
               i='Py_ssize_t',
               index_component_1='Py_ssize_t',
               index_component_2='Py_ssize_t',
+              indices='Py_ssize_t[::1]',
               local='bint',
               mutual='bint',
               only_supply='bint',
+              overlap='bint',
+              pairs=list,
               rank_send='int',
               rank_recv='int',
               synchronous='bint',
+              time_start='double',
               )
 def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
-                  dependent, affected, deterministic, extra_args={}):
+                  dependent, affected, deterministic, extra_args={}, cutoff=ထ):
     """This function takes care of pairings between all components
     and between all domains. The component-pairings include:
     - Receivers with themselves (interactions between
@@ -91,6 +107,16 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
     If affected is an empty list, this is not really an interaction.
     In this case, every domain will both send and receive from every
     other domain.
+
+    If a (finite) cutoff distance is given, the interaction is assumed
+    to vanish for particle separations larger than this. In this case
+    each domain is only paired with its (up to 26) neighbouring domains,
+    and only the particles within the cutoff distance of the shared
+    face, edge or corner are communicated.
+
+    If the dependent variables are not themselves affected by the
+    interaction, the communication is overlapped with the computation
+    using non-blocking communication and double buffering.
     """
     # List of all particles participating in this interaction
     components = receivers + suppliers
@@ -100,9 +126,33 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
     assisted = True
     if not affected:
         assisted = False
+    # The communication of the dependent variables for the next pairing
+    # may only be started early if these are not affected by
+    # the current pairing.
+    overlap = set(dependent).isdisjoint(affected)
+    # When using a cutoff, each domain is only paired with its
+    # neighbours. The domains must then be at least as wide as the
+    # cutoff. If only two domains exist along some dimension, the left
+    # and the right neighbour is the same process, and so the
+    # boundaries sent to it must not overlap, as this would lead to
+    # the interaction being applied twice.
+    if cutoff != ထ:
+        for dim in range(3):
+            domain_size = domain_width_min(dim)
+            if domain_subdivisions[dim] > 1 and (
+                   domain_size < cutoff
+                or (domain_subdivisions[dim] == 2 and domain_size < 2*cutoff)):
+                abort(
+                    f'The domain partitioning {list(domain_subdivisions)} results in domains '
+                    f'of width {domain_size} {unit_length} along the {"xyz"[dim]}-direction, '
+                    f'which is too narrow for the cutoff of {cutoff} {unit_length} used '
+                    f'for {interaction_name}'
+                )
     # Pair each receiver with all receivers and suppliers
     for     index_component_1, component_1       in enumerate(receivers):
-        for index_component_2, component_2_local in enumerate(components[index_component_1:]):
+        for index_component_2, component_2_local in enumerate(
+            components[index_component_1:], index_component_1,
+        ):
             if component_2_local.representation != 'particles':  # !!! Generalize to fluids also
                 abort('The domain_domain function is only implemented for particles')
             # Flag specifying whether component_2 should only supply
@@ -131,11 +181,51 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
             # - Extrl component_2 <- rank - i
             # On each process, the local component_1 and the external
             # (received) component_2 then interact.
-            N_domain_pairs = ℤ[1 + nprocs//2] if assisted else nprocs
+            # When using a cutoff, the pairing is instead done with the
+            # neighbouring domains, in the directions given by
+            # neighbour_directions:
+            # - Local component_2 (boundary) -> neighbour in direction i
+            # - Extrl component_2 (boundary) <- neighbour opposite to i
+            # For a component interacting with itself, half of the
+            # pairings suffice, as each pair of domains are then handled
+            # mutually. For two different components, the pairing of
+            # component_1 on one domain with component_2 on another is
+            # distinct from the reverse, and so all pairings are needed.
+            if cutoff == ထ:
+                N_domain_pairs = (ℤ[1 + nprocs//2]
+                    if assisted and index_component_1 == index_component_2 else nprocs)
+            else:
+                N_domain_pairs = (1 + N_neighbour_directions_half
+                    if assisted and index_component_1 == index_component_2
+                    else 1 + 2*N_neighbour_directions_half)
+            # Determine all pairings of this process/domain with
+            # other processes/domains before carrying out any of them.
+            pairs = []
             for i in range(N_domain_pairs):
                 # Process ranks to send to and receive from
-                rank_send = mod(rank + i, nprocs)
-                rank_recv = mod(rank - i, nprocs)
+                # and the indices of the particles to send.
+                if cutoff == ထ:
+                    rank_send = mod(rank + i, nprocs)
+                    rank_recv = mod(rank - i, nprocs)
+                    indices = None
+                else:
+                    rank_send = rank_neighboring_domain(
+                        +neighbour_directions[i, 0],
+                        +neighbour_directions[i, 1],
+                        +neighbour_directions[i, 2],
+                    )
+                    rank_recv = rank_neighboring_domain(
+                        -neighbour_directions[i, 0],
+                        -neighbour_directions[i, 1],
+                        -neighbour_directions[i, 2],
+                    )
+                    indices = None
+                    if i > 0:
+                        # Copy the indices, as these are stored in
+                        # a buffer which is reused for each pairing.
+                        indices = asarray(find_boundary_particles(
+                            component_2_local, neighbour_directions[i], cutoff,
+                        )).copy()
                 # Determine whther component_2 should be updated due to
                 # its interaction with component_1. This is usually the
                 # case. The exceptions are
@@ -163,18 +253,42 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                 local = False
                 if index_component_1 == index_component_2 and rank_send == rank == rank_recv:
                     local = True
+                # When using a cutoff, the boundary particles sent to
+                # rank_send are never the same as those received from
+                # rank_recv, even if these are the same process, and so
+                # the interaction is never synchronous.
                 synchronous = False
-                if not local and index_component_1 == index_component_2 and rank_send == rank_recv:
+                if (    not local and index_component_1 == index_component_2
+                    and rank_send == rank_recv and cutoff == ထ):
                     synchronous = True
                 mutual = True
                 if only_supply or local or (synchronous and deterministic) or not assisted:
                     mutual = False
+                pairs.append((rank_send, rank_recv, indices, local, synchronous, mutual))
+            # Carry out the pairings. When overlapping, the dependent
+            # variables of component_2 needed for the next pairing are
+            # communicated (into a second buffer component) while the
+            # current interaction is being computed, and the affected
+            # variables are sent back while the next pairing is being
+            # processed.
+            handle_dependent = None
+            handle_affected = None
+            for i in range(N_domain_pairs):
+                rank_send, rank_recv, indices, local, synchronous, mutual = pairs[i]
                 # Communicate the dependent variables
                 # (e.g. pos for gravity) of component_2.
-                component_2_extrl = sendrecv_component(component_2_local,
-                                                       dependent, dest=rank_send,
-                                                                  source=rank_recv,
-                                                       )
+                if handle_dependent is None:
+                    handle_dependent = sendrecv_component_start(
+                        component_2_local, dependent, dest=rank_send, source=rank_recv,
+                        indices=indices, buffer_index=i%2,
+                    )
+                component_2_extrl = sendrecv_component_wait(handle_dependent)
+                handle_dependent = None
+                if overlap and i + 1 < N_domain_pairs:
+                    handle_dependent = sendrecv_component_start(
+                        component_2_local, dependent, dest=pairs[i + 1][0], source=pairs[i + 1][1],
+                        indices=pairs[i + 1][2], buffer_index=(i + 1)%2,
+                    )
                 # Let the local component_1 interaction with the
                 # external component_2. This will update the affected
                 # variables (e.g. mom for gravity) of the local
@@ -189,25 +303,111 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                     or (    synchronous and     deterministic)
                     or (    synchronous and not deterministic and rank < rank_send)
                     ):
+                    time_start = time()
                     interaction(component_1, component_2_extrl,
                                 rank_recv, ᔑdt, local, mutual, extra_args)
+                    add_domain_work(time() - time_start)
+                # Complete the sending back of the affected variables
+                # of the previous pairing.
+                if handle_affected is not None:
+                    sendrecv_component_wait(handle_affected)
+                    handle_affected = None
                 if mutual:
                     # Send the populated buffers back to the process
                     # from which the external component_2 came.
-                    # Add the received values in the buffers to the
-                    # affected variables (e.g. mom for gravity) of
+                    # The received values in the buffers are added to
+                    # the affected variables (e.g. mom for gravity) of
                     # the local component_2.
-                    sendrecv_component(component_2_extrl,
-                                       affected,
-                                       dest=rank_recv,
-                                       source=rank_send,
-                                       component_recv=component_2_local,
-                                       )
+                    handle_affected = sendrecv_component_start(
+                        component_2_extrl, affected, dest=rank_recv, source=rank_send,
+                        component_recv=component_2_local, indices=indices, buffer_index=i%2,
+                    )
+                    # The buffers have now been packed for sending.
                     # Nullify the Δ buffers of the external component_2,
                     # leaving this with no leftover junk.
                     component_2_extrl.nullify_Δ(affected)
+                    if not overlap:
+                        sendrecv_component_wait(handle_affected)
+                        handle_affected = None
+            if handle_affected is not None:
+                sendrecv_component_wait(handle_affected)
             masterprint('done')
 
+# Function returning the indices of the local particles of a component
+# which are within the cutoff distance of the face, edge or corner
+# shared with the neighbouring domain in the given direction.
+@cython.header(# Arguments
+               component='Component',
+               direction='int[::1]',
+               cutoff='double',
+               # Locals
+               N='Py_ssize_t',
+               i='Py_ssize_t',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               returns='Py_ssize_t[::1]',
+               )
+def find_boundary_particles(component, direction, cutoff):
+    global boundary_indices
+    if boundary_indices.shape[0] < component.N_local:
+        boundary_indices = empty(component.N_local, dtype=C2np['Py_ssize_t'])
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    N = 0
+    for i in range(component.N_local):
+        with unswitch:
+            if direction[0] == -1:
+                if posx[i] >= ℝ[domain_start_x + cutoff]:
+                    continue
+            elif direction[0] == +1:
+                if posx[i] < ℝ[domain_end_x - cutoff]:
+                    continue
+        with unswitch:
+            if direction[1] == -1:
+                if posy[i] >= ℝ[domain_start_y + cutoff]:
+                    continue
+            elif direction[1] == +1:
+                if posy[i] < ℝ[domain_end_y - cutoff]:
+                    continue
+        with unswitch:
+            if direction[2] == -1:
+                if posz[i] >= ℝ[domain_start_z + cutoff]:
+                    continue
+            elif direction[2] == +1:
+                if posz[i] < ℝ[domain_end_z - cutoff]:
+                    continue
+        boundary_indices[N] = i
+        N += 1
+    return boundary_indices[:N]
+# Initialize the boundary indices buffer used by the above function,
+# as well as the directions to the neighbouring domains used by
+# domain_domain when a cutoff is given. The first direction is that of
+# the local domain itself, followed by half of the directions to the
+# neighbouring domains, followed by the opposite directions. Directions
+# pointing along dimensions with no domain subdivisions are left out,
+# as these are really pointing back to the local domain.
+cython.declare(boundary_indices='Py_ssize_t[::1]',
+               N_neighbour_directions_half='Py_ssize_t',
+               neighbour_directions='int[:, ::1]',
+               )
+boundary_indices = empty(1, dtype=C2np['Py_ssize_t'])
+neighbour_directions = np.array(
+    [direction for direction in itertools.product((-1, 0, +1), repeat=3)
+        if direction > (0, 0, 0) and all([
+            direction[dim] == 0 or domain_subdivisions[dim] > 1 for dim in range(3)
+        ])
+    ],
+    dtype=C2np['int'],
+).reshape(-1, 3)
+N_neighbour_directions_half = neighbour_directions.shape[0]
+neighbour_directions = np.concatenate((
+    np.zeros((1, 3), dtype=C2np['int']),
+    asarray(neighbour_directions),
+    -asarray(neighbour_directions),
+))
+
 # Generic function implementing particle-mesh interactions
 @cython.header(# Arguments
                receivers=list,
@@ -218,10 +418,12 @@ def domain_domain(receivers, suppliers, ᔑdt, interaction, interaction_name,
                dependent=list,
                apply_potential=func_apply_potential,
                # Locals
+               any_particles_receivers='bint',
                component='Component',
                components=list,
                dim='int',
                gradφ_dim='double[:, :, ::1]',
+               gradφ_dim_ghosts='double[:, :, ::1]',
                h='double',
                φ='double[:, :, ::1]',
                )
@@ -252,8 +454,27 @@ def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
     components = receivers + suppliers
     masterprint('Constructing the {} due to {} ...'
                 .format(potential_name, ', '.join([component.name for component in components])))
-    φ = construct_potential(components, dependent, potential)
+    φ = construct_potential(components, dependent, potential, potential_name)
     masterprint('done')
+    any_particles_receivers = any([
+        component.representation == 'particles' for component in receivers
+    ])
+    # With the fused gradient, φ is differentiated directly at the
+    # particle positions, in a single pass over the particles of each
+    # receiver (signalled by passing dim = -1). Only the remaining
+    # (fluid) receivers then need the differentiated grids below.
+    if φ_fused_gradient and φ_assignment_order == 2 and any_particles_receivers:
+        for component in receivers:
+            if component.representation != 'particles':
+                continue
+            masterprint(f'Differentiating the {potential_name} and applying it '
+                        f'to {component.name} ...')
+            apply_potential(component, ᔑdt, φ, -1)
+            masterprint('done')
+        receivers = [component for component in receivers
+                     if component.representation != 'particles']
+        if not receivers:
+            return
     # For each dimension, differentiate φ and apply the force to
     # all receiver components.
     h = boxsize/φ_gridsize  # Physical grid spacing of φ
@@ -263,22 +484,68 @@ def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
                     )
         # Do the differentiation of φ
         gradφ_dim = diff_domain(φ, dim, h, order=4)
+        # Interpolating to particles using a mass assignment scheme
+        # of order higher than CIC needs the ghost layers.
+        if φ_assignment_order > 2 and any_particles_receivers:
+            gradφ_dim_ghosts = diff_domain(φ, dim, h, 'gradφ_ghosts', order=4, noghosts=False)
         # Apply force to all the receivers
         for component in receivers:
             masterprint('Applying to {} ...'.format(component.name))
-            apply_potential(component, ᔑdt, gradφ_dim, dim)
+            if φ_assignment_order > 2 and component.representation == 'particles':
+                apply_potential(component, ᔑdt, gradφ_dim_ghosts, dim)
+            else:
+                apply_potential(component, ᔑdt, gradφ_dim, dim)
             masterprint('done')
         masterprint('done')
 
+# Function returning the potential function tabulated over all
+# (integer) values of k² in grid units, for grids of the given size.
+# The physical squared magnitude of the wave vector is then given by
+# (2π/boxsize)²k². The FFT normalization needed after a forward and a
+# backward Fourier transformation is included, while the k⃗ = 0⃗ entry
+# is set to zero, ensuring a vanishing mean of the potential.
+# As the potential functions are not time dependent, each table is
+# computed only once, keyed on the gridsize and the potential_name.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    potential=func_potential,
+    potential_name=str,
+    # Locals
+    fft_normalization_factor='double',
+    k2='Py_ssize_t',
+    k2_max='Py_ssize_t',
+    key=tuple,
+    potential_table='double[::1]',
+    returns='double[::1]',
+)
+def get_potential_table(gridsize, potential, potential_name):
+    key = (gridsize, potential_name)
+    potential_table = potential_tables.get(key)
+    if potential_table is not None:
+        return potential_table
+    fft_normalization_factor = float(gridsize)**(-3)
+    k2_max = 3*(gridsize//2)**2
+    potential_table = empty(k2_max + 1, dtype=C2np['double'])
+    potential_table[0] = 0
+    for k2 in range(1, k2_max + 1):
+        potential_table[k2] = potential(ℝ[(2*π/boxsize)**2]*k2)*fft_normalization_factor
+    potential_tables[key] = potential_table
+    return potential_table
+# Dict storing tabulated potentials
+cython.declare(potential_tables=dict)
+potential_tables = {}
+
 # Generic function capable of constructing a potential grid out of
 # components and a given expression for the potential.
 @cython.header(# Arguments
                components=list,
                quantities=list,
                potential=func_potential,
+               potential_name=str,
                # Locals
+               deconv='double[::1]',
                double_deconv='double',
-               fft_normalization_factor='double',
                i='Py_ssize_t',
                j='Py_ssize_t',
                j_global='Py_ssize_t',
@@ -288,15 +555,16 @@ def particle_mesh(receivers, suppliers, ᔑdt, potential, potential_name,
                kj2='Py_ssize_t',
                kk='Py_ssize_t',
                k2='Py_ssize_t',
+               potential_factor='double',
+               potential_table='double[::1]',
                slab='double[:, :, ::1]',
-               slab_jik='double*',
-               reciprocal_sqrt_deconv_ij='double',
-               reciprocal_sqrt_deconv_ijk='double',
-               reciprocal_sqrt_deconv_j='double',
+               slab_fourier='double[:, :, ::1]',
+               slab_start_j='Py_ssize_t',
+               slab_start_k='Py_ssize_t',
                φ='double[:, :, ::1]',
                returns='double[:, :, ::1]',
                )
-def construct_potential(components, quantities, potential):
+def construct_potential(components, quantities, potential, potential_name):
     """This function populate the φ grid (including pseudo points and
     ghost layers) with a real-space potential corresponding to the
     Fourier-space potential function given, due to all the components.
@@ -319,83 +587,87 @@ def construct_potential(components, quantities, potential):
                   ('ϱ', a**(-3*w_eff - 1))],
     potential = lambda k2: -4*π*G_Newton/k2
     (note: it is not allowed to actually pass a lambda function,
-    in compiled mode anyway).
+    in compiled mode anyway). The potential is tabulated over all k²
+    once for each potential_name, see get_potential_table.
     """
-    # CIC interpolate the particles/fluid elements onto the slabs
+    # Interpolate the particles/fluid elements onto the slabs
     φ = CIC_components2φ(components, quantities)
-    slab = slab_decompose(φ, prepare_fft=True)
+    slab = slab_decompose(φ, φ_gridsize, prepare_fft=True)
     # Do forward Fourier transform on the slabs
     # containing the density field.
     fft(slab, 'forward')
-    # Multiplicative factor needed after a forward and a backward
-    # Fourier transformation.
-    fft_normalization_factor = float(φ_gridsize)**(-3)
-    # Loop through the local j-dimension
-    for j in range(ℤ[slab.shape[0]]):
+    # Interlace the particle contributions. As the shifted grid only
+    # holds particles, this is not possible with fluids present.
+    if φ_interlace:
+        if any([component.representation == 'fluid' for component in components]):
+            abort('Interlacing (φ_interlace = True) is not implemented for construct_potential '
+                  'with fluid components present')
+        interlace_particles(components, quantities, slab)
+    # The Fourier-space layout of the slab (which differs from the
+    # real-space layout for pencil decomposed grids), together with the
+    # global starting indices of the local part along j and k.
+    slab_fourier, slab_start_j, slab_start_k = fourier_view(slab)
+    # We need two deconvolutions, one for each interpolation (the
+    # component assignment and the upcoming force interpolation).
+    # For a mass assignment scheme of order φ_assignment_order, such a
+    # double deconvolution is the product over the three dimensions of
+    # 1/sinc(π*k/φ_gridsize)**(2*order), each of which depends only on
+    # the grid index along that dimension.
+    deconv = get_deconvolution_table(φ_gridsize, 2*φ_assignment_order)
+    # The squared magnitude of the wave vector (grid units) is always
+    # an integer. Get the potential function times the FFT
+    # normalization tabulated for all possible values.
+    potential_table = get_potential_table(φ_gridsize, potential, potential_name)
+    # Loop through the local j-dimension. The slab elements are
+    # independent and so the loop is shared among the OpenMP threads.
+    for j in prange(slab_fourier.shape[0], nogil=True, num_threads=num_threads):
         # The j-component of the wave vector (grid units).
         # Since the slabs are distributed along the j-dimension,
         # an offset must be used.
-        j_global = ℤ[slab.shape[0]*rank] + j
-        if j_global > ℤ[φ_gridsize//2]:
+        j_global = slab_start_j + j
+        if j_global > φ_gridsize//2:
             kj = j_global - φ_gridsize
         else:
             kj = j_global
         kj2 = kj**2
-        # Reciprocal square root of the j-component of the deconvolution
-        reciprocal_sqrt_deconv_j = sinc(kj*ℝ[π/φ_gridsize])
         # Loop through the complete i-dimension
         for i in range(φ_gridsize):
             # The i-component of the wave vector (grid units)
-            if i > ℤ[φ_gridsize//2]:
+            if i > φ_gridsize//2:
                 ki = i - φ_gridsize
             else:
                 ki = i
-            # Reciprocal square root of the product of the i-
-            # and the j-component of the deconvolution.
-            reciprocal_sqrt_deconv_ij = sinc(ki*ℝ[π/φ_gridsize])*reciprocal_sqrt_deconv_j
-            # Loop through the complete, padded k-dimension
+            # Loop through the local, padded k-dimension
             # in steps of 2 (one complex number at a time).
-            for k in range(0, ℤ[slab.shape[2]], 2):
-                # The k-component of the wave vector (grid units)
-                kk = k//2
+            for k in range(0, slab_fourier.shape[2], 2):
+                # The k-component of the wave vector (grid units).
+                # For pencil decomposed grids, the k-dimension is
+                # distributed as well.
+                kk = (slab_start_k + k)//2
                 # The squared magnitude of the wave vector (grid units)
-                k2 = ℤ[ki**2 + kj2] + kk**2
-                # Pointer to the [j, i, k]'th element of the slab.
-                # The complex number is then given as
-                # Re = slab_jik[0], Im = slab_jik[1].
-                slab_jik = cython.address(slab[j, i, k:])
+                k2 = ki**2 + kj2 + kk**2
                 # Enforce the vanishing of the potential at |k| = 0.
                 # The real-space mean value of the potential will then
                 # be zero, as it should for a peculiar potential.
-                if k2 == 0:
-                    slab_jik[0] = 0  # Real part
-                    slab_jik[1] = 0  # Imag part
-                    continue
-                # Reciprocal square root of the product of
-                # all components of the deconvolution.
-                reciprocal_sqrt_deconv_ijk = reciprocal_sqrt_deconv_ij*sinc(kk*ℝ[π/φ_gridsize])
-                # A full deconvolution is now
-                # 1/reciprocal_sqrt_deconv_ijk**2.
-                # We need however two such full deconvolutions, one for
-                # each CIC interpolation (the component assignment and
-                # the upcoming force interpolation).
-                double_deconv = 1/reciprocal_sqrt_deconv_ijk**4
-                # Get the factor from the potential function at this k².
-                # The physical squared length of the wave vector is
-                # given by (2π/boxsize*|k|)².
-                potential_factor = potential(ℝ[(2*π/boxsize)**2]*k2)
+                # This is taken care of by potential_table[0] = 0.
+                # The double deconvolution, one for each interpolation
+                # (the component assignment and the upcoming
+                # force interpolation).
+                double_deconv = deconv[j_global]*deconv[i]*deconv[kk]
+                # Get the factor from the potential function at this k²,
+                # including the FFT normalization.
+                potential_factor = potential_table[k2]
                 # Transform the grid in the following ways:
                 # - Multiply by potential_factor, converting the grid
                 #   values to actual potential values
-                #   (in Fourier space).
+                #   (in Fourier space) and normalizing the grid values
+                #   after a forwards and a backwards
+                #   Fourier transformation.
                 # - Multiply by double_deconv, taking care of the
                 #   deconvolution needed due to the
-                #   two CIC-interpolations.
-                # - Multiply by fft_normalization_factor, needed to
-                #   normalize the grid values after a forwards and a
-                #   backwards Fourier transformation.
-                slab_jik[0] *= ℝ[potential_factor*double_deconv*fft_normalization_factor]
-                slab_jik[1] *= ℝ[potential_factor*double_deconv*fft_normalization_factor]
+                #   two interpolations.
+                slab_fourier[j, i, k    ] = slab_fourier[j, i, k    ]*potential_factor*double_deconv  # Real
+                slab_fourier[j, i, k + 1] = slab_fourier[j, i, k + 1]*potential_factor*double_deconv  # Imag
     # Fourier transform the slabs back to coordinate space.
     # Now the slabs store potential values.
     fft(slab, 'backward')
@@ -463,18 +735,36 @@ def particle_mesh_general(receivers, suppliers, ᔑdt, potential, potential_name
     components = receivers + suppliers
     masterprint('Constructing the {} due to {} ...'
                 .format(potential_name, ', '.join([component.name for component in components])))
-    φ_dict = construct_potential_general(receivers, suppliers, dependent, potential)
+    φ_dict = construct_potential_general(
+        receivers, suppliers, dependent, potential, potential_name,
+    )
     masterprint('done')
     # For each dimension, differentiate the potentials
     # and apply the force to all receiver components.
     h = boxsize/φ_gridsize  # Physical grid spacing of φ
     for representation, φ in φ_dict.items():
+        # With the fused gradient, the particle φ is differentiated
+        # directly at the particle positions, in a single pass over the
+        # particles of each receiver (signalled by passing dim = -1).
+        if representation == 'particles' and φ_fused_gradient and φ_assignment_order == 2:
+            for component in receivers:
+                if component.representation != representation:
+                    continue
+                masterprint(f'Differentiating the ({representation}) {potential_name} '
+                            f'and applying it to {component.name} ...')
+                apply_potential(component, ᔑdt, φ, -1)
+                masterprint('done')
+            continue
         for dim in range(3):
             masterprint(f'Differentiating the ({representation}) {potential_name} along the '
                         f'{"xyz"[dim]}-direction and applying it ...'
                         )
-            # Do the differentiation of φ
-            gradφ_dim = diff_domain(φ, dim, h, order=4)
+            # Do the differentiation of φ. Interpolating to particles
+            # using a mass assignment scheme of order higher than CIC
+            # needs the (populated) ghost layers.
+            gradφ_dim = diff_domain(φ, dim, h, order=4, noghosts=(
+                representation == 'fluid' or φ_assignment_order == 2
+            ))
             # Apply force to all the receivers
             for component in receivers:
                 if component.representation != representation:
@@ -491,15 +781,18 @@ def particle_mesh_general(receivers, suppliers, ᔑdt, potential, potential_name
                suppliers=list,
                quantities=list,
                potential=func_potential,
+               potential_name=str,
                # Locals
                any_fluid='bint',
                any_fluid_receivers='bint',
                any_particles='bint',
                any_particles_receivers='bint',
                components=list,
+               deconv='double[::1]',
                deconv_factor='double',
+               deconv_ij='double',
                deconv_ijk='double',
-               fft_normalization_factor='double',
+               deconv_j='double',
                i='Py_ssize_t',
                j='Py_ssize_t',
                j_global='Py_ssize_t',
@@ -510,10 +803,8 @@ def particle_mesh_general(receivers, suppliers, ᔑdt, potential, potential_name
                kk='Py_ssize_t',
                k2='Py_ssize_t',
                potential_factor='double',
+               potential_table='double[::1]',
                receiver_representations=list,
-               reciprocal_sqrt_deconv_ij='double',
-               reciprocal_sqrt_deconv_ijk='double',
-               reciprocal_sqrt_deconv_j='double',
                representation=str,
                representation_counter='int',
                slab='double[:, :, ::1]',
@@ -524,11 +815,13 @@ def particle_mesh_general(receivers, suppliers, ᔑdt, potential, potential_name
                slab_ordereddict=object,  # OrderedDict
                slab_particles='double[:, :, ::1]',
                slab_particles_jik='double*',
+               slab_start_j='Py_ssize_t',
+               slab_start_k='Py_ssize_t',
                φ='double[:, :, ::1]',
                φ_dict=dict,
                returns=dict,
                )
-def construct_potential_general(receivers, suppliers, quantities, potential):
+def construct_potential_general(receivers, suppliers, quantities, potential, potential_name):
     """This function populate two grids (including pseudo points and
     ghost layers) with a real-space potential corresponding to the
     Fourier-space potential function given, due to all the components.
@@ -574,7 +867,8 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
     any_particles = ('particles' in φ_dict)
     any_fluid     = ('fluid'     in φ_dict)
     # Slab decompose the grids
-    slab_dict = {representation: slab_decompose(φ, f'φ_{representation}_slab', prepare_fft=True)
+    slab_dict = {representation: slab_decompose(φ, φ_gridsize, f'φ_{representation}_slab',
+                                                 prepare_fft=True)
                  for representation, φ in φ_dict.items()}
     # In the case of both particle and fluid components being present,
     # it is important that the particle slabs are handled after the
@@ -591,9 +885,21 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
     # Do a forward in-place Fourier transform of the slabs
     for slab in slab_dict.values():
         fft(slab, 'forward')
-    # Multiplicative factor needed after a forward and a backward
-    # Fourier transformation.
-    fft_normalization_factor = float(φ_gridsize)**(-3)
+    # Interlace the particle contributions
+    if φ_interlace and any_particles:
+        interlace_particles(components, quantities, slab_dict['particles'])
+    # Switch to the Fourier-space layout of the slabs (which differs
+    # from the real-space layout for pencil decomposed grids). All slabs
+    # share the same global starting indices of the local part.
+    for representation, slab in list(slab_ordereddict.items()):
+        slab_ordereddict[representation], slab_start_j, slab_start_k = fourier_view(slab)
+    if any_fluid:
+        slab_fluid = slab_ordereddict['fluid']
+    # The potential function times the FFT normalization, tabulated
+    # for all (integer) values of k² in grid units, and the single
+    # deconvolution factors along one dimension.
+    potential_table = get_potential_table(φ_gridsize, potential, potential_name)
+    deconv = get_deconvolution_table(φ_gridsize, φ_assignment_order)
     # For each grid, multiply by the potential and deconvolution
     # factors. Do fluid slabs fist, then particle slabs.
     for representation_counter, (representation, slab) in enumerate(slab_ordereddict.items()):
@@ -603,16 +909,16 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
             # The j-component of the wave vector (grid units).
             # Since the slabs are distributed along the j-dimension,
             # an offset must be used.
-            j_global = ℤ[slab.shape[0]*rank] + j
+            j_global = slab_start_j + j
             if j_global > ℤ[φ_gridsize//2]:
                 kj = j_global - φ_gridsize
             else:
                 kj = j_global
             kj2 = kj**2
-            # Reciprocal square root of the j-component of the deconvolution
+            # The j-component of the deconvolution
             with unswitch(1):
                 if 𝔹[representation == 'particles']:
-                    reciprocal_sqrt_deconv_j = sinc(kj*ℝ[π/φ_gridsize])
+                    deconv_j = deconv[j_global]
             # Loop through the complete i-dimension
             for i in range(φ_gridsize):
                 # The i-component of the wave vector (grid units)
@@ -620,17 +926,16 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
                     ki = i - φ_gridsize
                 else:
                     ki = i
-                # Reciprocal square root of the product of the i-
-                # and the j-component of the deconvolution.
+                # The product of the i- and the j-component
+                # of the deconvolution.
                 with unswitch(2):
                     if 𝔹[representation == 'particles']:
-                        reciprocal_sqrt_deconv_ij = (sinc(ki*ℝ[π/φ_gridsize])
-                                                     *reciprocal_sqrt_deconv_j)
+                        deconv_ij = deconv[i]*deconv_j
                 # Loop through the complete, padded k-dimension
                 # in steps of 2 (one complex number at a time).
                 for k in range(0, ℤ[slab.shape[2]], 2):
                     # The k-component of the wave vector (grid units)
-                    kk = k//2
+                    kk = (slab_start_k + k)//2
                     # The squared magnitude of the wave vector (grid units)
                     k2 = ℤ[ki**2 + kj2] + kk**2
                     # Pointer to the [j, i, k]'th element of the slab.
@@ -646,19 +951,15 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
                         slab_jik[1] = 0  # Imag part
                         continue
                     # Get the factor from the potential function at
-                    # this k². The physical squared length of the wave
-                    # vector is given by (2π/boxsize*|k|)².
-                    potential_factor = potential(ℝ[(2*π/boxsize)**2]*k2)
+                    # this k², including the FFT normalization.
+                    potential_factor = potential_table[k2]
                     # The final deconvolution factor
                     with unswitch(3):
                         if 𝔹[representation == 'particles']:
-                            # Reciprocal square root of the product of
-                            # all components of the deconvolution.
-                            reciprocal_sqrt_deconv_ijk = (reciprocal_sqrt_deconv_ij
-                                                          *sinc(kk*ℝ[π/φ_gridsize]))
-                            # The total factor
-                            # for a complete deconvolution.
-                            deconv_ijk = 1/reciprocal_sqrt_deconv_ijk**2
+                            # The total factor for a complete
+                            # deconvolution, given the order of the
+                            # mass assignment scheme.
+                            deconv_ijk = deconv_ij*deconv[kk]
                             # A deconvolution of the particle potential
                             # is needed due to the interpolation from
                             # the particle positions to the grid.
@@ -678,10 +979,8 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
                             # Do not apply any deconvolution to fluids
                             deconv_factor = 1
                     # Transform this complex grid point
-                    slab_jik[0] *= ℝ[potential_factor*deconv_factor  # Real part
-                                     *fft_normalization_factor]
-                    slab_jik[1] *= ℝ[potential_factor*deconv_factor  # Imag part
-                                     *fft_normalization_factor]
+                    slab_jik[0] *= ℝ[potential_factor*deconv_factor]  # Real part
+                    slab_jik[1] *= ℝ[potential_factor*deconv_factor]  # Imag part
                     # If only particle components or only fluid
                     # components exist, the slabs now store the final
                     # potential in Fourier space. However, if both
@@ -756,6 +1055,7 @@ def construct_potential_general(receivers, suppliers, quantities, potential):
                extra_args=dict,
                # Locals
                N_2='Py_ssize_t',
+               cutoff='double',
                i='Py_ssize_t',
                index='Py_ssize_t',
                j='Py_ssize_t',
@@ -793,6 +1093,7 @@ def find_nearest_neighbour_pairwise(component_1, component_2, rank_2, ᔑdt, loc
     neighbour_indices = extra_args['neighbour_indices'][component_1]
     neighbour_ranks = extra_args['neighbour_ranks'][component_1]
     neighbour_distances2 = extra_args['neighbour_distances2'][component_1]
+    cutoff = extra_args['cutoff']
     # Extract variables from the first (the local) component
     posx_1 = component_1.posx
     posy_1 = component_1.posy
@@ -805,7 +1106,7 @@ def find_nearest_neighbour_pairwise(component_1, component_2, rank_2, ᔑdt, loc
     # Loop over the selected particles
     for i in range(selected_indices.shape[0]):
         index = selected_indices[i]
-        r2_min = neighbour_distances2[i] if neighbour_components[i] else ထ
+        r2_min = neighbour_distances2[i] if neighbour_components[i] else ℝ[cutoff**2]
         xi = posx_1[index]
         yi = posy_1[index]
         zi = posz_1[index]
@@ -844,6 +1145,7 @@ def find_nearest_neighbour_pairwise(component_1, component_2, rank_2, ᔑdt, loc
 @cython.header(# Arguments
                components=list,
                selected=dict,
+               cutoff='double',
                # Locals
                component='Component',
                indices='Py_ssize_t[::1]',
@@ -853,11 +1155,16 @@ def find_nearest_neighbour_pairwise(component_1, component_2, rank_2, ᔑdt, loc
                neighbour_ranks=dict,
                returns=tuple,
                )
-def find_nearest_neighbour(components, selected):
+def find_nearest_neighbour(components, selected, cutoff=ထ):
     """Here selected is a dict with Component instances as keys
     and corresponding particle indices (type Py_ssize_t[::1]) as values.
     These indices are the selected particles which neighbours should
     be found among all the given components.
+    If a (finite) cutoff distance is given, only neighbours within this
+    distance are searched for, in which case only the particles near
+    the boundaries of the neighbouring domains are communicated.
+    Selected particles with no neighbour within the cutoff get an empty
+    string as their neighbour component.
     """
     neighbour_components = {component: ['']*indices.shape[0]
                             for component, indices in selected.items()}
@@ -874,7 +1181,9 @@ def find_nearest_neighbour(components, selected):
                               'neighbour_indices': neighbour_indices,
                               'neighbour_ranks': neighbour_ranks,
                               'neighbour_distances2': neighbour_distances2,
+                              'cutoff': cutoff,
                               },
+                  cutoff=cutoff,
                   )
     return neighbour_components, neighbour_ranks, neighbour_indices, neighbour_distances2
 
@@ -884,20 +1193,24 @@ def find_nearest_neighbour(components, selected):
                 receivers=list,
                 suppliers=list,
                 ᔑdt=dict,
+                substep='bint',
                 # Locals
                 component='Component',
                 components=list,
                 dependent=list,
+                dependent_particles=list,
                 i='Py_ssize_t',
                 Δt='double',
                 φ_Vcell='double',
-                # DELETE BELOW WHEN DONE WITH gravity_old.py !!!
-                dim='int',
-                gradφ_dim='double[:, :, ::1]',
-                h='double',
-                φ='double[:, :, ::1]',
                 )
-def gravity(method, receivers, suppliers, ᔑdt):
+def gravity(method, receivers, suppliers, ᔑdt, substep=False):
+    """With block time steps (N_rungs > 1), the time integral ∫a⁻¹dt
+    for each rung is passed as ᔑdt['rungs'], which is then used for
+    all short-range (particle-particle and tree) forces. When substep
+    is True, the kick happens in between base time steps, and so only
+    these short-range forces are applied, while the long-range
+    (mesh) forces are left for the base time steps.
+    """
     # Regardless of the method, it may happen that some fluid components
     # classified as receivers are incapable of receiving the
     # gravitational force due to the lack of the non-linear J
@@ -912,11 +1225,16 @@ def gravity(method, receivers, suppliers, ᔑdt):
         return
     # List of all particles participating in this interaction
     components = receivers + suppliers
+    # With block time steps, the rungs of the particles
+    # are needed along with their positions.
+    dependent_particles = ['pos']
+    if 'rungs' in ᔑdt:
+        dependent_particles.append('rung')
     # Compute gravity via one of the following methods
     if method == 'ppnonperiodic':
         # The non-periodic particle-particle method
         domain_domain(receivers, suppliers, ᔑdt, gravity_pairwise, 'gravitation (PP (non-periodic))',
-                      dependent=['pos'], affected=['mom'], deterministic=True,
+                      dependent=dependent_particles, affected=['mom'], deterministic=True,
                       extra_args={'periodic'        : False,
                                   'only_short_range': False,
                                   },
@@ -924,13 +1242,29 @@ def gravity(method, receivers, suppliers, ᔑdt):
     elif method == 'pp':
         # The particle-particle method with Ewald-periodicity
         domain_domain(receivers, suppliers, ᔑdt, gravity_pairwise, 'gravitation (PP)',
-                      dependent=['pos'], affected=['mom'], deterministic=True,
+                      dependent=dependent_particles, affected=['mom'], deterministic=True,
                       extra_args={'periodic'        : True,
                                   'only_short_range': False,
                                   },
                       )
+    elif method in ('tree', 'treenonperiodic'):
+        # The Barnes-Hut tree method,
+        # with or without Ewald-periodicity.
+        for component in components:
+            if component.representation != 'particles':
+                abort('The tree method can only be used with particle components')
+        masterprint('Gravitationally ({}) accelerating {} ...'.format(
+            'tree' if method == 'tree' else 'tree (non-periodic)',
+            ', '.join([component.name for component in receivers]),
+        ))
+        gravity_tree(receivers, suppliers, ᔑdt, periodic=(method == 'tree'))
+        masterprint('done')
     elif method == 'pm':
-        # The particle-mesh method.
+        # The particle-mesh method. This is a purely long-range
+        # method, and so nothing is to be done in between
+        # base time steps.
+        if substep:
+            return
         # The gravitational potential is given by the Poisson equation
         # ∇²φ = 4πGa²ρ = 4πGa**(-3*w_eff - 1)ϱ.
         # The factor in front of the dependent variable ϱ is thus
@@ -951,38 +1285,92 @@ def gravity(method, receivers, suppliers, ᔑdt):
         # List of all particles participating in this interaction
         components = receivers + suppliers
         # The particle-particle-mesh method.
-        # So far, this method is only implemented between particles
-        # in a single component.
-        if len(components) != 1:
-            abort('The P³M method can only be used with a single gravitating component')
-        component = components[0]
         # So far, this method is only implemented for
         # particle components, not fluids.
-        if component.representation != 'particles':
-            abort('The P³M method can only be used with particle components')
-        # Construct the long-range gravitational potential from all
-        # components which interacts gravitationally.
-        φ = build_φ(components, ᔑdt, only_long_range=True)
-        # For each dimension, differentiate φ and apply the force to
-        # all receiver components.
-        h = boxsize/φ_gridsize  # Physical grid spacing of φ
-        for dim in range(3):
-            # Do the differentiation of φ
-            gradφ_dim = diff_domain(φ, dim, h, order=4)
-            # Apply long-range P³M force to all the receivers
-            for component in receivers:
-                masterprint('Applying gravitational (P³M, long-range) forces along the {}-direction to {} ...'
-                            .format('xyz'[dim], component.name)
-                            )
-                pm(component, ᔑdt, gradφ_dim, dim)
-                masterprint('done')
+        for component in components:
+            if component.representation != 'particles':
+                abort('The P³M method can only be used with particle components')
+        # The long-range forces are only applied at the base
+        # time steps, not in between (see the docstring).
+        if not substep:
+            apply_longrange_gravity(receivers, components, ᔑdt, 'P³M')
+        # Now apply the short-range gravitational forces. The
+        # components are paired up through domain_domain, which only
+        # communicates the particles within the cutoff of the
+        # neighbouring domains. Here, gravity_pairwise uses a chaining
+        # mesh constructed for the current domains.
+        domain_domain(receivers, suppliers, ᔑdt, gravity_pairwise, 'gravitation (P³M, short-range)',
+                      dependent=dependent_particles, affected=['mom'], deterministic=True,
+                      extra_args={'periodic'        : True,
+                                  'only_short_range': True,
+                                  },
+                      cutoff=p3m_cutoff_phys,
+                      )
+    elif method == 'treepm':
+        # The tree-particle-mesh method, where the long-range forces
+        # are computed as in P³M while the short-range forces
+        # are computed using the Barnes-Hut tree.
+        for component in components:
+            if component.representation != 'particles':
+                abort('The TreePM method can only be used with particle components')
+        # The long-range forces are only applied at the base
+        # time steps, not in between (see the docstring).
+        if not substep:
+            apply_longrange_gravity(receivers, components, ᔑdt, 'TreePM')
         # Now apply the short-range gravitational forces
-        masterprint('Gravitationally (P³M, short-range) accelerating {} ...'.format(component.name))
-        p3m(component, ᔑdt)
+        masterprint('Gravitationally (TreePM, short-range) accelerating {} ...'.format(
+            ', '.join([component.name for component in receivers])
+        ))
+        gravity_tree(receivers, suppliers, ᔑdt, periodic=True, only_short_range=True)
         masterprint('done')
     elif master:
         abort('gravity was called with the "{}" method'.format(method))
 
+# Helper function for the gravity function, applying the long-range
+# gravitational forces of the P³M and TreePM methods to the receivers.
+# The label is the name of the method, used for progress messages.
+@cython.header(# Arguments
+               receivers=list,
+               components=list,
+               ᔑdt=dict,
+               label=str,
+               # Locals
+               component='Component',
+               # DELETE BELOW WHEN DONE WITH gravity_old.py !!!
+               dim='int',
+               gradφ_dim='double[:, :, ::1]',
+               h='double',
+               φ='double[:, :, ::1]',
+               )
+def apply_longrange_gravity(receivers, components, ᔑdt, label):
+    # Construct the long-range gravitational potential from all
+    # components which interacts gravitationally.
+    φ = build_φ(components, ᔑdt, only_long_range=True)
+    # With the fused gradient, differentiate φ directly at the
+    # particle positions of each receiver in a single pass.
+    if φ_fused_gradient and φ_assignment_order == 2:
+        for component in receivers:
+            masterprint(f'Applying gravitational ({label}, long-range) forces to '
+                        f'{component.name} ...')
+            pm(component, ᔑdt, φ, -1)
+            masterprint('done')
+        return
+    # For each dimension, differentiate φ and apply the force
+    # to all receiver components.
+    h = boxsize/φ_gridsize  # Physical grid spacing of φ
+    for dim in range(3):
+        # Do the differentiation of φ, keeping the ghost layers
+        # when needed by the mass assignment scheme.
+        gradφ_dim = diff_domain(φ, dim, h, order=4, noghosts=(φ_assignment_order == 2))
+        # Apply the long-range force to all the receivers
+        for component in receivers:
+            masterprint(
+                f'Applying gravitational ({label}, long-range) forces '
+                f'along the {"xyz"[dim]}-direction to {component.name} ...'
+            )
+            pm(component, ᔑdt, gradφ_dim, dim)
+            masterprint('done')
+
 # Function which constructs a list of interactions from a list of
 # components. The list of interactions store information about which
 # components interact with one another, via what force and method.
@@ -1061,10 +1449,13 @@ Interaction = collections.namedtuple('Interaction', ('force',
 # alphanumeric, lowercase characters.
 cython.declare(forces_implemented_ordered=list)
 forces_implemented_ordered = [
-    ('gravity', 'ppnonperiodic'),
-    ('gravity', 'pp'           ),
-    ('gravity', 'p3m'          ),
-    ('gravity', 'pm'           ),
+    ('gravity', 'ppnonperiodic'  ),
+    ('gravity', 'pp'             ),
+    ('gravity', 'treenonperiodic'),
+    ('gravity', 'tree'           ),
+    ('gravity', 'p3m'            ),
+    ('gravity', 'treepm'         ),
+    ('gravity', 'pm'             ),
 ]
 # Non-ordered version of forces_implemented_ordered, implemented as a
 # (default) dict mapping forces to list of methods.
@@ -34,6 +34,7 @@ cimport('from communication import partition,                   '
 cimport('from graphics import plot_detrended_perturbations')
 cimport('from integration import Spline, remove_doppelgängers, hubble, ȧ, ä')
 cimport('from mesh import get_fftw_slab,       '
+        '                 free_fftw_slab,      '
         '                 domain_decompose,    '
         '                 slab_decompose,      '
         '                 fft,                 '
@@ -711,7 +712,7 @@ class CosmoResults:
                 if isinstance(a, (int, float)):
                     values += spline.eval(a)
                 else:
-                    values += asarray([spline.eval(a_i) for a_i in a])
+                    values += asarray(spline.eval_many(np.ascontiguousarray(a, dtype=C2np['double'])))
         # Apply unit
         if apply_unit:
             values *= ℝ[3/(8*π*G_Newton)*(light_speed/units.Mpc)**2]
@@ -732,7 +733,7 @@ class CosmoResults:
                 if isinstance(a, (int, float)):
                     values += spline.eval(a)
                 else:
-                    values += asarray([spline.eval(a_i) for a_i in a])
+                    values += asarray(spline.eval_many(np.ascontiguousarray(a, dtype=C2np['double'])))
         # Apply unit. Note that we define P_bar such that
         # w = c⁻²P_bar/ρ_bar.
         if apply_unit:
@@ -756,8 +757,9 @@ class CosmoResults:
                     ρ_bar += ρ_bar_spline.eval(a)
                     P_bar += P_bar_spline.eval(a)
                 else:
-                    ρ_bar += asarray([ρ_bar_spline.eval(a_i) for a_i in a])
-                    P_bar += asarray([P_bar_spline.eval(a_i) for a_i in a])
+                    a = np.ascontiguousarray(a, dtype=C2np['double'])
+                    ρ_bar += asarray(ρ_bar_spline.eval_many(a))
+                    P_bar += asarray(P_bar_spline.eval_many(a))
         # As we have done no unit convertion, the ratio P_bar/ρ_bar
         # gives us the unitless w.
         return P_bar/ρ_bar
@@ -2025,6 +2027,7 @@ def get_default_k_parameters(gridsize):
     k_pivot='double',
     k2='Py_ssize_t',
     k2_max='Py_ssize_t',
+    linear_realization_key=object,  # tuple or None
     mass='double',
     momⁱ='double*',
     multi_index=object,  # tuple or str
@@ -2037,6 +2040,8 @@ def get_default_k_parameters(gridsize):
     posⁱ='double*',
     pos_gridpoint='double',
     processed_specific_multi_index=object,  # tuple or str
+    realization_factor='double',
+    realization_offset='double',
     slab='double[:, :, ::1]',
     slab_jik='double*',
     sqrt_power='double',
@@ -2047,6 +2052,8 @@ def get_default_k_parameters(gridsize):
     tensor_rank='int',
     transfer='double',
     transfer_spline_δ='Spline',
+    transfer_table='double[::1]',
+    transfer_table_δ='double[::1]',
     uⁱ_noghosts='double[:, :, :]',
     w='double',
     w_eff='double',
@@ -2308,9 +2315,13 @@ def realize(component, variable, transfer_spline, cosmoresults,
         transfer_spline_δ, cosmoresults_δ = compute_transfer(
             component, 0, k_min, k_max, k_gridsize, a=a,
         )
+    # The transfer function(s) tabulated at all integer k²
+    transfer_table = get_transfer_table(gridsize, transfer_spline)
+    if options['structure'] == 'nonlinear':
+        transfer_table_δ = get_transfer_table(gridsize, transfer_spline_δ, 'δ')
     for k2 in range(1, k2_max + 1):
         k_magnitude = ℝ[2*π/boxsize]*sqrt(k2)
-        transfer = transfer_spline.eval(k_magnitude)
+        transfer = transfer_table[k2]
         with unswitch:
             if options['structure'] == 'primordial':
                 # Realize using ℱₓ⁻¹[T(k) ζ(k) K(k⃗) ℛ(k⃗)],
@@ -2341,7 +2352,7 @@ def realize(component, variable, transfer_spline, cosmoresults,
                     # T(k)
                     transfer
                     # 1/T_δϱ(k)
-                    /transfer_spline_δ.eval(k_magnitude)*ℝ[1/ϱ_bar
+                    /transfer_table_δ[k2]*ℝ[1/ϱ_bar
                         # Normalization due to FFT + IFFT
                         *float(gridsize)**(-3)
                     ]
@@ -2349,47 +2360,89 @@ def realize(component, variable, transfer_spline, cosmoresults,
     # At |k⃗| = 0, the power should be zero, corresponding to a
     # real-space mean value of zero of the realized variable.
     sqrt_power_common[0] = 0
+    # Linear fluid scalars realized from the primordial noise are
+    # remembered in the linear_realizations dict, keyed on the fluid
+    # scalar. As the noise is fixed, the realized field is completely
+    # determined by the compact sqrt_power_common table together with
+    # the (real-space) offset and factor which take the realized field
+    # to the fluid variable. If the new table is proportional to the
+    # stored one (scale-independent evolution), the grid already
+    # holding the previous realization can simply be rescaled,
+    # saving the entire Fourier space construction and the FFT.
+    # As the starred grid of a linear fluid scalar is the very same
+    # memory as its unstarred grid, a realization into either buffer
+    # is remembered in the same record.
+    linear_realization_key = None
+    if (    component.representation == 'fluid'
+        and specific_multi_index is not None
+        and options['structure'] == 'primordial'
+        and options['compoundorder'] == 'linear'
+    ):
+        fluidscalar = component.fluidvars[fluid_index][processed_specific_multi_index]
+        if fluidscalar.is_linear:
+            linear_realization_key = (
+                component.memory_name, fluid_index, processed_specific_multi_index,
+            )
+            if fluid_index == 0:
+                # δ → ϱ = ϱ_bar(1 + δ)
+                realization_offset = ϱ_bar
+                realization_factor = ϱ_bar
+            elif fluid_index == 1:
+                # uⁱ → Jⁱ = a**(1 - 3w_eff)ϱ_bar(1 + w) * uⁱ
+                realization_offset = 0
+                realization_factor = a**(1 - 3*w_eff)*ϱ_bar*(1 + w)
+            elif fluid_index == 2 and processed_specific_multi_index == 'trace':
+                # δP → 𝒫 = c²*w*ϱ_bar + a**(3*(1 + w_eff)) * δP
+                realization_offset = light_speed**2*w*ϱ_bar
+                realization_factor = a**(3*(1 + w_eff))
+            else:
+                # σⁱⱼ → ςⁱⱼ = ϱ_bar(1 + w) * σⁱⱼ
+                realization_offset = 0
+                realization_factor = ϱ_bar*(1 + w)
+            if rescale_linear_realization(
+                fluidscalar, linear_realization_key, gridsize, sqrt_power_common,
+                realization_offset, realization_factor, use_gridˣ,
+            ):
+                masterprint('done')
+                return
     # Fetch a slab decomposed grid for storing the entirety of what is
     # to be inverse Fourier transformed. As we cannot reuse data from
     # previous calls, we do not pass in a specific buffer name.
     slab = get_fftw_slab(gridsize)
-    # Fetch a slab decomposed grid for storing the structure. If this is
-    # the first time we perform a realization of this size, the grid
-    # will be allocated, otherwise the previous grid will be returned,
-    # still containing the previous data.
-    slab_structure = get_fftw_slab(gridsize, 'slab_structure')
-    # Information about the data from the previous call
-    # is stored in the module level slab_structure_previous_info dict.
-    # To see if we can reuse the slab_structure as is, we compare this
-    # information with that of the current realization.
-    slab_structure_info = {
-        'structure': options['structure'],
-        'a': a,
-        'use_gridˣ': use_gridˣ,
-        'gridsize': gridsize,
-    }
-    if slab_structure_info['structure'] == 'primordial':
-        # The slab_structure contain no non-linear information,
-        # and so it is of no importance at what time slab_structure
-        # was made, or whether using the starred or unstarred grids.
-        slab_structure_info['a'] = None
-        slab_structure_info['use_gridˣ'] = None
-    if slab_structure_info != slab_structure_previous_info:
-        # Populate slab_structure with either ℛ(k⃗) or ℱₓ[ϱ(x⃗)]
-        if options['structure'] == 'primordial':
-            # Populate slab_structure with primordial noise ℛ(k⃗)
-            generate_primordial_noise(slab_structure)
-        elif options['structure'] == 'nonlinear':
+    # Fetch a slab decomposed grid containing the structure
+    if options['structure'] == 'primordial':
+        # The primordial noise ℛ(k⃗) is generated only once
+        # for each gridsize and reused by all realizations.
+        slab_structure = get_primordial_noise(gridsize)
+    else:
+        # Fetch a slab decomposed grid for storing the non-linear
+        # structure. If this is the first time we perform a realization
+        # of this size, the grid will be allocated, otherwise the
+        # previous grid will be returned, still containing the
+        # previous data.
+        slab_structure = get_fftw_slab(gridsize, 'slab_structure')
+        # Information about the data from the previous call
+        # is stored in the module level slab_structure_previous_info
+        # dict. To see if we can reuse the slab_structure as is,
+        # we compare this information with that of the
+        # current realization.
+        slab_structure_info = {
+            'a': a,
+            'use_gridˣ': use_gridˣ,
+            'gridsize': gridsize,
+            'component': component.name,
+        }
+        if slab_structure_info != slab_structure_previous_info:
             # Populate slab_structure with ℱₓ[ϱ(x⃗)]
             masterprint(f'Extracting structure from ϱ of {component.name}')
             slab_decompose(component.ϱ.gridˣ_mv if use_gridˣ else component.ϱ.grid_mv,
-                slab_structure)
+                gridsize, slab_structure)
             fft(slab_structure, 'forward')
-        # Remove the k⃗ = 0⃗ mode, leaving ℱₓ[δϱ(x⃗)]
-        if master:
-            slab_structure[0, 0, 0] = 0  # Real part
-            slab_structure[0, 0, 1] = 0  # Imag part
-    slab_structure_previous_info.update(slab_structure_info)
+            # Remove the k⃗ = 0⃗ mode, leaving ℱₓ[δϱ(x⃗)]
+            if master:
+                slab_structure[0, 0, 0] = 0  # Real part
+                slab_structure[0, 0, 1] = 0  # Imag part
+        slab_structure_previous_info.update(slab_structure_info)
     # Allocate 3-vectors which will store componens
     # of the k vector (in grid units).
     k_gridvec = empty(3, dtype=C2np['Py_ssize_t'])
@@ -2593,6 +2646,17 @@ def realize(component, variable, transfer_spline, cosmoresults,
                     #           ≈ ϱ_bar(1 + w) * σⁱⱼ
                     for i in range(component.size):
                         ςⁱⱼ_ptr[i] *= ℝ[ϱ_bar*(1 + w)]
+            # Remember this realization of the linear fluid scalar
+            if linear_realization_key is not None:
+                linear_realizations[linear_realization_key] = {
+                    'fluidscalar'      : fluidscalar,
+                    'size'             : fluidscalar.size,
+                    'gridsize'         : gridsize,
+                    'random_seed'      : random_seed,
+                    'sqrt_power_common': asarray(sqrt_power_common).copy(),
+                    'offset'           : realization_offset,
+                    'factor'           : realization_factor,
+                }
             # Continue with the next fluidscalar
             continue
         # Below follows the Zel'dovich approximation for
@@ -2672,17 +2736,180 @@ def realize(component, variable, transfer_spline, cosmoresults,
         or pariclevar_name == 'mom'
     ):
         exchange(component, reset_buffers=True)
+        # Order the particles along a space-filling curve
+        component.reorder_particles()
 # Module level variable used by the realize function
 cython.declare(slab_structure_previous_info=dict)
 slab_structure_previous_info = {}
 
+# Function which attempts to carry out a realization of a linear fluid
+# scalar by rescaling the grid holding its previous realization,
+# as stored in the linear_realizations dict. This is possible when the
+# passed sqrt_power_common table is proportional to the one used for the
+# previous realization, to within a relative tolerance of
+# linear_rescaling_rtol. The return value signals whether the
+# rescaling was carried out. The grid which is rescaled is the one
+# being realized into, i.e. the starred grid if use_gridˣ is True.
+@cython.header(
+    # Arguments
+    fluidscalar='FluidScalar',
+    key=tuple,
+    gridsize='Py_ssize_t',
+    sqrt_power_common='double[::1]',
+    offset='double',
+    factor='double',
+    use_gridˣ='bint',
+    # Locals
+    grid='double*',
+    i='Py_ssize_t',
+    k2='Py_ssize_t',
+    k2_max='Py_ssize_t',
+    linear_realization=dict,
+    offset_previous='double',
+    ratio='double',
+    scale='double',
+    sqrt_power_common_previous='double[::1]',
+    returns='bint',
+)
+def rescale_linear_realization(
+    fluidscalar, key, gridsize, sqrt_power_common, offset, factor, use_gridˣ=False,
+):
+    linear_realization = linear_realizations.get(key)
+    if linear_realization is None:
+        return False
+    # The stored realization must belong to the very same (unresized)
+    # linear fluid scalar, have been realized on a grid of the same
+    # size and from the same primordial noise. Only for linear fluid
+    # scalars are the starred and unstarred grids one and the same,
+    # and so only then does the record hold for both.
+    if (   not fluidscalar.is_linear
+        or linear_realization['fluidscalar'] is not fluidscalar
+        or linear_realization['size'] != fluidscalar.size
+        or linear_realization['gridsize'] != gridsize
+        or linear_realization['random_seed'] != random_seed
+        or linear_realization['factor'] == 0
+    ):
+        return False
+    # Find the ratio between the new and the previous table,
+    # using the k² with the largest previous value.
+    sqrt_power_common_previous = linear_realization['sqrt_power_common']
+    k2_max = sqrt_power_common.shape[0] - 1
+    k2 = 1
+    for i in range(2, k2_max + 1):
+        if abs(sqrt_power_common_previous[i]) > abs(sqrt_power_common_previous[k2]):
+            k2 = i
+    if sqrt_power_common_previous[k2] == 0:
+        return False
+    ratio = sqrt_power_common[k2]/sqrt_power_common_previous[k2]
+    # Check for scale independence at every k²
+    for k2 in range(1, k2_max + 1):
+        if (abs(sqrt_power_common[k2] - ratio*sqrt_power_common_previous[k2])
+            > ℝ[linear_rescaling_rtol]*abs(sqrt_power_common[k2])
+        ):
+            return False
+    # Rescale the grid, taking the previous offset and factor
+    # into account. The pseudo and ghost points are rescaled as well,
+    # so no further communication is needed.
+    offset_previous = linear_realization['offset']
+    scale = ratio*factor/linear_realization['factor']
+    grid = fluidscalar.gridˣ if use_gridˣ else fluidscalar.grid
+    for i in range(fluidscalar.size):
+        grid[i] = offset + scale*(grid[i] - offset_previous)
+    # Update the stored realization
+    linear_realization['sqrt_power_common'] = asarray(sqrt_power_common).copy()
+    linear_realization['offset'] = offset
+    linear_realization['factor'] = factor
+    return True
+# Dict storing information about the latest realization
+# of each linear fluid scalar, used by the realize function.
+cython.declare(linear_realizations=dict)
+linear_realizations = {}
+
+# Function returning a transfer function tabulated at all (integer)
+# values of k² in grid units, for grids of the given size. The physical
+# magnitude of the wave vector is then given by 2π/boxsize*sqrt(k²).
+# One table is kept for each gridsize and role and reused as long as
+# the same transfer_spline is passed. A new spline evicts the old table
+# of the same role only, so that e.g. the transfer functions of a
+# variable and of δ, used together for non-linear realizations,
+# do not evict each other.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    transfer_spline='Spline',
+    role=str,
+    # Locals
+    key=tuple,
+    k2_max='Py_ssize_t',
+    k_magnitudes='double[::1]',
+    transfer_table='double[::1]',
+    returns='double[::1]',
+)
+def get_transfer_table(gridsize, transfer_spline, role=''):
+    key = (gridsize, role)
+    if key in transfer_tables:
+        if transfer_tables[key][0] is transfer_spline:
+            return transfer_tables[key][1]
+    k2_max = 3*(gridsize//2)**2
+    transfer_table = empty(k2_max + 1, dtype=C2np['double'])
+    transfer_table[0] = 0
+    k_magnitudes = ℝ[2*π/boxsize]*np.sqrt(arange(1, k2_max + 1, dtype=C2np['double']))
+    transfer_spline.eval_many(k_magnitudes, transfer_table[1:])
+    transfer_tables[key] = (transfer_spline, transfer_table)
+    return transfer_table
+# Dict mapping (gridsize, role) tuples to tuples of
+# transfer splines and their tabulated values.
+cython.declare(transfer_tables=dict)
+transfer_tables = {}
+
+# Function returning a slab decomposed grid of primordial noise ℛ(k⃗)
+# with the k⃗ = 0⃗ mode removed. The noise is generated only once for
+# each random seed and gridsize, after which it is kept in a named slab
+# and reused by all later realizations of that gridsize, regardless of
+# the variable and component being realized. Call
+# free_primordial_noise to evict the noise from memory.
+@cython.pheader(
+    # Arguments
+    gridsize='Py_ssize_t',
+    # Locals
+    slab='double[:, :, ::1]',
+    returns='double[:, :, ::1]',
+)
+def get_primordial_noise(gridsize):
+    slab = get_fftw_slab(gridsize, 'primordial_noise')
+    if primordial_noise_seeds.get(gridsize) != random_seed:
+        generate_primordial_noise(slab)
+        if master:
+            slab[0, 0, 0] = 0  # Real part
+            slab[0, 0, 1] = 0  # Imag part
+        primordial_noise_seeds[gridsize] = random_seed
+    return slab
+# Dict mapping gridsizes to the random seeds
+# of the currently held primordial noise.
+cython.declare(primordial_noise_seeds=dict)
+primordial_noise_seeds = {}
+
+# Function for freeing the memory of the primordial noise
+# of a given gridsize, or of all gridsizes if none is given.
+# Any later realization will then generate the noise anew.
+@cython.pheader(
+    # Arguments
+    gridsize='Py_ssize_t',
+    # Locals
+    gridsizes=list,
+)
+def free_primordial_noise(gridsize=-1):
+    gridsizes = list(primordial_noise_seeds) if gridsize == -1 else [gridsize]
+    for gridsize in gridsizes:
+        if primordial_noise_seeds.pop(gridsize, None) is not None:
+            free_fftw_slab(gridsize, 'primordial_noise')
+
 # Function that populates the passed slab decomposed grid
 # with primordial noise ℛ(k⃗).
 @cython.header(
     # Arguments
     slab='double[:, :, ::1]',
     # Locals
-    face='int',
     gridsize='Py_ssize_t',
     i='Py_ssize_t',
     i_conj='Py_ssize_t',
@@ -2690,24 +2917,13 @@ slab_structure_previous_info = {}
     j_global='Py_ssize_t',
     j_global_conj='Py_ssize_t',
     k='Py_ssize_t',
-    ki_start='Py_ssize_t',
-    ki_step='Py_ssize_t',
-    ki_stop='Py_ssize_t',
-    kj_start='Py_ssize_t',
-    kj_step='Py_ssize_t',
-    kj_stop='Py_ssize_t',
-    kk_start='Py_ssize_t',
-    kk_step='Py_ssize_t',
-    kk_stop='Py_ssize_t',
-    noise_im='double',
-    noise_re='double',
+    key0='unsigned long long int',
+    key1='unsigned long long int',
+    ki='Py_ssize_t',
+    kj='Py_ssize_t',
+    kk='Py_ssize_t',
+    noise='double*',
     nyquist='Py_ssize_t',
-    plane='double[:, :, ::1]',
-    plane_dc='double[:, :, ::1]',
-    plane_ji='double*',
-    plane_ji_conj='double*',
-    plane_nyquist='double[:, :, ::1]',
-    shell='Py_ssize_t',
     slab_jik='double*',
 )
 def generate_primordial_noise(slab):
@@ -2718,111 +2934,64 @@ def generate_primordial_noise(slab):
     the variance of these complex numbers to equal unity, and so their
     real and imaginary parts are drawn from a distribution
     with variance 1/√2.
-    The 3D sequence of random numbers should be independent on the size
+    The 3D field of random numbers should be independent on the size
     of the grid, in the sense that increasing the grid size should
     amount to just populating the additional "shell" with new random
     numbers, but keeping the random numbers inside of the inner cuboid
     the same. This has the effect that enlarging the grid leaves the
     large-scale structure invariant; one merely add information at
-    smaller scales. Additionally, the sequence of random numbers should
+    smaller scales. Additionally, the field of random numbers should
     be independent on the number of processes. To achieve all of this,
-    we draw the random numbers using the following scheme:
-    All processes loop over the entire 3D grid in shells, starting from
-    the inner most shell (labelled shell 1) containing (amongst others)
-    the (0, 0, 0) point. Since the kk-dimension is cut in half, each
-    shell is only tabulated at the kk ≥ 0 half. Thus, each shell
-    consists of a kk = constant face, two kj = constant faces and two
-    ki = constant faces. Denoting the shell number simply by 'shell',
-    the faces are defined by:
-        The kk = constant face : kk = shell              , -shell + 1 ≤ ki ≤ shell, -shell < kj ≤ shell,
-        The kj = constant faces: kj ∈ {-shell + 1, shell}, -shell + 1 ≤ ki ≤ shell,      0 ≤ kk < shell,
-        The ki = constant faces: ki ∈ {-shell + 1, shell}, -shell + 1 < kj ≤ shell,      0 ≤ kk < shell.
-    With 0 < shell ≤ nyquist, we hit all points in the 3D grid. The
-    (0, 0, 0) point will be part of the kj = 0 face in shell 1. At each
-    point, all processes draw the same two random numbers, but only the
-    process which owns the given point (determined by the j index that
-    goes with kj) assign the random numbers to its local slab.
+    the random numbers at each grid point are drawn from a counter-based
+    generator (see philox_gaussians), with the counter given by the
+    wave vector (ki, kj, kk) of the point and the key given by
+    random_seed. Each process then only needs to draw the random numbers
+    of the points within its local slab.
     The DC and Nyquist planes, defined by kk = 0 and kk = nyquist,
     respectively, need to satisfy the complex conjugacy symmetry of a
     Fourier transformed real field, namely
         plane[k_vec] = plane[-k_vec]*,
     where * means complex conjugation and k_vec is a 2D vector in the
-    plane. We enfore this symmetry by letting all processes tabulate
-    both planes with random numbers in their entirety. After the whole
-    3D grid and the two planes are filled with random numbers, we can
-    enforce the symmetry by simply looping over half of the two planes
-    and setting each point equal to the conjucate of the corresponding
-    symmetric point.
+    plane. We enforce this symmetry by looping over half of the two
+    planes and setting each point equal to the conjugate of the
+    corresponding symmetric point, the random numbers of which are
+    simply drawn anew from the counter-based generator.
     """
     masterprint('Generating primordial noise ...')
     # The global gridsize is equal to
     # the first (1) dimension of the slab.
     gridsize = slab.shape[1]
     nyquist = gridsize//2
-    # Allocate the entire DC and Nyquist plane on all processes
-    plane_dc      = empty((gridsize, gridsize, 2), dtype=C2np['double'])
-    plane_nyquist = empty((gridsize, gridsize, 2), dtype=C2np['double'])
-    # Seed the pseudo random number generator
-    # using the same seed on all processes.
-    seed_rng(random_seed)
-    # Loop through all shells
-    for shell in range(1, nyquist + 1):
-        # Loop over the three types of faces
-        for face in range(3):
-            if face == 0:
-                # The kk = constant face
-                kj_start, kj_stop, kj_step = ℤ[-shell + 1], ℤ[shell + 1], 1
-                ki_start, ki_stop, ki_step = ℤ[-shell + 1], ℤ[shell + 1], 1
-                kk_start, kk_stop, kk_step =   +shell     , ℤ[shell + 1], 1
-            elif face == 1:
-                # The two kj = constant faces
-                kj_start, kj_stop, kj_step = ℤ[-shell + 1], ℤ[shell + 1], ℤ[2*shell - 1]
-                ki_start, ki_stop, ki_step = ℤ[-shell + 1], ℤ[shell + 1],             1
-                kk_start, kk_stop, kk_step =            0 ,   shell     ,             1
-            elif face == 2:
-                # The two ki = constant faces
-                kj_start, kj_stop, kj_step = ℤ[-shell + 2],   shell     ,             1
-                ki_start, ki_stop, ki_step = ℤ[-shell + 1], ℤ[shell + 1], ℤ[2*shell - 1]
-                kk_start, kk_stop, kk_step =            0 ,   shell     ,             1
-            # Loop over the face
-            for kj in range(kj_start, kj_stop, kj_step):
-                j_global = kj + gridsize if kj < 0 else kj
-                j = j_global - ℤ[slab.shape[0]*rank]
-                for ki in range(ki_start, ki_stop, ki_step):
-                    i = ki + gridsize if ki < 0 else ki
-                    for kk in range(kk_start, kk_stop, kk_step):
-                        # Draw the random numbers
-                        noise_re = random_gaussian(0, ℝ[1/sqrt(2)])
-                        noise_im = random_gaussian(0, ℝ[1/sqrt(2)])
-                        # Populate the local slab
-                        with unswitch(2):
-                            if 0 <= j < ℤ[slab.shape[0]]:
-                                k = 2*kk
-                                slab_jik = cython.address(slab[j, i, k:])
-                                slab_jik[0] = noise_re
-                                slab_jik[1] = noise_im
-                        # Populate the DC and Nyquist planes
-                        if kk == 0:
-                            plane_ji = cython.address(plane_dc[j_global, i, :])
-                            plane_ji[0] = noise_re
-                            plane_ji[1] = noise_im
-                        elif kk == nyquist:
-                            plane_ji = cython.address(plane_nyquist[j_global, i, :])
-                            plane_ji[0] = noise_re
-                            plane_ji[1] = noise_im
+    # The key of the counter-based generator,
+    # given by the lower and upper 32 bits of the random seed.
+    key0 = random_seed & 0xFFFFFFFF
+    key1 = (random_seed >> 32) & 0xFFFFFFFF
+    # Populate the local slab. The wave vector components ki and kj
+    # lie in the range -nyquist < ki, kj ≤ nyquist, while the kk
+    # dimension is cut in half, 0 ≤ kk ≤ nyquist.
+    for j in range(ℤ[slab.shape[0]]):
+        j_global = ℤ[slab.shape[0]*rank] + j
+        kj = j_global - gridsize if j_global > nyquist else j_global
+        for i in range(gridsize):
+            ki = i - gridsize if i > nyquist else i
+            for kk in range(ℤ[nyquist + 1]):
+                noise = philox_gaussians(ki, kj, kk, key0, key1)
+                slab_jik = cython.address(slab[j, i, 2*kk:])
+                slab_jik[0] = noise[0]
+                slab_jik[1] = noise[1]
     # Enforce the complex conjugacy symmetry on the DC and Nyquist
     # planes. We do this by replacing the random numbers for the
     # elements in the lower j half of each plane with those of the
     # "conjugated" element, situated at the negative k vector.
-    # For j_global == j_global_conj, the conjucation is purely along i,
-    # and so we may only edit half of the points along this line.
-    for k, plane in zip((0, 2*nyquist), (plane_dc, plane_nyquist)):
+    for kk in (0, nyquist):
+        k = 2*kk
         for j_global in range(gridsize//2 + 1):
             j = j_global - ℤ[slab.shape[0]*rank]
             # Each process can only change their local slab
             if not (0 <= j < ℤ[slab.shape[0]]):
                 continue
             j_global_conj = 0 if j_global == 0 else gridsize - j_global
+            kj = j_global_conj - gridsize if j_global_conj > nyquist else j_global_conj
             for i in range(gridsize):
                 i_conj = 0 if i == 0 else gridsize - i
                 # Enforce complex conjugate symmetry if necessary.
@@ -2835,12 +3004,88 @@ def generate_primordial_noise(slab):
                     slab[j, i, k + 1] = 0
                 elif 𝔹[j_global != j_global_conj] or i < ℤ[gridsize//2]:
                     # Enforce conjugacy
-                    slab_jik      = cython.address(slab [j            , i     , k:])
-                    plane_ji_conj = cython.address(plane[j_global_conj, i_conj,  :])
-                    slab_jik[0] = +plane_ji_conj[0]
-                    slab_jik[1] = -plane_ji_conj[1]
+                    ki = i_conj - gridsize if i_conj > nyquist else i_conj
+                    noise = philox_gaussians(ki, kj, kk, key0, key1)
+                    slab_jik = cython.address(slab[j, i, k:])
+                    slab_jik[0] = +noise[0]
+                    slab_jik[1] = -noise[1]
     masterprint('done')
 
+# Function returning two independent Gaussian random numbers with
+# zero mean and variance 1/2, determined solely by the given wave
+# vector and key. The (two's complement) wave vector components are
+# used as the counter of the Philox generator (see philox4x32). The
+# resulting four 32-bit words are combined into two uniform numbers
+# with 53-bit resolution, which are then transformed via the
+# Box-Muller transform. The two random numbers are returned
+# through the global vector.
+@cython.header(
+    # Arguments
+    ki='Py_ssize_t',
+    kj='Py_ssize_t',
+    kk='Py_ssize_t',
+    key0='unsigned long long int',
+    key1='unsigned long long int',
+    # Locals
+    r='double',
+    u1='double',
+    u2='double',
+    words='unsigned long long int*',
+    returns='double*',
+)
+def philox_gaussians(ki, kj, kk, key0, key1):
+    words = philox4x32(ki & 0xFFFFFFFF, kj & 0xFFFFFFFF, kk & 0xFFFFFFFF, 0, key0, key1)
+    # Uniform numbers in [0, 1) with 53-bit resolution
+    u1 = ((words[0] >> 5)*67108864 + (words[1] >> 6))*ℝ[1/9007199254740992]
+    u2 = ((words[2] >> 5)*67108864 + (words[3] >> 6))*ℝ[1/9007199254740992]
+    # Box-Muller transform to Gaussian numbers with variance 1/2
+    r = sqrt(-log(1 - u1))
+    vector[0] = r*cos(ℝ[2*π]*u2)
+    vector[1] = r*sin(ℝ[2*π]*u2)
+    return vector
+
+# Function implementing the counter-based Philox-4×32-10 generator of
+# Salmon et al. (2011), as found in the Random123 library. The counter
+# (c0, c1, c2, c3) and the key (key0, key1) are all 32-bit words, which
+# are mapped to four pseudo-random 32-bit words. As only unsigned
+# integer arithmetic is used, the generated words are the same in pure
+# Python and compiled mode. The words are returned through the global
+# philox_words array.
+@cython.header(
+    # Arguments
+    c0='unsigned long long int',
+    c1='unsigned long long int',
+    c2='unsigned long long int',
+    c3='unsigned long long int',
+    key0='unsigned long long int',
+    key1='unsigned long long int',
+    # Locals
+    product0='unsigned long long int',
+    product1='unsigned long long int',
+    round_index='int',
+    returns='unsigned long long int*',
+)
+def philox4x32(c0, c1, c2, c3, key0, key1):
+    # The ten Philox rounds, with the key bumped between each round
+    for round_index in range(10):
+        if round_index > 0:
+            key0 = (key0 + 0x9E3779B9) & 0xFFFFFFFF
+            key1 = (key1 + 0xBB67AE85) & 0xFFFFFFFF
+        product0 = 0xD2511F53*c0
+        product1 = 0xCD9E8D57*c2
+        c0 = (product1 >> 32) ^ c1 ^ key0
+        c2 = (product0 >> 32) ^ c3 ^ key1
+        c1 = product1 & 0xFFFFFFFF
+        c3 = product0 & 0xFFFFFFFF
+    philox_words[0] = c0
+    philox_words[1] = c1
+    philox_words[2] = c2
+    philox_words[3] = c3
+    return philox_words
+# Array used for the return values of the above function
+cython.declare(philox_words='unsigned long long int*')
+philox_words = malloc(4*sizeof('unsigned long long int'))
+
 
 
 # Read in definitions from CLASS source files at import time
@@ -27,15 +27,21 @@ from commons import *
 # Cython imports
 import interactions
 cimport('from analysis import debug, measure, powerspec')
+cimport('from communication import rebalance_domains')
 cimport('from graphics import render2D, render3D')
+cimport('from instrumentation import memory_report, memory_summary, mpi_report, '
+        '                            profile_report, profile_tic, profile_toc')
 cimport('from integration import cosmic_time,          '
         '                        expand,               '
         '                        hubble,               '
         '                        initiate_time,        '
         '                        scale_factor,         '
         '                        scalefactor_integral, '
+        '                        tabulate_cosmic_clock, '
         )
 cimport('from interactions import find_interactions')
+cimport('from linear import free_primordial_noise')
+cimport('from mesh import update_domain_decomposition')
 cimport('from snapshot import get_initial_conditions, save')
 cimport('from species import Component, get_representation')
 cimport('from utilities import delegate')
@@ -133,6 +139,8 @@ def dump(components, output_filenames, final_render3D, op=None,
         drift(components, 'first half')
     elif op == 'kick':
         kick(components, 'second half')
+    if profiling:
+        profile_tic('dump')
     # Dump render2D
     for time_val, time_param in zip((universals.a, universals.t), ('a', 't')):
         if time_val in render2D_times[time_param]:
@@ -244,6 +252,8 @@ def dump(components, output_filenames, final_render3D, op=None,
                 for filename in (autosave_filename, autosave_params_filename):
                     if os.path.isfile(filename):
                         os.remove(filename)
+    if profiling:
+        profile_toc()
     return dumped
 cython.declare(autosave_filename=str,
                autosave_params_filename=str,
@@ -261,6 +271,9 @@ def nullify_ᔑdt_steps():
     for integrand in ᔑdt_steps:
         for index in range(2):
             ᔑdt_steps[integrand][index] = 0
+    # With block time steps, the particles on all rungs
+    # are now kicked up to the present time.
+    rung_t_kicked[:] = universals.t
 
 # Function which kick all of the components.
 # Here a 'kick' means all interactions together with other source terms
@@ -274,11 +287,14 @@ def nullify_ᔑdt_steps():
                integrand=object,  # str or tuple
                interactions_list=list,
                method=str,
+               opening='bint',
                receivers=list,
                suppliers=list,
                ᔑdt=dict,
                )
 def kick(components, step):
+    if profiling:
+        profile_tic('kick')
     # Construct the local dict ᔑdt,
     # based on which type of step is to be performed.
     ᔑdt = {}
@@ -291,6 +307,15 @@ def kick(components, step):
             ᔑdt[integrand] = np.sum(ᔑdt_steps[integrand])
         elif master:
             abort('The value "{}" was given for the step'.format(step))
+    # With block time steps, the short-range forces are applied
+    # using a separate time integral for each rung. Unless this is
+    # the closing 'second half' kick, the particles are assigned to
+    # new rungs, the time steps of which are opened by this kick.
+    if N_rungs > 1:
+        opening = (step != 'second half')
+        if opening:
+            assign_rungs(components, 2*ᔑdt_steps['1'][0])
+        ᔑdt['rungs'] = rung_integrals(universals.t, 2*ᔑdt_steps['1'][0]*opening, ထ)
     # Realize all linear fluid scalars which are not components
     # of a tensor. This comes down to ϱ and 𝒫.
     for component in components:
@@ -305,7 +330,15 @@ def kick(components, step):
     interactions_list = find_interactions(components)
     # Invoke each interaction sequentially
     for force, method, receivers, suppliers in interactions_list:
+        if profiling:
+            profile_tic(f'{force} ({method})')
         getattr(interactions, force)(method, receivers, suppliers, ᔑdt)
+        if profiling:
+            profile_toc()
+    if N_rungs > 1:
+        settle_rungs(components)
+    if profiling:
+        profile_toc()
 
 # Function which drift all of the components
 @cython.header(# Arguments
@@ -317,6 +350,8 @@ def kick(components, step):
                component='Component',
                )
 def drift(components, step):
+    if profiling:
+        profile_tic('drift')
     # Construct the local dict ᔑdt,
     # based on which type of step is to be performed.
     ᔑdt = {}
@@ -329,9 +364,249 @@ def drift(components, step):
             ᔑdt[integrand] = np.sum(ᔑdt_steps[integrand])
         elif master:
             abort('The value "{}" was given for the step'.format(step))
-    # Drift all components sequentially
+    # Drift all components sequentially. With block time steps,
+    # the particle components are drifted together, in sub-steps.
     for component in components:
+        if N_rungs > 1 and component.representation == 'particles':
+            continue
         component.drift(ᔑdt)
+    if N_rungs > 1:
+        drift_rungs(components, ᔑdt['1'])
+    if profiling:
+        profile_toc()
+
+# Function assigning each particle to a rung for use with block
+# time steps. Particles on rung r are kicked by the short-range forces
+# using a time step size of Δt/2**r, with Δt the base time step size.
+# The rung of a particle is chosen as the lowest one for which the
+# particle satisfies the Courant condition of reduce_Δt, based on its
+# own velocity. In between kicks, the value stored for a particle on
+# rung r is r*(N_rungs + 1). During a base kick, this is changed to
+# r_old*N_rungs + r_new, so that the kick closes the time step of the
+# old rung while opening that of the new one. The original form is
+# restored by settle_rungs after the kick.
+@cython.header(# Arguments
+               components=list,
+               Δt='double',
+               # Locals
+               component='Component',
+               fac2='double',
+               fac_courant='double',
+               i='Py_ssize_t',
+               momx='double*',
+               momy='double*',
+               momz='double*',
+               populations='Py_ssize_t[::1]',
+               r='int',
+               ratio2='double',
+               rung='unsigned char*',
+               returns='void',
+               )
+def assign_rungs(components, Δt):
+    global rung_populations
+    # The Courant factor as used by reduce_Δt
+    fac_courant = 2e-1
+    populations = zeros(N_rungs, dtype=C2np['Py_ssize_t'])
+    for component in components:
+        if component.representation != 'particles':
+            continue
+        # A particle with momentum mom needs a time step size
+        # smaller than Δt by a factor of sqrt(fac2)*|mom|.
+        fac2 = (sqrt(3)*Δt/(
+            fac_courant*particle_Δx_max(component, 'short-range')*universals.a**2*component.mass
+        ))**2
+        momx = component.momx
+        momy = component.momy
+        momz = component.momz
+        rung = component.rung
+        for i in range(component.N_local):
+            # Find the lowest rung r satisfying 2**r ≥ sqrt(fac2)*|mom|
+            ratio2 = (momx[i]**2 + momy[i]**2 + momz[i]**2)*fac2
+            r = 0
+            while ratio2 > 1 and r < ℤ[N_rungs - 1]:
+                ratio2 *= 0.25
+                r += 1
+            populations[r] += 1
+            rung[i] = rung[i]//ℤ[N_rungs + 1]*ℤ[N_rungs] + r
+    rung_populations = asarray(
+        allreduce(asarray(populations), op=MPI.SUM), dtype=C2np['Py_ssize_t'],
+    )
+    masterprint(
+        'Particles per rung:', ', '.join([str(population) for population in rung_populations])
+    )
+
+# Function restoring the rung values of the particles after a base
+# kick, leaving only the new rungs. See assign_rungs.
+@cython.header(# Arguments
+               components=list,
+               # Locals
+               component='Component',
+               i='Py_ssize_t',
+               rung='unsigned char*',
+               returns='void',
+               )
+def settle_rungs(components):
+    for component in components:
+        if component.representation != 'particles':
+            continue
+        rung = component.rung
+        for i in range(component.N_local):
+            rung[i] = rung[i]%ℤ[N_rungs]*ℤ[N_rungs + 1]
+# Arrays storing the time up to which the particles on each rung
+# have been kicked and the number of particles on each rung
+cython.declare(rung_t_kicked='double[::1]', rung_populations='Py_ssize_t[::1]')
+rung_t_kicked = zeros(N_rungs, dtype=C2np['double'])
+rung_populations = zeros(N_rungs, dtype=C2np['Py_ssize_t'])
+
+# Function returning the time integrals ∫a⁻¹dt used for kicking the
+# particles on each rung at time t, indexed by the rung values as
+# described in assign_rungs. Only rungs from rung_min and up are kicked.
+# Each of these is kicked from the time up to which it has already
+# been kicked until t, and then on to the midpoint t + Δt/2**(r + 1)
+# of its next time step (or t_end if this comes first).
+@cython.header(# Arguments
+               t='double',
+               Δt='double',
+               t_end='double',
+               rung_min='int',
+               # Locals
+               n='int',
+               o='int',
+               r='int',
+               t_open='double',
+               ᔑdt_close='double[::1]',
+               ᔑdt_open='double[::1]',
+               ᔑdt_rungs='double[::1]',
+               returns='double[::1]',
+               )
+def rung_integrals(t, Δt, t_end, rung_min=0):
+    ᔑdt_close = zeros(N_rungs, dtype=C2np['double'])
+    ᔑdt_open  = zeros(N_rungs, dtype=C2np['double'])
+    for r in range(rung_min, N_rungs):
+        t_open = pairmin(t + Δt/2**(r + 1), t_end)
+        ᔑdt_close[r] = scalefactor_integral('a**(-1)', rung_t_kicked[r], t - rung_t_kicked[r])
+        ᔑdt_open [r] = scalefactor_integral('a**(-1)', t, t_open - t)
+        rung_t_kicked[r] = t_open
+    ᔑdt_rungs = empty(N_rungs**2, dtype=C2np['double'])
+    for o in range(N_rungs):
+        for n in range(N_rungs):
+            ᔑdt_rungs[o*N_rungs + n] = ᔑdt_close[o] + ᔑdt_open[n]
+    return ᔑdt_rungs
+
+# Function which kicks the particles on the rungs from rung_min and up
+# by the short-range forces, in between the base time steps.
+@cython.header(# Arguments
+               components=list,
+               t='double',
+               Δt='double',
+               t_end='double',
+               rung_min='int',
+               # Locals
+               force=str,
+               interactions_list=list,
+               method=str,
+               receivers=list,
+               suppliers=list,
+               ᔑdt=dict,
+               returns='void',
+               )
+def kick_substep(components, t, Δt, t_end, rung_min):
+    # No base kick takes place, and so only the time integrals
+    # for the rungs are non-zero.
+    ᔑdt = {
+        'a**(-1)': 0,
+        'rungs': rung_integrals(t, Δt, t_end, rung_min),
+    }
+    # Do not bother with the interactions
+    # if the kicked rungs are all empty.
+    if not np.any(asarray(rung_populations[rung_min:])):
+        return
+    if profiling:
+        profile_tic('kick')
+    interactions_list = find_interactions(components)
+    for force, method, receivers, suppliers in interactions_list:
+        if profiling:
+            profile_tic(f'{force} ({method})')
+        getattr(interactions, force)(method, receivers, suppliers, ᔑdt, substep=True)
+        if profiling:
+            profile_toc()
+    if profiling:
+        profile_toc()
+
+# Function drifting all particle components over the time interval
+# Δt_drift ending at universals.t_next, when using block time steps.
+# The drift is split into sub-steps, in between which the particles
+# on the rungs due to be kicked are kicked. The rungs are laid out
+# relative to the base kick, which happened at
+# universals.t - ᔑdt_steps['1'][0], with rung r having a time step size
+# of 2*ᔑdt_steps['1'][0]/2**r. When the drift only catches up with the
+# base kick (ending at universals.t), all rungs are kicked up to this
+# time as well, synchronizing the particles.
+@cython.header(# Arguments
+               components=list,
+               Δt_drift='double',
+               # Locals
+               k='Py_ssize_t',
+               n_substeps='Py_ssize_t',
+               rung_min='int',
+               t_base='double',
+               t_drifted='double',
+               t_end='double',
+               t_start='double',
+               τ='double',
+               Δt='double',
+               δ='double',
+               returns='void',
+               )
+def drift_rungs(components, Δt_drift):
+    t_end = universals.t_next
+    t_start = t_end - Δt_drift
+    Δt = 2*ᔑdt_steps['1'][0]
+    t_base = universals.t - 0.5*Δt
+    # The finest sub-step size
+    n_substeps = 2**(N_rungs - 1)
+    δ = Δt/n_substeps
+    t_drifted = t_start
+    for k in range(1, n_substeps):
+        τ = t_base + k*δ
+        if τ < t_start + ℝ[1e-6*δ]:
+            continue
+        if τ > t_end - ℝ[1e-6*δ]:
+            break
+        # The rungs from rung_min and up are due to be kicked at τ,
+        # with rung_min given by the number of trailing zeros in
+        # the binary representation of k.
+        rung_min = N_rungs - 1
+        while k%2**(N_rungs - rung_min) == 0:
+            rung_min -= 1
+        if not np.any(asarray(rung_populations[rung_min:])):
+            continue
+        drift_particles(components, t_drifted, τ)
+        t_drifted = τ
+        kick_substep(components, τ, Δt, t_end, rung_min)
+    drift_particles(components, t_drifted, t_end)
+    # Synchronize the rungs if the drift caught up with the base kick
+    if t_end < universals.t + 1e-6*δ:
+        kick_substep(components, t_end, 0, t_end, 0)
+
+# Helper function for drift_rungs, drifting all particle components
+# from time t_ini to t_final.
+@cython.header(# Arguments
+               components=list,
+               t_ini='double',
+               t_final='double',
+               # Locals
+               component='Component',
+               ᔑdt=dict,
+               returns='void',
+               )
+def drift_particles(components, t_ini, t_final):
+    if t_final == t_ini:
+        return
+    ᔑdt = {'a**(-2)': scalefactor_integral('a**(-2)', t_ini, t_final - t_ini)}
+    for component in components:
+        if component.representation == 'particles':
+            component.drift(ᔑdt)
 
 # Function containing the main time loop of CO𝘕CEPT
 @cython.header(# Locals
@@ -376,6 +651,11 @@ def timeloop():
         component.realize_if_linear(1, specific_multi_index=0)        # J
         component.realize_if_linear(2, specific_multi_index='trace')  # 𝒫
         component.realize_if_linear(2, specific_multi_index=(0, 0))   # ς
+    # Free the memory of the primordial noise,
+    # unless it may be needed for realizations of
+    # linear fluid variables during the time loop.
+    if not any([component.representation == 'fluid' for component in components]):
+        free_primordial_noise()
     # Specification of first dump and a corresponding index
     i_dump = 0
     next_dump = dumps[i_dump]
@@ -423,6 +703,11 @@ def timeloop():
             ]
         )
     }
+    # Tabulate a(t) and all of the above integrands
+    # once and for all, from now until the last dump.
+    tabulate_cosmic_clock(max([dump[1] for dump in dumps]), list(ᔑdt_steps))
+    # With block time steps, all particles start out synchronized
+    rung_t_kicked[:] = universals.t
     # Record what time it is, for use with autosaving
     autosave_time = time()
     # The main time loop
@@ -436,6 +721,18 @@ def timeloop():
         # Analyze and print out debugging information, if required
         if enable_debugging:
             debug(components)
+        # Rebalance the domains at regular intervals
+        if not (universals.time_step % domain_balancing_interval):
+            if rebalance_domains(components):
+                update_domain_decomposition()
+        # Periodically reorder the local particles along a
+        # space-filling curve. This is done here, once per time step,
+        # as the drift (with its exchange) runs several times per step.
+        if (particle_ordering != 'none'
+            and not (universals.time_step % particle_ordering_interval)):
+            for component in components:
+                if component.representation == 'particles':
+                    component.reorder_particles()
         # Kick.
         # Even though 'whole' is used, the first kick (and the first
         # kick after a dump) is really only half a step (the first
@@ -515,6 +812,10 @@ def timeloop():
                # Locals
                component='Component',
                i='Py_ssize_t',
+               memory_current='double',
+               memory_current_total='double',
+               memory_peak='double',
+               memory_peak_total='double',
                part=str,
                parts=list,
                width='Py_ssize_t',
@@ -548,6 +849,15 @@ def print_timestep_heading(time_step, Δt, bottleneck, components, end=False):
         if component.w_type != 'constant':
             parts.append(f'\nEoS w ({component.name}):'.ljust(heading_ljust))
             parts.append(significant_figures(component.w(), 4, fmt='unicode'))
+    if memory_accounting:
+        memory_current, memory_peak, memory_current_total, memory_peak_total = memory_summary()
+        parts.append('\nMemory:'.ljust(heading_ljust))
+        parts.append(
+            f'{significant_figures(memory_current/2**20, 4, fmt="unicode")} MB max per process '
+            f'(peak {significant_figures(memory_peak/2**20, 4, fmt="unicode")} MB), '
+            f'{significant_figures(memory_current_total/2**20, 4, fmt="unicode")} MB in total '
+            f'(peak {significant_figures(memory_peak_total/2**20, 4, fmt="unicode")} MB)'
+        )
     # Find the maximum width of the first column and left justify
     # the entire first colum to match this maximum width.
     if heading_ljust == 0:
@@ -563,9 +873,56 @@ def print_timestep_heading(time_step, Δt, bottleneck, components, end=False):
                 parts[i] = part.ljust(heading_ljust)
     # Print out the combined heading
     masterprint(''.join(parts))
+    # Report the MPI communication and the wall time of each phase
+    # of the previous time step (or of the initialization,
+    # before the first time step).
+    mpi_report(time_step if end else time_step - 1)
+    profile_report(time_step if end else time_step - 1)
 cython.declare(heading_ljust='Py_ssize_t')
 heading_ljust = 0
 
+# Function returning the maximum comoving distance a particle of the
+# given component should be able to travel in a single time step.
+# This is set to be the boxsize divided by the resolution, where each
+# force on the particles have their own resolution. The number of
+# particles is also used as an addtional resolution. With block time
+# steps, the limit is split in two: With scope set to 'long-range',
+# only the number of particles and the grids of the long-range (PM)
+# forces (including the PM part of P³M and TreePM) are considered,
+# while with scope set to 'short-range', only the softening lengths of
+# the short-range forces are considered. These are the limits for the
+# base time step and for the rungs, respectively. With scope set to
+# 'all', the usual single time step limit is returned.
+@cython.header(# Arguments
+               component='Component',
+               scope=str,
+               # Locals
+               force=str,
+               method=str,
+               resolutions=list,
+               returns='double',
+               )
+def particle_Δx_max(component, scope='all'):
+    resolutions = []
+    if scope != 'short-range':
+        resolutions.append(cbrt(component.N))
+    for force, method in component.forces.items():
+        if force == 'gravity':
+            if scope == 'all':
+                if method == 'pm':
+                    resolutions.append(φ_gridsize)
+                elif method in ('pp', 'ppnonperiodic', 'p3m', 'tree', 'treenonperiodic', 'treepm'):
+                    resolutions.append(boxsize/component.softening_length)
+            elif scope == 'long-range':
+                if method in ('pm', 'p3m', 'treepm'):
+                    resolutions.append(φ_gridsize)
+            elif scope == 'short-range':
+                if method in ('pp', 'ppnonperiodic', 'p3m', 'tree', 'treenonperiodic', 'treepm'):
+                    resolutions.append(boxsize/component.softening_length)
+    if not resolutions:
+        return ထ
+    return boxsize/np.max(resolutions)
+
 # This function reduces the time step size Δt if it is too,
 # based on a number of conditions.
 @cython.header(# Arguments
@@ -641,6 +998,10 @@ def reduce_Δt(components, Δt, Δt_begin, timespan, worry=True):
       on the particle species.
     - A small fraction of 1/abs(ẇ) for every fluid components,
       so that w varies smoothly.
+    With block time steps (N_rungs > 1), the part of the criterion for
+    particles which stems from the short-range forces is relaxed, as
+    the fastest particles are kicked by these using a smaller
+    time step size than Δt.
     The conditions above are written in the same order in the code
     below. The last condition is by far the most involved.
     The optional worry argument flag specifies whether or not a
@@ -721,19 +1082,20 @@ def reduce_Δt(components, Δt, Δt_begin, timespan, worry=True):
     for component in components:
         if component.representation == 'particles':
             # Determine the maximum comoving distance a particle should
-            # be able to travel in a single time step. This is set to be
-            # the boxsize divided by the resolution, where each force
-            # on the particles have their own resolution.
-            # The number of particles is also used
-            # as an addtional resolution.
-            resolutions = [cbrt(component.N)]
-            for force, method in component.forces.items():
-                if force == 'gravity':
-                    if method == 'pm':
-                        resolutions.append(φ_gridsize)
-                    elif method in ('pp', 'p3m'):
-                        resolutions.append(boxsize/component.softening_length)
-            Δx_max = boxsize/np.max(resolutions)
+            # be able to travel in a single time step. With block time
+            # steps, the fastest particles are placed on the highest
+            # rung, having a time step size 2**(N_rungs - 1) times
+            # smaller than Δt (see assign_rungs). This relaxes the limit
+            # set by the short-range forces, which are applied per rung,
+            # but not the limit set by the long-range forces and the
+            # inter-particle distance, which apply to the base step.
+            if N_rungs == 1:
+                Δx_max = particle_Δx_max(component)
+            else:
+                Δx_max = pairmin(
+                    particle_Δx_max(component, 'long-range'),
+                    2**(N_rungs - 1)*particle_Δx_max(component, 'short-range'),
+                )
             # Find maximum speed of particles
             mom2_max = 0
             momx = component.momx
@@ -1001,6 +1363,9 @@ if special_params:
 else:
     # Run the time loop
     timeloop()
+    # Report the registered memory
+    if memory_accounting:
+        memory_report()
     # Simulation done
     universals.any_warnings = allreduce(universals.any_warnings, op=MPI.LOR)
     if universals.any_warnings:
@@ -26,6 +26,7 @@ from commons import *
 
 # Cython imports
 cimport('from communication import communicate_domain,                             '
+        '                          domain_balanced, domain_bounds,                 '
         '                          domain_layout_local_indices,                    '
         '                          domain_size_x,  domain_size_y,  domain_size_z,  '
         '                          domain_start_x, domain_start_y, domain_start_z, '
@@ -35,6 +36,9 @@ cimport('from communication import communicate_domain,
         '                          rank_neighboring_domain,                        '
         '                          smart_mpi,                                      '
         )
+cimport('from cython.parallel import prange, threadid')
+cimport('from instrumentation import memory_register, mpi_count_bytes, mpi_tic, mpi_toc, '
+        '                            profile_tic, profile_toc')
 
 # Function pointer types used in this module
 pxd('ctypedef double* (*func_dstar_ddd)(double, double, double)')
@@ -63,10 +67,29 @@ cdef extern from "fft.c":
                                   char*     rigor,
                                   bint      fftw_wisdom_reuse,
                                   char*     wisdom_filename,
+                                  int       nthreads,
                                   )
     void fftw_execute(fftw_plan plan)
     void fftw_clean(double* grid, fftw_plan plan_forward,
                                   fftw_plan plan_backward)
+    # Pencil decomposition
+    struct fftw_pencil_return_struct:
+        double* grid
+        fftw_plan plan_forward_k
+        fftw_plan plan_forward_j
+        fftw_plan plan_forward_i
+        fftw_plan plan_backward_i
+        fftw_plan plan_backward_j
+        fftw_plan plan_backward_k
+    fftw_pencil_return_struct fftw_pencil_setup(ptrdiff_t gridsize,
+                                                ptrdiff_t size_i_real,
+                                                ptrdiff_t size_j_real,
+                                                ptrdiff_t size_j_fourier,
+                                                ptrdiff_t size_k_fourier,
+                                                ptrdiff_t size_alloc,
+                                                char*     rigor,
+                                                int       nthreads,
+                                                )
 """)
 
 
@@ -239,12 +262,15 @@ def CIC_scalargrid2coordinates(grid, x, y, z):
             + grid[x_upper, y_upper, z_upper]*ℝ[Wxu*Wyu]*Wzu)
 
 # Function for doing lookup in a grid with vector values and
-# CIC-interpolating to specified coordinates
+# CIC-interpolating to specified coordinates. The interpolated vector
+# is written to the passed vector_out. As the function does not need
+# the GIL, it can be called from within threaded loops.
 @cython.header(# Argument
                grid='double[:, :, :, :]',
                x='double',
                y='double',
                z='double',
+               vector_out='double*',
                # Locals
                Wxl='double',
                Wxu='double',
@@ -259,9 +285,10 @@ def CIC_scalargrid2coordinates(grid, x, y, z):
                y_upper='Py_ssize_t',
                z_lower='Py_ssize_t',
                z_upper='Py_ssize_t',
-               returns='double*',
+               returns='void',
                )
-def CIC_vectorgrid2coordinates(grid, x, y, z):
+@cython.nogil
+def CIC_vectorgrid2coordinates(grid, x, y, z, vector_out):
     """This function looks up tabulated vectors in a grid and
     interpolates to (x, y, z) via the cloud in cell (CIC) method.
     Input arguments must be normalized so that 0 <= x, y, z < 1.
@@ -301,15 +328,14 @@ def CIC_vectorgrid2coordinates(grid, x, y, z):
     Wzu = z - z_lower  # = 1 - (z_upper - z)
     # Assign the weighted grid values to the vector components
     for dim in range(3):
-        vector[dim] = (  grid[x_lower, y_lower, z_lower, dim]*ℝ[Wxl*Wyl]*Wzl
-                       + grid[x_lower, y_lower, z_upper, dim]*ℝ[Wxl*Wyl]*Wzu
-                       + grid[x_lower, y_upper, z_lower, dim]*ℝ[Wxl*Wyu]*Wzl
-                       + grid[x_lower, y_upper, z_upper, dim]*ℝ[Wxl*Wyu]*Wzu
-                       + grid[x_upper, y_lower, z_lower, dim]*ℝ[Wxu*Wyl]*Wzl
-                       + grid[x_upper, y_lower, z_upper, dim]*ℝ[Wxu*Wyl]*Wzu
-                       + grid[x_upper, y_upper, z_lower, dim]*ℝ[Wxu*Wyu]*Wzl
-                       + grid[x_upper, y_upper, z_upper, dim]*ℝ[Wxu*Wyu]*Wzu)
-    return vector
+        vector_out[dim] = (  grid[x_lower, y_lower, z_lower, dim]*ℝ[Wxl*Wyl]*Wzl
+                           + grid[x_lower, y_lower, z_upper, dim]*ℝ[Wxl*Wyl]*Wzu
+                           + grid[x_lower, y_upper, z_lower, dim]*ℝ[Wxl*Wyu]*Wzl
+                           + grid[x_lower, y_upper, z_upper, dim]*ℝ[Wxl*Wyu]*Wzu
+                           + grid[x_upper, y_lower, z_lower, dim]*ℝ[Wxu*Wyl]*Wzl
+                           + grid[x_upper, y_lower, z_upper, dim]*ℝ[Wxu*Wyl]*Wzu
+                           + grid[x_upper, y_upper, z_lower, dim]*ℝ[Wxu*Wyu]*Wzl
+                           + grid[x_upper, y_upper, z_upper, dim]*ℝ[Wxu*Wyu]*Wzu)
 
 # Function which interpolates one grid onto another grid,
 # optionally multiplying the interpolated values by a factor.
@@ -491,6 +517,427 @@ def CIC_grid2grid(gridA, gridB, fac=1, fac_grid=None, fac2=1, fac_grid2=None):
                         gridA[iA_upper, jA_upper, kA_lower] += ℝ[value*Wiu*Wju]*Wkl
                         gridA[iA_upper, jA_upper, kA_upper] += ℝ[value*Wiu*Wju]*Wku
 
+# Function for interpolating particles to a domain grid using either
+# the cloud in cell (CIC, order 2), the triangular shaped cloud
+# (TSC, order 3) or the piecewise cubic spline (PCS, order 4) mass
+# assignment scheme, with the work shared among the OpenMP threads.
+# Each particle contributes to order**3 grid points. As different
+# particles may contribute to the same grid points, the particles are
+# first sorted into buckets according to the lowest x index of the
+# grid points to which they contribute. A particle in bucket i only
+# contributes to grid points with x indices i, ..., i + order - 1,
+# and so every order'th bucket can be handled in parallel.
+# The passed domain_grid must include the ghost layers, as the
+# higher-order schemes spread particles into these.
+@cython.header(# Arguments
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               particle_quantity='double*',
+               use_quantity='bint',
+               N_local='Py_ssize_t',
+               factor='double',
+               domain_grid='double[:, :, ::1]',
+               order='int',
+               shift='double',
+               # Locals
+               a='int',
+               amount='double',
+               b='int',
+               bucket='Py_ssize_t',
+               bucket_offsets='Py_ssize_t[::1]',
+               buckets='Py_ssize_t[::1]',
+               c='int',
+               colour='int',
+               dim='int',
+               dist='double',
+               index='Py_ssize_t',
+               indices='Py_ssize_t[:, ::1]',
+               j='Py_ssize_t',
+               n='Py_ssize_t',
+               n_buckets='Py_ssize_t',
+               particle_order='Py_ssize_t[::1]',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
+               shape_dim='Py_ssize_t',
+               shape_x='Py_ssize_t',
+               shape_y='Py_ssize_t',
+               shape_z='Py_ssize_t',
+               thread='int',
+               weight_x='double',
+               weight_xy='double',
+               weights='double[:, :, ::1]',
+               x='double',
+               returns='void',
+               )
+def particles2domain_grid(posx, posy, posz, particle_quantity, use_quantity,
+                          N_local, factor, domain_grid, order=2, shift=0):
+    """The coordinates of the particles are shifted by shift grid units
+    along all three dimensions prior to the interpolation,
+    as needed for interlacing.
+    """
+    if order not in (2, 3, 4):
+        abort(f'particles2domain_grid called with order = {order} ∉ {{2, 3, 4}}')
+    shape_x = domain_grid.shape[0] - 5
+    shape_y = domain_grid.shape[1] - 5
+    shape_z = domain_grid.shape[2] - 5
+    scale_x = shape_x/domain_size_x
+    scale_y = shape_y/domain_size_y
+    scale_z = shape_z/domain_size_z
+    # Scratch space for the weights and lowest indices
+    # along each dimension, one set per thread.
+    weights = empty((num_threads, 3, 4), dtype=C2np['double'])
+    indices = empty((num_threads, 3), dtype=C2np['Py_ssize_t'])
+    # Sort the particles into buckets (counting sort)
+    n_buckets = domain_grid.shape[0]
+    buckets = empty(N_local, dtype=C2np['Py_ssize_t'])
+    bucket_offsets = zeros(n_buckets + 1, dtype=C2np['Py_ssize_t'])
+    for j in prange(N_local, nogil=True, num_threads=num_threads):
+        x = (posx[j] - domain_start_x)*scale_x
+        if x >= shape_x:
+            x = shape_x*(1 - machine_ϵ)
+        x = x + shift
+        # The bucket is the lowest x index (including the 2 lower
+        # ghost layers) to which the particle contributes.
+        if order == 2:
+            bucket = int(x) + 2
+        elif order == 3:
+            bucket = int(x + 0.5) + 1
+        else:
+            bucket = int(x) + 1
+        buckets[j] = bucket
+    for j in range(N_local):
+        bucket_offsets[buckets[j] + 1] += 1
+    for bucket in range(n_buckets):
+        bucket_offsets[bucket + 1] += bucket_offsets[bucket]
+    particle_order = empty(N_local, dtype=C2np['Py_ssize_t'])
+    for j in range(N_local):
+        bucket = buckets[j]
+        particle_order[bucket_offsets[bucket]] = j
+        bucket_offsets[bucket] += 1
+    # The offsets are now shifted by one bucket. Shift them back.
+    for bucket in range(n_buckets, 0, -1):
+        bucket_offsets[bucket] = bucket_offsets[bucket - 1]
+    bucket_offsets[0] = 0
+    # Interpolate the particles bucket by bucket,
+    # handling every order'th bucket in parallel.
+    for colour in range(order):
+        for bucket in prange(colour, n_buckets, order, nogil=True, num_threads=num_threads):
+            thread = threadid()
+            for n in range(bucket_offsets[bucket], bucket_offsets[bucket + 1]):
+                j = particle_order[n]
+                # Get the amount this particle contribute
+                # to the interpolated grid.
+                amount = factor
+                if use_quantity:
+                    amount = factor*particle_quantity[j]
+                # Compute the weights and the lowest grid index
+                # (including the 2 lower ghost layers)
+                # along each dimension.
+                for dim in range(3):
+                    # Get, translate and scale the coordinate so that
+                    # 0 <= x < shape_dim. Coordinates exactly at an
+                    # upper domain boundary are corrected so that they
+                    # lie just inside.
+                    if dim == 0:
+                        x = (posx[j] - domain_start_x)*scale_x
+                        shape_dim = shape_x
+                    elif dim == 1:
+                        x = (posy[j] - domain_start_y)*scale_y
+                        shape_dim = shape_y
+                    else:
+                        x = (posz[j] - domain_start_z)*scale_z
+                        shape_dim = shape_z
+                    if x >= shape_dim:
+                        x = shape_dim*(1 - machine_ϵ)
+                    x = x + shift
+                    if order == 2:
+                        # CIC: W = 1 - |dist| for |dist| < 1
+                        index = int(x)
+                        dist = x - index
+                        weights[thread, dim, 0] = 1 - dist
+                        weights[thread, dim, 1] = dist
+                    elif order == 3:
+                        # TSC: W = 3/4 - dist² for |dist| < 1/2,
+                        # W = 1/2*(3/2 - |dist|)² for 1/2 <= |dist| < 3/2.
+                        index = int(x + 0.5)
+                        dist = x - index
+                        weights[thread, dim, 0] = 0.5*(0.5 - dist)**2
+                        weights[thread, dim, 1] = 0.75 - dist**2
+                        weights[thread, dim, 2] = 0.5*(0.5 + dist)**2
+                        index = index - 1
+                    else:
+                        # PCS: W = (4 - 6*dist² + 3*|dist|³)/6
+                        # for |dist| < 1, W = (2 - |dist|)³/6
+                        # for 1 <= |dist| < 2.
+                        index = int(x)
+                        dist = x - index
+                        weights[thread, dim, 0] = (1 - dist)**3/6
+                        weights[thread, dim, 1] = (4 - 6*dist**2 + 3*dist**3)/6
+                        weights[thread, dim, 2] = (1 + 3*dist + 3*dist**2 - 3*dist**3)/6
+                        weights[thread, dim, 3] = dist**3/6
+                        index = index - 1
+                    indices[thread, dim] = index + 2
+                # Assign the weights to the grid points
+                for a in range(order):
+                    weight_x = amount*weights[thread, 0, a]
+                    for b in range(order):
+                        weight_xy = weight_x*weights[thread, 1, b]
+                        for c in range(order):
+                            domain_grid[
+                                indices[thread, 0] + a,
+                                indices[thread, 1] + b,
+                                indices[thread, 2] + c,
+                            ] += weight_xy*weights[thread, 2, c]
+
+# Function for interpolating values of a domain grid to particle
+# positions using the CIC, TSC or PCS scheme (order 2, 3 or 4),
+# with the work shared among the OpenMP threads. The interpolated
+# values multiplied by factor are added to the values array.
+# The passed domain_grid must include the ghost layers,
+# which must be populated.
+@cython.header(# Arguments
+               domain_grid='double[:, :, ::1]',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               values='double*',
+               N_local='Py_ssize_t',
+               factor='double',
+               order='int',
+               # Locals
+               a='int',
+               b='int',
+               c='int',
+               dim='int',
+               dist='double',
+               index='Py_ssize_t',
+               indices='Py_ssize_t[:, ::1]',
+               j='Py_ssize_t',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
+               shape_dim='Py_ssize_t',
+               shape_x='Py_ssize_t',
+               shape_y='Py_ssize_t',
+               shape_z='Py_ssize_t',
+               thread='int',
+               value='double',
+               weight_x='double',
+               weight_xy='double',
+               weights='double[:, :, ::1]',
+               x='double',
+               returns='void',
+               )
+def domain_grid2particles(domain_grid, posx, posy, posz, values, N_local, factor, order=2):
+    if order not in (2, 3, 4):
+        abort(f'domain_grid2particles called with order = {order} ∉ {{2, 3, 4}}')
+    shape_x = domain_grid.shape[0] - 5
+    shape_y = domain_grid.shape[1] - 5
+    shape_z = domain_grid.shape[2] - 5
+    scale_x = shape_x/domain_size_x
+    scale_y = shape_y/domain_size_y
+    scale_z = shape_z/domain_size_z
+    # Scratch space for the weights and lowest indices
+    # along each dimension, one set per thread.
+    weights = empty((num_threads, 3, 4), dtype=C2np['double'])
+    indices = empty((num_threads, 3), dtype=C2np['Py_ssize_t'])
+    # The particles are independent and so the loop is shared
+    # among the OpenMP threads.
+    for j in prange(N_local, nogil=True, num_threads=num_threads):
+        thread = threadid()
+        # Compute the weights and the lowest grid index
+        # (including the 2 lower ghost layers) along each dimension,
+        # exactly as in the particles2domain_grid function.
+        for dim in range(3):
+            if dim == 0:
+                x = (posx[j] - domain_start_x)*scale_x
+                shape_dim = shape_x
+            elif dim == 1:
+                x = (posy[j] - domain_start_y)*scale_y
+                shape_dim = shape_y
+            else:
+                x = (posz[j] - domain_start_z)*scale_z
+                shape_dim = shape_z
+            if x >= shape_dim:
+                x = shape_dim*(1 - machine_ϵ)
+            if order == 2:
+                index = int(x)
+                dist = x - index
+                weights[thread, dim, 0] = 1 - dist
+                weights[thread, dim, 1] = dist
+            elif order == 3:
+                index = int(x + 0.5)
+                dist = x - index
+                weights[thread, dim, 0] = 0.5*(0.5 - dist)**2
+                weights[thread, dim, 1] = 0.75 - dist**2
+                weights[thread, dim, 2] = 0.5*(0.5 + dist)**2
+                index = index - 1
+            else:
+                index = int(x)
+                dist = x - index
+                weights[thread, dim, 0] = (1 - dist)**3/6
+                weights[thread, dim, 1] = (4 - 6*dist**2 + 3*dist**3)/6
+                weights[thread, dim, 2] = (1 + 3*dist + 3*dist**2 - 3*dist**3)/6
+                weights[thread, dim, 3] = dist**3/6
+                index = index - 1
+            indices[thread, dim] = index + 2
+        # Sum up the weighted grid values
+        value = 0
+        for a in range(order):
+            weight_x = weights[thread, 0, a]
+            for b in range(order):
+                weight_xy = weight_x*weights[thread, 1, b]
+                for c in range(order):
+                    value = value + weight_xy*weights[thread, 2, c]*domain_grid[
+                        indices[thread, 0] + a,
+                        indices[thread, 1] + b,
+                        indices[thread, 2] + c,
+                    ]
+        values[j] = values[j] + factor*value
+
+# Function for applying the gradient of a domain grid to particles,
+# fusing the differentiation and the CIC interpolation into a single
+# pass over the particles. The gradient is computed at the 8 grid
+# points surrounding each particle using the same fourth-order
+# symmetric finite difference as diff_domain, and the CIC-interpolated
+# gradient multiplied by factor is added to the three momentum
+# arrays. The passed domain_grid must include the ghost layers,
+# which must be populated.
+@cython.header(# Arguments
+               domain_grid='double[:, :, ::1]',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               momx='double*',
+               momy='double*',
+               momz='double*',
+               N_local='Py_ssize_t',
+               factor='double',
+               # Locals
+               Wx='double',
+               Wxy='double',
+               Wxyz='double',
+               Wxl='double',
+               Wxu='double',
+               Wyl='double',
+               Wyu='double',
+               Wzl='double',
+               Wzu='double',
+               a='int',
+               b='int',
+               c='int',
+               fac_x1='double',
+               fac_x2='double',
+               fac_y1='double',
+               fac_y2='double',
+               fac_z1='double',
+               fac_z2='double',
+               gradx='double',
+               grady='double',
+               gradz='double',
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               k='Py_ssize_t',
+               n='Py_ssize_t',
+               scale_x='double',
+               scale_y='double',
+               scale_z='double',
+               shape_x='Py_ssize_t',
+               shape_y='Py_ssize_t',
+               shape_z='Py_ssize_t',
+               x='double',
+               x_lower='Py_ssize_t',
+               y='double',
+               y_lower='Py_ssize_t',
+               z='double',
+               z_lower='Py_ssize_t',
+               returns='void',
+               )
+def domain_grid2particles_gradient(domain_grid, posx, posy, posz, momx, momy, momz,
+                                   N_local, factor):
+    shape_x = domain_grid.shape[0] - 5
+    shape_y = domain_grid.shape[1] - 5
+    shape_z = domain_grid.shape[2] - 5
+    scale_x = shape_x/domain_size_x
+    scale_y = shape_y/domain_size_y
+    scale_z = shape_z/domain_size_z
+    # Coefficients of the finite difference
+    # f'(x) ≈ 2/(3h)*(f(x + h) - f(x - h)) - 1/(12h)*(f(x + 2h) - f(x - 2h)),
+    # with h the physical grid spacing along each dimension.
+    fac_x1 = 2*scale_x/3
+    fac_y1 = 2*scale_y/3
+    fac_z1 = 2*scale_z/3
+    fac_x2 = scale_x/12
+    fac_y2 = scale_y/12
+    fac_z2 = scale_z/12
+    # The particles are independent and so the loop is shared
+    # among the OpenMP threads.
+    for n in prange(N_local, nogil=True, num_threads=num_threads):
+        # The coordinates of the n'th particle, transformed so that
+        # 0 <= x, y, z < shape. Coordinates exactly at an upper domain
+        # boundary are corrected so that they lie just inside.
+        x = (posx[n] - domain_start_x)*scale_x
+        y = (posy[n] - domain_start_y)*scale_y
+        z = (posz[n] - domain_start_z)*scale_z
+        if x >= shape_x:
+            x = shape_x*(1 - machine_ϵ)
+        if y >= shape_y:
+            y = shape_y*(1 - machine_ϵ)
+        if z >= shape_z:
+            z = shape_z*(1 - machine_ϵ)
+        # Lower indices of the surrounding grid points
+        # (including the 2 lower ghost layers).
+        x_lower = int(x)
+        y_lower = int(y)
+        z_lower = int(z)
+        # The linear weights according to the
+        # CIC rule W = 1 - |dist| if |dist| < 1.
+        Wxu = x - x_lower
+        Wyu = y - y_lower
+        Wzu = z - z_lower
+        Wxl = 1 - Wxu
+        Wyl = 1 - Wyu
+        Wzl = 1 - Wzu
+        x_lower = x_lower + 2
+        y_lower = y_lower + 2
+        z_lower = z_lower + 2
+        # Sum up the weighted gradient at the 8 surrounding grid points
+        gradx = 0
+        grady = 0
+        gradz = 0
+        for a in range(2):
+            i = x_lower + a
+            Wx = Wxl
+            if a == 1:
+                Wx = Wxu
+            for b in range(2):
+                j = y_lower + b
+                Wxy = Wx*Wyl
+                if b == 1:
+                    Wxy = Wx*Wyu
+                for c in range(2):
+                    k = z_lower + c
+                    Wxyz = Wxy*Wzl
+                    if c == 1:
+                        Wxyz = Wxy*Wzu
+                    gradx = gradx + Wxyz*(
+                        + fac_x1*(domain_grid[i + 1, j, k] - domain_grid[i - 1, j, k])
+                        - fac_x2*(domain_grid[i + 2, j, k] - domain_grid[i - 2, j, k])
+                    )
+                    grady = grady + Wxyz*(
+                        + fac_y1*(domain_grid[i, j + 1, k] - domain_grid[i, j - 1, k])
+                        - fac_y2*(domain_grid[i, j + 2, k] - domain_grid[i, j - 2, k])
+                    )
+                    gradz = gradz + Wxyz*(
+                        + fac_z1*(domain_grid[i, j, k + 1] - domain_grid[i, j, k - 1])
+                        - fac_z2*(domain_grid[i, j, k + 2] - domain_grid[i, j, k - 2])
+                    )
+        momx[n] = momx[n] + factor*gradx
+        momy[n] = momy[n] + factor*grady
+        momz[n] = momz[n] + factor*gradz
+
 # Function for CIC-interpolating particles/fluid elements of
 # components to a domain grid.
 @cython.pheader(# Argument
@@ -499,6 +946,8 @@ def CIC_grid2grid(gridA, gridB, fac=1, fac_grid=None, fac2=1, fac_grid2=None):
                 quantities=list,
                 only_fluid_components='bint',
                 only_particle_components='bint',
+                order='int',
+                shift='double',
                 # Locals
                 Wxl='double',
                 Wyl='double',
@@ -534,7 +983,8 @@ def CIC_grid2grid(gridA, gridB, fac=1, fac_grid=None, fac2=1, fac_grid2=None):
                 z_upper='int',
                 )
 def CIC_components2domain_grid(component_or_components, domain_grid, quantities,
-                               only_fluid_components=False, only_particle_components=False):
+                               only_fluid_components=False, only_particle_components=False,
+                               order=2, shift=0):
     """This function CIC-interpolates particle/fluid elements
     to domain_grid storing scalar values. The physical extend of the
     passed domain_grid should match the domain exactly. The interpolated
@@ -562,10 +1012,16 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities,
     particle and fluid components are present.
     If only_fluid_components or only_particle_components is True,
     all components with the opposite representation will be skipped.
+    Particles are interpolated using the mass assignment scheme of the
+    given order (2 for CIC, 3 for TSC, 4 for PCS), with their
+    coordinates shifted by shift grid units along all dimensions.
+    Fluid elements are always CIC-interpolated, without any shift.
     """
     if only_particle_components and only_fluid_components:
         abort('Both of only_particle_components and only_fluid_components '
               'cannot be True in CIC_components2domain_grid')
+    if profiling:
+        profile_tic('CIC deposit')
     if isinstance(component_or_components, list):
         components = component_or_components
     else:
@@ -623,6 +1079,17 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities,
                 # (for quantity != 'particles', this will be overwritten
                 # in the loop below).
                 amount = factor
+                # When running with multiple OpenMP threads or when
+                # using anything but unshifted CIC, use the general
+                # (threaded) interpolation.
+                if num_threads > 1 or order != 2 or shift != 0:
+                    particles2domain_grid(
+                        posx, posy, posz,
+                        (posx if quantity == 'particles' else particle_quantity),
+                        (quantity != 'particles'),
+                        component.N_local, factor, domain_grid, order, shift,
+                    )
+                    continue
                 # Interpolate each particle
                 for j in range(component.N_local):
                     # Get the amount this particle contribute
@@ -714,6 +1181,8 @@ def CIC_components2domain_grid(component_or_components, domain_grid, quantities,
     # mesh points of the domain grid on other processes.
     # Do the needed communication.
     communicate_domain(domain_grid, mode='add contributions')
+    if profiling:
+        profile_toc()
     # Check that each quantity got interpolated
     if interpolations != len(quantities):
         quantities_implemented = (# Particle quantities
@@ -1018,7 +1487,8 @@ def CIC_components2φ(component_or_components, quantities):
     φ = get_buffer(φ_shape, 'φ', nullify=True)
     # Interpolate component coordinates
     # weighted by the given quantities to φ.
-    CIC_components2domain_grid(component_or_components, φ, quantities)
+    CIC_components2domain_grid(component_or_components, φ, quantities,
+                               order=φ_assignment_order)
     return φ
 # Generic function for CIC interpolating components to φ grids.
 # Particle and fluid components will be interpolated to separate grids.
@@ -1062,7 +1532,7 @@ def CIC_components2φ_general(component_or_components, quantities, add_particles
     if any_particles:
         φ_particles = get_buffer(φ_shape, 'φ_particles', nullify=True)
         CIC_components2domain_grid(components, φ_particles, quantities,
-                                   only_particle_components=True)
+                                   only_particle_components=True, order=φ_assignment_order)
         φ_dict['particles'] = φ_particles
     if any_fluid:
         φ_fluid = get_buffer(φ_shape, 'φ_fluid', nullify=True)
@@ -1083,27 +1553,216 @@ def CIC_components2φ_general(component_or_components, quantities, add_particles
             return φ_fluid
     else:
         return φ_dict
+# Function for interlacing the particle contributions to a Fourier
+# space slab, suppressing aliasing. The particles are interpolated
+# once more to a grid, now with their positions shifted by half a
+# grid cell along all dimensions. In Fourier space, this shifted grid
+# is then phase shifted back and averaged with the passed slab.
+@cython.header(# Arguments
+               component_or_components=object, # Component or list of Components
+               quantities=list,
+               slab='double[:, :, ::1]',
+               # Locals
+               gridsize='Py_ssize_t',
+               i='Py_ssize_t',
+               im='double',
+               j='Py_ssize_t',
+               j_global='Py_ssize_t',
+               k='Py_ssize_t',
+               ki='Py_ssize_t',
+               kj='Py_ssize_t',
+               kk='Py_ssize_t',
+               m='Py_ssize_t',
+               phase_cos='double[::1]',
+               phase_sin='double[::1]',
+               re='double',
+               slab_fourier='double[:, :, ::1]',
+               slab_shifted='double[:, :, ::1]',
+               slab_shifted_fourier='double[:, :, ::1]',
+               slab_start_j='Py_ssize_t',
+               slab_start_k='Py_ssize_t',
+               φ_shifted='double[:, :, ::1]',
+               returns='void',
+               )
+def interlace_particles(component_or_components, quantities, slab):
+    """The passed slab must already be Fourier transformed and contain
+    the contribution from exactly the particle components given,
+    interpolated using the same quantities. Fluid components are
+    ignored. The slab is modified in place.
+    """
+    # Interpolate the particles with shifted positions
+    # and Fourier transform the result.
+    φ_shifted = get_buffer(φ_shape, 'φ_particles_shifted', nullify=True)
+    CIC_components2domain_grid(component_or_components, φ_shifted, quantities,
+                               only_particle_components=True,
+                               order=φ_assignment_order, shift=0.5)
+    slab_shifted = slab_decompose(φ_shifted, φ_gridsize, 'φ_particles_shifted_slab', prepare_fft=True)
+    fft(slab_shifted, 'forward')
+    # Switch to the Fourier-space layouts
+    slab_fourier, slab_start_j, slab_start_k = fourier_view(slab)
+    slab_shifted_fourier = fourier_view(slab_shifted)[0]
+    gridsize = slab_fourier.shape[1]
+    # Shifting the particles by half a grid cell corresponds to a
+    # multiplication by exp(-iπ(ki + kj + kk)/gridsize) in Fourier
+    # space, with the wave vector in grid units. Tabulate the cosine
+    # and sine of the reverse phase for all possible values of
+    # ki + kj + kk, offset by gridsize so that all indices
+    # are non-negative.
+    phase_cos = empty(3*gridsize, dtype=C2np['double'])
+    phase_sin = empty(3*gridsize, dtype=C2np['double'])
+    for m in range(3*gridsize):
+        phase_cos[m] = cos((m - gridsize)*ℝ[π/gridsize])
+        phase_sin[m] = sin((m - gridsize)*ℝ[π/gridsize])
+    # Replace each element of the slab with the average of itself and
+    # the phase shifted element of the shifted slab. The elements are
+    # independent and so the loop is shared among the OpenMP threads.
+    for j in prange(slab_fourier.shape[0], nogil=True, num_threads=num_threads):
+        j_global = slab_start_j + j
+        if j_global > gridsize//2:
+            kj = j_global - gridsize
+        else:
+            kj = j_global
+        for i in range(gridsize):
+            if i > gridsize//2:
+                ki = i - gridsize
+            else:
+                ki = i
+            for k in range(0, slab_fourier.shape[2], 2):
+                kk = (slab_start_k + k)//2
+                m = ki + kj + kk + gridsize
+                re = slab_shifted_fourier[j, i, k    ]
+                im = slab_shifted_fourier[j, i, k + 1]
+                slab_fourier[j, i, k    ] = 0.5*(
+                    slab_fourier[j, i, k    ] + phase_cos[m]*re - phase_sin[m]*im
+                )
+                slab_fourier[j, i, k + 1] = 0.5*(
+                    slab_fourier[j, i, k + 1] + phase_sin[m]*re + phase_cos[m]*im
+                )
+
 # Check that φ_gridsize fulfills the requirements for FFT.
 # If not, the reason why will be stored in φ_illegal.
 cython.declare(φ_illegal=str)
 φ_illegal = ''
-if φ_gridsize%nprocs != 0:
-    φ_illegal = f'A φ_gridsize = {φ_gridsize} cannot be evenly divided by {nprocs} processes.'
-else:
-    if (   φ_gridsize%domain_subdivisions[0] != 0
-        or φ_gridsize%domain_subdivisions[1] != 0
-        or φ_gridsize%domain_subdivisions[2] != 0
-        ):
-        φ_illegal = (f'As φ_gridsize = {φ_gridsize}, the global φ grid have a shape of'
-                     f'({φ_gridsize}, {φ_gridsize}, {φ_gridsize}), which cannot be divided '
-                     f'according to the domain decomposition ({domain_subdivisions[0]}, '
-                     f'{domain_subdivisions[1]}, {domain_subdivisions[2]}).'
-                     )
+# Note that a φ_gridsize which cannot be evenly divided by the number
+# of processes is allowed, as a pencil decomposition is then used
+# in place of the slab decomposition. Likewise, a φ_gridsize which
+# cannot be divided according to the domain decomposition is allowed,
+# as the domains are then aligned with the φ grid (see the domain cuts
+# in the communication module), leaving the domain grids of unequal
+# size. Each domain must however contain at least one grid cell.
+if (   φ_gridsize < domain_subdivisions[0]
+    or φ_gridsize < domain_subdivisions[1]
+    or φ_gridsize < domain_subdivisions[2]
+    ):
+    φ_illegal = (f'As φ_gridsize = {φ_gridsize}, the global φ grid have a shape of '
+                 f'({φ_gridsize}, {φ_gridsize}, {φ_gridsize}), which is too small to be divided '
+                 f'according to the domain decomposition ({domain_subdivisions[0]}, '
+                 f'{domain_subdivisions[1]}, {domain_subdivisions[2]}).'
+                 )
 if φ_gridsize%2 != 0:
     masterwarn(f'As φ_gridsize = {φ_gridsize} is odd, some operations may not function correctly.')
+# Function returning the global index ranges
+# ((i_start, i_end), (j_start, j_end), (k_start, k_end))
+# of the domain grid (excluding ghost and pseudo points) of the process
+# with the given rank, for a global grid of the given size.
+@cython.header(# Arguments
+               other_rank='int',
+               gridsize='Py_ssize_t',
+               # Locals
+               bounds=tuple,
+               dim='int',
+               returns=tuple,
+               )
+def domain_grid_box(other_rank, gridsize):
+    bounds = domain_bounds(other_rank)
+    return tuple([
+        (int(round(bounds[dim][0]*ℝ[1/boxsize]*gridsize)),
+         int(round(bounds[dim][1]*ℝ[1/boxsize]*gridsize)))
+        for dim in range(3)
+    ])
+
+# Function returning the shape of the local domain grid, including
+# pseudo and ghost points, for a global grid of the given size.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               # Locals
+               box=tuple,
+               dim='int',
+               returns=tuple,
+               )
+def domain_grid_shape(gridsize):
+    box = domain_grid_box(rank, gridsize)
+    return tuple([box[dim][1] - box[dim][0] + 1 + 2*2 for dim in range(3)])
+
 # The shape of the domain φ grid, including pseudo and ghost points
-cython.declare(φ_shape=tuple, dim='int')
-φ_shape = tuple([φ_gridsize//domain_subdivisions[dim] + 1 + 2*2 for dim in range(3)])
+cython.declare(φ_shape=tuple)
+φ_shape = domain_grid_shape(φ_gridsize)
+
+# Function which updates the cached information about the domain
+# grids and their decompositions, after the domains have been changed
+# by communication.rebalance_domains.
+@cython.pheader(# Locals
+                gridsize='Py_ssize_t',
+                layout=dict,
+                )
+def update_domain_decomposition():
+    global φ_shape
+    φ_shape = domain_grid_shape(φ_gridsize)
+    decomposition_info.clear()
+    slab_redistributions.clear()
+    for gridsize, layout in pencil_layouts.items():
+        layout['domain2real'] = prepare_redistribution(
+            get_domain_boxes(gridsize), layout['boxes_real'], comm)
+        layout['real2domain'] = prepare_redistribution(
+            layout['boxes_real'], get_domain_boxes(gridsize), comm)
+
+# Function returning the redistributions between the slabs and the
+# (balanced) domains, for a global grid of the given size. As the
+# balanced domains are not of equal size, the regular communication
+# pattern of prepare_decomposition cannot be used.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               # Locals
+               boxes_domain=list,
+               boxes_slab=list,
+               other_rank='int',
+               redistributions=dict,
+               returns=dict,
+               )
+def get_slab_redistributions(gridsize):
+    redistributions = slab_redistributions.get(gridsize)
+    if redistributions:
+        return redistributions
+    # The padding of the slabs along the k-dimension is left out
+    boxes_slab = [
+        ((other_rank*ℤ[gridsize//nprocs], (other_rank + 1)*ℤ[gridsize//nprocs]),
+         (0, gridsize),
+         (0, gridsize),
+         )
+        for other_rank in range(nprocs)
+    ]
+    boxes_domain = get_domain_boxes(gridsize)
+    redistributions = {
+        'slab2domain': prepare_redistribution(boxes_slab, boxes_domain, comm),
+        'domain2slab': prepare_redistribution(boxes_domain, boxes_slab, comm),
+    }
+    slab_redistributions[gridsize] = redistributions
+    return redistributions
+# Cache storing results of the get_slab_redistributions function.
+# The keys are gridsizes.
+cython.declare(slab_redistributions=dict)
+slab_redistributions = {}
+
+# Function returning the global index ranges of the domain grids
+# (excluding ghost and pseudo points) of all processes.
+@cython.header(# Arguments
+               gridsize='Py_ssize_t',
+               # Locals
+               other_rank='int',
+               returns=list,
+               )
+def get_domain_boxes(gridsize):
+    return [domain_grid_box(other_rank, gridsize) for other_rank in range(nprocs)]
 
 # Function that compute a lot of information needed by the
 # slab_decompose and domain_decompose functions.
@@ -1271,13 +1930,18 @@ decomposition_info = {}
                 returns='double[:, :, ::1]',
                 )
 def domain_decompose(slab, domain_grid_or_buffer_name=0):
+    # Pencil decomposed grids are handled separately
+    if get_grid_address(slab) in pencils_mapping:
+        return domain_decompose_pencil(slab, domain_grid_or_buffer_name)
+    if mpi_instrumentation:
+        mpi_tic()
     if slab.shape[0] > slab.shape[1]:
         masterwarn('domain_decompose was called with a slab that appears to be transposed, '
                    'i.e. in Fourier space.')
     # Determine the correct shape of the domain grid corresponding to
     # the passed slab.
     gridsize = slab.shape[1]
-    shape = tuple([gridsize//domain_subdivisions[dim] + 1 + 2*2 for dim in range(3)])
+    shape = domain_grid_shape(gridsize)
     # If no domain grid is passed, fetch a buffer of the right shape
     if isinstance(domain_grid_or_buffer_name, (int, str)):
         buffer_name = domain_grid_or_buffer_name
@@ -1292,6 +1956,20 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
     domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
                                        2:(domain_grid.shape[1] - 2),
                                        2:(domain_grid.shape[2] - 2)]
+    # Balanced domains are communicated in one go
+    if domain_balanced:
+        redistribute_grid(
+            asarray(slab)[:, :, :gridsize],
+            asarray(domain_grid_noghosts)[:ℤ[domain_grid_noghosts.shape[0] - 1],
+                                          :ℤ[domain_grid_noghosts.shape[1] - 1],
+                                          :ℤ[domain_grid_noghosts.shape[2] - 1]],
+            get_slab_redistributions(gridsize)['slab2domain'],
+            comm,
+        )
+        communicate_domain(domain_grid, mode='populate')
+        if mpi_instrumentation:
+            mpi_toc('domain_decompose')
+        return domain_grid
     # Compute needed communication variables
     (N_domain2slabs_communications,
      domain2slabs_recvsend_ranks,
@@ -1339,11 +2017,14 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
     # right/forward/upper domain. Do the needed communication.
     # Also populate the ghost layers of the domain grid.
     communicate_domain(domain_grid, mode='populate')
+    if mpi_instrumentation:
+        mpi_toc('domain_decompose')
     return domain_grid
 
 # Function for transfering data from domain grids to slabs
 @cython.pheader(# Arguments
                 domain_grid='double[:, :, ::1]',
+                gridsize='Py_ssize_t',
                 slab_or_buffer_name=object,  # double[:, :, ::1], int or str
                 prepare_fft='bint',
                 # Locals
@@ -1353,7 +2034,6 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
                 domain_sendrecv_i_end='int[::1]',
                 domain_sendrecv_i_start='int[::1]',
                 domain2slabs_recvsend_ranks='int[::1]',
-                gridsize='Py_ssize_t',
                 request=object,  # mpi4py.MPI.Request object
                 shape=tuple,
                 slab='double[:, :, ::1]',
@@ -1365,26 +2045,38 @@ def domain_decompose(slab, domain_grid_or_buffer_name=0):
                 ℓ='Py_ssize_t',
                 returns='double[:, :, ::1]',
                 )
-def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
+def slab_decompose(domain_grid, gridsize, slab_or_buffer_name=0, prepare_fft=False):
     """This function communicates a global domain decomposed grid into
-    a global slab decomposed grid. If an existing slab grid should be
-    used it can be passed as the second argument.
+    a global slab decomposed grid. The linear size of the global grid
+    must be passed as the second argument, as it cannot generally be
+    inferred from the shape of the local domain grid when the domains
+    are not of equal size. If an existing slab grid should be
+    used it can be passed as the third argument.
     Alternatively, if a slab grid should be fetched from elsewhere,
-    its name should be specified as the second argument.
+    its name should be specified as the third argument.
     If FFT's are to be carried out on a slab fetched by name,
     you must specify prepare_fft=True, in which case the slab will be
     created via FFTW.
+    If the gridsize is not evenly divisible by the number of processes,
+    a (FFTW prepared) pencil decomposed grid is returned in place of
+    the slab. Such grids are handled transparently by fft and
+    domain_decompose, while their Fourier-space layout is available
+    through fourier_view.
     """
     # Determine the correct shape of the slab grid corresponding to
     # the passed domain grid.
     domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
                                        2:(domain_grid.shape[1] - 2),
                                        2:(domain_grid.shape[2] - 2)]
-    gridsize = (domain_grid_noghosts.shape[0] - 1)*domain_subdivisions[0]
     if gridsize%nprocs != 0:
-        abort('A domain decomposed grid of gridsize {} was passed to the slab_decompose function. '
-              'This gridsize is not evenly divisible by {} processes.'
-              .format(gridsize, nprocs))
+        if not isinstance(slab_or_buffer_name, (int, str)):
+            abort('A domain decomposed grid of gridsize {} was passed to the slab_decompose '
+                  'function together with an existing slab. This gridsize is not evenly '
+                  'divisible by {} processes, and so a pencil decomposition is needed.'
+                  .format(gridsize, nprocs))
+        return pencil_decompose(domain_grid, gridsize, slab_or_buffer_name)
+    if mpi_instrumentation:
+        mpi_tic()
     shape = (gridsize//nprocs,  # Distributed dimension
              gridsize,
              2*(gridsize//2 + 1), # Padded dimension
@@ -1403,6 +2095,19 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
                   'have incompatible shapes: {}, {}.'
                   .format(asarray(slab).shape, asarray(domain_grid).shape)
                   )
+    # Balanced domains are communicated in one go
+    if domain_balanced:
+        redistribute_grid(
+            asarray(domain_grid_noghosts)[:ℤ[domain_grid_noghosts.shape[0] - 1],
+                                          :ℤ[domain_grid_noghosts.shape[1] - 1],
+                                          :ℤ[domain_grid_noghosts.shape[2] - 1]],
+            asarray(slab)[:, :, :gridsize],
+            get_slab_redistributions(gridsize)['domain2slab'],
+            comm,
+        )
+        if mpi_instrumentation:
+            mpi_toc('slab_decompose')
+        return slab
     # Compute needed communication variables
     (N_domain2slabs_communications,
      domain2slabs_recvsend_ranks,
@@ -1445,6 +2150,8 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
         # still in use by the non-blocking send - might get overwritten
         # by the next (non-blocking) send.
         request.wait()
+    if mpi_instrumentation:
+        mpi_toc('slab_decompose')
     return slab
 
 # Function that returns a slab decomposed grid,
@@ -1454,21 +2161,18 @@ def slab_decompose(domain_grid, slab_or_buffer_name=0, prepare_fft=False):
                 buffer_name=object,  # int or str
                 nullify='bint',
                 # Locals
-                as_expected='bint',
                 fftw_plans_index='Py_ssize_t',
                 fftw_struct=fftw_return_struct,
-                plan_backward=fftw_plan,
-                plan_forward=fftw_plan,
-                rigor=str,
+                gridsize_local_i='Py_ssize_t',
+                gridsize_local_j='Py_ssize_t',
+                gridstart_local_i='Py_ssize_t',
+                gridstart_local_j='Py_ssize_t',
+                reuse='bint',
                 rigor_final=str,
                 shape=tuple,
                 slab='double[:, :, ::1]',
                 slab_address='Py_ssize_t',
                 slab_ptr='double*',
-                slab_size_i='Py_ssize_t',
-                slab_size_j='Py_ssize_t',
-                slab_start_i='Py_ssize_t',
-                slab_start_j='Py_ssize_t',
                 wisdom_filename=str,
                 returns='double[:, :, ::1]',
                 )
@@ -1480,47 +2184,15 @@ def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
         if nullify:
             slab[...] = 0
         return slab
-    # Checks on the passed gridsize
-    if gridsize%nprocs != 0:
-        abort('A gridsize of {} was passed to the get_fftw_slab function. '
-              'This gridsize is not evenly divisible by {} processes.'
-              .format(gridsize, nprocs))
-    shape = (int(gridsize//nprocs),    # Distributed dimension
-             int(gridsize),
-             int(2*(gridsize//2 + 1)), # Padded dimension
-             )
+    shape = get_slab_shape(gridsize)
     # In pure Python mode we use NumPy, which really means that there
     # is no needed preparations. In compiled mode we use FFTW,
     # which means that the grid and its plans must be prepared.
     if not cython.compiled:
         slab = empty(shape, dtype=C2np['double'])
     else:
-        # Determine what FFTW rigor to use.
-        # The rigor to use will be stored as rigor_final.
-        if master:
-            if fftw_wisdom_reuse:
-                for rigor in fftw_wisdom_rigors:
-                    wisdom_filename = get_wisdom_filename(gridsize, rigor)
-                    # At least be as rigorous as defined by
-                    # the fftw_wisdom_rigor user parameter.
-                    if rigor == fftw_wisdom_rigor:
-                        break
-                    # Use a better rigor if wisdom already exist
-                    if os.path.isfile(wisdom_filename):
-                        break
-                rigor_final = rigor
-            else:
-                rigor_final = fftw_wisdom_rigor
-            # If less rigorous wisdom exists for the same problem,
-            # delete it.
-            for rigor in reversed(fftw_wisdom_rigors):
-                if rigor == rigor_final:
-                    break
-                wisdom_filename = get_wisdom_filename(gridsize, rigor)
-                if os.path.isfile(wisdom_filename):
-                    os.remove(wisdom_filename)
-        rigor_final = bcast(rigor_final if master else None)
-        wisdom_filename = bcast(get_wisdom_filename(gridsize, rigor_final) if master else None)
+        # Determine what FFTW rigor and wisdom file to use
+        rigor_final, wisdom_filename, reuse = prepare_fftw_wisdom(gridsize)
         # Initialize fftw_mpi, allocate the grid, initialize the
         # local grid sizes and start indices and do FFTW planning.
         # All this is handled by fftw_setup from fft.c.
@@ -1528,10 +2200,6 @@ def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
         # MPI session. The global wisdom_acquired dict keeps track of
         # what wisdom FFTW have already acquired, ensuring correct
         # progress messages.
-        if master:
-            os.makedirs(os.path.dirname(wisdom_filename), exist_ok=True)
-            reuse = (fftw_wisdom_reuse and os.path.isfile(wisdom_filename))
-        reuse = bcast(reuse if master else None)
         if not reuse and not wisdom_acquired.get((gridsize, nprocs, rigor_final)):
             masterprint('Acquiring FFTW wisdom ({}) for grid of linear size {} on {} {} ...'
                         .format(rigor_final, gridsize, nprocs,
@@ -1541,56 +2209,45 @@ def get_fftw_slab(gridsize, buffer_name=0, nullify=False):
                                  bytes(rigor_final, encoding='ascii'),
                                  reuse,
                                  bytes(wisdom_filename, encoding='ascii'),
+                                 num_threads,
                                  )
+        gridsize_local_i  = fftw_struct.gridsize_local_i
+        gridsize_local_j  = fftw_struct.gridsize_local_j
+        gridstart_local_i = fftw_struct.gridstart_local_i
+        gridstart_local_j = fftw_struct.gridstart_local_j
+        slab_ptr          = fftw_struct.grid
         if not reuse and not wisdom_acquired.get((gridsize, nprocs, rigor_final)):
             masterprint('done')
         wisdom_acquired[gridsize, nprocs, rigor_final] = True
-        # Unpack every variable from fftw_struct
-        # and compare to expected values.
-        slab_size_i   = int(fftw_struct.gridsize_local_i)
-        slab_size_j   = int(fftw_struct.gridsize_local_j)
-        slab_start_i  = int(fftw_struct.gridstart_local_i)
-        slab_start_j  = int(fftw_struct.gridstart_local_j)
-        plan_forward  = fftw_struct.plan_forward
-        plan_backward = fftw_struct.plan_backward
-        slab_ptr      = fftw_struct.grid
-        as_expected = True
-        if (   slab_size_i  != ℤ[shape[0]]
-            or slab_size_j  != ℤ[shape[0]]
-            or slab_start_i != ℤ[shape[0]*rank]
-            or slab_start_j != ℤ[shape[0]*rank]
-            ):
-            as_expected = False
-            warn(f'FFTW has distributed a slab of gridsize {gridsize} differently '
-                 f'from what was expected on rank {rank}:\n'
-                 f'    slab_size_i  = {slab_size_i}, expected {shape[0]},\n'
-                 f'    slab_size_j  = {slab_size_j}, expected {shape[0]},\n'
-                 f'    slab_start_i = {slab_start_i}, expected {shape[0]*rank},\n'
-                 f'    slab_start_j = {slab_start_j}, expected {shape[0]*rank},\n'
-                 )
-        as_expected = allreduce(as_expected, op=MPI.LOR)
-        if not as_expected:
-            abort('Refusing to carry on with this non-expected decomposition.')
+        # Compare the local decomposition to expected values
+        check_fftw_decomposition(gridsize, shape,
+                                 gridsize_local_i,
+                                 gridsize_local_j,
+                                 gridstart_local_i,
+                                 gridstart_local_j,
+                                 )
         # Wrap the slab pointer in a memory view. Looping over this
         # memory view should be done as noted in fft.c, but use
         # slab[i, j, k] when in real space and slab[j, i, k]
         # when in Fourier space.
         slab = cast(slab_ptr, 'double[:shape[0], :shape[1], :shape[2]]')
-        # Store the plans for this slab in the global
-        # fftw_plans_forward and fftw_plans_backward arrays.
+        slab_address = cast(cython.address(slab[0, 0, 0]), 'Py_ssize_t')
+        # Store the plans for this slab in the global plan arrays, and
+        # insert mapping from the slab to the index of its plans in
+        # these arrays into the global fftw_plans_mapping dict.
         fftw_plans_index = fftw_plans_size
         fftw_plans_size += 1
         fftw_plans_forward  = realloc(fftw_plans_forward , fftw_plans_size*sizeof('fftw_plan'))
         fftw_plans_backward = realloc(fftw_plans_backward, fftw_plans_size*sizeof('fftw_plan'))
-        fftw_plans_forward [fftw_plans_index] = plan_forward
-        fftw_plans_backward[fftw_plans_index] = plan_backward
-        # Insert mapping from the slab to the index of its plans
-        # in the global fftw_plans_forward and fftw_plans_backward
-        # arrays, into the global fftw_plans_mapping dict.
-        slab_address = cast(cython.address(slab[0, 0, 0]), 'Py_ssize_t')
+        fftw_plans_forward [fftw_plans_index] = fftw_struct.plan_forward
+        fftw_plans_backward[fftw_plans_index] = fftw_struct.plan_backward
         fftw_plans_mapping[slab_address] = fftw_plans_index
     # Store and return this slab
     slabs[gridsize, buffer_name] = slab
+    memory_register(
+        'slab', f'{buffer_name} (gridsize {gridsize})',
+        np.prod(shape)*np.dtype(C2np['double']).itemsize,
+    )
     if nullify:
         slab[...] = 0
     return slab
@@ -1616,7 +2273,105 @@ fftw_plans_mapping = {}
 cython.declare(wisdom_acquired=dict)
 wisdom_acquired = {}
 
-# Helper function for the get_fftw_slab function,
+# Helper function for the get_fftw_slab* functions,
+# returning the shape of the local slab.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    # Locals
+    shape=tuple,
+    returns=tuple,
+)
+def get_slab_shape(gridsize):
+    # Checks on the passed gridsize
+    if gridsize%nprocs != 0:
+        abort('A gridsize of {} was passed to the get_fftw_slab function. '
+              'This gridsize is not evenly divisible by {} processes.'
+              .format(gridsize, nprocs))
+    shape = (int(gridsize//nprocs),    # Distributed dimension
+             int(gridsize),
+             int(2*(gridsize//2 + 1)), # Padded dimension
+             )
+    return shape
+
+# Helper function for the get_fftw_slab* functions,
+# determining what FFTW rigor and wisdom file to use,
+# as well as whether existing wisdom should be reused.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    # Locals
+    reuse='bint',
+    rigor=str,
+    rigor_final=str,
+    wisdom_filename=str,
+    returns=tuple,
+)
+def prepare_fftw_wisdom(gridsize):
+    # The rigor to use will be stored as rigor_final
+    if master:
+        if fftw_wisdom_reuse:
+            for rigor in fftw_wisdom_rigors:
+                wisdom_filename = get_wisdom_filename(gridsize, rigor)
+                # At least be as rigorous as defined by
+                # the fftw_wisdom_rigor user parameter.
+                if rigor == fftw_wisdom_rigor:
+                    break
+                # Use a better rigor if wisdom already exist
+                if os.path.isfile(wisdom_filename):
+                    break
+            rigor_final = rigor
+        else:
+            rigor_final = fftw_wisdom_rigor
+        # If less rigorous wisdom exists for the same problem,
+        # delete it.
+        for rigor in reversed(fftw_wisdom_rigors):
+            if rigor == rigor_final:
+                break
+            wisdom_filename = get_wisdom_filename(gridsize, rigor)
+            if os.path.isfile(wisdom_filename):
+                os.remove(wisdom_filename)
+        wisdom_filename = get_wisdom_filename(gridsize, rigor_final)
+        os.makedirs(os.path.dirname(wisdom_filename), exist_ok=True)
+        reuse = (fftw_wisdom_reuse and os.path.isfile(wisdom_filename))
+    rigor_final = bcast(rigor_final if master else None)
+    wisdom_filename = bcast(wisdom_filename if master else None)
+    reuse = bcast(reuse if master else None)
+    return rigor_final, wisdom_filename, reuse
+
+# Helper function for the get_fftw_slab* functions,
+# checking that FFTW has distributed the slabs as expected.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    shape=tuple,
+    slab_size_i='Py_ssize_t',
+    slab_size_j='Py_ssize_t',
+    slab_start_i='Py_ssize_t',
+    slab_start_j='Py_ssize_t',
+    # Locals
+    as_expected='bint',
+)
+def check_fftw_decomposition(gridsize, shape, slab_size_i, slab_size_j, slab_start_i, slab_start_j):
+    as_expected = True
+    if (   slab_size_i  != ℤ[shape[0]]
+        or slab_size_j  != ℤ[shape[0]]
+        or slab_start_i != ℤ[shape[0]*rank]
+        or slab_start_j != ℤ[shape[0]*rank]
+        ):
+        as_expected = False
+        warn(f'FFTW has distributed a slab of gridsize {gridsize} differently '
+             f'from what was expected on rank {rank}:\n'
+             f'    slab_size_i  = {slab_size_i}, expected {shape[0]},\n'
+             f'    slab_size_j  = {slab_size_j}, expected {shape[0]},\n'
+             f'    slab_start_i = {slab_start_i}, expected {shape[0]*rank},\n'
+             f'    slab_start_j = {slab_start_j}, expected {shape[0]*rank},\n'
+             )
+    as_expected = allreduce(as_expected, op=MPI.LOR)
+    if not as_expected:
+        abort('Refusing to carry on with this non-expected decomposition.')
+
+# Helper function for the get_fftw_slab* functions,
 # which construct the absolute path to the wisdome file to use.
 @cython.header(
     # Arguments
@@ -1650,12 +2405,12 @@ def get_wisdom_filename(gridsize, rigor):
         except:
             masterwarn(f'Failed to determine FFTW version')
             fftw_version = '?'
-    # Construct a hash based on the FFTW problem (gridsize and rigor),
-    # as well as the FFTW version and the MPI layout (the nodes and CPUs
-    # in use for the current job). It is important to include the
-    # MPI layout, as reusing FFTW wisdom across different nodes or even
-    # CPUs within the same node may not be optimal due to e.g.
-    # ethernet connection.
+    # Construct a hash based on the FFTW problem (gridsize, rigor
+    # and number of threads), as well as the FFTW version and
+    # the MPI layout (the nodes and CPUs in use for the current job).
+    # It is important to include the MPI layout, as reusing FFTW wisdom
+    # across different nodes or even CPUs within the same node may not
+    # be optimal due to e.g. ethernet connection.
     mpi_layout = []
     for other_node in range(nnodes):
         other_node_name = node_numbers2names[other_node]
@@ -1664,6 +2419,7 @@ def get_wisdom_filename(gridsize, rigor):
     wisdom_hash = hashlib.sha1(str((
         gridsize,
         rigor,
+        num_threads,
         fftw_version,
         mpi_layout,
     )).encode()).hexdigest()
@@ -1704,61 +2460,13 @@ def fft(slab, direction):
     if not direction in ('forward', 'backward'):
         abort('fft was called with the direction "{}", which is neither "forward" nor "backward".'
               .format(direction))
-    if not cython.compiled:
-        # The pure Python FFT implementation is serial.
-        # Every process computes the entire FFT of the temporary
-        # varaible grid_global_pure_python.
-        slab_size_i = slab_size_j = slab.shape[0]
-        slab_start_i = slab_size_i*rank
-        slab_start_j = slab_size_j*rank
-        gridsize = slab.shape[1]
-        gridsize_padding = slab.shape[2]
-        grid_global_pure_python = empty((gridsize, gridsize, gridsize_padding))
-        Allgatherv(slab, grid_global_pure_python)
-        if direction == 'forward':
-            # Delete the padding on last dimension
-            for i in range(gridsize_padding - gridsize):
-                grid_global_pure_python = np.delete(grid_global_pure_python, -1, axis=2)
-            # Do real transform via NumPy
-            grid_global_pure_python = np.fft.rfftn(grid_global_pure_python)
-            # FFTW transposes the first two dimensions
-            grid_global_pure_python = grid_global_pure_python.transpose([1, 0, 2])
-            # FFTW represents the complex array by doubles only
-            tmp = empty((gridsize, gridsize, gridsize_padding))
-            for i in range(gridsize_padding):
-                if i % 2:
-                    tmp[:, :, i] = grid_global_pure_python.imag[:, :, i//2]
-                else:
-                    tmp[:, :, i] = grid_global_pure_python.real[:, :, i//2]
-            grid_global_pure_python = tmp
-            # As in FFTW, distribute the slabs along the y-dimension
-            # (which is the first dimension now, due to transposing).
-            slab[...] = grid_global_pure_python[slab_start_j:(slab_start_j + slab_size_j), :, :]
-        elif direction == 'backward':
-            # FFTW represents the complex array by doubles only.
-            # Go back to using complex entries.
-            tmp = zeros((gridsize, gridsize, gridsize_padding//2), dtype='complex128')
-            for i in range(gridsize_padding):
-                if i % 2:
-                    tmp[:, :, i//2] += 1j*grid_global_pure_python[:, :, i]
-                else:
-                    tmp[:, :, i//2] += grid_global_pure_python[:, :, i]
-            grid_global_pure_python = tmp
-            # FFTW transposes the first
-            # two dimensions back to normal.
-            grid_global_pure_python = grid_global_pure_python.transpose([1, 0, 2])
-            # Do real inverse transform via NumPy
-            grid_global_pure_python = np.fft.irfftn(grid_global_pure_python, s=[gridsize]*3)
-            # Remove the autoscaling provided by NumPy
-            grid_global_pure_python *= gridsize**3
-            # Add padding on last dimension, as in FFTW
-            padding = empty((gridsize,
-                             gridsize,
-                             gridsize_padding - gridsize,
-                             ))
-            grid_global_pure_python = np.concatenate((grid_global_pure_python, padding), axis=2)
-            # As in FFTW, distribute the slabs along the x-dimension
-            slab[...] = grid_global_pure_python[slab_start_i:(slab_start_i + slab_size_i), :, :]
+    if profiling:
+        profile_tic(f'fft ({direction})')
+    # Pencil decomposed grids are handled separately
+    if get_grid_address(slab) in pencils_mapping:
+        fft_pencil(slab, direction)
+    elif not cython.compiled:
+        fft_pure_python(slab, direction)
     else:  # Compiled mode
         # Look up the index of the FFTW plans for the passed slab.
         slab_address = cast(cython.address(slab[0, 0, 0]), 'Py_ssize_t')
@@ -1768,6 +2476,70 @@ def fft(slab, direction):
             fftw_execute(fftw_plans_forward[fftw_plans_index])
         elif direction == 'backward':
             fftw_execute(fftw_plans_backward[fftw_plans_index])
+    if profiling:
+        profile_toc()
+
+# Function emulating FFTW Fourier transformations in pure Python,
+# used by the fft function.
+@cython.header(# Arguments
+               slab=object,  # np.ndarray
+               direction=str,
+               )
+def fft_pure_python(slab, direction):
+    # The pure Python FFT implementation is serial.
+    # Every process computes the entire FFT of the temporary
+    # varaible grid_global_pure_python.
+    slab_size_i = slab_size_j = slab.shape[0]
+    slab_start_i = slab_size_i*rank
+    slab_start_j = slab_size_j*rank
+    gridsize = slab.shape[1]
+    gridsize_padding = slab.shape[2]
+    grid_global_pure_python = empty((gridsize, gridsize, gridsize_padding))
+    Allgatherv(slab, grid_global_pure_python)
+    if direction == 'forward':
+        # Delete the padding on last dimension
+        for i in range(gridsize_padding - gridsize):
+            grid_global_pure_python = np.delete(grid_global_pure_python, -1, axis=2)
+        # Do real transform via NumPy
+        grid_global_pure_python = np.fft.rfftn(grid_global_pure_python)
+        # FFTW transposes the first two dimensions
+        grid_global_pure_python = grid_global_pure_python.transpose([1, 0, 2])
+        # FFTW represents the complex array by doubles only
+        tmp = empty((gridsize, gridsize, gridsize_padding))
+        for i in range(gridsize_padding):
+            if i % 2:
+                tmp[:, :, i] = grid_global_pure_python.imag[:, :, i//2]
+            else:
+                tmp[:, :, i] = grid_global_pure_python.real[:, :, i//2]
+        grid_global_pure_python = tmp
+        # As in FFTW, distribute the slabs along the y-dimension
+        # (which is the first dimension now, due to transposing).
+        slab[...] = grid_global_pure_python[slab_start_j:(slab_start_j + slab_size_j), :, :]
+    elif direction == 'backward':
+        # FFTW represents the complex array by doubles only.
+        # Go back to using complex entries.
+        tmp = zeros((gridsize, gridsize, gridsize_padding//2), dtype='complex128')
+        for i in range(gridsize_padding):
+            if i % 2:
+                tmp[:, :, i//2] += 1j*grid_global_pure_python[:, :, i]
+            else:
+                tmp[:, :, i//2] += grid_global_pure_python[:, :, i]
+        grid_global_pure_python = tmp
+        # FFTW transposes the first
+        # two dimensions back to normal.
+        grid_global_pure_python = grid_global_pure_python.transpose([1, 0, 2])
+        # Do real inverse transform via NumPy
+        grid_global_pure_python = np.fft.irfftn(grid_global_pure_python, s=[gridsize]*3)
+        # Remove the autoscaling provided by NumPy
+        grid_global_pure_python *= gridsize**3
+        # Add padding on last dimension, as in FFTW
+        padding = empty((gridsize,
+                         gridsize,
+                         gridsize_padding - gridsize,
+                         ))
+        grid_global_pure_python = np.concatenate((grid_global_pure_python, padding), axis=2)
+        # As in FFTW, distribute the slabs along the x-dimension
+        slab[...] = grid_global_pure_python[slab_start_i:(slab_start_i + slab_size_i), :, :]
 
 # Function for deallocating a slab and its plans, allocated by FFTW
 @cython.header(# Arguments
@@ -1778,16 +2550,22 @@ def fft(slab, direction):
                plan_forward=fftw_plan,
                plan_backward=fftw_plan,
                slab='double[:, :, ::1]',
+               slab_address='Py_ssize_t',
                slab_ptr='double*',
                )
 def free_fftw_slab(gridsize, buffer_name):
     # Fetch the slab from the slab cache and remove it
     slab = slabs.pop((gridsize, buffer_name))
+    memory_register('slab', f'{buffer_name} (gridsize {gridsize})', 0)
+    # In pure Python mode the slab is a NumPy array,
+    # which is freed once no longer referenced.
+    if not cython.compiled:
+        return
     # Grab pointer to the slab
     slab_ptr = cython.address(slab[0, 0, 0])
+    slab_address = cast(slab_ptr, 'Py_ssize_t')
     # Look up the index of the FFTW plans for the passed slab
     # and use this to look up the plans.
-    slab_address = cast(slab_ptr, 'Py_ssize_t')
     fftw_plans_index = fftw_plans_mapping[slab_address]
     plan_forward  = fftw_plans_forward[fftw_plans_index]
     plan_backward = fftw_plans_backward[fftw_plans_index]
@@ -1800,6 +2578,598 @@ def free_fftw_slab(gridsize, buffer_name):
     # segmentation fault. As this should not ever happen, we leave
     # these as is.
 
+# Function that returns a pencil decomposed grid, allocated by FFTW.
+# Pencils are used in place of slabs whenever the gridsize cannot be
+# evenly divided between the processes, including when there are more
+# processes than grid points along a dimension. The returned grid is
+# the real-space pencil, distributed over both the i- and the
+# j-dimension. See the notes on pencil decompositions in fft.c.
+@cython.pheader(# Arguments
+                gridsize='Py_ssize_t',
+                buffer_name=object,  # int or str
+                nullify='bint',
+                # Locals
+                fftw_pencil_struct=fftw_pencil_return_struct,
+                fftw_pencil_plans_index='Py_ssize_t',
+                layout=dict,
+                memory='double[::1]',
+                memory_ptr='double*',
+                pencil='double[:, :, ::1]',
+                shape=tuple,
+                size_alloc='Py_ssize_t',
+                returns='double[:, :, ::1]',
+                )
+def get_fftw_pencil(gridsize, buffer_name=0, nullify=False):
+    global fftw_pencil_plans_size, fftw_pencil_plans
+    # If this pencil has already been constructed, fetch it
+    pencil = pencils.get((gridsize, buffer_name))
+    if pencil is not None:
+        if nullify:
+            pencil[...] = 0
+        return pencil
+    layout = get_pencil_layout(gridsize)
+    size_alloc = layout['size_alloc']
+    # In pure Python mode the transformations are carried out by NumPy
+    # and so no preparations are needed. In compiled mode the memory
+    # and the FFTW plans for all stages of the transformations are
+    # prepared by fftw_pencil_setup from fft.c.
+    if not cython.compiled:
+        memory = empty(size_alloc, dtype=C2np['double'])
+    else:
+        masterprint(
+            f'Planning FFTW pencil transformations ({fftw_wisdom_rigor}) for grid of '
+            f'linear size {gridsize} on a {layout["process_grid"][0]}×{layout["process_grid"][1]} '
+            f'process grid ...'
+        )
+        fftw_pencil_struct = fftw_pencil_setup(gridsize,
+                                               layout['shape_real'][0],
+                                               layout['shape_real'][1],
+                                               layout['shape_fourier'][0],
+                                               layout['shape_fourier'][2]//2,
+                                               size_alloc,
+                                               bytes(fftw_wisdom_rigor, encoding='ascii'),
+                                               num_threads,
+                                               )
+        masterprint('done')
+        memory_ptr = fftw_pencil_struct.grid
+        memory = cast(memory_ptr, 'double[:size_alloc]')
+        # Store the plans for this pencil in the global
+        # fftw_pencil_plans array, in the order given by
+        # fftw_pencil_plans_stages.
+        fftw_pencil_plans_index = fftw_pencil_plans_size
+        fftw_pencil_plans_size += 6
+        fftw_pencil_plans = realloc(fftw_pencil_plans, fftw_pencil_plans_size*sizeof('fftw_plan'))
+        fftw_pencil_plans[fftw_pencil_plans_index + 0] = fftw_pencil_struct.plan_forward_k
+        fftw_pencil_plans[fftw_pencil_plans_index + 1] = fftw_pencil_struct.plan_forward_j
+        fftw_pencil_plans[fftw_pencil_plans_index + 2] = fftw_pencil_struct.plan_forward_i
+        fftw_pencil_plans[fftw_pencil_plans_index + 3] = fftw_pencil_struct.plan_backward_i
+        fftw_pencil_plans[fftw_pencil_plans_index + 4] = fftw_pencil_struct.plan_backward_j
+        fftw_pencil_plans[fftw_pencil_plans_index + 5] = fftw_pencil_struct.plan_backward_k
+    # Wrap the memory in the real-space layout
+    shape = layout['shape_real']
+    pencil = get_pencil_view(memory, shape)
+    # Store and return this pencil, remembering its memory
+    # and (in compiled mode) the index of its plans.
+    pencils[gridsize, buffer_name] = pencil
+    memory_register(
+        'pencil', f'{buffer_name} (gridsize {gridsize})',
+        size_alloc*np.dtype(C2np['double']).itemsize,
+    )
+    pencils_mapping[get_grid_address(pencil)] = (
+        gridsize, memory, (fftw_pencil_plans_index if cython.compiled else -1),
+    )
+    if nullify:
+        pencil[...] = 0
+    return pencil
+# Cache storing pencils. The keys have the format
+# (gridsize, buffer_name).
+cython.declare(pencils=dict)
+pencils = {}
+# Mapping from memory addresses of pencils to tuples of the form
+# (gridsize, memory, fftw_pencil_plans_index).
+cython.declare(pencils_mapping=dict)
+pencils_mapping = {}
+# Array of FFTW plans for the pencils. Each pencil has six plans,
+# stored consecutively as forward k, j, i and backward i, j, k.
+cython.declare(fftw_pencil_plans_size='Py_ssize_t',
+               fftw_pencil_plans='fftw_plan*',
+               )
+fftw_pencil_plans_size = 0
+fftw_pencil_plans = malloc(fftw_pencil_plans_size*sizeof('fftw_plan'))
+
+# Function returning a 3D view into the first part of
+# a 1D pencil memory.
+@cython.header(
+    # Arguments
+    memory='double[::1]',
+    shape=tuple,
+    returns=object,  # np.ndarray
+)
+def get_pencil_view(memory, shape):
+    return asarray(memory)[:np.prod(shape)].reshape(shape)
+
+# Function returning the memory address of the first element of a grid,
+# used for identifying FFT grids.
+@cython.header(
+    # Arguments
+    grid='double[:, :, ::1]',
+    returns='Py_ssize_t',
+)
+def get_grid_address(grid):
+    if not cython.compiled:
+        return asarray(grid).ctypes.data
+    return cast(cython.address(grid[0, 0, 0]), 'Py_ssize_t')
+
+# Function computing (and caching) the pencil decomposition layout
+# of a grid of a given size, including the MPI redistributions
+# needed between the different stages.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    # Locals
+    P1='int',
+    P2='int',
+    boxes_domain=list,
+    boxes_fourier_col=list,
+    boxes_real=list,
+    boxes_real_row=list,
+    boxes_transposed_col=list,
+    boxes_transposed_row=list,
+    comm_col=object,  # mpi4py.MPI.Intracomm
+    comm_row=object,  # mpi4py.MPI.Intracomm
+    gridsize_complex='Py_ssize_t',
+    layout=dict,
+    other_rank='int',
+    p1='int',
+    p2='int',
+    q='int',
+    shape_fourier=tuple,
+    shape_real=tuple,
+    shape_transposed=tuple,
+    returns=dict,
+)
+def get_pencil_layout(gridsize):
+    layout = pencil_layouts.get(gridsize)
+    if layout:
+        return layout
+    # Distribute the processes over a balanced P1×P2 process grid,
+    # with P1 >= P2. The i-dimension (real space) and the j-dimension
+    # (Fourier space) are distributed over P1 processes, while the
+    # j-dimension (real space) and the complex k-dimension
+    # (the other layouts) are distributed over P2 processes.
+    P1, P2 = MPI.Compute_dims(nprocs, 2)
+    gridsize_complex = gridsize//2 + 1
+    if P1 > gridsize or P2 > gridsize_complex:
+        abort(
+            f'Cannot pencil decompose a grid of linear size {gridsize} '
+            f'over a {P1}×{P2} process grid'
+        )
+    p1, p2 = rank//P2, rank%P2
+    # Communicators between processes in the same row
+    # (same p1, ranked by p2) and column (same p2, ranked by p1)
+    # of the process grid.
+    comm_row = comm.Split(p1, p2)
+    comm_col = comm.Split(p2, p1)
+    # Global index ranges ((i_start, i_end), (j_start, j_end),
+    # (k_start, k_end)) of the pencils on every process, in the
+    # different layouts. Indices along k count doubles.
+    boxes_real = [
+        (split_range(gridsize, P1, other_rank//P2),
+         split_range(gridsize, P2, other_rank%P2),
+         (0, 2*gridsize_complex),
+         )
+        for other_rank in range(nprocs)
+    ]
+    boxes_real_row = [
+        (split_range(gridsize, P1, p1),
+         split_range(gridsize, P2, q),
+         (0, 2*gridsize_complex),
+         )
+        for q in range(P2)
+    ]
+    boxes_transposed_row = [
+        (split_range(gridsize, P1, p1),
+         (0, gridsize),
+         tuple([2*index for index in split_range(gridsize_complex, P2, q)]),
+         )
+        for q in range(P2)
+    ]
+    boxes_transposed_col = [
+        (split_range(gridsize, P1, q),
+         (0, gridsize),
+         tuple([2*index for index in split_range(gridsize_complex, P2, p2)]),
+         )
+        for q in range(P1)
+    ]
+    boxes_fourier_col = [
+        ((0, gridsize),
+         split_range(gridsize, P1, q),
+         tuple([2*index for index in split_range(gridsize_complex, P2, p2)]),
+         )
+        for q in range(P1)
+    ]
+    # Global index ranges of the domains on every process,
+    # excluding ghost and pseudo points.
+    boxes_domain = get_domain_boxes(gridsize)
+    # The local shapes of the three layouts. Note that the Fourier
+    # space layout has the i- and j-dimensions transposed.
+    shape_real = tuple([
+        boxes_real[rank][dim][1] - boxes_real[rank][dim][0] for dim in range(3)
+    ])
+    shape_transposed = tuple([
+        boxes_transposed_row[p2][dim][1] - boxes_transposed_row[p2][dim][0] for dim in range(3)
+    ])
+    shape_fourier = (
+        boxes_fourier_col[p1][1][1] - boxes_fourier_col[p1][1][0],
+        gridsize,
+        boxes_fourier_col[p1][2][1] - boxes_fourier_col[p1][2][0],
+    )
+    layout = {
+        'process_grid'    : (P1, P2),
+        'shape_real'      : shape_real,
+        'shape_transposed': shape_transposed,
+        'shape_fourier'   : shape_fourier,
+        'size_alloc'      : int(np.max([np.prod(shape_real),
+                                        np.prod(shape_transposed),
+                                        np.prod(shape_fourier)])),
+        'start_j_fourier' : boxes_fourier_col[p1][1][0],
+        'start_k_fourier' : boxes_fourier_col[p1][2][0],
+        'comm_row'        : comm_row,
+        'comm_col'        : comm_col,
+        'boxes_real'      : boxes_real,
+        # Redistributions between the layouts and the domains
+        'real2transposed' : prepare_redistribution(boxes_real_row, boxes_transposed_row, comm_row),
+        'transposed2real' : prepare_redistribution(boxes_transposed_row, boxes_real_row, comm_row),
+        'transposed2fourier': prepare_redistribution(
+            boxes_transposed_col, boxes_fourier_col, comm_col),
+        'fourier2transposed': prepare_redistribution(
+            boxes_fourier_col, boxes_transposed_col, comm_col),
+        'domain2real'     : prepare_redistribution(boxes_domain, boxes_real, comm),
+        'real2domain'     : prepare_redistribution(boxes_real, boxes_domain, comm),
+    }
+    pencil_layouts[gridsize] = layout
+    return layout
+# Cache storing results of the get_pencil_layout function.
+# The keys are gridsizes.
+cython.declare(pencil_layouts=dict)
+pencil_layouts = {}
+
+# Function returning the index range (start, end) of part number
+# 'part' when distributing size elements fairly over n_parts parts.
+@cython.header(
+    # Arguments
+    size='Py_ssize_t',
+    n_parts='Py_ssize_t',
+    part='Py_ssize_t',
+    # Locals
+    size_part='Py_ssize_t',
+    start='Py_ssize_t',
+    returns=tuple,
+)
+def split_range(size, n_parts, part):
+    size_part = size//n_parts
+    start = part*size_part + pairmin(part, size%n_parts)
+    if part < size%n_parts:
+        size_part += 1
+    return (start, start + size_part)
+
+# Function computing what to send and receive when redistributing a
+# global grid between two decompositions. The boxes_send and
+# boxes_recv lists hold the global index ranges
+# ((i_start, i_end), (j_start, j_end), (k_start, k_end))
+# of the grids to send from and receive into, for every process
+# in the communicator.
+@cython.header(
+    # Arguments
+    boxes_send=list,
+    boxes_recv=list,
+    communicator=object,  # mpi4py.MPI.Intracomm
+    # Locals
+    box_local=tuple,
+    box_other=tuple,
+    boxes_other=list,
+    counts=object,  # np.ndarray
+    counts_recv='int[::1]',
+    counts_send='int[::1]',
+    dim='int',
+    other_rank='int',
+    overlap=list,
+    rank_local='int',
+    size='Py_ssize_t',
+    slices=list,
+    slices_recv=list,
+    slices_send=list,
+    returns=tuple,
+)
+def prepare_redistribution(boxes_send, boxes_recv, communicator):
+    rank_local = communicator.Get_rank()
+    counts_send = zeros(communicator.Get_size(), dtype=C2np['int'])
+    counts_recv = zeros(communicator.Get_size(), dtype=C2np['int'])
+    # For each other process, store the local slices of the overlap
+    # between the local box and the box of the other process.
+    slices_send = []
+    slices_recv = []
+    for box_local, boxes_other, counts, slices in (
+        (boxes_send[rank_local], boxes_recv, counts_send, slices_send),
+        (boxes_recv[rank_local], boxes_send, counts_recv, slices_recv),
+    ):
+        for other_rank in range(communicator.Get_size()):
+            box_other = boxes_other[other_rank]
+            overlap = []
+            size = 1
+            for dim in range(3):
+                overlap.append(slice(
+                    pairmax(box_local[dim][0], box_other[dim][0]) - box_local[dim][0],
+                    pairmin(box_local[dim][1], box_other[dim][1]) - box_local[dim][0],
+                ))
+                size *= pairmax(overlap[dim].stop - overlap[dim].start, 0)
+            counts[other_rank] = size
+            if size > 0:
+                slices.append((other_rank, tuple(overlap)))
+    return (
+        counts_send, asarray(np.concatenate(([0], np.cumsum(counts_send)[:-1])), dtype=C2np['int']),
+        counts_recv, asarray(np.concatenate(([0], np.cumsum(counts_recv)[:-1])), dtype=C2np['int']),
+        slices_send,
+        slices_recv,
+    )
+
+# Function carrying out a redistribution of a global grid as prepared
+# by prepare_redistribution. The grids should be passed with the
+# dimensions ordered as (i, j, k), possibly as transposed views.
+# The two grids are allowed to share memory.
+@cython.header(
+    # Arguments
+    grid_send=object,  # np.ndarray
+    grid_recv=object,  # np.ndarray
+    redistribution=tuple,
+    communicator=object,  # mpi4py.MPI.Intracomm
+    # Locals
+    buffer_recv=object,  # np.ndarray
+    buffer_send=object,  # np.ndarray
+    counts_recv='int[::1]',
+    counts_send='int[::1]',
+    displacements_recv='int[::1]',
+    displacements_send='int[::1]',
+    other_rank='int',
+    overlap=tuple,
+    slices_recv=list,
+    slices_send=list,
+)
+def redistribute_grid(grid_send, grid_recv, redistribution, communicator):
+    (counts_send, displacements_send,
+     counts_recv, displacements_recv,
+     slices_send, slices_recv,
+     ) = redistribution
+    if mpi_instrumentation:
+        mpi_tic()
+    # Pack all data to be send into a contiguous buffer
+    buffer_send = asarray(get_buffer(int(np.sum(counts_send)), 'redistribute_send'))
+    for other_rank, overlap in slices_send:
+        buffer_send[
+            displacements_send[other_rank]:displacements_send[other_rank] + counts_send[other_rank]
+        ] = grid_send[overlap].reshape(-1)
+    # Communicate everything in one go
+    buffer_recv = asarray(get_buffer(int(np.sum(counts_recv)), 'redistribute_recv'))
+    communicator.Alltoallv(
+        [buffer_send, (asarray(counts_send), asarray(displacements_send)), MPI.DOUBLE],
+        [buffer_recv, (asarray(counts_recv), asarray(displacements_recv)), MPI.DOUBLE],
+    )
+    # Unpack the received data
+    for other_rank, overlap in slices_recv:
+        grid_recv[overlap] = buffer_recv[
+            displacements_recv[other_rank]:displacements_recv[other_rank] + counts_recv[other_rank]
+        ].reshape(grid_recv[overlap].shape)
+    if mpi_instrumentation:
+        mpi_count_bytes(8*np.sum(counts_send))
+        mpi_toc('redistribute_grid')
+
+# Function performing Fourier transformations of pencil decomposed
+# grids, as obtained from get_fftw_pencil. Note that as for slabs,
+# the Fourier-space grid (available through fourier_view) shares memory
+# with the real-space pencil, but has a different shape.
+@cython.header(# Arguments
+               pencil='double[:, :, ::1]',
+               direction=str,
+               # Locals
+               fftw_pencil_plans_index='Py_ssize_t',
+               gridsize='Py_ssize_t',
+               grid_fourier=object,      # np.ndarray
+               grid_real=object,         # np.ndarray
+               grid_transposed=object,   # np.ndarray
+               layout=dict,
+               memory='double[::1]',
+               )
+def fft_pencil(pencil, direction):
+    gridsize, memory, fftw_pencil_plans_index = pencils_mapping[get_grid_address(pencil)]
+    layout = get_pencil_layout(gridsize)
+    grid_real       = get_pencil_view(memory, layout['shape_real'])
+    grid_transposed = get_pencil_view(memory, layout['shape_transposed'])
+    grid_fourier    = get_pencil_view(memory, layout['shape_fourier'])
+    if direction == 'forward':
+        # Transform along k, bring the j-dimension local,
+        # transform along j, bring the i-dimension local
+        # and transform along i.
+        fft_pencil_stage(grid_real, fftw_pencil_plans_index, 0, 2, gridsize)
+        redistribute_grid(grid_real, grid_transposed,
+            layout['real2transposed'], layout['comm_row'])
+        fft_pencil_stage(grid_transposed, fftw_pencil_plans_index, 1, 1, gridsize)
+        redistribute_grid(grid_transposed, grid_fourier.transpose(1, 0, 2),
+            layout['transposed2fourier'], layout['comm_col'])
+        fft_pencil_stage(grid_fourier, fftw_pencil_plans_index, 2, 1, gridsize)
+    else:
+        # The reverse of the above
+        fft_pencil_stage(grid_fourier, fftw_pencil_plans_index, 3, 1, gridsize)
+        redistribute_grid(grid_fourier.transpose(1, 0, 2), grid_transposed,
+            layout['fourier2transposed'], layout['comm_col'])
+        fft_pencil_stage(grid_transposed, fftw_pencil_plans_index, 4, 1, gridsize)
+        redistribute_grid(grid_transposed, grid_real,
+            layout['transposed2real'], layout['comm_row'])
+        fft_pencil_stage(grid_real, fftw_pencil_plans_index, 5, 2, gridsize)
+
+# Helper function for fft_pencil, carrying out the local 1D
+# transformations of a single stage. The stage is given as the index
+# into the six plans of the pencil (forward k, j, i and backward i, j,
+# k), while axis is the array axis along which to transform.
+@cython.header(
+    # Arguments
+    grid=object,  # np.ndarray
+    fftw_pencil_plans_index='Py_ssize_t',
+    stage='int',
+    axis='int',
+    gridsize='Py_ssize_t',
+    # Locals
+    grid_complex=object,  # np.ndarray
+)
+def fft_pencil_stage(grid, fftw_pencil_plans_index, stage, axis, gridsize):
+    if cython.compiled:
+        fftw_execute(fftw_pencil_plans[fftw_pencil_plans_index + stage])
+        return
+    # Emulate the unnormalized FFTW transformations using NumPy
+    if stage == 0:
+        grid_complex = np.fft.rfft(grid[:, :, :gridsize], axis=2)
+        grid[:, :, 0::2] = grid_complex.real
+        grid[:, :, 1::2] = grid_complex.imag
+    elif stage == 5:
+        grid_complex = grid[:, :, 0::2] + 1j*grid[:, :, 1::2]
+        grid[:, :, :gridsize] = np.fft.irfft(grid_complex, n=gridsize, axis=2)*gridsize
+    else:
+        grid_complex = grid.view(np.complex128)
+        if stage < 3:
+            grid_complex[...] = np.fft.fft(grid_complex, axis=axis)
+        else:
+            grid_complex[...] = np.fft.ifft(grid_complex, axis=axis)*gridsize
+
+# Function for transferring data from a domain grid to a pencil
+@cython.header(
+    # Arguments
+    domain_grid='double[:, :, ::1]',
+    gridsize='Py_ssize_t',
+    buffer_name=object,  # int or str
+    # Locals
+    domain_grid_noghosts='double[:, :, :]',
+    layout=dict,
+    pencil='double[:, :, ::1]',
+    returns='double[:, :, ::1]',
+)
+def pencil_decompose(domain_grid, gridsize, buffer_name=0):
+    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
+                                       2:(domain_grid.shape[1] - 2),
+                                       2:(domain_grid.shape[2] - 2)]
+    pencil = get_fftw_pencil(gridsize, buffer_name)
+    layout = get_pencil_layout(gridsize)
+    # Leave out the pseudo points of the domain grid
+    redistribute_grid(
+        asarray(domain_grid_noghosts)[:ℤ[domain_grid_noghosts.shape[0] - 1],
+                                      :ℤ[domain_grid_noghosts.shape[1] - 1],
+                                      :ℤ[domain_grid_noghosts.shape[2] - 1]],
+        asarray(pencil),
+        layout['domain2real'],
+        comm,
+    )
+    return pencil
+
+# Function for transferring data from a pencil to a domain grid
+@cython.header(
+    # Arguments
+    pencil='double[:, :, ::1]',
+    domain_grid_or_buffer_name=object,  # double[:, :, ::1], int or str
+    # Locals
+    domain_grid='double[:, :, ::1]',
+    domain_grid_noghosts='double[:, :, :]',
+    gridsize='Py_ssize_t',
+    layout=dict,
+    shape=tuple,
+    returns='double[:, :, ::1]',
+)
+def domain_decompose_pencil(pencil, domain_grid_or_buffer_name=0):
+    gridsize = pencils_mapping[get_grid_address(pencil)][0]
+    layout = get_pencil_layout(gridsize)
+    shape = domain_grid_shape(gridsize)
+    if isinstance(domain_grid_or_buffer_name, (int, str)):
+        domain_grid = get_buffer(shape, domain_grid_or_buffer_name)
+    else:
+        domain_grid = domain_grid_or_buffer_name
+        if asarray(domain_grid).shape != shape:
+            abort('The pencil and domain grid passed to domain_decompose '
+                  'have incompatible shapes: {}, {}.'
+                  .format(asarray(pencil).shape, asarray(domain_grid).shape)
+                  )
+    domain_grid_noghosts = domain_grid[2:(domain_grid.shape[0] - 2),
+                                       2:(domain_grid.shape[1] - 2),
+                                       2:(domain_grid.shape[2] - 2)]
+    redistribute_grid(
+        asarray(pencil),
+        asarray(domain_grid_noghosts)[:ℤ[domain_grid_noghosts.shape[0] - 1],
+                                      :ℤ[domain_grid_noghosts.shape[1] - 1],
+                                      :ℤ[domain_grid_noghosts.shape[2] - 1]],
+        layout['real2domain'],
+        comm,
+    )
+    # Populate pseudo points and ghost layers
+    communicate_domain(domain_grid, mode='populate')
+    return domain_grid
+
+# Function returning the Fourier-space view of a slab or pencil
+# decomposed grid, together with the global starting indices of the
+# local part along the (distributed) j- and k-dimension. For slabs,
+# the view is the slab itself. In both cases, the view is indexed as
+# [j, i, k], with the index along k counting doubles.
+@cython.header(
+    # Arguments
+    slab='double[:, :, ::1]',
+    # Locals
+    gridsize='Py_ssize_t',
+    layout=dict,
+    memory='double[::1]',
+    slab_address='Py_ssize_t',
+    returns=tuple,
+)
+def fourier_view(slab):
+    slab_address = get_grid_address(slab)
+    if slab_address not in pencils_mapping:
+        return slab, slab.shape[0]*rank, 0
+    gridsize, memory = pencils_mapping[slab_address][:2]
+    layout = get_pencil_layout(gridsize)
+    return (
+        get_pencil_view(memory, layout['shape_fourier']),
+        layout['start_j_fourier'],
+        layout['start_k_fourier'],
+    )
+
+# Function returning a table of Fourier-space deconvolution factors
+# for a mass assignment scheme (or product of schemes) of the given
+# order. As the deconvolution factor is separable, the table is indexed
+# by the grid index along a single dimension, with the full factor at
+# grid point [j, i, k] (k counting complex numbers) given by
+# table[j_global]*table[i]*table[kk].
+# The tables are computed once for each gridsize and order.
+@cython.header(
+    # Arguments
+    gridsize='Py_ssize_t',
+    order='int',
+    # Locals
+    i='Py_ssize_t',
+    ki='Py_ssize_t',
+    key=tuple,
+    table='double[::1]',
+    returns='double[::1]',
+)
+def get_deconvolution_table(gridsize, order):
+    key = (gridsize, order)
+    table = deconvolution_tables.get(key)
+    if table is not None:
+        return table
+    table = empty(gridsize, dtype=C2np['double'])
+    for i in range(gridsize):
+        # The wave vector component (grid units)
+        ki = i - gridsize if i > ℤ[gridsize//2] else i
+        table[i] = 1/sinc(ki*ℝ[π/gridsize])**order
+    deconvolution_tables[key] = table
+    return table
+# Dict storing deconvolution tables
+cython.declare(deconvolution_tables=dict)
+deconvolution_tables = {}
+
 # Function for checking that the slabs satisfy the required symmetry
 # of a Fourier transformed real field.
 @cython.pheader(# Arguments
@@ -1978,6 +3348,8 @@ def diff_domain(grid, dim, h=1, buffer_or_buffer_name=0,
         buffer = get_buffer(shape, buffer_name, nullify=True)
     else:
         buffer = buffer_or_buffer_name
+    if profiling:
+        profile_tic('diff_domain')
     # Do the differentiation and add the results to the buffer
     for         i in range(2, ℤ[grid.shape[0] - 2]):
         for     j in range(2, ℤ[grid.shape[1] - 2]):
@@ -2064,4 +3436,6 @@ def diff_domain(grid, dim, h=1, buffer_or_buffer_name=0,
     # ghost points with copies of their corresponding actual points.
     if not noghosts:
         communicate_domain(buffer, mode='populate')
+    if profiling:
+        profile_toc()
     return buffer
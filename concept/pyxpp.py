@@ -2449,9 +2449,12 @@ def make_pxd(filename, no_optimization):
                 # or cpdef (ccall) function.
                 cpdef = False
                 purepy_func = True
+                nogil = False
                 for cp_line in reversed(code[:i]):
                     if cp_line.startswith('def '):
                         break
+                    if cp_line.startswith('@cython.nogil'):
+                        nogil = True
                     if cp_line.startswith('@cython.ccall'):
                         purepy_func = False
                         cpdef = True
@@ -2616,7 +2619,10 @@ def make_pxd(filename, no_optimization):
                     s += arg + ', '
                 if len(s) > 1 and s[-2:] == ', ':
                     s = s[:-2]
-                s += ')\n'
+                s += ')'
+                if nogil:
+                    s += ' nogil'
+                s += '\n'
                 pxd_lines.append(' '*indent + s)
     # Remove all triple quotes with no indentation
     code_notriplequotes = []
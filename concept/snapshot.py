@@ -187,7 +187,7 @@ class StandardSnapshot:
                             # slab decomposed. Here we communicate the
                             # fluid scalar to slabs before saving to
                             # disk, improving performance enormously.
-                            slab = slab_decompose(fluidscalar.grid_mv)
+                            slab = slab_decompose(fluidscalar.grid_mv, component.gridsize)
                             slab_start = slab.shape[0]*rank
                             slab_end = slab_start + slab.shape[0]
                             fluidscalar_h5[slab_start:slab_end, :, :] = slab[:,
@@ -1045,6 +1045,8 @@ def load(filename, compare_params=True,
         # actual simulation.
         for i, component in enumerate(snapshot.components):
             exchange(component, reset_buffers=(i == len(snapshot.components) - 1))
+            # Order the particles along a space-filling curve
+            component.reorder_particles()
         # Communicate the pseudo and ghost points
         # of all fluid variables in fluid components.
         for component in snapshot.components:
@@ -26,7 +26,13 @@ from commons import *
 
 # Cython imports
 cimport('from analysis import measure')
-cimport('from communication import communicate_domain, domain_subdivisions, exchange, smart_mpi')
+cimport('from cython.parallel import prange')
+cimport('from communication import communicate_domain, domain_balanced, domain_subdivisions, '
+        '                          exchange, smart_mpi')
+cimport('from communication import domain_size_x,  domain_size_y,  domain_size_z')
+cimport('from communication import domain_start_x, domain_start_y, domain_start_z')
+cimport('from communication import get_buffer')
+cimport('from instrumentation import memory_register, profile_tic, profile_toc')
 cimport('from fluid import maccormack, maccormack_internal_sources, '
     'kurganov_tadmor, kurganov_tadmor_internal_sources'
 )
@@ -515,6 +521,7 @@ class Component:
         """
         # General component attributes
         public str name
+        public str memory_name
         public str species
         public str representation
         public dict forces
@@ -542,6 +549,9 @@ class Component:
         public double[::1] momz_mv
         public list pos_mv
         public list mom_mv
+        # Particle rungs (block time steps)
+        unsigned char* rung
+        public unsigned char[::1] rung_mv
         # Particle Δ buffers
         double* Δposx
         double* Δposy
@@ -622,6 +632,10 @@ class Component:
             component_names.add(name)
         # General attributes
         self.name    = name
+        # The name under which the allocated memory is registered.
+        # Nameless components are used internally as buffers, with
+        # their name changing as they are used with other components.
+        self.memory_name = name if name else f'buffer {id(self):#x}'
         self.species = species
         self.representation = get_representation(self.species)
         if self.representation == 'particles':
@@ -875,6 +889,12 @@ class Component:
         self.mom[2] = self.momz
         self.pos_mv = [self.posx_mv, self.posy_mv, self.posz_mv]
         self.mom_mv = [self.momx_mv, self.momy_mv, self.momz_mv]
+        # The rung of each particle, used with block time steps.
+        # See assign_rungs in the main module for the meaning
+        # of the stored values.
+        self.rung = malloc(self.N_allocated*sizeof('unsigned char'))
+        self.rung_mv = cast(self.rung, 'unsigned char[:self.N_allocated]')
+        self.rung_mv[...] = 0
         # Particle data buffers
         self.Δposx = malloc(self.N_allocated*sizeof('double'))
         self.Δposy = malloc(self.N_allocated*sizeof('double'))
@@ -1290,7 +1310,9 @@ class Component:
     @cython.pheader(# Arguments
                     size_or_shape_nopseudo_noghosts=object,  # Py_ssize_t or tuple
                     # Locals
+                    N_allocated_old='Py_ssize_t',
                     fluidscalar='FluidScalar',
+                    nbytes='Py_ssize_t',
                     s='Py_ssize_t',
                     shape_nopseudo_noghosts=tuple,
                     size='Py_ssize_t',
@@ -1300,6 +1322,7 @@ class Component:
         if self.representation == 'particles':
             size = size_or_shape_nopseudo_noghosts
             if size != self.N_allocated:
+                N_allocated_old = self.N_allocated
                 self.N_allocated = size
                 # Reallocate particle data
                 self.posx = realloc(self.posx, self.N_allocated*sizeof('double'))
@@ -1321,6 +1344,12 @@ class Component:
                 self.mom[0], self.mom[1], self.mom[2] = self.momx, self.momy, self.momz
                 self.pos_mv = [self.posx_mv, self.posy_mv, self.posz_mv]
                 self.mom_mv = [self.momx_mv, self.momy_mv, self.momz_mv]
+                # Reallocate the particle rungs, placing any new
+                # particles on the lowest rung.
+                self.rung = realloc(self.rung, self.N_allocated*sizeof('unsigned char'))
+                self.rung_mv = cast(self.rung, 'unsigned char[:self.N_allocated]')
+                if self.N_allocated > N_allocated_old:
+                    self.rung_mv[N_allocated_old:] = 0
                 # Reallocate particle buffers
                 # (commented as these are not currently used).
                 #self.Δposx = realloc(self.Δposx, self.N_allocated*sizeof('double'))
@@ -1345,6 +1374,15 @@ class Component:
                 self.Δmom_mv = [self.Δmomx_mv, self.Δmomy_mv, self.Δmomz_mv]
                 # Nullify the newly allocated Δ buffer
                 self.nullify_Δ()
+                # Register the memory of the 6 data and 3 Δ arrays
+                # together with the rungs.
+                memory_register(
+                    'component', f'{self.memory_name} (particles)',
+                    self.N_allocated*(
+                        9*np.dtype(C2np['double']).itemsize
+                        + np.dtype(C2np['unsigned char']).itemsize
+                    ),
+                )
         elif self.representation == 'fluid':
             shape_nopseudo_noghosts = size_or_shape_nopseudo_noghosts
             # The allocated shape of the fluid grids are 5 points
@@ -1357,14 +1395,28 @@ class Component:
             if any([s < 1 for s in shape_nopseudo_noghosts]):
                 abort('Attempted to resize fluid grids of the {} component'
                       'to a shape of {}'.format(self.name, shape_nopseudo_noghosts))
+            # The fluid grids are equally shared among the domains,
+            # which must then be of equal size.
+            if domain_balanced:
+                abort(f'The fluid component {self.name} requires domains of equal size, '
+                      f'but φ_gridsize = {φ_gridsize} cannot be divided according to the '
+                      f'domain decomposition {list(domain_subdivisions)}')
             # Recalculate and reassign meta data
             self.shape          = tuple([2 + s + 1 + 2 for s in shape_nopseudo_noghosts])
             self.shape_noghosts = tuple([    s + 1     for s in shape_nopseudo_noghosts])
             self.size           = np.prod(self.shape)
             self.size_noghosts  = np.prod(self.shape_noghosts)
             # Reallocate fluid data
+            nbytes = 0
             for fluidscalar in self.iterate_fluidscalars():
                 fluidscalar.resize(shape_nopseudo_noghosts)
+                # Register the memory of the grid, the Δ buffer and
+                # (for non-linear fluid scalars) the starred buffer.
+                nbytes += (
+                    (3 - fluidscalar.is_linear)*fluidscalar.size
+                    *np.dtype(C2np['double']).itemsize
+                )
+            memory_register('component', f'{self.memory_name} (fluid)', nbytes)
 
     # Method for 3D realisation of linear transfer functions.
     # As all arguments are optional,
@@ -1534,6 +1586,8 @@ class Component:
                         options = self.realization_options['𝒫']['backscaling']
                     elif variable == 2:
                         options = self.realization_options['ς']['backscaling']
+                if profiling:
+                    profile_tic(f'realization ({variable})')
                 # Get transfer function if not passed
                 if transfer_spline is None:
                     transfer_spline, cosmoresults = compute_transfer(
@@ -1555,6 +1609,8 @@ class Component:
                     options,
                     use_gridˣ,
                 )
+                if profiling:
+                    profile_toc()
                 # Reset transfer_spline to None so that a transfer
                 # function will be computed for the next variable.
                 transfer_spline = None
@@ -1694,6 +1750,7 @@ class Component:
     @cython.header(# Arguments
                    ᔑdt=dict,
                    # Locals
+                   fac='double',
                    i='Py_ssize_t',
                    momx='double*',
                    momy='double*',
@@ -1713,15 +1770,24 @@ class Component:
             momx = self.momx
             momy = self.momy
             momz = self.momz
-            # Update positions
-            for i in range(self.N_local):
-                posx[i] += momx[i]*ℝ[ᔑdt['a**(-2)']/self.mass]
-                posy[i] += momy[i]*ℝ[ᔑdt['a**(-2)']/self.mass]
-                posz[i] += momz[i]*ℝ[ᔑdt['a**(-2)']/self.mass]
-                # Toroidal boundaries
-                posx[i] = mod(posx[i], boxsize)
-                posy[i] = mod(posy[i], boxsize)
-                posz[i] = mod(posz[i], boxsize)
+            # Update positions. The particles are independent and so
+            # the loop is shared among the OpenMP threads.
+            fac = ᔑdt['a**(-2)']/self.mass
+            for i in prange(self.N_local, nogil=True, num_threads=num_threads):
+                posx[i] = posx[i] + momx[i]*fac
+                posy[i] = posy[i] + momy[i]*fac
+                posz[i] = posz[i] + momz[i]*fac
+                # Toroidal boundaries. The mod function
+                # requires the GIL, and so fmod is used directly.
+                posx[i] = fmod(posx[i], boxsize)
+                posy[i] = fmod(posy[i], boxsize)
+                posz[i] = fmod(posz[i], boxsize)
+                if posx[i] < 0:
+                    posx[i] = posx[i] + boxsize
+                if posy[i] < 0:
+                    posy[i] = posy[i] + boxsize
+                if posz[i] < 0:
+                    posz[i] = posz[i] + boxsize
             masterprint('done')
             # Some partiles may have drifted out of the local domain.
             # Exchange particles to the correct processes.
@@ -1741,7 +1807,11 @@ class Component:
                         f'Evolving fluid variables (flux terms, using the MacCormack scheme) '
                         f'of {self.name} ...'
                     )
+                    if profiling:
+                        profile_tic('maccormack')
                     maccormack(self, ᔑdt)
+                    if profiling:
+                        profile_toc()
                     masterprint('done')
             elif scheme == 'kurganovtadmor':
                 # For the Kurganov-Tadmor scheme to do anything,
@@ -1756,7 +1826,11 @@ class Component:
                         f'Evolving fluid variables (flux terms, using the Kurganov-Tadmor scheme) '
                         f'of {self.name} ...'
                     )
+                    if profiling:
+                        profile_tic('kurganov_tadmor')
                     kurganov_tadmor(self, ᔑdt, rk_order=rk_order)
+                    if profiling:
+                        profile_toc()
                     masterprint('done')
             else:
                 abort(
@@ -1764,6 +1838,92 @@ class Component:
                     f'the "{scheme}" scheme, which is not implemented.'
                 )
 
+    # Method for reordering the local particles along a space-filling
+    # curve, improving the cache locality of the particle data when
+    # interpolating to and from grids.
+    @cython.pheader(# Locals
+                    curve=str,
+                    data='double*',
+                    dim='int',
+                    i='Py_ssize_t',
+                    index_max='Py_ssize_t',
+                    index_x='Py_ssize_t',
+                    index_y='Py_ssize_t',
+                    index_z='Py_ssize_t',
+                    keys='Py_ssize_t[::1]',
+                    order='Py_ssize_t[::1]',
+                    posx='double*',
+                    posy='double*',
+                    posz='double*',
+                    rung='unsigned char*',
+                    scale_x='double',
+                    scale_y='double',
+                    scale_z='double',
+                    scratch='double[::1]',
+                    )
+    def reorder_particles(self, curve=''):
+        """The particles are sorted according to their key along either
+        a Morton (Z-order) or a Peano-Hilbert curve through the local
+        domain, as specified by the curve argument or the
+        particle_ordering parameter. All per-particle arrays (positions,
+        momenta, Δ buffers and rungs) are permuted.
+        """
+        if self.representation != 'particles' or self.N_local < 2:
+            return
+        if not curve:
+            curve = particle_ordering
+        if curve == 'none':
+            return
+        if curve not in ('morton', 'hilbert'):
+            abort(f'reorder_particles() called with unknown curve "{curve}"')
+        posx = self.posx
+        posy = self.posy
+        posz = self.posz
+        # Compute the key of each particle along the curve,
+        # with each dimension of the domain divided into
+        # 2**sfc_bits cells.
+        index_max = (1 << sfc_bits) - 1
+        scale_x = ℝ[1 << sfc_bits]/domain_size_x
+        scale_y = ℝ[1 << sfc_bits]/domain_size_y
+        scale_z = ℝ[1 << sfc_bits]/domain_size_z
+        keys = empty(self.N_local, dtype=C2np['Py_ssize_t'])
+        for i in range(self.N_local):
+            index_x = int((posx[i] - domain_start_x)*scale_x)
+            index_y = int((posy[i] - domain_start_y)*scale_y)
+            index_z = int((posz[i] - domain_start_z)*scale_z)
+            index_x = pairmin(pairmax(index_x, 0), index_max)
+            index_y = pairmin(pairmax(index_y, 0), index_max)
+            index_z = pairmin(pairmax(index_z, 0), index_max)
+            with unswitch:
+                if curve == 'morton':
+                    keys[i] = morton_key(index_x, index_y, index_z)
+                else:
+                    keys[i] = hilbert_key(index_x, index_y, index_z)
+        # Sort the keys
+        order = asarray(np.argsort(asarray(keys), kind='mergesort'), dtype=C2np['Py_ssize_t'])
+        # Permute all particle data according to the sorted order,
+        # one array at a time, using a scratch buffer.
+        scratch = get_buffer(self.N_local, 'reorder_particles')
+        for dim in range(9):
+            if dim < 3:
+                data = self.pos[dim]
+            elif dim < 6:
+                data = self.mom[dim - 3]
+            else:
+                data = self.Δmom[dim - 6]
+            for i in prange(self.N_local, nogil=True, num_threads=num_threads):
+                scratch[i] = data[order[i]]
+            for i in prange(self.N_local, nogil=True, num_threads=num_threads):
+                data[i] = scratch[i]
+        # Permute the rungs, which are only in use
+        # with block time steps.
+        if N_rungs > 1:
+            rung = self.rung
+            for i in range(self.N_local):
+                scratch[i] = rung[order[i]]
+            for i in range(self.N_local):
+                rung[i] = int(scratch[i])
+
     # Method for integrating fluid values forward in time
     # due to "internal" source terms, meaning source terms that do not
     # result from interacting with other components.
@@ -1799,7 +1959,11 @@ class Component:
                 )
             ):
                 masterprint(f'Evolving fluid variables (internal source terms) of {self.name} ...')
+                if profiling:
+                    profile_tic('maccormack_internal_sources')
                 maccormack_internal_sources(self, ᔑdt)
+                if profiling:
+                    profile_toc()
                 masterprint('done')
         elif scheme == 'kurganovtadmor':
             # Only the Hubble term in the continuity equation
@@ -1812,7 +1976,11 @@ class Component:
                 and enable_Hubble
             ):
                 masterprint(f'Evolving fluid variables (internal source terms) of {self.name} ...')
+                if profiling:
+                    profile_tic('kurganov_tadmor_internal_sources')
                 kurganov_tadmor_internal_sources(self, ᔑdt)
+                if profiling:
+                    profile_toc()
                 masterprint('done')
         else:
             abort(f'It was specified that the {self.name} component should be evolved using '
@@ -2538,6 +2706,7 @@ class Component:
         free(self.momx)
         free(self.momy)
         free(self.momz)
+        free(self.rung)
 
     # String representation
     def __repr__(self):
@@ -2600,6 +2769,82 @@ def update_species_present(components):
     universals_dict['class_species_present'] = class_species_present_bytes
 
 
+# Function spreading out the lower sfc_bits bits of an integer,
+# so that two zero bits are inserted between each bit.
+@cython.header(# Arguments
+               n='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def spread_bits(n):
+    n = (n | (n << 32)) & 0x1f00000000ffff
+    n = (n | (n << 16)) & 0x1f0000ff0000ff
+    n = (n | (n <<  8)) & 0x100f00f00f00f00f
+    n = (n | (n <<  4)) & 0x10c30c30c30c30c3
+    n = (n | (n <<  2)) & 0x1249249249249249
+    return n
+
+# Function computing the key of a cell along the Morton (Z-order)
+# curve, given the integer cell indices (each less than 2**sfc_bits).
+@cython.header(# Arguments
+               x='Py_ssize_t',
+               y='Py_ssize_t',
+               z='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def morton_key(x, y, z):
+    return (spread_bits(x) << 2) | (spread_bits(y) << 1) | spread_bits(z)
+
+# Function computing the key of a cell along the Peano-Hilbert curve,
+# given the integer cell indices (each less than 2**sfc_bits).
+# This uses the algorithm by J. Skilling (AIP Conf. Proc. 707, 381
+# (2004)), transforming the indices into the transposed Hilbert index,
+# the bits of which are then interleaved as for the Morton key.
+@cython.header(# Arguments
+               x='Py_ssize_t',
+               y='Py_ssize_t',
+               z='Py_ssize_t',
+               # Locals
+               p='Py_ssize_t',
+               q='Py_ssize_t',
+               t='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def hilbert_key(x, y, z):
+    # Inverse undo excess work
+    q = 1 << (sfc_bits - 1)
+    while q > 1:
+        p = q - 1
+        if x & q:
+            x ^= p
+        if y & q:
+            x ^= p
+        else:
+            t = (x ^ y) & p
+            x ^= t
+            y ^= t
+        if z & q:
+            x ^= p
+        else:
+            t = (x ^ z) & p
+            x ^= t
+            z ^= t
+        q >>= 1
+    # Gray encode
+    y ^= x
+    z ^= y
+    t = 0
+    q = 1 << (sfc_bits - 1)
+    while q > 1:
+        if z & q:
+            t ^= q - 1
+        q >>= 1
+    x ^= t
+    y ^= t
+    z ^= t
+    return morton_key(x, y, z)
+# Number of bits per dimension used for the space-filling curve keys
+cython.declare(sfc_bits='int')
+sfc_bits = 20
 
 # Mapping from species to their representations
 cython.declare(representation_of_species=dict)
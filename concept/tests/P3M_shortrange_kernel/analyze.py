@@ -0,0 +1,93 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+import gravity
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# Values of r² at which to compare the tabulated kernel to the exact
+# one, covering the entire table as well as the regions below it, where
+# the power series is used, and beyond it, where the kernel is computed
+# exactly. Both the tabulated points themselves and random points in
+# between are included.
+np.random.seed(42)
+r2_values = np.concatenate((
+    gravity.shortrange_table_r2_max*np.random.random(20000),
+    gravity.shortrange_table_r2_min*np.random.random(1000),
+    np.exp(np.random.uniform(
+        log(1e-6*gravity.shortrange_table_r2_min), log(gravity.shortrange_table_r2_max), 20000,
+    )),
+    gravity.shortrange_table_r2_max*np.random.uniform(1, 2, 1000),
+))
+r2_values = r2_values[r2_values > 0]
+
+# Function returning the maximum error of the tabulated kernel,
+# relative to the Newtonian force. Note that shortrange_force_factor
+# returns shortrange_fac/r³, with shortrange_fac the short-range force
+# relative to the Newtonian force.
+def measure_error():
+    return max([
+        abs(gravity.shortrange_force_factor(r2)*r2*sqrt(r2) - gravity.shortrange_fac_exact(r2))
+        for r2 in r2_values
+    ])
+
+# The maximum error of the table with the default size should be below
+# the tolerance at which tabulate_shortrange issues a warning.
+tol = 1e-4
+error = measure_error()
+if error > tol:
+    abort(
+        f'The tabulated short-range force ({p3m_shortrange_table_size} points) '
+        f'has a maximum error of {error:.3e} '
+        f'relative to the Newtonian force, exceeding the tolerance of {tol}'
+    )
+
+# The error should decrease rapidly with the table size. The linear
+# interpolation is of second order in the spacing, and so each
+# quadrupling of the size should reduce the error by a factor of
+# about 16. A factor of 4 is required.
+errors = {}
+for table_size in (2**8, 2**10, 2**12):
+    gravity.p3m_shortrange_table_size = table_size
+    gravity.tabulate_shortrange()
+    errors[table_size] = measure_error()
+for table_size in (2**8, 2**10):
+    if errors[table_size]/errors[4*table_size] < 4:
+        abort(
+            f'The error of the tabulated short-range force '
+            f'only decreases from {errors[table_size]:.3e} to {errors[4*table_size]:.3e} '
+            f'when the table size is increased from {table_size} to {4*table_size}'
+        )
+
+# Done analyzing
+masterprint('done')
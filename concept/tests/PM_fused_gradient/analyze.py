@@ -0,0 +1,102 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle positions from the CO𝘕CEPT snapshots
+def read_positions(output_dir):
+    a = []
+    positions = []
+    for fname in sorted(glob(f'{output_dir}/snapshot_a=*'),
+                        key=lambda s: s[(s.index('=') + 1):]):
+        snapshot = load(fname, compare_params=False)
+        a.append(snapshot.params['a'])
+        component = snapshot.components[0]
+        positions.append(np.array([asarray(component.posx_mv)[:component.N_local],
+                                   asarray(component.posy_mv)[:component.N_local],
+                                   asarray(component.posz_mv)[:component.N_local],
+                                   ]).T)
+    return a, positions
+nprocs_list = sorted({int(dname[(dname.rindex('_') + 1):])
+                      for dname in glob(f'{this_dir}/output_fused=*')})
+positions = {}
+for fused in (True, False):
+    for n in nprocs_list:
+        a, positions[fused, n] = read_positions(f'{this_dir}/output_fused={fused}_{n}')
+N_snapshots = len(a)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# For each particle in the runs using the three-pass gradient,
+# find the distance to the nearest particle in the runs using
+# the fused gradient, with the same number of processes.
+dist = collections.OrderedDict((n, []) for n in nprocs_list)
+for n in nprocs_list:
+    for i in range(N_snapshots):
+        separations = positions[False, n][i][:, None, :] - positions[True, n][i][None, :, :]
+        separations -= boxsize*np.round(separations/boxsize)
+        dist[n].append(np.min(np.sqrt(np.sum(separations**2, axis=2)), axis=1))
+
+# Plot
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(nprocs_list), sharex=True, sharey=True)
+for n, d, ax_i in zip(dist.keys(), dist.values(), ax):
+    for i in range(N_snapshots):
+        ax_i.semilogy(machine_ϵ + np.array(d[i])/boxsize,
+                      '.',
+                      alpha=0.7,
+                      label='$a={}$'.format(a[i]),
+                      zorder=-i,
+                      )
+    ax_i.set_ylabel(
+        f'$|\\mathbf{{x}}_{{\\mathrm{{fused}}}} - \\mathbf{{x}}|/\\mathrm{{boxsize}}$\n'
+        f'({n} process{"es" if n > 1 else ""})'
+    )
+ax[-1].set_xlabel('Particle number')
+plt.xlim(0, positions[True, nprocs_list[0]][0].shape[0] - 1)
+fig.subplots_adjust(hspace=0)
+plt.setp([ax_i.get_xticklabels() for ax_i in ax[:-1]], visible=False)
+ax[0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test. The fused and the
+# three-pass gradient use the same finite difference and interpolation,
+# and so they should agree up to round-off errors.
+tol = 1e-9
+if any(np.mean(np.array(d)/boxsize) > tol for d in dist.values()):
+    abort('The fused and the three-pass gradient yield different results!\n'
+          f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
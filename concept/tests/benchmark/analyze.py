@@ -0,0 +1,183 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+
+# Further imports
+import csv, json
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# The maximum allowed relative increase in the wall time per time step,
+# compared to the baseline. Phases taking up less than phase_min of
+# the time step are not reported individually.
+tol = 0.2
+phase_min = 0.01
+
+# Begin analysis
+masterprint('Analyzing {} data ...'.format(this_test))
+
+# Read in the profiling data of each benchmark run. The wall time of
+# each phase is taken to be the maximum over the processes, averaged
+# over the time steps. Rows from before the first time step
+# (initialization) are skipped.
+runs = collections.OrderedDict()
+for filename in sorted(glob('{}/output/*.csv'.format(this_dir))):
+    name = os.path.basename(filename)[:-len('.csv')]
+    setup, size, nprocs_run = name.split('_')
+    size, nprocs_run = int(size), int(nprocs_run)
+    phases = collections.defaultdict(float)
+    time_steps = set()
+    with open(filename, 'r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            if int(row['time_step']) < 0:
+                continue
+            time_steps.add(int(row['time_step']))
+            phases[row['phase']] += float(row['time_max'])
+    if not time_steps:
+        abort('No time steps were recorded in "{}"'.format(filename))
+    phases = {phase: t/len(time_steps) for phase, t in phases.items()}
+    time_per_step = np.sum([t for phase, t in phases.items() if '/' not in phase])
+    runs[name] = {
+        'setup'             : setup,
+        'size'              : size,
+        'nprocs'            : nprocs_run,
+        'N'                 : size**3,
+        'time_steps'        : len(time_steps),
+        'time_per_step'     : time_per_step,
+        'updates_per_second': size**3/time_per_step,
+        'phases'            : phases,
+    }
+if not runs:
+    abort('No benchmark output found in "{}/output"'.format(this_dir))
+
+# Compute the strong and weak scaling efficiencies. For each setup,
+# the reference run is the one with the fewest processes at the
+# smallest size. Strong scaling is measured relative to this run for
+# all other runs of the same size, while weak scaling is measured for
+# the runs of larger sizes, comparing the updates per second per
+# process. Note that for PP, the work per particle grows with the
+# number of particles, and so perfect weak scaling is not expected.
+scaling = collections.OrderedDict()
+for setup in sorted(set([run['setup'] for run in runs.values()])):
+    runs_setup = sorted(
+        [run for run in runs.values() if run['setup'] == setup],
+        key=(lambda run: (run['size'], run['nprocs'])),
+    )
+    reference = runs_setup[0]
+    scaling[setup] = {'strong': collections.OrderedDict(), 'weak': collections.OrderedDict()}
+    for run in runs_setup:
+        if run['size'] == reference['size']:
+            scaling[setup]['strong'][run['nprocs']] = (
+                (reference['time_per_step']*reference['nprocs'])
+                /(run['time_per_step']*run['nprocs'])
+            )
+        else:
+            scaling[setup]['weak'][run['nprocs']] = (
+                (run['updates_per_second']/run['nprocs'])
+                /(reference['updates_per_second']/reference['nprocs'])
+            )
+
+# Save the results in machine-readable form
+results = {'runs': runs, 'scaling': scaling}
+results_filename = '{}/results.json'.format(this_dir)
+with open(results_filename, 'w', encoding='utf-8') as file:
+    json.dump(results, file, indent=4)
+
+# Print out a summary
+lines = ['Benchmark results:']
+for name, run in runs.items():
+    lines.append(
+        '    {}: {} s per time step, {} updates per second'
+        .format(
+            name,
+            significant_figures(run['time_per_step'], 3),
+            significant_figures(run['updates_per_second'], 3, fmt='unicode'),
+        )
+    )
+for setup, efficiencies in scaling.items():
+    for kind, efficiencies_kind in efficiencies.items():
+        if efficiencies_kind:
+            lines.append(
+                '    {} {} scaling efficiency: {}'
+                .format(
+                    setup,
+                    kind,
+                    ', '.join([
+                        '{} ({} processes)'.format(significant_figures(efficiency, 3), n)
+                        for n, efficiency in efficiencies_kind.items()
+                    ]),
+                )
+            )
+masterprint('\n'.join(lines), wrap=False)
+
+# Compare against the baseline. As the timings are specific to the
+# machine, no baseline is shipped. If no baseline exists, the
+# comparison is skipped. A baseline is stored explicitly by running
+# the store_baseline script after a benchmark run.
+baseline_filename = '{}/baseline.json'.format(this_dir)
+if not os.path.isfile(baseline_filename):
+    masterwarn(
+        'No baseline "{}" found, so the comparison against the baseline is skipped. '
+        'To store the present results as the baseline, run "{}/store_baseline".'
+        .format(baseline_filename, this_dir)
+    )
+else:
+    with open(baseline_filename, 'r', encoding='utf-8') as file:
+        baseline = json.load(file)
+    regressions = []
+    for name, run in runs.items():
+        run_baseline = baseline['runs'].get(name)
+        if run_baseline is None:
+            continue
+        if run['time_per_step'] <= (1 + tol)*run_baseline['time_per_step']:
+            continue
+        regressions.append(
+            '{}: {} s per time step (baseline: {} s)'
+            .format(
+                name,
+                significant_figures(run['time_per_step'], 3),
+                significant_figures(run_baseline['time_per_step'], 3),
+            )
+        )
+        for phase, t in run['phases'].items():
+            t_baseline = run_baseline['phases'].get(phase)
+            if t_baseline is None or t < phase_min*run['time_per_step']:
+                continue
+            if t > (1 + tol)*t_baseline:
+                regressions.append(
+                    '    {}: {} s (baseline: {} s)'
+                    .format(phase, significant_figures(t, 3), significant_figures(t_baseline, 3))
+                )
+    if regressions:
+        abort(
+            'Performance regressions compared to the baseline "{}" were found:\n{}'
+            .format(baseline_filename, '\n'.join(regressions))
+        )
+
+# Done analyzing
+masterprint('done')
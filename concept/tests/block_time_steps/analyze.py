@@ -0,0 +1,112 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle data of the final snapshot of each run
+# (labelled by the setup, N_rungs and the number of processes)
+# as well as of the initial conditions.
+def read(filename):
+    component = load(filename, compare_params=False).components[0]
+    N = component.N_local
+    pos = asarray([component.posx_mv[:N], component.posy_mv[:N], component.posz_mv[:N]]).T.copy()
+    mom = asarray([component.momx_mv[:N], component.momy_mv[:N], component.momz_mv[:N]]).T.copy()
+    return pos, mom
+setups = ('drift', 'binary')
+runs = ((1, 1), (3, 1), (3, 2))
+data = {}
+for setup in setups:
+    data[setup, 'IC'] = read(f'{this_dir}/IC_{setup}.hdf5')
+    for N_rungs, n in runs:
+        filenames = sorted(glob(f'{this_dir}/output/{setup}_{N_rungs}_{n}/snapshot_t=*'))
+        data[setup, N_rungs, n] = read(filenames[-1])
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# The free particle should have drifted to (0.25, 0.25, 0.25)*boxsize,
+# regardless of the block time steps.
+for N_rungs, n in runs:
+    pos, mom = data['drift', N_rungs, n]
+    if not np.allclose(pos, 0.25*boxsize, rtol=0, atol=1e-9*boxsize):
+        abort(
+            f'With N_rungs = {N_rungs} on {n} process(es), the free particle should have '
+            f'drifted to (0.25, 0.25, 0.25)*boxsize, but the actual position is '
+            f'({pos[0, 0]/boxsize}, {pos[0, 1]/boxsize}, {pos[0, 2]/boxsize})*boxsize'
+        )
+
+# The total momentum of the binary setup vanishes initially. Without
+# block time steps it should remain zero up to round-off, as all
+# particles are kicked together. With block time steps, the particles
+# on different rungs are not kicked in lockstep, and so the total
+# momentum is only approximately conserved.
+pos_IC, mom_IC = data['binary', 'IC']
+mom_scale = np.sum(np.sqrt(np.sum(mom_IC**2, axis=1)))
+for N_rungs, n in runs:
+    pos, mom = data['binary', N_rungs, n]
+    rtol = 1e-10 if N_rungs == 1 else 2e-2
+    mom_total = np.sqrt(np.sum(np.sum(mom, axis=0)**2))
+    if mom_total > rtol*mom_scale:
+        abort(
+            f'With N_rungs = {N_rungs} on {n} process(es), the total momentum of the binary '
+            f'setup is {mom_total/mom_scale} times the initial summed magnitude of the momenta, '
+            f'exceeding the tolerance of {rtol}'
+        )
+
+# With block time steps, the particles should end up close to where they
+# end up without block time steps. The distances are measured relative
+# to the separation of the binary. Using block time steps with one and
+# two processes should lead to identical results, up to round-off.
+# As the order of the particles may change when they are exchanged
+# between processes, each particle is compared to the nearest
+# particle of the reference run.
+separation = np.sqrt(np.sum((pos_IC[0] - pos_IC[1])**2))
+for (N_rungs, n), reference, rtol in [
+    ((3, 1), (1, 1), 5e-2),
+    ((3, 2), (3, 1), 1e-6),
+]:
+    pos, mom = data['binary', N_rungs, n]
+    pos_reference, mom_reference = data[('binary', ) + reference]
+    distance = np.max(np.min(
+        np.sqrt(np.sum((pos[:, None, :] - pos_reference[None, :, :])**2, axis=2)),
+        axis=1,
+    ))
+    if distance > rtol*separation:
+        abort(
+            f'With N_rungs = {N_rungs} on {n} process(es), the particles of the binary setup '
+            f'end up as far as {distance/separation} times the binary separation from where '
+            f'they end up with N_rungs = {reference[0]} on {reference[1]} process(es), '
+            f'exceeding the tolerance of {rtol}'
+        )
+
+# Done analyzing
+masterprint('done')
@@ -0,0 +1,68 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from species import Component
+from snapshot import save
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+
+# Initial conditions for the drift setup, consisting of a single fast
+# particle which does not feel any force, but which is nevertheless
+# placed on a high rung due to its speed.
+N = 1
+mass = ρ_mbar*boxsize**3/N
+particles = Component('test particles', 'matter particles', N, mass=mass)
+particles.populate(asarray([0.75])*boxsize, 'posx')
+particles.populate(asarray([0.75])*boxsize, 'posy')
+particles.populate(asarray([0.75])*boxsize, 'posz')
+particles.populate(ones(N)*boxsize/(0.6*units.Gyr)*mass, 'momx')
+particles.populate(ones(N)*boxsize/(0.6*units.Gyr)*mass, 'momy')
+particles.populate(ones(N)*boxsize/(0.6*units.Gyr)*mass, 'momz')
+save(particles, f'{this_dir}/IC_drift.hdf5')
+
+# Initial conditions for the binary setup, consisting of a tight binary
+# on a (nearly) circular orbit with a period of 0.1 Gyr at the center
+# of the box, together with two distant particles initially at rest.
+# The binary particles are placed on a higher rung than
+# the distant particles.
+N = 4
+particles = Component('test particles', 'matter particles', N, mass=1)
+separation = 0.02*boxsize
+speed = π*separation/(0.1*units.Gyr)
+# The mass needed for the softened gravitational force to keep the
+# binary particles on the circular orbit.
+mass = 2*speed**2*(separation**2 + particles.softening_length**2)**1.5/(G_Newton*separation**2)
+particles.mass = mass
+particles.populate(asarray([0.5 - 0.5*separation/boxsize, 0.5 + 0.5*separation/boxsize, 0.25, 0.75])*boxsize, 'posx')
+particles.populate(asarray([0.5, 0.5, 0.25, 0.75])*boxsize, 'posy')
+particles.populate(asarray([0.5, 0.5, 0.5, 0.5])*boxsize, 'posz')
+particles.populate(asarray([0, 0, 0, 0])*mass, 'momx')
+particles.populate(asarray([-speed, speed, 0, 0])*mass, 'momy')
+particles.populate(asarray([0, 0, 0, 0])*mass, 'momz')
+save(particles, f'{this_dir}/IC_binary.hdf5')
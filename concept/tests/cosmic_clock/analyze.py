@@ -0,0 +1,81 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from integration import (
+    cosmic_time, expand, initiate_time, scale_factor, scalefactor_integral, tabulate_cosmic_clock,
+)
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# Initiate the cosmic time and the scale factor
+commons_flood()
+initiate_time()
+t_begin = universals.t
+t_end = cosmic_time(1)
+
+# Compute reference values of a(t + Δt) and the scalefactor integrals
+# over [t, t + Δt] by direct integration, for a range of initial times
+# t and time steps Δt, before the cosmic clock is tabulated.
+keys = ['1', 'a**(-1)', 'a**(-2)', 'ȧ/a']
+intervals = [
+    (t, fraction*(t_end - t_begin))
+    for t in t_begin + asarray([0.1, 0.5, 0.9])*(t_end - t_begin)
+    for fraction in logspace(-6, -2, 9)
+]
+a_references = []
+integral_references = []
+for t, Δt in intervals:
+    a = expand(universals.a, t_begin, t - t_begin)
+    a_references.append(expand(a, t, Δt))
+    integral_references.append([scalefactor_integral(key, t, Δt) for key in keys])
+
+# Tabulate the cosmic clock and compare
+# its lookups with the reference values.
+tabulate_cosmic_clock(t_end, keys)
+rel_tol = 1e-8
+for (t, Δt), a_reference, integrals in zip(intervals, a_references, integral_references):
+    a = scale_factor(t + Δt)
+    if not isclose(a, a_reference, rel_tol=rel_tol):
+        abort(
+            f'The cosmic clock gives a({t + Δt} {unit_time}) = {a}, '
+            f'while direct integration gives {a_reference}'
+        )
+    for key, integral_reference in zip(keys, integrals):
+        integral = scalefactor_integral(key, t, Δt)
+        if not isclose(integral, integral_reference, rel_tol=rel_tol):
+            abort(
+                f'The cosmic clock gives ∫_t^(t + Δt) {key} dt = {integral} '
+                f'with t = {t} {unit_time}, Δt = {Δt} {unit_time}, '
+                f'while direct integration gives {integral_reference}'
+            )
+masterprint('done')
@@ -0,0 +1,117 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle positions from the CO𝘕CEPT snapshots
+def read_positions(output_dir):
+    a = []
+    positions = []
+    for fname in sorted(glob(f'{output_dir}/snapshot_a=*'),
+                        key=lambda s: s[(s.index('=') + 1):]):
+        snapshot = load(fname, compare_params=False)
+        a.append(snapshot.params['a'])
+        component = snapshot.components[0]
+        positions.append(np.array([asarray(component.posx_mv)[:component.N_local],
+                                   asarray(component.posy_mv)[:component.N_local],
+                                   asarray(component.posz_mv)[:component.N_local],
+                                   ]).T)
+    return a, positions
+nprocs_list = sorted({int(dname[(dname.rindex('_') + 1):])
+                      for dname in glob(f'{this_dir}/output_counts_*')})
+positions = {}
+a, positions['none', 1] = read_positions(f'{this_dir}/output_none_1')
+for balancing in ('none', 'counts'):
+    for n in nprocs_list:
+        a, positions[balancing, n] = read_positions(f'{this_dir}/output_{balancing}_{n}')
+N_snapshots = len(a)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# For each particle in a given run, find the distance to the nearest
+# particle in another run. The runs on several processes are compared
+# to the run on a single process, while the runs with balanced domains
+# are further compared to the runs without balancing
+# on the same number of processes.
+def compute_dist(positions_0, positions_1):
+    dist = []
+    for i in range(N_snapshots):
+        separations = positions_0[i][:, None, :] - positions_1[i][None, :, :]
+        separations -= boxsize*np.round(separations/boxsize)
+        dist.append(np.min(np.sqrt(np.sum(separations**2, axis=2)), axis=1))
+    return dist
+dist_nprocs = collections.OrderedDict()
+dist_balancing = collections.OrderedDict()
+for balancing in ('none', 'counts'):
+    for n in nprocs_list:
+        dist_nprocs[balancing, n] = compute_dist(positions['none', 1], positions[balancing, n])
+for n in nprocs_list:
+    dist_balancing[n] = compute_dist(positions['none', n], positions['counts', n])
+
+# Plot
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(dist_nprocs) + len(dist_balancing), sharex=True, sharey=True,
+                       figsize=(8, 2*(len(dist_nprocs) + len(dist_balancing))))
+labels = [f'{balancing} ({n} processes)\nvs. none (1 process)' for balancing, n in dist_nprocs]
+labels += [f'counts vs. none\n({n} processes)' for n in dist_balancing]
+for dist, label, ax_i in zip(list(dist_nprocs.values()) + list(dist_balancing.values()),
+                             labels, ax):
+    for i in range(N_snapshots):
+        ax_i.semilogy(machine_ϵ + np.array(dist[i])/boxsize,
+                      '.',
+                      alpha=0.7,
+                      label='$a={}$'.format(a[i]),
+                      zorder=-i,
+                      )
+    ax_i.set_ylabel(label)
+ax[-1].set_xlabel('Particle number')
+plt.xlim(0, positions['none', 1][0].shape[0] - 1)
+fig.subplots_adjust(hspace=0)
+plt.setp([ax_i.get_xticklabels() for ax_i in ax[:-1]], visible=False)
+ax[0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test. Balancing the domains
+# should not alter the results beyond the differences already present
+# between runs with different numbers of processes.
+tol = 2e-2
+for (balancing, n), dist in dist_nprocs.items():
+    if np.mean(np.array(dist)/boxsize) > tol:
+        abort(f'The run on {n} processes {"with" if balancing != "none" else "without"} '
+              f'domain balancing deviates from the run on a single process!\n'
+              f'See "{fig_file}" for a visualization.')
+if any(np.mean(np.array(dist)/boxsize) > tol for dist in dist_balancing.values()):
+    abort('Runs with and without domain balancing yield different results!\n'
+          f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
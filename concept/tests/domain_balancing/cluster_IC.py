@@ -0,0 +1,44 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load, save
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+
+# Load the random ICs
+component = load(this_dir + '/IC.hdf5', compare_params=False).components[0]
+
+# Cluster the particles towards the origin (the corners of the box)
+# by transforming each coordinate x → boxsize*(x/boxsize)³,
+# so that equally sized domains hold very different numbers
+# of particles.
+for variable in ('posx', 'posy', 'posz'):
+    pos = asarray(getattr(component, variable + '_mv'))[:component.N_local]
+    pos[:] = boxsize*(pos/boxsize)**3
+
+# Save snapshot
+save(component, initial_conditions)
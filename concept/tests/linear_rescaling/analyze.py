@@ -0,0 +1,85 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from species import Component
+import linear
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# A fluid component with a linear J, the x component of which
+# is realized at a number of different times. Every realization but
+# the first should be carried out by rescaling the previous one.
+# The realizations alternate between the unstarred and the
+# starred grid.
+gridsize = 16
+component = Component(
+    'test fluid', 'matter fluid', gridsize, boltzmann_order=1, boltzmann_closure='class',
+)
+fluidscalar = component.J[0]
+options = {'structure': 'primordial', 'compound-order': 'linear'}
+a_values = (0.5, 0.6, 0.7, 0.8)
+use_gridˣ_values = (False, True, False, True)
+# Record whether the rescaling is carried out
+rescaled = []
+rescale_linear_realization = linear.rescale_linear_realization
+def rescale_linear_realization_recorded(*args, **kwargs):
+    rescaled.append(rescale_linear_realization(*args, **kwargs))
+    return rescaled[-1]
+linear.rescale_linear_realization = rescale_linear_realization_recorded
+# Do the (rescaled) realizations
+grids_rescaled = []
+for a, use_gridˣ in zip(a_values, use_gridˣ_values):
+    component.realize('J', specific_multi_index=0, a=a, options=options, use_gridˣ=use_gridˣ)
+    grid = fluidscalar.gridˣ_noghosts if use_gridˣ else fluidscalar.grid_noghosts
+    grids_rescaled.append(asarray(grid).copy())
+if not all(rescaled[1:]):
+    abort(
+        f'Not all linear realizations after the first were carried out by rescaling. '
+        f'Is linear_rescaling_rtol = {linear_rescaling_rtol} too small?'
+    )
+# Compare against fresh realizations
+for a, use_gridˣ, grid_rescaled in zip(a_values, use_gridˣ_values, grids_rescaled):
+    linear.linear_realizations.clear()
+    component.realize('J', specific_multi_index=0, a=a, options=options, use_gridˣ=use_gridˣ)
+    grid = fluidscalar.gridˣ_noghosts if use_gridˣ else fluidscalar.grid_noghosts
+    grid_fresh = asarray(grid)
+    # The rescaling is accurate to within linear_rescaling_rtol
+    # at every k, and so the realizations should agree to within
+    # a few times this in real space.
+    tol = 10*linear_rescaling_rtol*np.max(np.abs(grid_fresh))
+    if not np.allclose(grid_rescaled, grid_fresh, rtol=0, atol=tol):
+        abort(
+            f'The rescaled realization of {fluidscalar} '
+            f'at a = {a} (use_gridˣ = {use_gridˣ}) does not match a fresh realization'
+        )
+masterprint('done')
@@ -0,0 +1,102 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the power spectra computed using each mass assignment scheme,
+# with and without interlacing.
+assignments = ('CIC', 'TSC', 'PCS')
+k = {}
+power = {}
+for assignment in assignments:
+    for interlace in (False, True):
+        k[assignment, interlace], modes, power[assignment, interlace] = np.loadtxt(
+            f'{this_dir}/powerspec_{assignment}_interlace={interlace}', unpack=True,
+        )
+N = 64**3
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# The power spectrum of randomly distributed particles is pure shot
+# noise, P = boxsize³/N. Deviations from this are due to aliasing,
+# which increases towards the Nyquist frequency.
+k_nyquist = π*φ_gridsize/boxsize
+P_shotnoise = boxsize**3/N
+ratio = {key: power_key/P_shotnoise for key, power_key in power.items()}
+# The mean relative excess power at small and large scales
+excess_low = {}
+excess_high = {}
+for key, ratio_key in ratio.items():
+    excess_low [key] = np.mean(ratio_key[k[key] < 0.25*k_nyquist]) - 1
+    excess_high[key] = np.mean(ratio_key[(0.5*k_nyquist < k[key]) & (k[key] < k_nyquist)]) - 1
+
+# Plot
+fig_file = this_dir + '/result.png'
+plt.figure()
+for assignment, color in zip(assignments, ('C0', 'C1', 'C2')):
+    for interlace, linestyle in zip((False, True), ('-', '--')):
+        plt.semilogx(k[assignment, interlace]/k_nyquist, ratio[assignment, interlace],
+                     color=color,
+                     linestyle=linestyle,
+                     label=f'{assignment}{", interlaced" if interlace else ""}',
+                     )
+plt.xlim(xmax=1)
+plt.xlabel(r'$k/k_{\mathrm{Nyquist}}$')
+plt.ylabel(r'$P/P_{\mathrm{shot\,noise}}$')
+plt.legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test. At small scales, all
+# schemes should recover the shot noise. At large scales, the aliasing
+# should be reduced by going to higher order and by interlacing.
+tol = 0.05
+for (assignment, interlace), excess in excess_low.items():
+    if abs(excess) > tol:
+        abort(f'The power spectrum computed using {assignment}'
+              f'{" with interlacing" if interlace else ""} does not match the shot noise '
+              f'at small k!\n'
+              f'See "{fig_file}" for a visualization.')
+for assignment_lower, assignment_higher in zip(assignments[:-1], assignments[1:]):
+    if excess_high[assignment_higher, False] >= excess_high[assignment_lower, False]:
+        abort(f'The aliasing of {assignment_higher} is not lower than that of '
+              f'{assignment_lower}!\n'
+              f'See "{fig_file}" for a visualization.')
+for assignment in assignments:
+    if abs(excess_high[assignment, True]) >= abs(excess_high[assignment, False]):
+        abort(f'Interlacing does not reduce the aliasing of {assignment}!\n'
+              f'See "{fig_file}" for a visualization.')
+    if abs(excess_high[assignment, True]) > tol:
+        abort(f'The power spectrum computed using {assignment} with interlacing '
+              f'does not match the shot noise at large k!\n'
+              f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
@@ -0,0 +1,96 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle positions from the CO𝘕CEPT snapshots,
+# joining together the particles of all components.
+def read_positions(output_dir):
+    a = []
+    positions = []
+    for fname in sorted(glob(f'{output_dir}/snapshot_a=*'),
+                        key=lambda s: s[(s.index('=') + 1):]):
+        snapshot = load(fname, compare_params=False)
+        a.append(snapshot.params['a'])
+        positions.append(np.concatenate([
+            np.array([asarray(component.posx_mv)[:component.N_local],
+                      asarray(component.posy_mv)[:component.N_local],
+                      asarray(component.posz_mv)[:component.N_local],
+                      ]).T
+            for component in snapshot.components
+        ]))
+    return a, positions
+a, positions_single = read_positions(f'{this_dir}/output_single')
+nprocs_list = sorted(int(dname[(dname.index('_') + 1):])
+                     for dname in [os.path.basename(dname)
+                                   for dname in glob(f'{this_dir}/output_*')]
+                     if not dname.endswith('_single'))
+positions_split = {n: read_positions(f'{this_dir}/output_{n}')[1] for n in nprocs_list}
+N_snapshots = len(a)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# For each particle in the single-component snapshots, find the
+# distance to the nearest particle in the split snapshots.
+dist = collections.OrderedDict((n, []) for n in nprocs_list)
+for n in nprocs_list:
+    for i in range(N_snapshots):
+        separations = positions_single[i][:, None, :] - positions_split[n][i][None, :, :]
+        separations -= boxsize*np.round(separations/boxsize)
+        dist[n].append(np.min(np.sqrt(np.sum(separations**2, axis=2)), axis=1))
+
+# Plot
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(nprocs_list), sharex=True, sharey=True)
+for n, d, ax_i in zip(dist.keys(), dist.values(), ax):
+    for i in range(N_snapshots):
+        ax_i.semilogy(machine_ϵ + np.array(d[i])/boxsize,
+                      '.',
+                      alpha=0.7,
+                      label='$a={}$'.format(a[i]),
+                      zorder=-i,
+                      )
+    ax_i.set_ylabel(f'$|\\mathbf{{x}}_{{{n}}} - \\mathbf{{x}}_{{\\mathrm{{single}}}}|/\\mathrm{{boxsize}}$')
+ax[-1].set_xlabel('Particle number')
+plt.xlim(0, positions_single[0].shape[0] - 1)
+fig.subplots_adjust(hspace=0)
+plt.setp([ax_i.get_xticklabels() for ax_i in ax[:-1]], visible=False)
+ax[0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test
+tol = 2e-2
+if any(np.mean(np.array(d)/boxsize) > tol for d in dist.values()):
+    abort('Splitting the particles between two components yields different results!\n'
+          f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
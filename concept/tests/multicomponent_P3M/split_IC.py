@@ -0,0 +1,46 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from species import Component
+from snapshot import load, save
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+
+# Load the single-component ICs
+component = load(initial_conditions, compare_params=False).components[0]
+
+# Split the particles between two components,
+# every other particle going into each.
+components = []
+for i, name in enumerate(('test particles A', 'test particles B')):
+    N = component.N//2 + (i < component.N%2)
+    component_split = Component(name, component.species, N, mass=component.mass)
+    for variable in ('posx', 'posy', 'posz', 'momx', 'momy', 'momz'):
+        component_split.populate(asarray(getattr(component, variable + '_mv'))[i:component.N_local:2], variable)
+    components.append(component_split)
+
+# Save snapshot
+save(components, this_dir + '/IC_split.hdf5')
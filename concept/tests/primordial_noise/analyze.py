@@ -0,0 +1,72 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the primordial noise
+noises = collections.defaultdict(dict)
+for filename in glob(f'{this_dir}/output/noise_*.npy'):
+    gridsize, label = os.path.basename(filename)[len('noise_'):-len('.npy')].split('_', 1)
+    noises[int(gridsize)][label] = np.load(filename)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# The noise should be independent of the number of processes,
+# and the same in pure Python and compiled mode.
+for gridsize, noises_gridsize in noises.items():
+    noise_reference = noises_gridsize['1']
+    for label, noise in noises_gridsize.items():
+        if not np.allclose(noise, noise_reference, rtol=1e-12, atol=0):
+            abort(
+                f'The primordial noise of gridsize {gridsize} generated with '
+                f'{label.replace("_pure", " (pure Python)")} process(es) differs '
+                f'from that generated with 1 process.'
+            )
+
+# The noise on a grid should equal that on the corresponding sub-grid
+# (the modes of the smaller grid strictly below its Nyquist frequency)
+# of a larger grid. The Nyquist planes themselves differ, as these are
+# subject to the complex conjugacy symmetry on the smaller grid only.
+gridsize_small, gridsize_large = sorted(noises)
+noise_small = noises[gridsize_small]['1']
+noise_large = noises[gridsize_large]['1']
+nyquist = gridsize_small//2
+k = np.arange(-nyquist + 1, nyquist)
+index_small = np.mod(k, gridsize_small)
+index_large = np.mod(k, gridsize_large)
+sub_small = noise_small[np.ix_(index_small, index_small, np.arange(2*nyquist))]
+sub_large = noise_large[np.ix_(index_large, index_large, np.arange(2*nyquist))]
+if not np.allclose(sub_small, sub_large, rtol=1e-12, atol=0):
+    abort(
+        f'The primordial noise of gridsize {gridsize_small} differs from that of '
+        f'the corresponding modes of gridsize {gridsize_large}.'
+    )
+
+# Done analyzing
+masterprint('done')
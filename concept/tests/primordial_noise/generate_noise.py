@@ -0,0 +1,43 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from linear import get_primordial_noise
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+
+# Generate the primordial noise on grids of different sizes and save
+# the entire grids to disk, labelled by the gridsize, the number of
+# processes and whether the code is compiled.
+for gridsize in (16, 32):
+    slab = get_primordial_noise(gridsize)
+    noise = empty((gridsize, slab.shape[1], slab.shape[2]), dtype=C2np['double'])
+    Allgatherv(asarray(slab), noise)
+    if master:
+        os.makedirs(f'{this_dir}/output', exist_ok=True)
+        np.save(
+            '{}/output/noise_{}_{}{}.npy'.format(
+                this_dir, gridsize, nprocs, '' if cython.compiled else '_pure',
+            ),
+            noise,
+        )
@@ -0,0 +1,124 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle positions from the CO𝘕CEPT snapshots
+def read_positions(output_dir):
+    a = []
+    positions = []
+    for fname in sorted(glob(f'{output_dir}/snapshot_a=*'),
+                        key=lambda s: s[(s.index('=') + 1):]):
+        snapshot = load(fname, compare_params=False)
+        a.append(snapshot.params['a'])
+        component = snapshot.components[0]
+        positions.append(np.array([asarray(component.posx_mv)[:component.N_local],
+                                   asarray(component.posy_mv)[:component.N_local],
+                                   asarray(component.posz_mv)[:component.N_local],
+                                   ]).T)
+    return a, positions
+# The tree methods and their corresponding PP methods
+methods = {'tree': 'pp', 'treenonperiodic': 'ppnonperiodic'}
+nprocs_list = sorted({int(dname[(dname.rindex('_') + 1):])
+                      for dname in glob(f'{this_dir}/output_tree_*')})
+positions = {}
+for method_tree, method_pp in methods.items():
+    a, positions[method_pp, 1] = read_positions(f'{this_dir}/output_{method_pp}_1')
+    for n in nprocs_list:
+        a, positions[method_tree, n] = read_positions(f'{this_dir}/output_{method_tree}_{n}')
+N_snapshots = len(a)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# For each particle in a given run, find the distance to the nearest
+# particle in another run. The tree runs are compared to the
+# corresponding PP run, as well as to the tree run on 1 process.
+def compute_dist(positions_0, positions_1):
+    dist = []
+    for i in range(N_snapshots):
+        separations = positions_0[i][:, None, :] - positions_1[i][None, :, :]
+        separations -= boxsize*np.round(separations/boxsize)
+        dist.append(np.min(np.sqrt(np.sum(separations**2, axis=2)), axis=1))
+    return dist
+dist_pp = collections.OrderedDict()
+dist_nprocs = collections.OrderedDict()
+for method_tree, method_pp in methods.items():
+    for n in nprocs_list:
+        dist_pp[method_tree, n] = compute_dist(
+            positions[method_pp, 1], positions[method_tree, n],
+        )
+        if n > 1:
+            dist_nprocs[method_tree, n] = compute_dist(
+                positions[method_tree, 1], positions[method_tree, n],
+            )
+
+# Plot
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(dist_pp), 2, sharex=True, sharey=True, figsize=(12, 2*len(dist_pp)))
+for (method_tree, n), ax_row in zip(dist_pp.keys(), ax):
+    for dist, reference, ax_i in zip((dist_pp, dist_nprocs),
+                                     (methods[method_tree], f'{method_tree}, 1 process'),
+                                     ax_row):
+        if (method_tree, n) not in dist:
+            ax_i.set_axis_off()
+            continue
+        for i in range(N_snapshots):
+            ax_i.semilogy(machine_ϵ + np.array(dist[method_tree, n][i])/boxsize,
+                          '.',
+                          alpha=0.7,
+                          label='$a={}$'.format(a[i]),
+                          zorder=-i,
+                          )
+        ax_i.set_ylabel(f'{method_tree} ({n} process{"es" if n > 1 else ""})\nvs. {reference}')
+for ax_i in ax[-1]:
+    ax_i.set_xlabel('Particle number')
+plt.xlim(0, positions[methods['tree'], 1][0].shape[0] - 1)
+ax[0, 0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test. With the small opening
+# angle used, the tree methods should closely follow the PP methods,
+# independently of the number of processes.
+tol = 1e-3
+for method_tree, n in dist_pp.keys():
+    if np.mean(np.array(dist_pp[method_tree, n])/boxsize) > tol:
+        abort(f'The {method_tree} method on {n} process{"es" if n > 1 else ""} '
+              f'deviates from the {methods[method_tree]} method!\n'
+              f'See "{fig_file}" for a visualization.')
+for method_tree, n in dist_nprocs.keys():
+    if np.mean(np.array(dist_nprocs[method_tree, n])/boxsize) > tol:
+        abort(f'Runs of the {method_tree} method with different numbers of processes '
+              f'yield different results!\n'
+              f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
@@ -0,0 +1,116 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# This file has to be run in pure Python mode!
+
+# Imports from the CO𝘕CEPT code
+from commons import *
+from snapshot import load
+
+# Absolute path and name of the directory of this file
+this_dir  = os.path.dirname(os.path.realpath(__file__))
+this_test = os.path.basename(this_dir)
+
+# Read in the particle positions from the CO𝘕CEPT snapshots
+def read_positions(output_dir):
+    a = []
+    positions = []
+    for fname in sorted(glob(f'{output_dir}/snapshot_a=*'),
+                        key=lambda s: s[(s.index('=') + 1):]):
+        snapshot = load(fname, compare_params=False)
+        a.append(snapshot.params['a'])
+        component = snapshot.components[0]
+        positions.append(np.array([asarray(component.posx_mv)[:component.N_local],
+                                   asarray(component.posy_mv)[:component.N_local],
+                                   asarray(component.posz_mv)[:component.N_local],
+                                   ]).T)
+    return a, positions
+nprocs_list = sorted({int(dname[(dname.rindex('_') + 1):])
+                      for dname in glob(f'{this_dir}/output_treepm_*')})
+positions = {}
+a, positions['p3m', 1] = read_positions(f'{this_dir}/output_p3m_1')
+for n in nprocs_list:
+    a, positions['treepm', n] = read_positions(f'{this_dir}/output_treepm_{n}')
+N_snapshots = len(a)
+
+# Begin analysis
+masterprint(f'Analyzing {this_test} data ...')
+
+# For each particle in a given run, find the distance to the nearest
+# particle in another run. The TreePM runs are compared to the
+# P³M run, as well as to the TreePM run on 1 process.
+def compute_dist(positions_0, positions_1):
+    dist = []
+    for i in range(N_snapshots):
+        separations = positions_0[i][:, None, :] - positions_1[i][None, :, :]
+        separations -= boxsize*np.round(separations/boxsize)
+        dist.append(np.min(np.sqrt(np.sum(separations**2, axis=2)), axis=1))
+    return dist
+dist_p3m = collections.OrderedDict()
+dist_nprocs = collections.OrderedDict()
+for n in nprocs_list:
+    dist_p3m[n] = compute_dist(positions['p3m', 1], positions['treepm', n])
+    if n > 1:
+        dist_nprocs[n] = compute_dist(positions['treepm', 1], positions['treepm', n])
+
+# Plot
+fig_file = this_dir + '/result.png'
+fig, ax = plt.subplots(len(dist_p3m), 2, sharex=True, sharey=True, figsize=(12, 2*len(dist_p3m)))
+for n, ax_row in zip(dist_p3m.keys(), ax):
+    for dist, reference, ax_i in zip((dist_p3m, dist_nprocs),
+                                     ('P³M', 'TreePM, 1 process'),
+                                     ax_row):
+        if n not in dist:
+            ax_i.set_axis_off()
+            continue
+        for i in range(N_snapshots):
+            ax_i.semilogy(machine_ϵ + np.array(dist[n][i])/boxsize,
+                          '.',
+                          alpha=0.7,
+                          label='$a={}$'.format(a[i]),
+                          zorder=-i,
+                          )
+        ax_i.set_ylabel(f'TreePM ({n} process{"es" if n > 1 else ""})\nvs. {reference}')
+for ax_i in ax[-1]:
+    ax_i.set_xlabel('Particle number')
+plt.xlim(0, positions['p3m', 1][0].shape[0] - 1)
+ax[0, 0].legend(loc='best').get_frame().set_alpha(0.7)
+plt.tight_layout()
+plt.savefig(fig_file)
+
+# Printout error message for unsuccessful test. The long-range forces
+# of the two methods are identical, while the short-range forces of the
+# TreePM method approach those of the P³M method for the small opening
+# angle used, independently of the number of processes.
+tol = 1e-3
+for n, dist in dist_p3m.items():
+    if np.mean(np.array(dist)/boxsize) > tol:
+        abort(f'The TreePM method on {n} process{"es" if n > 1 else ""} '
+              f'deviates from the P³M method!\n'
+              f'See "{fig_file}" for a visualization.')
+if any(np.mean(np.array(dist)/boxsize) > tol for dist in dist_nprocs.values()):
+    abort('Runs of the TreePM method with different numbers of processes '
+          'yield different results!\n'
+          f'See "{fig_file}" for a visualization.')
+
+# Done analyzing
+masterprint('done')
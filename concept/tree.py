@@ -0,0 +1,697 @@
+# This file is part of CO𝘕CEPT, the cosmological 𝘕-body code in Python.
+# Copyright © 2015–2018 Jeppe Mosgaard Dakin.
+#
+# CO𝘕CEPT is free software: You can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# CO𝘕CEPT is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with CO𝘕CEPT. If not, see http://www.gnu.org/licenses/
+#
+# The author of CO𝘕CEPT can be contacted at dakin(at)phys.au.dk
+# The latest version of CO𝘕CEPT is available at
+# https://github.com/jmd-dk/concept/
+
+
+
+# Import everything from the commons module.
+# In the .pyx file, Cython declared variables will also get cimported.
+from commons import *
+
+# Cython imports
+cimport('from communication import domain_bounds, get_buffer')
+cimport('from ewald import ewald')
+
+# Function pointer types used in this module
+pxd('ctypedef double (*func_force_factor)(double)')
+
+
+
+# This module implements the Barnes-Hut octree used by the tree
+# gravity method. The tree is stored as a collection of flat arrays,
+# with the particles (positions, masses and ids) being reordered in
+# place during construction, so that each node covers a contiguous
+# range of particles. The children of a node are stored as 8
+# consecutive nodes. A particle id of -1 designates a particle or
+# pseudo-particle received from another process, while non-negative ids
+# identify the local particles, which may then receive forces.
+
+# Function which empties the tree of particles
+@cython.header(returns='void')
+def tree_reset():
+    global tree_N, tree_N_nodes
+    tree_N = 0
+    tree_N_nodes = 0
+
+# Function which enlarges the particle arrays of the tree,
+# if needed to hold N particles.
+@cython.header(# Arguments
+               N='Py_ssize_t',
+               returns='void',
+               )
+def tree_ensure_particle_size(N):
+    global tree_posx, tree_posy, tree_posz, tree_mass, tree_ids, tree_size
+    if N <= tree_size:
+        return
+    tree_size = pairmax(N, 2*tree_size)
+    tree_posx = realloc(tree_posx, tree_size*sizeof('double'))
+    tree_posy = realloc(tree_posy, tree_size*sizeof('double'))
+    tree_posz = realloc(tree_posz, tree_size*sizeof('double'))
+    tree_mass = realloc(tree_mass, tree_size*sizeof('double'))
+    tree_ids  = realloc(tree_ids , tree_size*sizeof('Py_ssize_t'))
+
+# Function which adds the local particles of a component to the tree.
+# The ids of these particles will be offset + i, with offset the
+# number of particles already in the tree and i the index of the
+# particle within the component.
+@cython.header(# Arguments
+               component='Component',
+               # Locals
+               i='Py_ssize_t',
+               mass='double',
+               posx='double*',
+               posy='double*',
+               posz='double*',
+               returns='void',
+               )
+def tree_add_component(component):
+    global tree_N
+    if component.representation != 'particles':
+        abort('The tree can only be constructed from particle components')
+    tree_ensure_particle_size(tree_N + component.N_local)
+    mass = component.mass
+    posx = component.posx
+    posy = component.posy
+    posz = component.posz
+    for i in range(component.N_local):
+        tree_posx[tree_N] = posx[i]
+        tree_posy[tree_N] = posy[i]
+        tree_posz[tree_N] = posz[i]
+        tree_mass[tree_N] = mass
+        tree_ids [tree_N] = tree_N
+        tree_N += 1
+
+# Function which adds external (pseudo-)particles to the tree,
+# given as a buffer of packed (x, y, z, mass) values.
+@cython.header(# Arguments
+               buffer_mv='double[::1]',
+               N='Py_ssize_t',
+               # Locals
+               i='Py_ssize_t',
+               returns='void',
+               )
+def tree_add_particles(buffer_mv, N):
+    global tree_N
+    tree_ensure_particle_size(tree_N + N)
+    for i in range(N):
+        tree_posx[tree_N] = buffer_mv[4*i    ]
+        tree_posy[tree_N] = buffer_mv[4*i + 1]
+        tree_posz[tree_N] = buffer_mv[4*i + 2]
+        tree_mass[tree_N] = buffer_mv[4*i + 3]
+        tree_ids [tree_N] = -1
+        tree_N += 1
+
+# Function which allocates n new consecutive nodes,
+# returning the index of the first one.
+@cython.header(# Arguments
+               n='Py_ssize_t',
+               # Locals
+               node='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def tree_new_nodes(n):
+    global tree_N_nodes, tree_nodes_size
+    global node_centerx, node_centery, node_centerz, node_width
+    global node_comx, node_comy, node_comz, node_mass
+    global node_start, node_count, node_children
+    if tree_N_nodes + n > tree_nodes_size:
+        tree_nodes_size = pairmax(tree_N_nodes + n, 2*tree_nodes_size)
+        node_centerx  = realloc(node_centerx , tree_nodes_size*sizeof('double'))
+        node_centery  = realloc(node_centery , tree_nodes_size*sizeof('double'))
+        node_centerz  = realloc(node_centerz , tree_nodes_size*sizeof('double'))
+        node_width    = realloc(node_width   , tree_nodes_size*sizeof('double'))
+        node_comx     = realloc(node_comx    , tree_nodes_size*sizeof('double'))
+        node_comy     = realloc(node_comy    , tree_nodes_size*sizeof('double'))
+        node_comz     = realloc(node_comz    , tree_nodes_size*sizeof('double'))
+        node_mass     = realloc(node_mass    , tree_nodes_size*sizeof('double'))
+        node_start    = realloc(node_start   , tree_nodes_size*sizeof('Py_ssize_t'))
+        node_count    = realloc(node_count   , tree_nodes_size*sizeof('Py_ssize_t'))
+        node_children = realloc(node_children, tree_nodes_size*sizeof('Py_ssize_t'))
+    node = tree_N_nodes
+    tree_N_nodes += n
+    return node
+
+# Function for swapping two particles in the tree
+@cython.header(# Arguments
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               # Locals
+               id_tmp='Py_ssize_t',
+               tmp='double',
+               returns='void',
+               )
+def tree_swap(i, j):
+    tmp = tree_posx[i]; tree_posx[i] = tree_posx[j]; tree_posx[j] = tmp
+    tmp = tree_posy[i]; tree_posy[i] = tree_posy[j]; tree_posy[j] = tmp
+    tmp = tree_posz[i]; tree_posz[i] = tree_posz[j]; tree_posz[j] = tmp
+    tmp = tree_mass[i]; tree_mass[i] = tree_mass[j]; tree_mass[j] = tmp
+    id_tmp = tree_ids[i]; tree_ids[i] = tree_ids[j]; tree_ids[j] = id_tmp
+
+# Function which partitions the particles in the range
+# [start, start + count) so that those with a coordinate along dim
+# below split comes first. The number of such particles is returned.
+@cython.header(# Arguments
+               start='Py_ssize_t',
+               count='Py_ssize_t',
+               dim='int',
+               split='double',
+               # Locals
+               i='Py_ssize_t',
+               j='Py_ssize_t',
+               pos='double*',
+               returns='Py_ssize_t',
+               )
+def tree_partition(start, count, dim, split):
+    if dim == 0:
+        pos = tree_posx
+    elif dim == 1:
+        pos = tree_posy
+    else:
+        pos = tree_posz
+    i = start
+    j = start + count - 1
+    while i <= j:
+        if pos[i] < split:
+            i += 1
+        else:
+            tree_swap(i, j)
+            j -= 1
+    return i - start
+
+# Function which recursively constructs a node of the tree
+# (and all of its descendants) from the particles in the range
+# [start, start + count).
+@cython.header(# Arguments
+               node='Py_ssize_t',
+               start='Py_ssize_t',
+               count='Py_ssize_t',
+               centerx='double',
+               centery='double',
+               centerz='double',
+               width='double',
+               depth='int',
+               # Locals
+               child='Py_ssize_t',
+               children='Py_ssize_t',
+               comx='double',
+               comy='double',
+               comz='double',
+               count_x='Py_ssize_t',
+               count_y='Py_ssize_t',
+               count_z='Py_ssize_t',
+               i='Py_ssize_t',
+               ix='int',
+               iy='int',
+               iz='int',
+               mass='double',
+               mass_i='double',
+               n_x='Py_ssize_t',
+               n_y='Py_ssize_t',
+               n_z='Py_ssize_t',
+               start_x='Py_ssize_t',
+               start_y='Py_ssize_t',
+               start_z='Py_ssize_t',
+               returns='void',
+               )
+def tree_build_node(node, start, count, centerx, centery, centerz, width, depth):
+    # Geometric properties of the node
+    node_centerx[node] = centerx
+    node_centery[node] = centery
+    node_centerz[node] = centerz
+    node_width  [node] = width
+    node_start  [node] = start
+    node_count  [node] = count
+    # Total mass and center of mass of the node
+    mass = 0
+    comx = comy = comz = 0
+    for i in range(start, start + count):
+        mass_i = tree_mass[i]
+        mass += mass_i
+        comx += mass_i*tree_posx[i]
+        comy += mass_i*tree_posy[i]
+        comz += mass_i*tree_posz[i]
+    node_mass[node] = mass
+    if mass > 0:
+        node_comx[node] = comx/mass
+        node_comy[node] = comy/mass
+        node_comz[node] = comz/mass
+    else:
+        node_comx[node] = centerx
+        node_comy[node] = centery
+        node_comz[node] = centerz
+    # Few particles in the node makes it a leaf. A maximum depth is
+    # imposed to guard against (nearly) coincident particles.
+    if count <= tree_leaf_size_max or depth == tree_depth_max:
+        node_children[node] = -1
+        return
+    # Sort the particles into the 8 octants (children) of the node,
+    # by partitioning along x, then y and then z.
+    children = tree_new_nodes(8)
+    node_children[node] = children
+    n_x = tree_partition(start, count, 0, centerx)
+    for ix in range(2):
+        start_x = start if ix == 0 else start + n_x
+        count_x = n_x if ix == 0 else count - n_x
+        n_y = tree_partition(start_x, count_x, 1, centery)
+        for iy in range(2):
+            start_y = start_x if iy == 0 else start_x + n_y
+            count_y = n_y if iy == 0 else count_x - n_y
+            n_z = tree_partition(start_y, count_y, 2, centerz)
+            for iz in range(2):
+                start_z = start_y if iz == 0 else start_y + n_z
+                count_z = n_z if iz == 0 else count_y - n_z
+                child = children + 4*ix + 2*iy + iz
+                tree_build_node(child, start_z, count_z,
+                                centerx + (ix - 0.5)*ℝ[0.5*width],
+                                centery + (iy - 0.5)*ℝ[0.5*width],
+                                centerz + (iz - 0.5)*ℝ[0.5*width],
+                                ℝ[0.5*width],
+                                depth + 1,
+                                )
+
+# Function which (re)constructs the tree from all particles
+# currently added to it.
+@cython.header(# Locals
+               i='Py_ssize_t',
+               root='Py_ssize_t',
+               width='double',
+               x_max='double',
+               x_min='double',
+               y_max='double',
+               y_min='double',
+               z_max='double',
+               z_min='double',
+               returns='void',
+               )
+def tree_build():
+    global tree_N_nodes
+    tree_N_nodes = 0
+    root = tree_new_nodes(1)
+    # The root node is the smallest cube containing all particles
+    x_min = y_min = z_min = +ထ
+    x_max = y_max = z_max = -ထ
+    for i in range(tree_N):
+        x_min = pairmin(x_min, tree_posx[i])
+        x_max = pairmax(x_max, tree_posx[i])
+        y_min = pairmin(y_min, tree_posy[i])
+        y_max = pairmax(y_max, tree_posy[i])
+        z_min = pairmin(z_min, tree_posz[i])
+        z_max = pairmax(z_max, tree_posz[i])
+    if tree_N == 0:
+        x_min = y_min = z_min = x_max = y_max = z_max = 0
+    width = pairmax(pairmax(x_max - x_min, y_max - y_min), z_max - z_min)
+    # Enlarge the width slightly so that particles at the upper
+    # boundaries are strictly inside of the root node.
+    width = (1 + 1e-6)*width + machine_ϵ*boxsize
+    tree_build_node(root, 0, tree_N,
+                    x_min + 0.5*width, y_min + 0.5*width, z_min + 0.5*width,
+                    width, 0)
+
+# Function which given a coordinate difference returns
+# the difference to the nearest periodic image.
+@cython.header(# Arguments
+               d='double',
+               returns='double',
+               )
+def nearest_image(d):
+    if d > ℝ[0.5*boxsize]:
+        d -= boxsize
+    elif d < ℝ[-0.5*boxsize]:
+        d += boxsize
+    return d
+
+# Function which updates the centers and half widths
+# of the domains of all processes.
+@cython.header(# Locals
+               bounds=tuple,
+               dim='int',
+               other_rank='int',
+               returns='void',
+               )
+def tree_update_domains():
+    for other_rank in range(nprocs):
+        bounds = domain_bounds(other_rank)
+        for dim in range(3):
+            domain_centers[other_rank, dim] = 0.5*(bounds[dim][0] + bounds[dim][1])
+            domain_halfwidths[other_rank, dim] = 0.5*(bounds[dim][1] - bounds[dim][0])
+
+# Function which packs the locally essential set of (pseudo-)particles
+# of the local tree with respect to the domain of some other process
+# into the send buffer. The returned value is the number of packed
+# (pseudo-)particles. A node whose width is small compared to its
+# (minimum) distance to the other domain, as given by the opening
+# angle, is sent as a single pseudo-particle placed at its center of
+# mass. Otherwise it is opened, with leafs sending their particles.
+# Nodes lying entirely farther away from the other domain than the
+# given cutoff distance are not sent at all.
+@cython.header(# Arguments
+               rank_other='int',
+               periodic='bint',
+               cutoff='double',
+               # Locals
+               N='Py_ssize_t',
+               child='int',
+               children='Py_ssize_t',
+               d2='double',
+               d2_box='double',
+               dx='double',
+               dy='double',
+               dz='double',
+               i='Py_ssize_t',
+               node='Py_ssize_t',
+               stack_size='Py_ssize_t',
+               returns='Py_ssize_t',
+               )
+def tree_pack_essential(rank_other, periodic, cutoff):
+    global tree_sendbuf, tree_sendbuf_mv
+    N = 0
+    if tree_N == 0:
+        return N
+    tree_stack[0] = 0
+    stack_size = 1
+    while stack_size > 0:
+        stack_size -= 1
+        node = tree_stack[stack_size]
+        if node_count[node] == 0:
+            continue
+        # The distance from the node (cube) to the other domain
+        if cutoff != ထ:
+            dx = node_centerx[node] - domain_centers[rank_other, 0]
+            dy = node_centery[node] - domain_centers[rank_other, 1]
+            dz = node_centerz[node] - domain_centers[rank_other, 2]
+            if periodic:
+                dx = nearest_image(dx)
+                dy = nearest_image(dy)
+                dz = nearest_image(dz)
+            dx = pairmax(abs(dx) - 0.5*node_width[node] - domain_halfwidths[rank_other, 0], 0)
+            dy = pairmax(abs(dy) - 0.5*node_width[node] - domain_halfwidths[rank_other, 1], 0)
+            dz = pairmax(abs(dz) - 0.5*node_width[node] - domain_halfwidths[rank_other, 2], 0)
+            d2_box = dx**2 + dy**2 + dz**2
+            if d2_box > cutoff**2:
+                continue
+        # The distance from the center of mass of the node to the
+        # nearest point in the other domain.
+        dx = node_comx[node] - domain_centers[rank_other, 0]
+        dy = node_comy[node] - domain_centers[rank_other, 1]
+        dz = node_comz[node] - domain_centers[rank_other, 2]
+        if periodic:
+            dx = nearest_image(dx)
+            dy = nearest_image(dy)
+            dz = nearest_image(dz)
+        dx = pairmax(abs(dx) - domain_halfwidths[rank_other, 0], 0)
+        dy = pairmax(abs(dy) - domain_halfwidths[rank_other, 1], 0)
+        dz = pairmax(abs(dz) - domain_halfwidths[rank_other, 2], 0)
+        d2 = dx**2 + dy**2 + dz**2
+        children = node_children[node]
+        if node_width[node]**2 < ℝ[tree_opening_angle**2]*d2:
+            # Send the node as a single pseudo-particle
+            if tree_sendbuf_mv.shape[0] < 4*(N + 1):
+                tree_sendbuf = realloc(tree_sendbuf, 8*(N + 1)*sizeof('double'))
+                tree_sendbuf_mv = cast(tree_sendbuf, 'double[:8*(N + 1)]')
+            tree_sendbuf[4*N    ] = node_comx[node]
+            tree_sendbuf[4*N + 1] = node_comy[node]
+            tree_sendbuf[4*N + 2] = node_comz[node]
+            tree_sendbuf[4*N + 3] = node_mass[node]
+            N += 1
+        elif children == -1:
+            # Send all particles in the leaf
+            if tree_sendbuf_mv.shape[0] < 4*(N + node_count[node]):
+                tree_sendbuf = realloc(tree_sendbuf, 8*(N + node_count[node])*sizeof('double'))
+                tree_sendbuf_mv = cast(tree_sendbuf, 'double[:8*(N + node_count[node])]')
+            for i in range(node_start[node], node_start[node] + node_count[node]):
+                tree_sendbuf[4*N    ] = tree_posx[i]
+                tree_sendbuf[4*N + 1] = tree_posy[i]
+                tree_sendbuf[4*N + 2] = tree_posz[i]
+                tree_sendbuf[4*N + 3] = tree_mass[i]
+                N += 1
+        else:
+            # Open the node
+            for child in range(8):
+                tree_stack[stack_size] = children + child
+                stack_size += 1
+    return N
+
+# Function which constructs the tree of the passed components together
+# with the locally essential sets of (pseudo-)particles from all other
+# processes. Which particles are locally essential depends on the
+# opening angle, on whether periodicity should be taken into account
+# and on the cutoff distance beyond which no interactions take place.
+@cython.pheader(# Arguments
+                components=list,
+                periodic='bint',
+                cutoff='double',
+                # Locals
+                N_recv='Py_ssize_t',
+                N_send='Py_ssize_t',
+                component='Component',
+                i='int',
+                rank_recv='int',
+                rank_send='int',
+                recvbuf_mv='double[::1]',
+                returns='void',
+                )
+def construct_tree(components, periodic, cutoff=ထ):
+    # The domains may have been rebalanced since the last time
+    tree_update_domains()
+    # Construct the tree of the local particles
+    tree_reset()
+    for component in components:
+        tree_add_component(component)
+    tree_build()
+    # Exchange locally essential (pseudo-)particles with all other
+    # processes, pairing with two processes at a time. As the locally
+    # essential sets are placed after the local particles,
+    # they do not interfere with the local tree.
+    for i in range(1, nprocs):
+        rank_send = mod(rank + i, nprocs)
+        rank_recv = mod(rank - i, nprocs)
+        N_send = tree_pack_essential(rank_send, periodic, cutoff)
+        N_recv = sendrecv(N_send, dest=rank_send, source=rank_recv)
+        recvbuf_mv = get_buffer(4*N_recv, 'tree')
+        Sendrecv(tree_sendbuf_mv[:4*N_send], dest=rank_send,
+                 recvbuf=recvbuf_mv, source=rank_recv)
+        tree_add_particles(recvbuf_mv, N_recv)
+    # Construct the tree of all (pseudo-)particles
+    if nprocs > 1:
+        tree_build()
+
+# Function which computes the gravitational force (per G) on a local
+# particle due to all other (pseudo-)particles in the tree, by walking
+# the tree. The particle is not required to be in the tree itself, but
+# if it is, its id should be passed so that self-interaction is
+# avoided. With only_short_range, the force is computed using the
+# passed shortrange_factor function (taking in the squared softened
+# separation r² and returning the short-range force over r), and the
+# walk is truncated at the cutoff distance. Otherwise the full
+# Newtonian force is computed, including Ewald corrections
+# if periodic. The force is stored in the global vector.
+@cython.header(# Arguments
+               xi='double',
+               yi='double',
+               zi='double',
+               id_i='Py_ssize_t',
+               mass_i='double',
+               softening2='double',
+               periodic='bint',
+               only_short_range='bint',
+               shortrange_factor=func_force_factor,
+               cutoff='double',
+               # Locals
+               children='Py_ssize_t',
+               child='int',
+               dx='double',
+               dy='double',
+               dz='double',
+               fac='double',
+               force_ewald='double*',
+               forcex='double',
+               forcey='double',
+               forcez='double',
+               j='Py_ssize_t',
+               mass_j='double',
+               node='Py_ssize_t',
+               r2='double',
+               stack_size='Py_ssize_t',
+               width_half='double',
+               x='double',
+               y='double',
+               z='double',
+               returns='double*',
+               )
+def tree_force(xi, yi, zi, id_i, mass_i, softening2, periodic,
+               only_short_range, shortrange_factor, cutoff=ထ):
+    forcex = forcey = forcez = 0
+    tree_stack[0] = 0
+    stack_size = 1
+    while stack_size > 0:
+        stack_size -= 1
+        node = tree_stack[stack_size]
+        if node_count[node] == 0:
+            continue
+        children = node_children[node]
+        width_half = 0.5*node_width[node]
+        # Distances from the node (cube) to particle i along each
+        # dimension. All of these vanish if particle i lies
+        # within the node.
+        dx = xi - node_centerx[node]
+        dy = yi - node_centery[node]
+        dz = zi - node_centerz[node]
+        if periodic:
+            dx = nearest_image(dx)
+            dy = nearest_image(dy)
+            dz = nearest_image(dz)
+        dx = pairmax(abs(dx) - width_half, 0)
+        dy = pairmax(abs(dy) - width_half, 0)
+        dz = pairmax(abs(dz) - width_half, 0)
+        # Skip nodes entirely beyond the cutoff
+        if only_short_range:
+            if dx**2 + dy**2 + dz**2 > cutoff**2:
+                continue
+        # "Vector" from the center of mass of the node to particle i
+        x = xi - node_comx[node]
+        y = yi - node_comy[node]
+        z = zi - node_comz[node]
+        if periodic:
+            x = nearest_image(x)
+            y = nearest_image(y)
+            z = nearest_image(z)
+        r2 = x**2 + y**2 + z**2
+        # Accept the node as a whole if it appears small as seen from
+        # particle i, though never if particle i lies within the node.
+        if (    node_width[node]**2 < ℝ[tree_opening_angle**2]*r2
+            and (dx > 0 or dy > 0 or dz > 0)):
+            mass_j = node_mass[node]
+            if only_short_range:
+                fac = mass_j*shortrange_factor(r2 + softening2)
+            else:
+                fac = mass_j/(r2 + softening2)**1.5
+            forcex -= x*fac
+            forcey -= y*fac
+            forcez -= z*fac
+            if periodic and not only_short_range:
+                force_ewald = ewald(x, y, z)
+                forcex += mass_j*force_ewald[0]
+                forcey += mass_j*force_ewald[1]
+                forcez += mass_j*force_ewald[2]
+        elif children == -1:
+            # Interact directly with all particles in the leaf
+            for j in range(node_start[node], node_start[node] + node_count[node]):
+                if tree_ids[j] == id_i:
+                    continue
+                x = xi - tree_posx[j]
+                y = yi - tree_posy[j]
+                z = zi - tree_posz[j]
+                if periodic:
+                    x = nearest_image(x)
+                    y = nearest_image(y)
+                    z = nearest_image(z)
+                r2 = x**2 + y**2 + z**2
+                mass_j = tree_mass[j]
+                if only_short_range:
+                    if r2 > cutoff**2:
+                        continue
+                    fac = mass_j*shortrange_factor(r2 + softening2)
+                else:
+                    fac = mass_j/(r2 + softening2)**1.5
+                forcex -= x*fac
+                forcey -= y*fac
+                forcez -= z*fac
+                if periodic and not only_short_range:
+                    force_ewald = ewald(x, y, z)
+                    forcex += mass_j*force_ewald[0]
+                    forcey += mass_j*force_ewald[1]
+                    forcez += mass_j*force_ewald[2]
+        else:
+            # Open the node
+            for child in range(8):
+                tree_stack[stack_size] = children + child
+                stack_size += 1
+    vector[0] = forcex*mass_i
+    vector[1] = forcey*mass_i
+    vector[2] = forcez*mass_i
+    return vector
+
+
+
+# Initialize the tree at import time
+cython.declare(domain_centers='double[:, ::1]',
+               domain_halfwidths='double[:, ::1]',
+               node_centerx='double*',
+               node_centery='double*',
+               node_centerz='double*',
+               node_children='Py_ssize_t*',
+               node_comx='double*',
+               node_comy='double*',
+               node_comz='double*',
+               node_count='Py_ssize_t*',
+               node_mass='double*',
+               node_start='Py_ssize_t*',
+               node_width='double*',
+               tree_N='Py_ssize_t',
+               tree_N_nodes='Py_ssize_t',
+               tree_depth_max='int',
+               tree_ids='Py_ssize_t*',
+               tree_leaf_size_max='Py_ssize_t',
+               tree_mass='double*',
+               tree_nodes_size='Py_ssize_t',
+               tree_posx='double*',
+               tree_posy='double*',
+               tree_posz='double*',
+               tree_sendbuf='double*',
+               tree_sendbuf_mv='double[::1]',
+               tree_size='Py_ssize_t',
+               tree_stack='Py_ssize_t*',
+               )
+# Nodes containing at most this many particles are leafs
+tree_leaf_size_max = 8
+# The maximum depth of the tree
+tree_depth_max = 64
+# The particle arrays
+tree_N = 0
+tree_size = 1
+tree_posx = malloc(tree_size*sizeof('double'))
+tree_posy = malloc(tree_size*sizeof('double'))
+tree_posz = malloc(tree_size*sizeof('double'))
+tree_mass = malloc(tree_size*sizeof('double'))
+tree_ids  = malloc(tree_size*sizeof('Py_ssize_t'))
+# The node arrays
+tree_N_nodes = 0
+tree_nodes_size = 1
+node_centerx  = malloc(tree_nodes_size*sizeof('double'))
+node_centery  = malloc(tree_nodes_size*sizeof('double'))
+node_centerz  = malloc(tree_nodes_size*sizeof('double'))
+node_width    = malloc(tree_nodes_size*sizeof('double'))
+node_comx     = malloc(tree_nodes_size*sizeof('double'))
+node_comy     = malloc(tree_nodes_size*sizeof('double'))
+node_comz     = malloc(tree_nodes_size*sizeof('double'))
+node_mass     = malloc(tree_nodes_size*sizeof('double'))
+node_start    = malloc(tree_nodes_size*sizeof('Py_ssize_t'))
+node_count    = malloc(tree_nodes_size*sizeof('Py_ssize_t'))
+node_children = malloc(tree_nodes_size*sizeof('Py_ssize_t'))
+# The stack used when walking the tree. Opening a node replaces it
+# by its 8 children, and so each level of the tree can add at most
+# 7 nodes to the stack.
+tree_stack = malloc((7*tree_depth_max + 8)*sizeof('Py_ssize_t'))
+# Buffer for packing locally essential (pseudo-)particles
+tree_sendbuf = malloc(4*sizeof('double'))
+tree_sendbuf_mv = cast(tree_sendbuf, 'double[:4]')
+# The centers and half widths of the domains of all processes
+domain_centers = empty((nprocs, 3), dtype=C2np['double'])
+domain_halfwidths = empty((nprocs, 3), dtype=C2np['double'])
+tree_update_domains()